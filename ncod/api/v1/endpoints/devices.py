@@ -1,6 +1,6 @@
 """设备相关API端点"""
 
-from typing import List
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 
 from ncod.core.auth import get_current_user
@@ -14,12 +14,15 @@ router = APIRouter()
 
 @router.get("/", response_model=List[DeviceInDB])
 async def get_devices(
-    current_user=Depends(get_current_user), skip: int = 0, limit: int = 100
+    current_user=Depends(get_current_user),
+    skip: int = 0,
+    limit: int = 100,
+    after_id: Optional[int] = None,
 ):
-    """获取设备列表"""
+    """获取设备列表，翻页时传入上一页最后一个设备的ID(after_id)"""
     try:
         devices = await DeviceService.get_devices(
-            user_id=current_user.id, skip=skip, limit=limit
+            user_id=current_user.id, skip=skip, limit=limit, after_id=after_id
         )
         return devices
     except Exception as e:
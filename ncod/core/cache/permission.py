@@ -1,19 +1,23 @@
 """权限缓存"""
 
-from typing import Dict, List, Optional
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
 from datetime import datetime, timedelta
-import json
-from ncod.core.cache.base import BaseCache
 from ncod.core.logger import setup_logger
+from ncod.utils.cache import NearCache, near_cache
 
 logger = setup_logger("permission_cache")
 
 
-class PermissionCache(BaseCache):
-    """权限缓存"""
+class PermissionCache:
+    """权限缓存
 
-    def __init__(self):
-        super().__init__()
+    基于两级缓存: 热点用户/角色的权限常驻进程内，变更时通过Redis通知各工作进程失效。
+    """
+
+    def __init__(self, cache: NearCache = near_cache):
+        self.cache = cache
         self.prefix = "permission:"
         self.expire = timedelta(minutes=30)
 
@@ -21,8 +25,7 @@ class PermissionCache(BaseCache):
         """获取用户权限"""
         try:
             key = f"{self.prefix}user:{user_id}"
-            data = await self.get(key)
-            return json.loads(data) if data else []
+            return await self.cache.get(key) or []
         except Exception as e:
             logger.error(f"Error getting user permissions: {e}")
             return []
@@ -31,7 +34,9 @@ class PermissionCache(BaseCache):
         """设置用户权限"""
         try:
             key = f"{self.prefix}user:{user_id}"
-            return await self.set(key, json.dumps(permissions), expire=self.expire)
+            return await self.cache.set(
+                key, permissions, expire=int(self.expire.total_seconds())
+            )
         except Exception as e:
             logger.error(f"Error setting user permissions: {e}")
             return False
@@ -40,8 +45,7 @@ class PermissionCache(BaseCache):
         """获取角色权限"""
         try:
             key = f"{self.prefix}role:{role_name}"
-            data = await self.get(key)
-            return json.loads(data) if data else []
+            return await self.cache.get(key) or []
         except Exception as e:
             logger.error(f"Error getting role permissions: {e}")
             return []
@@ -52,7 +56,9 @@ class PermissionCache(BaseCache):
         """设置角色权限"""
         try:
             key = f"{self.prefix}role:{role_name}"
-            return await self.set(key, json.dumps(permissions), expire=self.expire)
+            return await self.cache.set(
+                key, permissions, expire=int(self.expire.total_seconds())
+            )
         except Exception as e:
             logger.error(f"Error setting role permissions: {e}")
             return False
@@ -61,7 +67,7 @@ class PermissionCache(BaseCache):
         """删除用户权限缓存"""
         try:
             key = f"{self.prefix}user:{user_id}"
-            return await self.delete(key)
+            return await self.cache.delete(key)
         except Exception as e:
             logger.error(f"Error deleting user permissions: {e}")
             return False
@@ -70,11 +76,230 @@ class PermissionCache(BaseCache):
         """删除角色权限缓存"""
         try:
             key = f"{self.prefix}role:{role_name}"
-            return await self.delete(key)
+            return await self.cache.delete(key)
         except Exception as e:
             logger.error(f"Error deleting role permissions: {e}")
             return False
 
 
+class _UserEntry:
+    """用户的角色及合成后的权限位集"""
+
+    __slots__ = ("roles", "mask", "epoch")
+
+    def __init__(self, roles: Tuple[str, ...], mask: int, epoch: int):
+        self.roles = roles
+        self.mask = mask
+        self.epoch = epoch
+
+
+class PermissionEngine:
+    """进程内编译的权限判定
+
+    权限代码按首次出现的顺序映射为整数中的一位，角色编译为位集，用户位集是其所有
+    角色位集的按位或，判定只需一次按位与，不访问Redis或数据库。
+
+    角色变更只替换该角色的位集并递增本地纪元，用户位集在下一次判定时用已编译的
+    角色重新合成，失效代价与用户数无关。变更时递增Redis中的全局版本号，并通过
+    NearCache的失效通知广播给其它工作进程；发现版本号跳变(错过通知)时清空全部
+    编译结果。编译结果最多保留ttl秒，即使变更没有发布也会在此之后重新加载。
+    """
+
+    VERSION_KEY = "permission:version"
+
+    def __init__(
+        self,
+        cache: NearCache = near_cache,
+        sync_interval: float = 30.0,
+        max_users: int = 100000,
+        ttl: float = 1800.0,
+    ):
+        self.cache = cache
+        self.prefix = "permission:"
+        self.sync_interval = sync_interval
+        self.max_users = max_users
+        self.ttl = ttl
+        # 已知的全局版本号
+        self.version = 0
+        self._bits: Dict[str, int] = {}
+        self._codes: List[str] = []
+        self._roles: Dict[str, int] = {}
+        self._users: Dict[str, _UserEntry] = {}
+        self._masks: Dict[Tuple[str, ...], int] = {}
+        self._epoch = 0
+        self._cleared_at = time.monotonic()
+        self._sync_task: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self._sync_task is not None
+
+    def bit(self, code: str) -> int:
+        """权限代码对应的位，首次出现时分配"""
+        bit = self._bits.get(code)
+        if bit is None:
+            bit = self._bits[code] = 1 << len(self._codes)
+            self._codes.append(code)
+        return bit
+
+    def mask(self, codes: Iterable[str]) -> Optional[int]:
+        """所需权限的位集，包含未被任何角色授予过的权限时返回None"""
+        codes = tuple(codes)
+        mask = self._masks.get(codes)
+        if mask is None:
+            mask = 0
+            for code in codes:
+                bit = self._bits.get(code)
+                if bit is None:
+                    return None
+                mask |= bit
+            self._masks[codes] = mask
+        return mask
+
+    def codes(self, mask: int) -> List[str]:
+        """位集对应的权限代码"""
+        return [code for code, bit in self._bits.items() if mask & bit]
+
+    def compile_role(self, role_name: str, codes: Iterable[str]) -> int:
+        """编译角色权限"""
+        mask = 0
+        for code in codes:
+            mask |= self.bit(code)
+        self._roles[role_name] = mask
+        self._epoch += 1
+        return mask
+
+    def drop_role(self, role_name: str):
+        """丢弃角色的编译结果，使用该角色的用户在下次判定时重新加载角色"""
+        if self._roles.pop(role_name, None) is not None:
+            self._epoch += 1
+
+    def set_user(self, user_id: str, roles: Iterable[str]) -> Optional[int]:
+        """登记用户的角色，角色都已编译时返回用户位集"""
+        if user_id not in self._users and len(self._users) >= self.max_users:
+            # 按登记顺序淘汰最早的用户
+            del self._users[next(iter(self._users))]
+        self._users[user_id] = _UserEntry(tuple(roles), 0, -1)
+        return self.user_mask(user_id)
+
+    def drop_user(self, user_id: str):
+        """丢弃用户的编译结果，下次判定时从数据库重新加载"""
+        self._users.pop(user_id, None)
+
+    def user_mask(self, user_id: str) -> Optional[int]:
+        """用户位集，用户未登记或有角色未编译时返回None"""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        if entry.epoch != self._epoch:
+            mask = 0
+            for role_name in entry.roles:
+                role_mask = self._roles.get(role_name)
+                if role_mask is None:
+                    return None
+                mask |= role_mask
+            entry.mask = mask
+            entry.epoch = self._epoch
+        return entry.mask
+
+    def missing_roles(self, user_id: str) -> Optional[List[str]]:
+        """用户尚未编译的角色，用户未登记时返回None"""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        return [name for name in entry.roles if name not in self._roles]
+
+    def check(self, user_id: str, required: int) -> Optional[bool]:
+        """判定用户是否拥有全部所需权限，用户位集不可用时返回None"""
+        mask = self.user_mask(user_id)
+        if mask is None:
+            return None
+        return mask & required == required
+
+    def clear(self):
+        """清空全部编译结果(权限代码到位的映射保持不变)"""
+        self._roles.clear()
+        self._users.clear()
+        self._epoch += 1
+        self._cleared_at = time.monotonic()
+
+    async def start(self):
+        """读取全局版本号并开始接收失效通知"""
+        if self._sync_task is not None:
+            return
+        self.cache.add_listener(self.on_invalidate)
+        await self.cache.start()
+        self.version = await self._remote_version()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        """停止接收失效通知"""
+        self.cache.remove_listener(self.on_invalidate)
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    async def publish(self, roles: Iterable[str] = (), users: Iterable[str] = ()):
+        """递增全局版本号并通知其它工作进程"""
+        keys = [f"{self.prefix}role:{name}" for name in roles]
+        keys += [f"{self.prefix}user:{user_id}" for user_id in users]
+        version = await self.cache.remote.incr(self.VERSION_KEY)
+        if version == self.version + 1:
+            self.version = version
+        else:
+            # 期间有其它进程的变更未收到
+            self.clear()
+            self.version = version
+        keys.append(f"{self.VERSION_KEY}:{version}")
+        await self.cache.publish_invalidation(keys)
+
+    def on_invalidate(self, keys: List[str]):
+        """处理其它进程的失效通知"""
+        version = None
+        for key in keys:
+            if key.startswith(f"{self.VERSION_KEY}:"):
+                version = int(key.rsplit(":", 1)[1])
+            elif key.startswith(f"{self.prefix}role:"):
+                self.drop_role(key[len(f"{self.prefix}role:") :])
+            elif key.startswith(f"{self.prefix}user:"):
+                self.drop_user(key[len(f"{self.prefix}user:") :])
+        if version is None:
+            return
+        if version > self.version + 1:
+            logger.warning(
+                f"Permission version jumped from {self.version} to {version}"
+            )
+            self.clear()
+        self.version = max(self.version, version)
+
+    async def sync(self):
+        """与全局版本号对齐，错过通知或编译结果超过ttl时清空"""
+        if time.monotonic() - self._cleared_at >= self.ttl:
+            self.clear()
+        version = await self._remote_version()
+        if version > self.version:
+            logger.warning(
+                f"Permission version {self.version} is stale (latest {version})"
+            )
+            self.clear()
+            self.version = version
+
+    async def _remote_version(self) -> int:
+        try:
+            return int(await self.cache.remote.get(self.VERSION_KEY) or 0)
+        except Exception as e:
+            logger.error(f"Error getting permission version: {e}")
+            return self.version
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing permission version: {e}")
+
+
 # 创建全局权限缓存实例
 permission_cache = PermissionCache()
+permission_engine = PermissionEngine()
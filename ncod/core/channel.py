@@ -0,0 +1,74 @@
+"""主从节点长连接帧协议
+
+帧格式: 4字节大端长度 + 1字节编码标识 + 负载。负载优先使用msgpack编码，
+未安装msgpack时退回JSON；接收方按编码标识解码，两端版本不一致也能互通。
+"""
+
+import json
+import struct
+from datetime import datetime
+from typing import Any, Dict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+HEADER = struct.Struct(">IB")
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+
+# 消息类型
+MSG_HELLO = "hello"
+MSG_HEARTBEAT = "heartbeat"
+MSG_LOAD = "load"
+MSG_DEVICE_DELTA = "device_delta"
+MSG_DEVICE_SNAPSHOT = "device_snapshot"
+# 主服务器 -> 从服务器: 增量版本不连续，请求完整快照
+MSG_RESYNC_DEVICES = "resync_devices"
+
+
+class FrameError(Exception):
+    """帧格式错误"""
+
+
+def _default(value: Any) -> Any:
+    """序列化无法直接编码的值"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"无法序列化类型: {type(value).__name__}")
+
+
+def encode_frame(message: Dict) -> bytes:
+    """编码一条消息为帧"""
+    if msgpack is not None:
+        codec = CODEC_MSGPACK
+        payload = msgpack.packb(message, default=_default, use_bin_type=True)
+    else:
+        codec = CODEC_JSON
+        payload = json.dumps(message, default=_default, separators=(",", ":")).encode()
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"帧过大: {len(payload)}")
+    return HEADER.pack(len(payload), codec) + payload
+
+
+def decode_payload(codec: int, payload: bytes) -> Dict:
+    """按编码标识解码负载"""
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise FrameError("收到msgpack帧但未安装msgpack")
+        return msgpack.unpackb(payload, raw=False)
+    if codec == CODEC_JSON:
+        return json.loads(payload)
+    raise FrameError(f"未知编码: {codec}")
+
+
+async def read_frame(reader) -> Dict:
+    """从StreamReader读取一帧，连接关闭时抛出IncompleteReadError"""
+    header = await reader.readexactly(HEADER.size)
+    length, codec = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"帧过大: {length}")
+    return decode_payload(codec, await reader.readexactly(length))
@@ -33,6 +33,14 @@ class Settings(BaseSettings):
     DEVICE_TIMEOUT: int = 30
     DEVICE_CHECK_INTERVAL: int = 5
 
+    # 设备调度配置
+    SCHEDULING_INTERVAL: int = 5  # 兜底检查等待队列的间隔(秒)
+    MAX_DEVICE_WAIT_TIME: int = 3600  # 最长排队时间(秒)，0表示不限
+    MAX_DEVICE_USE_TIME: int = 7200  # 单次最长使用时间(秒)，0表示不限
+    QUEUE_AGING_RATE: float = 1 / 60  # 每等待一秒提升的优先级(默认每分钟+1)
+    MAX_QUEUED_PER_USER: int = 5  # 每个用户同时排队的设备数上限
+    MAX_DEVICES_PER_USER: int = 3  # 每个用户同时占用的设备数上限
+
     # 日志配置
     LOG_LEVEL: str = "INFO"
     LOG_PATH: str = "logs/ncod.log"
@@ -0,0 +1,39 @@
+"""端口队列调度字段
+
+Revision ID: 002
+Revises: 001
+Create Date: 2024-04-02 10:00:00.000000
+"""
+
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "002"
+down_revision: Union[str, None] = "001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 从服务器按设备序列号排队，不一定对应usb_ports中的端口
+    op.alter_column("port_queues", "port_id", existing_type=sa.Integer(), nullable=True)
+    op.add_column("port_queues", sa.Column("device_id", sa.String(length=64)))
+    op.add_column(
+        "port_queues", sa.Column("priority", sa.Integer(), server_default="0")
+    )
+    op.create_index("ix_port_queues_device_id", "port_queues", ["device_id"])
+    op.create_index(
+        "ix_port_queues_status_device", "port_queues", ["status", "device_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_port_queues_status_device", table_name="port_queues")
+    op.drop_index("ix_port_queues_device_id", table_name="port_queues")
+    op.drop_column("port_queues", "priority")
+    op.drop_column("port_queues", "device_id")
+    op.alter_column(
+        "port_queues", "port_id", existing_type=sa.Integer(), nullable=False
+    )
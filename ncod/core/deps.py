@@ -77,6 +77,8 @@ async def get_current_active_admin(
                 status_code=status.HTTP_403_FORBIDDEN, detail="Not enough privileges"
             )
         return current_user
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error checking admin permission: {e}")
         raise HTTPException(
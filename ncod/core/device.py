@@ -15,16 +15,19 @@ class DeviceService:
 
     @staticmethod
     async def get_devices(
-        user_id: int, skip: int = 0, limit: int = 100
+        user_id: int, skip: int = 0, limit: int = 100, after_id: Optional[int] = None
     ) -> List[Device]:
-        """获取设备列表"""
+        """获取设备列表
+
+        传入after_id(上一页最后一个设备ID)时按ID键集分页，不再使用OFFSET。
+        """
         async with db.async_session() as session:
-            result = await session.execute(
-                select(Device)
-                .where(Device.user_id == user_id)
-                .offset(skip)
-                .limit(limit)
-            )
+            stmt = select(Device).where(Device.user_id == user_id).order_by(Device.id)
+            if after_id is not None:
+                stmt = stmt.where(Device.id > after_id)
+            elif skip:
+                stmt = stmt.offset(skip)
+            result = await session.execute(stmt.limit(limit))
             return result.scalars().all()
 
     @staticmethod
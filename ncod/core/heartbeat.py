@@ -1,29 +1,45 @@
 """心跳检测模块"""
 
 import asyncio
+import heapq
 import logging
+import time
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 # 创建日志记录器
 logger = logging.getLogger("heartbeat")
 logger.setLevel(logging.INFO)
 
+NODE_UP = "node_up"
+NODE_DOWN = "node_down"
+
 
 class HeartbeatMonitor:
-    """心跳监控器"""
+    """心跳监控器
+
+    每个节点的超时截止时间保存在最小堆中(过期条目惰性删除)，存活判断为O(1)，
+    超时检测只处理真正到期的节点；节点上线/下线时向订阅者发出事件。
+    """
 
     def __init__(self, interval: int = 5):
         self.interval = interval
+        self.timeout = interval * 3
         self.last_beats: Dict[str, datetime] = {}
         self.running = False
+        self._deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._alive: Set[str] = set()
+        self._listeners: Dict[str, List[Callable]] = {NODE_UP: [], NODE_DOWN: []}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
 
     async def start(self):
         """启动监控"""
         try:
             self.running = True
             logger.info("Heartbeat monitor started")
-            asyncio.create_task(self._check_heartbeats())
+            self._task = asyncio.create_task(self._check_heartbeats())
         except Exception as e:
             logger.error(f"Error starting heartbeat monitor: {e}")
             self.running = False
@@ -33,41 +49,105 @@ class HeartbeatMonitor:
         """停止监控"""
         try:
             self.running = False
+            if self._task:
+                self._task.cancel()
+                self._task = None
             logger.info("Heartbeat monitor stopped")
         except Exception as e:
             logger.error(f"Error stopping heartbeat monitor: {e}")
             raise
 
+    def add_listener(self, event: str, callback: Callable):
+        """订阅节点事件(node_up/node_down)，回调参数为node_id，可为协程函数"""
+        self._listeners[event].append(callback)
+
+    def remove_listener(self, event: str, callback: Callable):
+        """取消订阅节点事件"""
+        if callback in self._listeners[event]:
+            self._listeners[event].remove(callback)
+
+    def _emit(self, event: str, node_id: str):
+        """派发节点事件"""
+        for callback in list(self._listeners[event]):
+            try:
+                result = callback(node_id)
+                if asyncio.iscoroutine(result):
+                    asyncio.create_task(result)
+            except Exception as e:
+                logger.error(f"Error dispatching {event} for {node_id}: {e}")
+
     async def _check_heartbeats(self):
-        """检查心跳"""
+        """等待最近的截止时间并处理到期节点"""
         while self.running:
             try:
-                now = datetime.utcnow()
-                for node_id, last_beat in self.last_beats.items():
-                    if (now - last_beat).total_seconds() > self.interval * 3:
-                        logger.warning(f"Node {node_id} heartbeat timeout")
+                if not self._heap:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    # 新心跳的截止时间总晚于堆顶，无需被唤醒重排
+                    await asyncio.sleep(delay)
+                self.expire()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Error checking heartbeats: {e}")
-            await asyncio.sleep(self.interval)
+                await asyncio.sleep(self.interval)
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """弹出所有已到期的节点并标记为下线"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, node_id = heapq.heappop(self._heap)
+            # 节点之后又有心跳时，堆中旧条目已失效
+            if self._deadlines.get(node_id) != deadline:
+                continue
+            del self._deadlines[node_id]
+            if node_id in self._alive:
+                self._alive.discard(node_id)
+                expired.append(node_id)
+                logger.warning(f"Node {node_id} heartbeat timeout")
+                self._emit(NODE_DOWN, node_id)
+        return expired
 
     def update_heartbeat(self, node_id: str):
         """更新心跳"""
         try:
             self.last_beats[node_id] = datetime.utcnow()
+            deadline = time.monotonic() + self.timeout
+            self._deadlines[node_id] = deadline
+            heapq.heappush(self._heap, (deadline, node_id))
+            self._wakeup.set()
+            if node_id not in self._alive:
+                self._alive.add(node_id)
+                self._emit(NODE_UP, node_id)
         except Exception as e:
             logger.error(f"Error updating heartbeat for {node_id}: {e}")
 
+    async def record_heartbeat(self, node_id: str, timestamp: Optional[datetime] = None):
+        """记录心跳(截止时间以接收时刻为准，timestamp仅作记录)"""
+        self.update_heartbeat(node_id)
+        if timestamp is not None:
+            self.last_beats[node_id] = timestamp
+
+    def remove_node(self, node_id: str):
+        """移除节点(不触发下线事件)"""
+        self.last_beats.pop(node_id, None)
+        self._deadlines.pop(node_id, None)
+        self._alive.discard(node_id)
+
     def get_last_heartbeat(self, node_id: str) -> Optional[datetime]:
         """获取最后心跳时间"""
         return self.last_beats.get(node_id)
 
+    @property
+    def alive_nodes(self) -> Set[str]:
+        """当前存活节点"""
+        return self._alive
+
     def is_node_alive(self, node_id: str) -> bool:
         """检查节点是否存活"""
-        try:
-            last_beat = self.last_beats.get(node_id)
-            if not last_beat:
-                return False
-            return (datetime.utcnow() - last_beat).total_seconds() <= self.interval * 3
-        except Exception as e:
-            logger.error(f"Error checking node status for {node_id}: {e}")
-            return False
+        deadline = self._deadlines.get(node_id)
+        return deadline is not None and deadline > time.monotonic()
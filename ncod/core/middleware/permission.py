@@ -33,6 +33,8 @@ def require_permission(resource_type: str, action: str):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied"
                 )
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error checking permission: {e}")
             raise HTTPException(
@@ -68,6 +70,8 @@ class PermissionChecker:
                         status_code=status.HTTP_403_FORBIDDEN,
                         detail=error_message or "Permission denied",
                     )
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Error checking permission: {e}")
                 raise HTTPException(
@@ -0,0 +1,526 @@
+"""通知分发模块
+
+告警路径只把通知写入持久化队列后立即返回。同一渠道、同一接收方在合并窗口
+内的通知合并为一条摘要(相同合并键的通知只保留最新一条并计数)，由各渠道的
+工作协程按令牌桶限速发送，失败后按指数退避重试，超过重试次数后丢弃。
+"""
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import json
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from ncod.core.logger import setup_logger
+
+logger = setup_logger("notifier")
+
+# 摘要的严重程度取其中最高的一条
+SEVERITY_ORDER = {
+    "info": 0,
+    "minor": 1,
+    "warning": 2,
+    "major": 3,
+    "error": 3,
+    "critical": 4,
+}
+
+
+@dataclass
+class Notification:
+    """待发送的通知"""
+
+    channel: str
+    recipient: str
+    title: str
+    body: str
+    severity: str = "info"
+    key: Optional[str] = None  # 合并键，窗口内相同的键只保留最新一条
+    meta: Dict[str, Any] = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.time)
+    count: int = 1  # 合并的通知数
+    merged_ids: List[str] = field(default_factory=list)
+    attempts: int = 0
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), default=str)
+
+    @classmethod
+    def from_json(cls, data: str) -> "Notification":
+        return cls(**json.loads(data))
+
+
+@dataclass
+class Digest:
+    """同一渠道、同一接收方在一个窗口内的通知摘要"""
+
+    channel: str
+    recipient: str
+    items: List[Notification]
+    attempts: int = 0
+
+    @property
+    def ids(self) -> List[str]:
+        return [i for item in self.items for i in (item.id, *item.merged_ids)]
+
+    @property
+    def severity(self) -> str:
+        return max(
+            (item.severity for item in self.items),
+            key=lambda severity: SEVERITY_ORDER.get(severity, 0),
+        )
+
+    @property
+    def title(self) -> str:
+        if len(self.items) == 1:
+            return self.items[0].title
+        return f"[{self.severity}] {len(self.items)} notifications"
+
+    @property
+    def body(self) -> str:
+        if len(self.items) == 1 and self.items[0].count == 1:
+            return self.items[0].body
+        parts = []
+        for item in self.items:
+            repeat = f" (x{item.count})" if item.count > 1 else ""
+            parts.append(f"{item.title}{repeat}\n{item.body}")
+        return "\n\n".join(parts)
+
+
+class TokenBucket:
+    """令牌桶限速"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, now: Optional[float] = None) -> float:
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class MemoryNotificationQueue:
+    """进程内通知队列(进程退出后丢失)"""
+
+    # 租约时长(秒)，为空表示队列只有一个消费者，不需要续租
+    lease: Optional[float] = None
+
+    def __init__(self):
+        self._items: Dict[str, str] = {}
+
+    async def claim(self, notification_id: str) -> bool:
+        """认领通知，通知已在队列中(由消费者持有)时返回False"""
+        return notification_id not in self._items
+
+    async def put(self, notification: Notification) -> None:
+        self._items[notification.id] = notification.to_json()
+
+    async def ack(self, ids: List[str]) -> None:
+        for notification_id in ids:
+            self._items.pop(notification_id, None)
+
+    async def load(self) -> List[Notification]:
+        """返回由本消费者发送的未确认通知"""
+        return [Notification.from_json(data) for data in self._items.values()]
+
+    async def renew(self) -> List[Notification]:
+        """续租持有的通知，返回新认领的通知"""
+        return []
+
+
+class RedisNotificationQueue(MemoryNotificationQueue):
+    """Redis持久化通知队列，未确认的通知在重启后重新发送
+
+    多个进程共享同一队列时，每条通知由认领它的消费者发送：认领即用SET NX
+    写入带过期时间的租约键，消费者运行期间定期续租。消费者退出后租约过期，
+    其余消费者续租时认领这些通知。确认后租约键保留到过期，刚发送完的通知
+    在此期间不能被重新认领。
+    """
+
+    def __init__(self, redis, key: str = "notify:pending", lease: float = 60.0):
+        self.redis = redis
+        self.key = key
+        self.lease = lease
+        self.consumer = uuid.uuid4().hex
+        self._held: Set[str] = set()
+
+    def _lease_key(self, notification_id: str) -> str:
+        return f"{self.key}:lease:{notification_id}"
+
+    async def claim(self, notification_id: str) -> bool:
+        if notification_id in self._held:
+            return False
+        claimed = await self.redis.set(
+            self._lease_key(notification_id),
+            self.consumer,
+            nx=True,
+            px=int(self.lease * 1000),
+        )
+        if claimed:
+            self._held.add(notification_id)
+        return bool(claimed)
+
+    async def put(self, notification: Notification) -> None:
+        self._held.add(notification.id)
+        await self.redis.hset(self.key, notification.id, notification.to_json())
+
+    async def ack(self, ids: List[str]) -> None:
+        if ids:
+            self._held.difference_update(ids)
+            await self.redis.hdel(self.key, *ids)
+
+    async def load(self) -> List[Notification]:
+        return await self._claim_unheld(include_held=True)
+
+    async def renew(self) -> List[Notification]:
+        for notification_id in list(self._held):
+            await self.redis.pexpire(
+                self._lease_key(notification_id), int(self.lease * 1000)
+            )
+        return await self._claim_unheld()
+
+    async def _claim_unheld(self, include_held: bool = False) -> List[Notification]:
+        """认领租约已过期的通知"""
+        items = await self.redis.hgetall(self.key)
+        claimed = []
+        for notification_id, data in items.items():
+            if notification_id in self._held:
+                if include_held:
+                    claimed.append(Notification.from_json(data))
+            elif await self.claim(notification_id):
+                claimed.append(Notification.from_json(data))
+        return claimed
+
+
+class _Channel:
+    """渠道的发送函数、限速和工作协程"""
+
+    def __init__(
+        self,
+        name: str,
+        sender: Callable,
+        rate: float,
+        burst: Optional[float],
+        workers: int,
+        on_result: Optional[Callable],
+    ):
+        self.name = name
+        self.sender = sender
+        self.is_async = inspect.iscoroutinefunction(sender)
+        self.bucket = TokenBucket(rate, burst)
+        self.workers = workers
+        self.on_result = on_result
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+
+class NotificationDispatcher:
+    """通知分发器
+
+    发送函数接收一个Digest，可以是协程函数或普通函数(在线程池中运行)，
+    抛出异常或返回False视为失败。on_result(digest, ok, error)在摘要发送成功
+    或最终放弃时调用，同样可以是协程函数或普通函数。
+    """
+
+    def __init__(
+        self,
+        queue: Optional[MemoryNotificationQueue] = None,
+        window: float = 30.0,
+        max_attempts: int = 5,
+        backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        send_timeout: float = 30.0,
+    ):
+        self.queue = queue or MemoryNotificationQueue()
+        self.window = window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.send_timeout = send_timeout
+        self.stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "sent": 0,
+            "retried": 0,
+            "dropped": 0,
+        }
+        self._channels: Dict[str, _Channel] = {}
+        # 合并窗口: (渠道, 接收方) -> 通知
+        self._windows: Dict[Tuple[str, str], List[Notification]] = {}
+        self._deadlines: List[Tuple[float, int, Tuple[str, str]]] = []
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._renewer: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._batcher is not None and not self._batcher.done()
+
+    def has_channel(self, name: str) -> bool:
+        return name in self._channels
+
+    def register_channel(
+        self,
+        name: str,
+        sender: Callable,
+        rate: float = 1.0,
+        burst: Optional[float] = None,
+        workers: int = 2,
+        on_result: Optional[Callable] = None,
+    ) -> None:
+        """注册渠道
+
+        Args:
+            name: 渠道名称
+            sender: 发送函数，参数为Digest
+            rate: 每秒最多发送的摘要数
+            burst: 令牌桶容量，默认为max(1, rate)
+            workers: 并发发送的工作协程数
+            on_result: 发送成功或最终失败时的回调
+        """
+        channel = _Channel(name, sender, rate, burst, workers, on_result)
+        self._channels[name] = channel
+        if self.running:
+            self._start_channel(channel)
+
+    async def start(self, pending: Iterable[Notification] = ()) -> None:
+        """启动分发器，并重新加载队列中未发送的通知
+
+        Args:
+            pending: 需要恢复发送的通知，开始发送前写入队列，已在队列中的跳过
+        """
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        for channel in self._channels.values():
+            self._start_channel(channel)
+        self._batcher = asyncio.create_task(self._batch_loop())
+        if self.queue.lease:
+            self._renewer = asyncio.create_task(self._renew_loop())
+
+        for notification in pending:
+            if await self.queue.claim(notification.id):
+                await self.queue.put(notification)
+        reloaded = await self.queue.load()
+        self._buffer_claimed(reloaded)
+        if reloaded:
+            logger.info(f"Reloaded {len(reloaded)} pending notifications")
+
+    def _buffer_claimed(self, claimed: List[Notification]) -> None:
+        for notification in sorted(claimed, key=lambda n: n.created_at):
+            if notification.channel in self._channels:
+                self._buffer(notification)
+
+    def start_in_thread(self, pending: Iterable[Notification] = ()) -> None:
+        """在独立线程的事件循环中运行(供同步代码使用)"""
+        if self._thread and self._thread.is_alive():
+            return
+        loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=loop.run_forever, name="notifier", daemon=True
+        )
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(pending), loop).result()
+
+    async def stop(self) -> None:
+        """停止分发器，未发送的通知保留在队列中"""
+        tasks = [task for task in (self._batcher, self._renewer) if task]
+        for channel in self._channels.values():
+            tasks.extend(channel.tasks)
+            channel.tasks = []
+            channel.queue = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._batcher = None
+        self._renewer = None
+        self._windows.clear()
+        self._deadlines.clear()
+
+    def _start_channel(self, channel: _Channel) -> None:
+        channel.queue = asyncio.Queue()
+        channel.tasks = [
+            asyncio.create_task(self._worker(channel)) for _ in range(channel.workers)
+        ]
+
+    async def submit(self, notification: Notification) -> bool:
+        """提交通知，写入队列后立即返回
+
+        通知ID已在队列中(由本进程或其他进程持有)时不重复提交，返回False。
+        """
+        if notification.channel not in self._channels:
+            logger.warning(f"Unsupported notification channel: {notification.channel}")
+            return False
+        if not self.running:
+            await self.start()
+        if not await self.queue.claim(notification.id):
+            return False
+        self.stats["submitted"] += 1
+        await self.queue.put(self._buffer(notification))
+        return True
+
+    def submit_threadsafe(self, notification: Notification):
+        """从其他线程提交通知，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self.submit(notification), self._loop)
+
+    def _buffer(self, notification: Notification) -> Notification:
+        """放入合并窗口，返回需要持久化的通知"""
+        key = (notification.channel, notification.recipient)
+        items = self._windows.get(key)
+        if items is None:
+            items = self._windows[key] = []
+            heapq.heappush(
+                self._deadlines,
+                (time.monotonic() + self.window, next(self._seq), key),
+            )
+            self._wakeup.set()
+
+        if notification.key is not None:
+            for existing in items:
+                if existing.key == notification.key:
+                    # 保留最新的内容，计数累加
+                    existing.title = notification.title
+                    existing.body = notification.body
+                    existing.severity = notification.severity
+                    existing.count += notification.count
+                    existing.merged_ids += [notification.id, *notification.merged_ids]
+                    self.stats["coalesced"] += 1
+                    return existing
+
+        items.append(notification)
+        return notification
+
+    async def _batch_loop(self) -> None:
+        """窗口到期时把合并后的摘要交给渠道的工作协程"""
+        while True:
+            now = time.monotonic()
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, _, key = heapq.heappop(self._deadlines)
+                items = self._windows.pop(key, None)
+                channel = self._channels.get(key[0])
+                if items and channel and channel.queue is not None:
+                    channel.queue.put_nowait(Digest(key[0], key[1], items))
+
+            delay = self._deadlines[0][0] - now if self._deadlines else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _renew_loop(self) -> None:
+        """定期续租，并接手已退出的消费者留下的通知"""
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            try:
+                self._buffer_claimed(await self.queue.renew())
+            except Exception as e:
+                logger.error(f"Failed to renew notification leases: {e}")
+
+    async def _worker(self, channel: _Channel) -> None:
+        while True:
+            digest = await channel.queue.get()
+            try:
+                await channel.bucket.acquire()
+                await self._deliver(channel, digest)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification worker error on {channel.name}: {e}")
+            finally:
+                channel.queue.task_done()
+
+    async def _deliver(self, channel: _Channel, digest: Digest) -> None:
+        error: Optional[str] = None
+        try:
+            if channel.is_async:
+                result = await asyncio.wait_for(
+                    channel.sender(digest), self.send_timeout
+                )
+            else:
+                result = await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(
+                        None, channel.sender, digest
+                    ),
+                    self.send_timeout,
+                )
+            ok = result is not False
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            ok = False
+            error = str(e) or type(e).__name__
+
+        if ok:
+            self.stats["sent"] += 1
+            await self.queue.ack(digest.ids)
+            await self._report(channel, digest, True, None)
+            return
+
+        digest.attempts += 1
+        if digest.attempts >= self.max_attempts:
+            self.stats["dropped"] += 1
+            logger.error(
+                f"Dropping notification digest to {channel.name}:{digest.recipient} "
+                f"after {digest.attempts} attempts: {error}"
+            )
+            await self.queue.ack(digest.ids)
+            await self._report(channel, digest, False, error)
+            return
+
+        self.stats["retried"] += 1
+        delay = min(self.max_backoff, self.backoff * 2 ** (digest.attempts - 1))
+        for item in digest.items:
+            item.attempts = digest.attempts
+            await self.queue.put(item)
+        logger.warning(
+            f"Notification to {channel.name}:{digest.recipient} failed "
+            f"({error}), retrying in {delay:.1f}s"
+        )
+        asyncio.get_running_loop().call_later(delay, self._requeue, channel, digest)
+
+    @staticmethod
+    def _requeue(channel: _Channel, digest: Digest) -> None:
+        if channel.queue is not None:
+            channel.queue.put_nowait(digest)
+
+    async def _report(
+        self, channel: _Channel, digest: Digest, ok: bool, error: Optional[str]
+    ) -> None:
+        if channel.on_result is None:
+            return
+        try:
+            if inspect.iscoroutinefunction(channel.on_result):
+                await channel.on_result(digest, ok, error)
+            else:
+                # 同步回调(如写数据库)在线程池中运行，不阻塞事件循环
+                await asyncio.get_running_loop().run_in_executor(
+                    None, channel.on_result, digest, ok, error
+                )
+        except Exception as e:
+            logger.error(f"Error in notification result callback: {e}")
@@ -0,0 +1,38 @@
+"""
+心跳记录按从服务器唯一，IP地址可以为空
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "002_heartbeat_slave_unique"
+down_revision = "001_add_monitor_tables"
+branch_labels = None
+depends_on = None
+
+DEDUPLICATE = """
+DELETE FROM heartbeat_records a
+USING heartbeat_records b
+WHERE a.slave_id = b.slave_id
+  AND (a.last_beat_time, a.id) < (b.last_beat_time, b.id)
+"""
+
+
+def upgrade():
+    # 每个从服务器只保留最新的一条心跳记录
+    op.execute(DEDUPLICATE)
+
+    # 心跳批量写回按slave_id upsert，需要唯一索引
+    op.drop_index("ix_heartbeat_records_slave_id", "heartbeat_records")
+    op.create_index(
+        "ix_heartbeat_records_slave_id", "heartbeat_records", ["slave_id"], unique=True
+    )
+
+    # 通道心跳不携带IP地址，新从服务器的记录由心跳直接插入
+    op.alter_column("heartbeat_records", "ip_address", nullable=True)
+
+
+def downgrade():
+    op.alter_column("heartbeat_records", "ip_address", nullable=False)
+    op.drop_index("ix_heartbeat_records_slave_id", "heartbeat_records")
+    op.create_index("ix_heartbeat_records_slave_id", "heartbeat_records", ["slave_id"])
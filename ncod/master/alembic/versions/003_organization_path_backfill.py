@@ -0,0 +1,45 @@
+"""
+按parent_id回填组织的物化路径和层级，并为路径建立索引
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "003_organization_path_backfill"
+down_revision = "002_heartbeat_slave_unique"
+branch_labels = None
+depends_on = None
+
+# 父组织不存在的组织作为根组织，成环的组织不会被回填
+BACKFILL = """
+WITH RECURSIVE tree (id, path, level) AS (
+    SELECT id, '/' || CAST(id AS VARCHAR) || '/', 0
+    FROM organizations
+    WHERE parent_id IS NULL
+       OR parent_id NOT IN (SELECT id FROM organizations)
+    UNION ALL
+    SELECT o.id, t.path || CAST(o.id AS VARCHAR) || '/', t.level + 1
+    FROM organizations o
+    JOIN tree t ON o.parent_id = t.id
+)
+UPDATE organizations
+SET path = tree.path, level = tree.level
+FROM tree
+WHERE organizations.id = tree.id
+  AND (organizations.path IS DISTINCT FROM tree.path
+       OR organizations.level IS DISTINCT FROM tree.level)
+"""
+
+
+def upgrade():
+    # 旧数据的path为空或不是"/1/5/9/"格式，统一按parent_id重新计算
+    op.execute(BACKFILL)
+
+    # 子树查询为path LIKE '/1/5/%'
+    op.create_index(
+        "ix_organizations_path", "organizations", ["path"], if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_index("ix_organizations_path", "organizations", if_exists=True)
@@ -0,0 +1,26 @@
+"""
+设备增加所属组织和从服务器列，用于按组织子树统计和设备列表过滤
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "004_device_organization_slave"
+down_revision = "003_organization_path_backfill"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("organization_id", "slave_id")
+
+
+def upgrade():
+    # 表由create_all建立时已包含这些列
+    for column in COLUMNS:
+        op.execute(f"ALTER TABLE devices ADD COLUMN IF NOT EXISTS {column} INTEGER")
+        op.create_index(f"ix_devices_{column}", "devices", [column], if_not_exists=True)
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.drop_index(f"ix_devices_{column}", "devices", if_exists=True)
+        op.drop_column("devices", column)
@@ -17,7 +17,7 @@ class OrganizationCreate(BaseModel):
     name: str
     code: str
     description: Optional[str] = None
-    parent_id: Optional[str] = None
+    parent_id: Optional[int] = None
 
 
 class OrganizationUpdate(BaseModel):
@@ -26,7 +26,17 @@ class OrganizationUpdate(BaseModel):
     name: Optional[str] = None
     code: Optional[str] = None
     description: Optional[str] = None
-    parent_id: Optional[str] = None
+    parent_id: Optional[int] = None
+
+
+async def _check_subtree_access(org_id: int, user: dict) -> None:
+    """非管理员只能访问所属组织及其下级组织"""
+    if "admin" in user.get("roles", []):
+        return
+    if not await organization_service.user_within(user["id"], org_id):
+        raise HTTPException(
+            status_code=403, detail="Not authorized to access this organization"
+        )
 
 
 @router.post("")
@@ -125,3 +135,46 @@ async def get_organization_tree(
     except Exception as e:
         logger.error(f"Error getting organization tree: {e}")
         raise HTTPException(status_code=500, detail="Failed to get organization tree")
+
+
+@router.get("/{org_id}/subtree/devices")
+@require_permissions(["organization:read", "device:read"])
+async def get_subtree_devices(
+    org_id: int, status: Optional[str] = None, user: dict = Depends(get_current_user)
+):
+    """获取组织及其下级组织的所有设备"""
+    await _check_subtree_access(org_id, user)
+    try:
+        return await organization_service.get_subtree_devices(org_id, status)
+    except Exception as e:
+        logger.error(f"Error getting subtree devices: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get subtree devices")
+
+
+@router.get("/{org_id}/subtree/users")
+@require_permissions(["organization:read", "user:read"])
+async def get_subtree_users(org_id: int, user: dict = Depends(get_current_user)):
+    """获取组织及其下级组织的所有用户"""
+    await _check_subtree_access(org_id, user)
+    try:
+        return await organization_service.get_subtree_users(org_id)
+    except Exception as e:
+        logger.error(f"Error getting subtree users: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get subtree users")
+
+
+@router.get("/{org_id}/subtree/stats")
+@require_permissions(["organization:read"])
+async def get_subtree_stats(org_id: int, user: dict = Depends(get_current_user)):
+    """获取组织及其下级组织的统计"""
+    await _check_subtree_access(org_id, user)
+    try:
+        stats = await organization_service.get_subtree_stats(org_id)
+        if stats is None:
+            raise HTTPException(status_code=404, detail="Organization not found")
+        return stats
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting subtree stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get subtree stats")
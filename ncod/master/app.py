@@ -1,5 +1,6 @@
 """主应用入口"""
 
+import atexit
 from typing import Optional, Any
 from flask import Flask, Response
 from flask_cors import CORS
@@ -9,6 +10,10 @@ from .models import db
 from .api.routes import api
 from .api.ws_routes import ws, socketio
 from .config_manager import ConfigManager
+from .device_notifier import DeviceNotifier
+from .device_permission import DevicePermissionManager
+from .device_scheduler import DeviceScheduler
+from .device_stats import DeviceStatsManager
 from .scheduler_manager import SchedulerManager
 from .utils.logger import setup_logger
 
@@ -45,6 +50,26 @@ def create_app(test_config: Optional[dict] = None) -> Flask:
     scheduler = SchedulerManager()
     scheduler.start()
     
+    # 构建空闲设备索引和设备授权索引并注册对账任务，初始化设备统计桶
+    device_scheduler = DeviceScheduler()
+    device_permissions = DevicePermissionManager()
+    device_stats = DeviceStatsManager()
+    with app.app_context():
+        device_scheduler.start()
+        device_permissions.start()
+        device_stats.start()
+        # 重新跟踪重启前尚未发送完成的设备通知
+        DeviceNotifier().recover_pending()
+    
+    def shutdown() -> None:
+        """进程退出时停止后台任务"""
+        device_scheduler.stop()
+        device_permissions.stop()
+        device_stats.stop()
+        scheduler.stop()
+    
+    atexit.register(shutdown)
+    
     @app.before_first_request
     def before_first_request() -> None:
         """首次请求前的初始化"""
@@ -2,17 +2,23 @@
 审计日志模块
 """
 
+import asyncio
+import hashlib
 import json
+import logging
 import time
+import uuid
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import redis.asyncio as aioredis
 from app.core.config import settings
 from fastapi import HTTPException, Request
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
 
 class AuditAction(str, Enum):
     """审计动作"""
@@ -55,20 +61,141 @@ class AuditLogEntry(BaseModel):
     user_agent: str
 
 
+def _value(item: Union[str, Enum]) -> str:
+    """枚举取值，避免str(Enum)带上类名"""
+    return item.value if isinstance(item, Enum) else str(item)
+
+
 class AuditLogger:
-    """审计日志记录器"""
+    """审计日志记录器
+
+    存储结构:
+        audit:entries                    条目ID -> JSON
+        audit:idx:all                    全部条目ID(按时间戳排序)
+        audit:idx:type:{资源类型}         按资源类型的条目ID
+        audit:idx:user:{用户}            按用户的条目ID
+        audit:idx:action:{动作}          按动作的条目ID
+        audit:idx:resource:{类型}:{ID}   按具体资源的条目ID
+        audit:count:{用户}:{小时}         该小时内各动作的次数
+
+    写入先进入内存缓冲，达到批量大小或定时由后台任务用一个管道批量写入条目、
+    索引和计数器；过期条目由定期运行的压缩任务删除，不在写入路径上清理。
+
+    缓冲区中的日志只保存在内存中: 进程崩溃时最多丢失FLUSH_INTERVAL秒内、
+    BATCH_SIZE条以内的日志，正常退出前应调用close()写入剩余日志。Redis不可用时
+    写入失败的日志放回缓冲区重试，缓冲区超过MAX_BUFFER条时丢弃最早的日志并计入
+    dropped。
+
+    旧版本按资源类型把JSON保存在有序集合 audit:{资源类型} 中，setup时由后台任务
+    一次性迁移到上述结构。
+    """
+
+    # 缓冲区达到该条数时立即写入
+    BATCH_SIZE = 100
+    # 缓冲区最长停留时间(秒)
+    FLUSH_INTERVAL = 1.0
+    # 压缩任务运行间隔(秒)
+    COMPACT_INTERVAL = 3600
+    # 压缩时每批处理的条目数
+    COMPACT_CHUNK = 1000
+    # 写入失败时缓冲区最多保留的条目数
+    MAX_BUFFER = 10000
+    # 旧数据迁移锁的有效期(秒)，迁移进程崩溃后其它进程可以接手
+    MIGRATE_LOCK_TTL = 600
 
     def __init__(self):
         self.redis: Optional[aioredis.Redis] = None
         self.prefix = "audit:"
         self.retention = settings.AUDIT_LOG_RETENTION_DAYS * 24 * 60 * 60
+        self._buffer: List[Tuple[str, AuditLogEntry]] = []
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._compactor: Optional[asyncio.Task] = None
+        self._migrator: Optional[asyncio.Task] = None
+        # 缓冲区溢出丢弃的条目数
+        self.dropped = 0
 
     async def setup(self):
-        """初始化Redis连接"""
+        """初始化Redis连接并启动后台写入、压缩和旧数据迁移任务"""
         if not self.redis:
             self.redis = await aioredis.from_url(
                 settings.REDIS_URL, encoding="utf-8", decode_responses=True
             )
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if self._compactor is None or self._compactor.done():
+            self._compactor = asyncio.create_task(self._compact_loop())
+        if self._migrator is None:
+            self._migrator = asyncio.create_task(self._migrate_once())
+
+    async def close(self):
+        """停止后台任务并写入缓冲区中剩余的日志"""
+        tasks = [
+            task
+            for task in (self._flusher, self._compactor, self._migrator)
+            if task and not task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._flusher = None
+        self._compactor = None
+        self._migrator = None
+        await self.flush()
+
+    # 键名
+
+    @property
+    def _entries_key(self) -> str:
+        return f"{self.prefix}entries"
+
+    @property
+    def _all_key(self) -> str:
+        return f"{self.prefix}idx:all"
+
+    def _type_key(self, resource_type: Union[str, AuditResourceType]) -> str:
+        return f"{self.prefix}idx:type:{_value(resource_type)}"
+
+    def _user_key(self, user_id: str) -> str:
+        return f"{self.prefix}idx:user:{user_id}"
+
+    def _action_key(self, action: Union[str, AuditAction]) -> str:
+        return f"{self.prefix}idx:action:{_value(action)}"
+
+    def _resource_key(
+        self, resource_type: Union[str, AuditResourceType], resource_id: str
+    ) -> str:
+        return f"{self.prefix}idx:resource:{_value(resource_type)}:{resource_id}"
+
+    def _count_key(self, user_id: str, hour: int) -> str:
+        return f"{self.prefix}count:{user_id}:{hour}"
+
+    def _legacy_keys(self) -> List[str]:
+        """旧版本按资源类型的有序集合
+
+        旧版本用f-string拼接枚举，键名随Python版本为值或"类名.成员名"。
+        """
+        keys = []
+        for rt in AuditResourceType:
+            keys.append(f"{self.prefix}{rt.value}")
+            keys.append(f"{self.prefix}{type(rt).__name__}.{rt.name}")
+        return keys
+
+    def _index_keys(self, entry: Dict[str, Any]) -> List[str]:
+        """条目所在的全部索引"""
+        return [
+            self._all_key,
+            self._type_key(entry["resource_type"]),
+            self._user_key(entry["user_id"]),
+            self._action_key(entry["action"]),
+            self._resource_key(entry["resource_type"], entry["resource_id"]),
+        ]
+
+    # 写入
 
     async def log(
         self,
@@ -80,7 +207,7 @@ class AuditLogger:
         details: Dict[str, Any],
         request: Request,
     ):
-        """记录审计日志"""
+        """记录审计日志(先进入缓冲区，批量写入)"""
         if not settings.AUDIT_LOG_ENABLED:
             return
 
@@ -101,13 +228,183 @@ class AuditLogger:
             user_agent=request.headers.get("user-agent", ""),
         )
 
-        # 保存日志
-        await self.redis.zadd(
-            f"{self.prefix}{resource_type}", {json.dumps(entry.dict()): entry.timestamp}
-        )
+        self._buffer.append((uuid.uuid4().hex, entry))
+        if len(self._buffer) >= self.BATCH_SIZE:
+            await self.flush()
 
-        # 清理过期日志
-        await self.cleanup()
+    async def flush(self) -> int:
+        """把缓冲区中的日志用一个管道写入
+
+        Returns:
+            int: 写入的条目数
+        """
+        async with self._flush_lock:
+            if not self._buffer or not self.redis:
+                return 0
+            batch, self._buffer = self._buffer, []
+            try:
+                await self._write(batch)
+            except Exception:
+                # 写入失败时放回缓冲区，下次重试；超过上限时丢弃最早的日志
+                self._buffer[:0] = batch
+                overflow = len(self._buffer) - self.MAX_BUFFER
+                if overflow > 0:
+                    del self._buffer[:overflow]
+                    self.dropped += overflow
+                    logger.warning(
+                        f"Audit log buffer full, dropped {overflow} entries "
+                        f"({self.dropped} in total)"
+                    )
+                raise
+            return len(batch)
+
+    async def _write(self, batch: List[Tuple[str, AuditLogEntry]]):
+        """用一个管道写入条目、索引和计数器"""
+        entries: Dict[str, str] = {}
+        indexes: Dict[str, Dict[str, int]] = {}
+        counters: Dict[Tuple[str, int], Dict[str, int]] = {}
+        for entry_id, entry in batch:
+            data = json.loads(entry.json())
+            entries[entry_id] = json.dumps(data)
+            for key in self._index_keys(data):
+                indexes.setdefault(key, {})[entry_id] = entry.timestamp
+            hour = entry.timestamp // 3600
+            actions = counters.setdefault((entry.user_id, hour), {})
+            actions[data["action"]] = actions.get(data["action"], 0) + 1
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self._entries_key, mapping=entries)
+        for key, members in indexes.items():
+            pipe.zadd(key, members)
+        for (user_id, hour), actions in counters.items():
+            count_key = self._count_key(user_id, hour)
+            for action, count in actions.items():
+                pipe.hincrby(count_key, action, count)
+            # 计数器按小时过期，不需要压缩任务处理
+            pipe.expireat(count_key, (hour + 1) * 3600 + self.retention)
+        await pipe.execute()
+
+    async def _flush_loop(self):
+        """定时写入缓冲区"""
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Audit log flush failed: {e}")
+
+    # 旧数据迁移
+
+    async def migrate_legacy(self) -> int:
+        """把旧版本按资源类型保存的日志迁移到条目和索引中
+
+        同一时间只有一个进程迁移，全部完成后写入标记，之后不再执行。条目ID由
+        旧数据内容生成，迁移中断后重新执行不会产生重复条目。
+
+        Returns:
+            int: 迁移的条目数
+        """
+        await self.setup()
+        if not self.redis:
+            return 0
+        return await self._migrate_legacy()
+
+    async def _migrate_legacy(self) -> int:
+        done_key = f"{self.prefix}migrated"
+        lock_key = f"{self.prefix}migrating"
+        if await self.redis.exists(done_key):
+            return 0
+        if not await self.redis.set(lock_key, 1, nx=True, ex=self.MIGRATE_LOCK_TTL):
+            return 0
+
+        migrated = 0
+        try:
+            for key in self._legacy_keys():
+                while True:
+                    members = await self.redis.zrange(key, 0, self.COMPACT_CHUNK - 1)
+                    if not members:
+                        break
+                    batch = []
+                    for member in members:
+                        try:
+                            entry = AuditLogEntry(**json.loads(member))
+                        except (ValueError, TypeError) as e:
+                            logger.warning(f"Skipping invalid legacy audit log: {e}")
+                            continue
+                        entry_id = hashlib.sha1(member.encode()).hexdigest()
+                        batch.append((entry_id, entry))
+                    if batch:
+                        await self._write(batch)
+                    # 写入后再从旧集合删除
+                    await self.redis.zrem(key, *members)
+                    migrated += len(batch)
+            await self.redis.set(done_key, 1)
+        finally:
+            await self.redis.delete(lock_key)
+        if migrated:
+            logger.info(f"Migrated {migrated} legacy audit log entries")
+        return migrated
+
+    async def _migrate_once(self):
+        try:
+            await self._migrate_legacy()
+        except Exception as e:
+            logger.error(f"Audit log migration failed: {e}")
+
+    # 查询
+
+    async def _load(self, entry_ids: List[str]) -> List[Dict[str, Any]]:
+        """批量读取条目，已被压缩删除的条目跳过"""
+        if not entry_ids:
+            return []
+        values = await self.redis.hmget(self._entries_key, entry_ids)
+        return [json.loads(value) for value in values if value]
+
+    async def _scan(
+        self,
+        key: str,
+        start_time: int,
+        end_time: int,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        match=None,
+    ) -> List[AuditLogEntry]:
+        """按时间倒序分页读取索引中的条目
+
+        只有存在索引无法覆盖的过滤条件(match)时才需要逐页读取并过滤，
+        否则直接按偏移量分页。
+        """
+        if match is None:
+            entry_ids = await self.redis.zrevrangebyscore(
+                key,
+                end_time,
+                start_time,
+                start=offset if limit is not None else None,
+                num=limit,
+            )
+            return [AuditLogEntry(**entry) for entry in await self._load(entry_ids)]
+
+        results: List[AuditLogEntry] = []
+        skipped = 0
+        position = 0
+        page = max(limit or 0, 100)
+        while limit is None or len(results) < limit:
+            entry_ids = await self.redis.zrevrangebyscore(
+                key, end_time, start_time, start=position, num=page
+            )
+            if not entry_ids:
+                break
+            position += len(entry_ids)
+            for entry in await self._load(entry_ids):
+                if not match(entry):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                results.append(AuditLogEntry(**entry))
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
 
     async def get_logs(
         self,
@@ -119,42 +416,38 @@ class AuditLogger:
         limit: int = 100,
         offset: int = 0,
     ) -> List[AuditLogEntry]:
-        """获取审计日志"""
+        """获取审计日志(按时间倒序)
+
+        使用最具选择性的索引(用户 > 资源类型 > 动作)，其余条件在读取时过滤。
+        """
         await self.setup()
         if not self.redis:
             return []
+        await self.flush()
 
         if start_time is None:
             start_time = 0
         if end_time is None:
             end_time = int(time.time())
 
-        # 获取指定类型的日志
-        if resource_type:
-            keys = [f"{self.prefix}{resource_type}"]
+        filters: List[Tuple[str, str]] = []
+        if user_id:
+            key = self._user_key(user_id)
+        elif resource_type:
+            key = self._type_key(resource_type)
+        elif action:
+            key = self._action_key(action)
         else:
-            # 获取所有类型的日志
-            keys = []
-            for rt in AuditResourceType:
-                keys.append(f"{self.prefix}{rt}")
-
-        # 获取日志条目
-        all_entries = []
-        for key in keys:
-            entries = await self.redis.zrangebyscore(
-                key, start_time, end_time, start=offset, num=limit, withscores=True
-            )
-            for entry_json, score in entries:
-                entry = json.loads(entry_json)
-                if (not user_id or entry["user_id"] == user_id) and (
-                    not action or entry["action"] == action
-                ):
-                    all_entries.append(AuditLogEntry(**entry))
+            key = self._all_key
+        if resource_type and key != self._type_key(resource_type):
+            filters.append(("resource_type", _value(resource_type)))
+        if action and key != self._action_key(action):
+            filters.append(("action", _value(action)))
 
-        # 按时间戳排序
-        all_entries.sort(key=lambda x: x.timestamp, reverse=True)
-
-        return all_entries[:limit]
+        match = None
+        if filters:
+            match = lambda entry: all(entry[f] == v for f, v in filters)  # noqa: E731
+        return await self._scan(key, start_time, end_time, limit, offset, match)
 
     async def get_user_activity(
         self,
@@ -162,29 +455,33 @@ class AuditLogger:
         start_time: Optional[int] = None,
         end_time: Optional[int] = None,
     ) -> Dict[str, int]:
-        """获取用户活动统计"""
+        """获取用户活动统计
+
+        直接读取按小时预计算的计数器，时间范围按整小时对齐。
+        """
         await self.setup()
         if not self.redis:
             return {}
+        await self.flush()
 
         if start_time is None:
             start_time = int(time.time()) - 24 * 60 * 60  # 默认查询最近24小时
         if end_time is None:
             end_time = int(time.time())
 
-        # 统计各类操作次数
-        activity = {}
-        for action in AuditAction:
-            count = 0
-            for rt in AuditResourceType:
-                key = f"{self.prefix}{rt}"
-                entries = await self.redis.zrangebyscore(key, start_time, end_time)
-                for entry_json in entries:
-                    entry = json.loads(entry_json)
-                    if entry["user_id"] == user_id and entry["action"] == action:
-                        count += 1
-            activity[action] = count
+        pipe = self.redis.pipeline(transaction=False)
+        for hour in range(start_time // 3600, end_time // 3600 + 1):
+            pipe.hgetall(self._count_key(user_id, hour))
+        buckets = await pipe.execute()
 
+        # 统计各类操作次数
+        activity = {action: 0 for action in AuditAction}
+        for bucket in buckets:
+            for action, count in (bucket or {}).items():
+                try:
+                    activity[AuditAction(action)] += int(count)
+                except ValueError:
+                    continue
         return activity
 
     async def get_resource_activity(
@@ -194,45 +491,83 @@ class AuditLogger:
         start_time: Optional[int] = None,
         end_time: Optional[int] = None,
     ) -> List[AuditLogEntry]:
-        """获取资源活动记录"""
+        """获取资源活动记录(按时间倒序)"""
         await self.setup()
         if not self.redis:
             return []
+        await self.flush()
 
         if start_time is None:
             start_time = int(time.time()) - 24 * 60 * 60  # 默认查询最近24小时
         if end_time is None:
             end_time = int(time.time())
 
-        # 获取资源的所有操作记录
-        key = f"{self.prefix}{resource_type}"
-        entries = await self.redis.zrangebyscore(key, start_time, end_time)
+        return await self._scan(
+            self._resource_key(resource_type, resource_id), start_time, end_time
+        )
 
-        # 过滤指定资源的记录
-        resource_entries = []
-        for entry_json in entries:
-            entry = json.loads(entry_json)
-            if entry["resource_id"] == resource_id:
-                resource_entries.append(AuditLogEntry(**entry))
+    # 压缩
 
-        # 按时间戳排序
-        resource_entries.sort(key=lambda x: x.timestamp, reverse=True)
+    async def compact(self) -> int:
+        """删除超过保留期的条目及其全部索引
 
-        return resource_entries
+        从总索引中按批取出过期条目，读取条目得到它所在的索引后用管道删除。
 
-    async def cleanup(self):
-        """清理过期日志"""
+        Returns:
+            int: 删除的条目数
+        """
         await self.setup()
         if not self.redis:
-            return
+            return 0
 
         # 获取截止时间
         cutoff = int(time.time()) - self.retention
+        removed = 0
+        while True:
+            entry_ids = await self.redis.zrangebyscore(
+                self._all_key, "-inf", cutoff, start=0, num=self.COMPACT_CHUNK
+            )
+            if not entry_ids:
+                break
 
-        # 清理各类型的过期日志
-        for rt in AuditResourceType:
-            key = f"{self.prefix}{rt}"
-            await self.redis.zremrangebyscore(key, "-inf", cutoff)
+            values = await self.redis.hmget(self._entries_key, entry_ids)
+            members: Dict[str, List[str]] = {}
+            for entry_id, value in zip(entry_ids, values):
+                if not value:
+                    continue
+                for key in self._index_keys(json.loads(value)):
+                    members.setdefault(key, []).append(entry_id)
+
+            pipe = self.redis.pipeline(transaction=False)
+            for key, ids in members.items():
+                pipe.zrem(key, *ids)
+            # 条目缺失时也要从总索引中移除，否则会一直被取到
+            pipe.zrem(self._all_key, *entry_ids)
+            pipe.hdel(self._entries_key, *entry_ids)
+            await pipe.execute()
+            removed += len(entry_ids)
+
+        # 尚未迁移的旧版本有序集合
+        pipe = self.redis.pipeline(transaction=False)
+        for key in self._legacy_keys():
+            pipe.zremrangebyscore(key, "-inf", cutoff)
+        await pipe.execute()
+        return removed
+
+    async def cleanup(self):
+        """清理过期日志"""
+        await self.compact()
+
+    async def _compact_loop(self):
+        """定期压缩"""
+        while True:
+            await asyncio.sleep(self.COMPACT_INTERVAL)
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error(f"Audit log compaction failed: {e}")
+
+    # 备份
 
     async def backup(self):
         """备份审计日志"""
@@ -242,21 +577,30 @@ class AuditLogger:
         await self.setup()
         if not self.redis:
             return
+        await self.flush()
 
         # 获取当前时间
         now = datetime.now()
         backup_time = int(now.timestamp())
 
-        # 备份各类型的日志
-        for rt in AuditResourceType:
-            key = f"{self.prefix}{rt}"
-            entries = await self.redis.zrange(key, 0, -1, withscores=True)
+        # 索引在服务端整体复制
+        keys = [self._all_key] + [self._type_key(rt) for rt in AuditResourceType]
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.zunionstore(f"{key}:backup:{backup_time}", [key])
+        await pipe.execute()
 
+        # 条目分批复制
+        backup_key = f"{self._entries_key}:backup:{backup_time}"
+        cursor = 0
+        while True:
+            cursor, entries = await self.redis.hscan(
+                self._entries_key, cursor, count=self.COMPACT_CHUNK
+            )
             if entries:
-                # 创建备份
-                backup_key = f"{key}:backup:{backup_time}"
-                for entry_json, score in entries:
-                    await self.redis.zadd(backup_key, {entry_json: score})
+                await self.redis.hset(backup_key, mapping=entries)
+            if cursor == 0:
+                break
 
     async def cleanup_backups(self):
         """清理过期备份"""
@@ -276,10 +620,13 @@ class AuditLogger:
                 break
 
         # 删除过期备份
+        expired = []
         for key in backup_keys:
             try:
                 backup_time = int(key.split(":")[-1])
                 if backup_time < int(time.time()) - self.retention:
-                    await self.redis.delete(key)
+                    expired.append(key)
             except (ValueError, IndexError):
                 continue
+        if expired:
+            await self.redis.delete(*expired)
@@ -0,0 +1,162 @@
+"""
+审计日志测试
+"""
+
+import json
+import time
+
+import pytest
+
+from ..core.audit import AuditAction, AuditLogEntry, AuditLogger, AuditResourceType
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return command
+
+    async def execute(self):
+        if self.redis.fail:
+            raise ConnectionError("redis down")
+        return [
+            await getattr(self.redis, name)(*args, **kwargs)
+            for name, args, kwargs in self.commands
+        ]
+
+
+class FakeRedis:
+    """模拟审计日志用到的Redis命令"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.zsets = {}
+        self.strings = {}
+        self.fail = False
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    async def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def hincrby(self, key, field, amount):
+        values = self.hashes.setdefault(key, {})
+        values[field] = str(int(values.get(field, 0)) + amount)
+
+    async def expireat(self, key, when):
+        return True
+
+    async def zadd(self, key, members):
+        self.zsets.setdefault(key, {}).update(members)
+
+    async def zrem(self, key, *members):
+        for member in members:
+            self.zsets.get(key, {}).pop(member, None)
+
+    def _sorted(self, key, low, high):
+        items = self.zsets.get(key, {}).items()
+        return [
+            member
+            for member, score in sorted(items, key=lambda item: item[1])
+            if float(low) <= score <= float(high)
+        ]
+
+    async def zrange(self, key, start, stop):
+        return self._sorted(key, "-inf", "inf")[start : stop + 1]
+
+    async def zrangebyscore(self, key, low, high, start=None, num=None):
+        members = self._sorted(key, low, high)
+        return members[start : start + num] if start is not None else members
+
+    async def zrevrangebyscore(self, key, high, low, start=None, num=None):
+        members = self._sorted(key, low, high)[::-1]
+        return members[start : start + num] if start is not None else members
+
+    async def zremrangebyscore(self, key, low, high):
+        for member in self._sorted(key, low, high):
+            self.zsets[key].pop(member)
+
+    async def exists(self, key):
+        return int(key in self.strings)
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.strings.pop(key, None)
+
+
+def _entry(user_id="u1", resource_id="d1", timestamp=None):
+    return AuditLogEntry(
+        timestamp=timestamp or int(time.time()) - 60,
+        user_id=user_id,
+        action=AuditAction.UPDATE,
+        resource_type=AuditResourceType.DEVICE,
+        resource_id=resource_id,
+        status="success",
+        details={},
+        client_ip="127.0.0.1",
+        user_agent="",
+    )
+
+
+@pytest.mark.asyncio
+async def test_legacy_logs_migrated_and_queryable():
+    """测试旧版本按资源类型保存的日志迁移后可以按用户和资源查询"""
+    audit = AuditLogger()
+    redis = audit.redis = FakeRedis()
+    legacy = [_entry("u1", "d1"), _entry("u2", "d2")]
+    redis.zsets["audit:device"] = {
+        json.dumps(json.loads(entry.json())): entry.timestamp for entry in legacy
+    }
+    try:
+        assert await audit.migrate_legacy() == 2
+        assert "audit:device" not in redis.zsets or not redis.zsets["audit:device"]
+
+        logs = await audit.get_logs(resource_type=AuditResourceType.DEVICE)
+        assert {log.user_id for log in logs} == {"u1", "u2"}
+        activity = await audit.get_resource_activity(AuditResourceType.DEVICE, "d1")
+        assert [log.user_id for log in activity] == ["u1"]
+        assert (await audit.get_user_activity("u2"))[AuditAction.UPDATE] == 1
+
+        # 迁移只执行一次
+        redis.zsets["audit:device"] = {json.dumps({"bad": 1}): 1}
+        assert await audit.migrate_legacy() == 0
+    finally:
+        await audit.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_buffer_is_bounded():
+    """测试写入失败时缓冲区有上限，超出部分丢弃最早的日志并计数"""
+    audit = AuditLogger()
+    audit.redis = FakeRedis()
+    audit.redis.fail = True
+    audit.MAX_BUFFER = 5
+    audit._buffer = [(f"e{i}", _entry()) for i in range(8)]
+
+    with pytest.raises(ConnectionError):
+        await audit.flush()
+
+    assert [entry_id for entry_id, _ in audit._buffer] == [f"e{i}" for i in range(3, 8)]
+    assert audit.dropped == 3
+
+    audit.redis.fail = False
+    assert await audit.flush() == 5
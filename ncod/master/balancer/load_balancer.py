@@ -34,6 +34,18 @@ class LoadBalancer:
         except Exception as e:
             logger.error(f"Error updating node load: {e}")
 
+    async def handle_load_report(self, node_id: str, load: Dict) -> None:
+        """处理从服务器通道上报的负载"""
+        await self.update_node_load(
+            node_id,
+            {
+                "cpu_usage": load.get("cpu", 0),
+                "memory_usage": load.get("memory", 0),
+                "device_count": load.get("device_count", 0),
+                "max_devices": load.get("max_devices", 1),
+            },
+        )
+
     def get_best_node(self, device_type: Optional[str] = None) -> Optional[str]:
         """获取最佳节点"""
         try:
@@ -113,6 +113,12 @@ MASTER_SLAVE_CONFIG = {
     "sync_interval": 300,  # 5分钟
 }
 
+# 从服务器长连接通道配置
+CHANNEL_CONFIG = {
+    "host": "0.0.0.0",
+    "port": int(os.getenv("CHANNEL_PORT", 5679)),
+}
+
 # API配置
 API_CONFIG = {
     "rate_limit": {
@@ -21,6 +21,7 @@ class Settings(BaseSettings):
     # 心跳配置
     HEARTBEAT_TIMEOUT: int = 30
     HEARTBEAT_RETRY_LIMIT: int = 3
+    HEARTBEAT_FLUSH_INTERVAL: int = 5  # 心跳批量落库间隔(秒)
 
     # 服务器配置
     MASTER_ID: str = "master-1"
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Dict, List, Optional, Any, cast
+from typing import Callable, Dict, List, Optional, Any, cast
 from sqlalchemy.sql import desc
 from sqlalchemy.sql.functions import count
 from .models import db, Device, DeviceUsage
@@ -10,14 +10,40 @@ logger = get_logger(__name__)
 config = ConfigManager()
 
 
+UsageListener = Callable[..., None]
+
+
 class DeviceManager:
     _instance: Optional['DeviceManager'] = None
+    # 设备使用/状态事件监听器: listener(event, device_id, **data)
+    _usage_listeners: List[UsageListener] = []
     
     def __new__(cls) -> 'DeviceManager':
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
     
+    def add_usage_listener(self, listener: UsageListener) -> None:
+        """注册设备事件监听器
+
+        事件: start(开始使用)、end(结束使用)、status(状态变化)、delete(删除)
+        """
+        if listener not in self._usage_listeners:
+            self._usage_listeners.append(listener)
+    
+    def remove_usage_listener(self, listener: UsageListener) -> None:
+        """移除设备事件监听器"""
+        if listener in self._usage_listeners:
+            self._usage_listeners.remove(listener)
+    
+    def _notify(self, event: str, device_id: int, **data: Any) -> None:
+        """通知监听器(监听器异常不影响设备操作)"""
+        for listener in list(self._usage_listeners):
+            try:
+                listener(event, device_id, **data)
+            except Exception as e:
+                logger.error(f"Device event listener failed: {e}")
+    
     def register_device(
         self,
         name: str,
@@ -117,6 +143,7 @@ class DeviceManager:
                 
             db.session.delete(device)
             db.session.commit()
+            self._notify('delete', device_id)
             
             logger.info(f"Device deleted: {device.name}")
             return True
@@ -143,6 +170,7 @@ class DeviceManager:
             device.status_message = message
             device.updated_at = datetime.now()
             db.session.commit()
+            self._notify('status', device_id, status=status)
             
             logger.info(f"Device status updated: {device.name} -> {status}")
             return True
@@ -193,6 +221,7 @@ class DeviceManager:
             
             db.session.add(usage)
             db.session.commit()
+            self._notify('start', device_id, user_id=user_id)
             
             logger.info(f"Device usage started: {device.name}")
             return cast(Dict[str, Any], usage.to_dict())
@@ -221,6 +250,7 @@ class DeviceManager:
                 
             usage.end_time = datetime.now()
             db.session.commit()
+            self._notify('end', device_id, user_id=user_id)
             
             logger.info(f"Device released: {usage.device.name}")
             return True
@@ -1,6 +1,15 @@
+import threading
 from datetime import datetime
 from typing import Dict, List, Optional, Any, cast
+import redis.asyncio as aioredis
+from flask import current_app
 from sqlalchemy.sql import desc
+from ncod.core.notifier import (
+    Digest,
+    Notification,
+    NotificationDispatcher,
+    RedisNotificationQueue,
+)
 from .models import db, Device, DeviceNotification
 from .utils.logger import get_logger
 from .config_manager import ConfigManager
@@ -10,13 +19,48 @@ config = ConfigManager()
 
 
 class DeviceNotifier:
+    """设备通知
+
+    通知记录写入数据库后交给通知分发器异步发送，同一渠道窗口内的通知
+    合并为摘要；每个渠道有结果后记入delivered_channels，所有渠道都有结果
+    后再把记录标记为sent或failed。
+
+    配置了REDIS_URL时分发队列保存在Redis中，多个进程共享队列，每条通知
+    由认领它的进程发送。启动时recover_pending重新提交pending记录中尚未有
+    结果的渠道，队列中已有的通知不会重复提交。
+    """
+    
     _instance: Optional['DeviceNotifier'] = None
+    # 合并窗口(秒)
+    DIGEST_WINDOW = 30
+    # 各渠道每秒最多发送的摘要数
+    CHANNEL_RATES = {'email': 1.0, 'sms': 0.2, 'webhook': 5.0}
+    # Redis中待发送通知的键
+    QUEUE_KEY = 'device:notify:pending'
     
     def __new__(cls) -> 'DeviceNotifier':
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance._setup()
         return cls._instance
     
+    def _setup(self) -> None:
+        self._lock = threading.Lock()
+        self._app: Any = None
+        self.dispatcher = NotificationDispatcher(window=self.DIGEST_WINDOW)
+        senders = {
+            'email': self._send_email_notification,
+            'sms': self._send_sms_notification,
+            'webhook': self._send_webhook_notification
+        }
+        for name, sender in senders.items():
+            self.dispatcher.register_channel(
+                name,
+                sender,
+                rate=self.CHANNEL_RATES[name],
+                on_result=self._on_delivered
+            )
+    
     def send_alert_notification(
         self,
         alert: Any,
@@ -45,7 +89,7 @@ class DeviceNotifier:
                 severity=alert.severity,
                 channels=channels,
                 status='pending',
-                metadata={
+                meta={
                     'alert_id': alert.id,
                     'alert_type': alert.alert_type,
                     'device_name': alert.device.name
@@ -60,7 +104,7 @@ class DeviceNotifier:
             self._send_notification(notification)
             
             logger.info(
-                f"Alert notification sent: {alert.device.name} -> {channels}"
+                f"Alert notification queued: {alert.device.name} -> {channels}"
             )
             return cast(Dict[str, Any], notification.to_dict())
             
@@ -97,7 +141,7 @@ class DeviceNotifier:
                 severity='info',
                 channels=channels,
                 status='pending',
-                metadata={
+                meta={
                     'alert_id': alert.id,
                     'alert_type': alert.alert_type,
                     'device_name': alert.device.name,
@@ -113,7 +157,7 @@ class DeviceNotifier:
             self._send_notification(notification)
             
             logger.info(
-                f"Alert resolution notification sent: {alert.device.name}"
+                f"Alert resolution notification queued: {alert.device.name}"
             )
             return cast(Dict[str, Any], notification.to_dict())
             
@@ -124,32 +168,175 @@ class DeviceNotifier:
             db.session.rollback()
             return None
     
+    def _start(self, pending: Optional[List[Notification]] = None) -> bool:
+        """首次使用时启动分发器(需在应用上下文中调用)
+        
+        Args:
+            pending: 启动时恢复发送的通知
+            
+        Returns:
+            bool: 是否由本次调用启动
+        """
+        with self._lock:
+            if self._app is not None:
+                return False
+            self._app = current_app._get_current_object()
+            redis_url = self._app.config.get('REDIS_URL')
+            if redis_url:
+                self.dispatcher.queue = RedisNotificationQueue(
+                    aioredis.from_url(redis_url, decode_responses=True),
+                    self.QUEUE_KEY
+                )
+            self.dispatcher.start_in_thread(pending or [])
+            return True
+    
+    def recover_pending(self) -> int:
+        """重新提交数据库中仍为pending的通知(需在应用上下文中调用)
+        
+        只提交尚未有结果的渠道，并在分发器开始发送前写入队列；队列中已有
+        的通知(重新加载的或由其他进程持有的)由分发器跳过。
+        
+        Returns:
+            int: 恢复的通知数
+        """
+        try:
+            pending = DeviceNotification.query.filter_by(status='pending').all()
+            
+            resend: List[Notification] = []
+            for notification in pending:
+                channels = self._channels(notification)
+                if not channels:
+                    self._fail(notification, 'No supported channel')
+                    continue
+                delivered = set(notification.delivered_channels or ())
+                remaining = [c for c in channels if c not in delivered]
+                if not remaining:
+                    # 所有渠道都有结果，但退出前未来得及更新状态
+                    self._finish(notification)
+                    db.session.commit()
+                    continue
+                resend.extend(
+                    self._notification(notification, channel)
+                    for channel in remaining
+                )
+                
+            if not self._start(resend):
+                for item in resend:
+                    self.dispatcher.submit_threadsafe(item).result()
+            if pending:
+                logger.info(f"Recovered {len(pending)} pending notifications")
+            return len(pending)
+            
+        except Exception as e:
+            logger.error(f"Failed to recover pending notifications: {e}")
+            db.session.rollback()
+            return 0
+    
+    def _channels(self, notification: Any) -> List[str]:
+        """通知中分发器支持的渠道"""
+        return [
+            channel for channel in notification.channels
+            if self.dispatcher.has_channel(channel)
+        ]
+    
     def _send_notification(self, notification: Any) -> None:
-        """发送通知"""
+        """把通知提交给分发器，记录保持pending直到发送有结果"""
         try:
+            channels = self._channels(notification)
             for channel in notification.channels:
-                if channel == 'email':
-                    self._send_email_notification(notification)
-                elif channel == 'sms':
-                    self._send_sms_notification(notification)
-                elif channel == 'webhook':
-                    self._send_webhook_notification(notification)
-                else:
+                if channel not in channels:
                     logger.warning(
                         f"Unsupported notification channel: {channel}"
                     )
-                    
-            notification.status = 'sent'
-            notification.sent_at = datetime.now()
-            db.session.commit()
+            if not channels:
+                notification.status = 'failed'
+                notification.error_message = 'No supported channel'
+                db.session.commit()
+                return
+                
+            self._start()
+            for channel in channels:
+                self.dispatcher.submit_threadsafe(
+                    self._notification(notification, channel)
+                ).result()
             
         except Exception as e:
             logger.error(f"Failed to send notification: {e}")
+            self._fail(notification, str(e))
+    
+    def _notification(self, notification: Any, channel: str) -> Notification:
+        """一个渠道的待发送通知
+        
+        队列中的ID由记录ID和渠道组成，同一渠道不会被重复提交。
+        """
+        return Notification(
+            id=f"{notification.id}:{channel}",
+            channel=channel,
+            recipient=channel,
+            title=f"[{notification.severity}] "
+                  f"{notification.notification_type}",
+            body=notification.message,
+            severity=notification.severity,
+            # 每条记录都要更新状态，不按键合并，只合并为摘要
+            meta={'notification_id': notification.id}
+        )
+    
+    def _fail(self, notification: Any, error: str) -> None:
+        """标记通知为失败"""
+        notification.status = 'failed'
+        notification.error_message = error
+        db.session.commit()
+    
+    @staticmethod
+    def _finish(notification: Any) -> None:
+        """所有渠道都有结果后按是否有渠道失败更新状态"""
+        if notification.error_message:
             notification.status = 'failed'
-            notification.error_message = str(e)
-            db.session.commit()
+        else:
+            notification.status = 'sent'
+            notification.sent_at = datetime.now()
+    
+    def _on_delivered(
+        self,
+        digest: Digest,
+        ok: bool,
+        error: Optional[str]
+    ) -> None:
+        """摘要发送成功或最终失败后更新通知记录(在线程池中调用)
+        
+        记录行加锁后再更新，同一通知的不同渠道在其他线程或进程中同时
+        有结果时不会互相覆盖。
+        """
+        if self._app is None:
+            return
+        ids = [item.meta.get('notification_id') for item in digest.items]
+            
+        with self._lock, self._app.app_context():
+            try:
+                for notification in DeviceNotification.query.filter(
+                    DeviceNotification.id.in_(ids)
+                ).with_for_update().all():
+                    delivered = list(notification.delivered_channels or ())
+                    if digest.channel in delivered:
+                        continue
+                    notification.delivered_channels = delivered + [
+                        digest.channel
+                    ]
+                    if not ok:
+                        notification.error_message = '; '.join(filter(None, [
+                            notification.error_message,
+                            f"{digest.channel}: {error}"
+                        ]))
+                    if set(self._channels(notification)) <= set(
+                        notification.delivered_channels
+                    ):
+                        self._finish(notification)
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"Failed to update notification status: {e}")
+                db.session.rollback()
     
-    def _send_email_notification(self, notification: Any) -> None:
+    def _send_email_notification(self, digest: Digest) -> None:
         """发送邮件通知"""
         try:
             # TODO: 实现邮件发送逻辑
@@ -158,7 +345,7 @@ class DeviceNotifier:
             logger.error(f"Failed to send email notification: {e}")
             raise
     
-    def _send_sms_notification(self, notification: Any) -> None:
+    def _send_sms_notification(self, digest: Digest) -> None:
         """发送短信通知"""
         try:
             # TODO: 实现短信发送逻辑
@@ -167,7 +354,7 @@ class DeviceNotifier:
             logger.error(f"Failed to send SMS notification: {e}")
             raise
     
-    def _send_webhook_notification(self, notification: Any) -> None:
+    def _send_webhook_notification(self, digest: Digest) -> None:
         """发送Webhook通知"""
         try:
             # TODO: 实现Webhook发送逻辑
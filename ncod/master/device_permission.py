@@ -1,22 +1,360 @@
+import heapq
+import json
+import threading
+import uuid
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Optional, Any, cast
+from typing import (
+    Dict, List, Optional, Any, Iterable, Set, Tuple, cast
+)
+import redis
+from flask import current_app
 from sqlalchemy.sql import desc
 from .models import db, Device, DevicePermission as PermissionModel
 from .utils.logger import get_logger
 from .config_manager import ConfigManager
+from .scheduler_manager import SchedulerManager
 
 logger = get_logger(__name__)
 config = ConfigManager()
 
+# (授权ID, 用户ID, 设备ID, 权限类型, 过期时间)
+GrantRow = Tuple[int, int, int, str, Optional[datetime]]
+
+
+class DeviceACLIndex:
+    """设备访问控制索引
+    
+    按(用户, 设备)维护有效授权，由授予/撤销事件实时更新，并定期用数据库快照
+    整体重建(重建期间的事件先记入日志，快照应用后重放)。带过期时间的授权
+    放入过期堆，判定时按过期时间即时生效，后台任务再从堆中取出到期的授权
+    写回数据库。
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        # (用户ID, 设备ID) -> {权限类型: 授权ID}
+        self._acl: Dict[Tuple[int, int], Dict[str, int]] = {}
+        self._grants: Dict[int, GrantRow] = {}
+        self._user_devices: Dict[int, Set[int]] = defaultdict(set)
+        # (过期时间, 授权ID)，撤销的授权在出堆时跳过
+        self._expiry: List[Tuple[datetime, int]] = []
+        self._journal: Optional[List[Tuple[str, Any]]] = None
+        self.ready = False
+    
+    def begin_rebuild(self) -> None:
+        """开始重建，之后的事件记入日志"""
+        with self._lock:
+            self._journal = []
+    
+    def rebuild(self, grants: Iterable[GrantRow]) -> None:
+        """用有效授权快照重建索引并重放重建期间的事件"""
+        with self._lock:
+            journal, self._journal = self._journal or [], None
+            self._acl.clear()
+            self._grants.clear()
+            self._user_devices.clear()
+            self._expiry = []
+            for grant in grants:
+                self._add(tuple(grant))
+            for event, data in journal:
+                self._apply(event, data)
+            self.ready = True
+    
+    def abort_rebuild(self) -> None:
+        """放弃重建(事件已实时生效，丢弃日志即可)"""
+        with self._lock:
+            self._journal = None
+    
+    def grant(
+        self,
+        grant_id: int,
+        user_id: int,
+        device_id: int,
+        permission_type: str,
+        expires_at: Optional[datetime] = None
+    ) -> None:
+        """授权事件"""
+        self._record(
+            'grant',
+            (grant_id, user_id, device_id, permission_type, expires_at)
+        )
+    
+    def revoke(self, grant_id: int) -> None:
+        """撤销/停用事件"""
+        self._record('revoke', grant_id)
+    
+    def check(
+        self,
+        user_id: int,
+        device_id: int,
+        permission_type: str,
+        now: Optional[datetime] = None
+    ) -> bool:
+        """检查用户对设备是否有某种有效权限"""
+        with self._lock:
+            grant_id = self._acl.get((user_id, device_id), {}).get(
+                permission_type
+            )
+            if grant_id is None:
+                return False
+            return self._valid(self._grants[grant_id], now or datetime.now())
+    
+    def permissions(
+        self,
+        user_id: int,
+        device_id: int,
+        now: Optional[datetime] = None
+    ) -> Set[str]:
+        """用户对设备的有效权限类型"""
+        now = now or datetime.now()
+        with self._lock:
+            return {
+                permission_type
+                for permission_type, grant_id in self._acl.get(
+                    (user_id, device_id), {}
+                ).items()
+                if self._valid(self._grants[grant_id], now)
+            }
+    
+    def devices(
+        self,
+        user_id: int,
+        permission_type: Optional[str] = None,
+        now: Optional[datetime] = None
+    ) -> Set[int]:
+        """用户有(某种)有效权限的设备"""
+        now = now or datetime.now()
+        with self._lock:
+            result = set()
+            for device_id in self._user_devices.get(user_id, ()):
+                grants = self._acl[(user_id, device_id)]
+                if permission_type is not None:
+                    grant_id = grants.get(permission_type)
+                    ids = [grant_id] if grant_id is not None else []
+                else:
+                    ids = list(grants.values())
+                if any(self._valid(self._grants[i], now) for i in ids):
+                    result.add(device_id)
+            return result
+    
+    def pop_expired(self, now: Optional[datetime] = None) -> List[int]:
+        """从索引中移除已到期的授权，返回其ID"""
+        now = now or datetime.now()
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, grant_id = heapq.heappop(self._expiry)
+                grant = self._grants.get(grant_id)
+                if grant is None or grant[4] != expires_at:
+                    continue
+                self._record('revoke', grant_id)
+                expired.append(grant_id)
+        return expired
+    
+    def next_expiry(self) -> Optional[datetime]:
+        with self._lock:
+            return self._expiry[0][0] if self._expiry else None
+    
+    def __len__(self) -> int:
+        return len(self._grants)
+    
+    @staticmethod
+    def _valid(grant: GrantRow, now: datetime) -> bool:
+        return grant[4] is None or grant[4] > now
+    
+    def _record(self, event: str, data: Any) -> None:
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((event, data))
+            self._apply(event, data)
+    
+    def _apply(self, event: str, data: Any) -> None:
+        if event == 'grant':
+            self._add(data)
+        elif event == 'revoke':
+            self._remove(data)
+    
+    def _add(self, grant: GrantRow) -> None:
+        grant_id, user_id, device_id, permission_type, expires_at = grant
+        self._remove(grant_id)
+        grants = self._acl.setdefault((user_id, device_id), {})
+        previous = grants.get(permission_type)
+        if previous is not None:
+            self._remove(previous)
+            grants = self._acl.setdefault((user_id, device_id), {})
+        grants[permission_type] = grant_id
+        self._grants[grant_id] = grant
+        self._user_devices[user_id].add(device_id)
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, grant_id))
+    
+    def _remove(self, grant_id: int) -> None:
+        grant = self._grants.pop(grant_id, None)
+        if grant is None:
+            return
+        _, user_id, device_id, permission_type, _ = grant
+        key = (user_id, device_id)
+        grants = self._acl.get(key)
+        if grants and grants.get(permission_type) == grant_id:
+            del grants[permission_type]
+            if not grants:
+                del self._acl[key]
+                devices = self._user_devices.get(user_id)
+                if devices is not None:
+                    devices.discard(device_id)
+                    if not devices:
+                        del self._user_devices[user_id]
+
 
 class DevicePermissionManager:
+    """设备权限管理
+    
+    判定只读内存索引。配置了REDIS_URL时授予/撤销事件经Redis频道广播，其他
+    工作进程收到后直接更新自己的索引，撤销立即在所有进程生效；定期对账兜底
+    处理丢失的通知。
+    """
+    
     _instance: Optional['DevicePermissionManager'] = None
+    # 授权变更事件频道
+    EVENT_CHANNEL = 'device_acl:events'
+    # 索引与数据库对账间隔(秒)，用于同步其他进程的授权变更
+    RECONCILE_INTERVAL = 300
+    # 到期授权写回数据库的检查间隔(秒)，判定本身按过期时间即时生效
+    EXPIRY_INTERVAL = 10
     
     def __new__(cls) -> 'DevicePermissionManager':
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance.index = DeviceACLIndex()
+            cls._instance._reconcile_lock = threading.Lock()
+            cls._instance._app = None
+            cls._instance._redis = None
+            cls._instance._events = None
+            cls._instance._node_id = uuid.uuid4().hex
         return cls._instance
     
+    def start(self) -> None:
+        """构建索引并注册后台对账和过期任务(需在应用上下文中调用)"""
+        self._app = current_app._get_current_object()
+        # 先订阅事件再构建索引，构建期间的事件由索引日志重放
+        self._subscribe(self._app.config.get('REDIS_URL'))
+        self.reconcile()
+        scheduler = SchedulerManager()
+        scheduler.add_task(
+            self._in_app_context,
+            self.RECONCILE_INTERVAL,
+            'device_acl_reconcile',
+            args=(self.reconcile,)
+        )
+        scheduler.add_task(
+            self._in_app_context,
+            self.EXPIRY_INTERVAL,
+            'device_acl_expiry',
+            args=(self.deactivate_expired,)
+        )
+    
+    def stop(self) -> None:
+        """移除后台任务并停止接收授权变更事件"""
+        scheduler = SchedulerManager()
+        scheduler.remove_task('device_acl_reconcile')
+        scheduler.remove_task('device_acl_expiry')
+        if self._events is not None:
+            self._events.stop()
+            self._events = None
+    
+    def _in_app_context(self, func: Any) -> Any:
+        with self._app.app_context():
+            return func()
+    
+    def _subscribe(self, redis_url: Optional[str]) -> None:
+        """在后台线程中接收其他进程的授权变更事件"""
+        if not redis_url or self._events is not None:
+            return
+        self._redis = redis.Redis.from_url(redis_url)
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.EVENT_CHANNEL: self._on_event})
+        self._events = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+    
+    def _publish(self, event: str, data: Any) -> None:
+        """广播授权变更事件，失败时由定期对账兜底"""
+        if self._redis is None:
+            return
+        try:
+            self._redis.publish(self.EVENT_CHANNEL, json.dumps({
+                'origin': self._node_id,
+                'event': event,
+                'data': data
+            }, default=str))
+        except Exception as e:
+            logger.error(f"Failed to publish device ACL event: {e}")
+    
+    def _on_event(self, message: Dict[str, Any]) -> None:
+        """应用其他进程的授权变更事件"""
+        try:
+            payload = json.loads(message['data'])
+            if payload.get('origin') == self._node_id:
+                return
+            if payload['event'] == 'grant':
+                grant_id, user_id, device_id, permission_type, expires_at = (
+                    payload['data']
+                )
+                self.index.grant(
+                    grant_id,
+                    user_id,
+                    device_id,
+                    permission_type,
+                    datetime.fromisoformat(expires_at) if expires_at else None
+                )
+            elif payload['event'] == 'revoke':
+                self.index.revoke(payload['data'])
+        except Exception as e:
+            logger.error(f"Invalid device ACL event: {e}")
+    
+    def reconcile(self) -> None:
+        """用数据库中的有效授权重建索引(一次查询)"""
+        with self._reconcile_lock:
+            self.index.begin_rebuild()
+            try:
+                grants = PermissionModel.query.filter_by(
+                    is_active=True
+                ).with_entities(
+                    PermissionModel.id,
+                    PermissionModel.user_id,
+                    PermissionModel.device_id,
+                    PermissionModel.permission_type,
+                    PermissionModel.expires_at
+                ).all()
+            except Exception:
+                self.index.abort_rebuild()
+                raise
+            self.index.rebuild(grants)
+            logger.debug(f"Device ACL index rebuilt: {len(grants)} grants")
+    
+    def _ensure_index(self) -> None:
+        if not self.index.ready:
+            self.reconcile()
+    
+    def deactivate_expired(self, now: Optional[datetime] = None) -> int:
+        """把已到期的授权批量标记为无效"""
+        now = now or datetime.now()
+        expired = self.index.pop_expired(now)
+        if not expired:
+            return 0
+        try:
+            PermissionModel.query.filter(
+                PermissionModel.id.in_(expired)
+            ).update(
+                {'is_active': False, 'updated_at': now},
+                synchronize_session=False
+            )
+            db.session.commit()
+            logger.info(f"Deactivated {len(expired)} expired device permissions")
+        except Exception as e:
+            logger.error(f"Failed to deactivate expired permissions: {e}")
+            db.session.rollback()
+        return len(expired)
+    
     def grant_permission(
         self,
         device_id: int,
@@ -41,6 +379,16 @@ class DevicePermissionManager:
                 is_active=True
             ).first()
             
+            if existing and existing.expires_at and (
+                existing.expires_at <= datetime.now()
+            ):
+                # 已过期但尚未被后台任务停用
+                existing.is_active = False
+                existing.updated_at = datetime.now()
+                self.index.revoke(existing.id)
+                self._publish('revoke', existing.id)
+                existing = None
+                
             if existing:
                 logger.error(
                     f"Permission already exists: {device_id} -> {user_id}"
@@ -60,6 +408,15 @@ class DevicePermissionManager:
             
             db.session.add(permission)
             db.session.commit()
+            grant = (
+                permission.id,
+                user_id,
+                device_id,
+                permission_type,
+                expires_at
+            )
+            self.index.grant(*grant)
+            self._publish('grant', grant)
             
             logger.info(
                 f"Permission granted: {device.name} -> User {user_id}"
@@ -89,6 +446,8 @@ class DevicePermissionManager:
             permission.updated_at = datetime.now()
             
             db.session.commit()
+            self.index.revoke(permission_id)
+            self._publish('revoke', permission_id)
             
             logger.info(f"Permission revoked: {permission_id}")
             return True
@@ -104,31 +463,39 @@ class DevicePermissionManager:
         user_id: int,
         permission_type: str
     ) -> bool:
-        """检查设备权限"""
+        """检查设备权限(只读内存索引)"""
         try:
-            # 检查是否有有效权限
-            permission = PermissionModel.query.filter_by(
-                device_id=device_id,
-                user_id=user_id,
-                permission_type=permission_type,
-                is_active=True
-            ).first()
-            
-            if not permission:
-                return False
-                
-            # 检查是否过期
-            if permission.expires_at and permission.expires_at < datetime.now():
-                permission.is_active = False
-                db.session.commit()
-                return False
-                
-            return True
+            self._ensure_index()
+            return self.index.check(user_id, device_id, permission_type)
             
         except Exception as e:
             logger.error(f"Failed to check permission: {e}")
             return False
     
+    def get_user_device_ids(
+        self,
+        user_id: int,
+        permission_type: Optional[str] = None
+    ) -> Set[int]:
+        """用户有(某种)有效权限的设备ID"""
+        try:
+            self._ensure_index()
+            return self.index.devices(user_id, permission_type)
+            
+        except Exception as e:
+            logger.error(f"Failed to get user devices: {e}")
+            return set()
+    
+    def filter_devices(
+        self,
+        user_id: int,
+        device_ids: Iterable[int],
+        permission_type: Optional[str] = None
+    ) -> List[int]:
+        """按权限过滤设备列表，保持原有顺序"""
+        allowed = self.get_user_device_ids(user_id, permission_type)
+        return [device_id for device_id in device_ids if device_id in allowed]
+    
     def list_user_permissions(
         self,
         user_id: int,
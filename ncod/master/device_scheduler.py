@@ -1,70 +1,392 @@
+import threading
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Optional, Any, cast
+from typing import Dict, List, Optional, Any, Iterable, Set, Tuple, cast
+from flask import current_app
 from sqlalchemy.sql import desc
 from .models import Device, DeviceUsage
 from .utils.logger import get_logger
 from .config_manager import ConfigManager
 from .device_manager import DeviceManager
+from .scheduler_manager import SchedulerManager
 
 logger = get_logger(__name__)
 config = ConfigManager()
 device_manager = DeviceManager()
 
+# (设备类型, 从服务器ID)
+PoolKey = Tuple[str, int]
+
+
+class AvailabilityIndex:
+    """空闲设备索引
+    
+    按(设备类型, 从服务器)维护空闲/占用集合，由设备使用事件实时更新，
+    并定期用数据库快照整体重建。重建期间到达的事件先记入日志，快照应用后
+    重放，避免事件被旧快照覆盖。
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._free: Dict[PoolKey, Set[int]] = defaultdict(set)
+        self._busy: Dict[PoolKey, Set[int]] = defaultdict(set)
+        # 设备类型 -> 有空闲设备的从服务器
+        self._slaves: Dict[str, Set[int]] = defaultdict(set)
+        self._devices: Dict[int, PoolKey] = {}
+        self._slave_load: Dict[int, int] = defaultdict(int)
+        self._user_slave: Dict[int, int] = {}
+        self._journal: Optional[List[Tuple[str, int, Optional[int]]]] = None
+        self.ready = False
+    
+    def begin_rebuild(self) -> None:
+        """开始重建，之后的事件记入日志"""
+        with self._lock:
+            self._journal = []
+    
+    def rebuild(
+        self,
+        devices: Iterable[Tuple[int, str, int]],
+        busy: Iterable[Tuple[int, Optional[int]]]
+    ) -> None:
+        """用数据库快照重建索引并重放重建期间的事件
+        
+        Args:
+            devices: 在线设备 (device_id, device_type, slave_id)
+            busy: 未结束的使用记录 (device_id, user_id)
+        """
+        with self._lock:
+            journal, self._journal = self._journal or [], None
+            self._free.clear()
+            self._busy.clear()
+            self._slaves.clear()
+            self._devices.clear()
+            self._slave_load.clear()
+            for device_id, device_type, slave_id in devices:
+                self._add(device_id, (device_type, slave_id))
+            for device_id, user_id in busy:
+                self._mark_busy(device_id, user_id)
+            for event, device_id, user_id in journal:
+                self._apply(event, device_id, user_id)
+            self.ready = True
+    
+    def abort_rebuild(self) -> None:
+        """放弃重建(事件已实时生效，丢弃日志即可)"""
+        with self._lock:
+            self._journal = None
+    
+    def add_device(self, device_id: int, device_type: str, slave_id: int) -> None:
+        """加入空闲设备"""
+        with self._lock:
+            self._add(device_id, (device_type, slave_id))
+    
+    def remove_device(self, device_id: int) -> None:
+        """移除设备(离线/删除)"""
+        self._record('remove', device_id)
+    
+    def mark_busy(self, device_id: int, user_id: Optional[int] = None) -> None:
+        """设备开始使用"""
+        self._record('busy', device_id, user_id)
+    
+    def mark_free(self, device_id: int) -> None:
+        """设备结束使用"""
+        self._record('free', device_id)
+    
+    def acquire(
+        self,
+        device_type: str,
+        policy: 'PlacementPolicy',
+        user_id: Optional[int] = None,
+        slave_id: Optional[int] = None
+    ) -> Optional[int]:
+        """按放置策略选出一个空闲设备并标记为占用"""
+        with self._lock:
+            slaves = self._slaves.get(device_type)
+            if not slaves:
+                return None
+            if slave_id is not None:
+                chosen = slave_id if slave_id in slaves else None
+            else:
+                chosen = policy.choose(device_type, slaves, self, user_id)
+            if chosen is None:
+                return None
+            device_id = next(iter(self._free[(device_type, chosen)]))
+            self._record('busy', device_id, user_id)
+            return device_id
+    
+    def free_count(self, device_type: str, slave_id: Optional[int] = None) -> int:
+        """空闲设备数量"""
+        with self._lock:
+            if slave_id is not None:
+                return len(self._free.get((device_type, slave_id), ()))
+            return sum(
+                len(self._free[(device_type, slave)])
+                for slave in self._slaves.get(device_type, ())
+            )
+    
+    def slave_load(self, slave_id: int) -> int:
+        """从服务器上正在使用的设备数"""
+        return self._slave_load.get(slave_id, 0)
+    
+    def last_slave(self, user_id: Optional[int]) -> Optional[int]:
+        """用户最近使用的从服务器"""
+        return self._user_slave.get(user_id) if user_id is not None else None
+    
+    def _record(
+        self,
+        event: str,
+        device_id: int,
+        user_id: Optional[int] = None
+    ) -> None:
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((event, device_id, user_id))
+            self._apply(event, device_id, user_id)
+    
+    def _apply(self, event: str, device_id: int, user_id: Optional[int]) -> None:
+        if event == 'busy':
+            self._mark_busy(device_id, user_id)
+        elif event == 'free':
+            self._mark_free(device_id)
+        elif event == 'remove':
+            self._remove(device_id)
+    
+    def _add(self, device_id: int, key: PoolKey) -> None:
+        if device_id in self._devices:
+            return
+        self._devices[device_id] = key
+        self._free[key].add(device_id)
+        self._slaves[key[0]].add(key[1])
+    
+    def _mark_busy(self, device_id: int, user_id: Optional[int]) -> None:
+        key = self._devices.get(device_id)
+        if key is None or device_id in self._busy[key]:
+            return
+        device_type, slave_id = key
+        free = self._free[key]
+        free.discard(device_id)
+        if not free:
+            self._slaves[device_type].discard(slave_id)
+        self._busy[key].add(device_id)
+        self._slave_load[slave_id] += 1
+        if user_id is not None:
+            self._user_slave[user_id] = slave_id
+    
+    def _mark_free(self, device_id: int) -> None:
+        key = self._devices.get(device_id)
+        if key is None or device_id not in self._busy[key]:
+            return
+        self._busy[key].discard(device_id)
+        self._slave_load[key[1]] -= 1
+        self._free[key].add(device_id)
+        self._slaves[key[0]].add(key[1])
+    
+    def _remove(self, device_id: int) -> None:
+        key = self._devices.pop(device_id, None)
+        if key is None:
+            return
+        if device_id in self._busy[key]:
+            self._busy[key].discard(device_id)
+            self._slave_load[key[1]] -= 1
+        free = self._free[key]
+        free.discard(device_id)
+        if not free:
+            self._slaves[key[0]].discard(key[1])
+
+
+class PlacementPolicy:
+    """放置策略: 从有空闲设备的从服务器中选一个"""
+    
+    name = ''
+    
+    def choose(
+        self,
+        device_type: str,
+        slaves: Set[int],
+        index: AvailabilityIndex,
+        user_id: Optional[int] = None
+    ) -> Optional[int]:
+        raise NotImplementedError
+
+
+class LeastLoadedPolicy(PlacementPolicy):
+    """负载最低的从服务器优先，负载相同时空闲设备多的优先"""
+    
+    name = 'least_loaded'
+    
+    def choose(self, device_type, slaves, index, user_id=None):
+        return min(
+            slaves,
+            key=lambda slave: (
+                index.slave_load(slave),
+                -index.free_count(device_type, slave),
+                slave
+            )
+        )
+
+
+class LocalityPolicy(PlacementPolicy):
+    """优先用户最近使用的从服务器，否则退回负载最低"""
+    
+    name = 'locality'
+    
+    def __init__(self) -> None:
+        self.fallback = LeastLoadedPolicy()
+    
+    def choose(self, device_type, slaves, index, user_id=None):
+        preferred = index.last_slave(user_id)
+        if preferred in slaves:
+            return preferred
+        return self.fallback.choose(device_type, slaves, index, user_id)
+
+
+class RoundRobinPolicy(PlacementPolicy):
+    """按设备类型在从服务器间轮询"""
+    
+    name = 'round_robin'
+    
+    def __init__(self) -> None:
+        self._last: Dict[str, int] = {}
+    
+    def choose(self, device_type, slaves, index, user_id=None):
+        last = self._last.get(device_type)
+        ordered = sorted(slaves)
+        # 上次选择之后的第一个，越过末尾时回到开头
+        chosen = next(
+            (slave for slave in ordered if last is None or slave > last),
+            ordered[0]
+        )
+        self._last[device_type] = chosen
+        return chosen
+
+
+PLACEMENT_POLICIES: Dict[str, PlacementPolicy] = {
+    policy.name: policy
+    for policy in (LeastLoadedPolicy(), LocalityPolicy(), RoundRobinPolicy())
+}
+
+
+def register_policy(policy: PlacementPolicy) -> None:
+    """注册自定义放置策略"""
+    PLACEMENT_POLICIES[policy.name] = policy
+
 
 class DeviceScheduler:
     _instance: Optional['DeviceScheduler'] = None
+    # 选择设备失败(索引与数据库不一致)时的最大重试次数
+    MAX_ATTEMPTS = 3
+    # 索引与数据库对账间隔(秒)
+    RECONCILE_INTERVAL = 60
+    DEFAULT_POLICY = LeastLoadedPolicy.name
     
     def __new__(cls) -> 'DeviceScheduler':
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance.index = AvailabilityIndex()
+            cls._instance._reconcile_lock = threading.Lock()
+            cls._instance._app = None
+            device_manager.add_usage_listener(cls._instance._on_device_event)
         return cls._instance
     
+    def start(self) -> None:
+        """构建索引并注册后台对账任务(需在应用上下文中调用)"""
+        self._app = current_app._get_current_object()
+        self.reconcile()
+        SchedulerManager().add_task(
+            self._in_app_context,
+            self.RECONCILE_INTERVAL,
+            'device_availability_reconcile',
+            args=(self.reconcile,)
+        )
+    
+    def stop(self) -> None:
+        """移除后台对账任务"""
+        SchedulerManager().remove_task('device_availability_reconcile')
+    
+    def _in_app_context(self, func: Any) -> Any:
+        with self._app.app_context():
+            return func()
+    
+    def reconcile(self) -> None:
+        """用数据库快照重建空闲设备索引(两次查询)"""
+        with self._reconcile_lock:
+            self.index.begin_rebuild()
+            try:
+                devices = Device.query.filter_by(
+                    status='online'
+                ).with_entities(
+                    Device.id, Device.device_type, Device.slave_id
+                ).all()
+                busy = DeviceUsage.query.filter_by(
+                    end_time=None
+                ).with_entities(
+                    DeviceUsage.device_id, DeviceUsage.user_id
+                ).all()
+            except Exception:
+                self.index.abort_rebuild()
+                raise
+            self.index.rebuild(devices, busy)
+            logger.debug(f"Device availability index rebuilt: {len(devices)} devices")
+    
+    def _on_device_event(self, event: str, device_id: int, **data: Any) -> None:
+        """设备使用/状态事件"""
+        if event == 'start':
+            self.index.mark_busy(device_id, data.get('user_id'))
+        elif event == 'end':
+            self.index.mark_free(device_id)
+        elif event == 'delete':
+            self.index.remove_device(device_id)
+        elif event == 'status':
+            if data.get('status') == 'online':
+                device = Device.query.get(device_id)
+                if device:
+                    self.index.add_device(
+                        device.id, device.device_type, device.slave_id
+                    )
+            else:
+                self.index.remove_device(device_id)
+    
     def schedule_device(
         self,
         device_type: str,
         user_id: int,
         duration: Optional[int] = None,
         slave_id: Optional[int] = None,
-        priority: int = 0
+        priority: int = 0,
+        policy: Optional[str] = None
     ) -> Optional[Dict[str, Any]]:
-        """调度设备"""
+        """调度设备
+        
+        从空闲设备索引中按放置策略选择设备，不再逐个查询设备的使用记录。
+        """
         try:
-            # 查找可用设备
-            query = Device.query.filter_by(
-                device_type=device_type,
-                is_active=True,
-                status='online'
-            )
-            
-            if slave_id:
-                query = query.filter_by(slave_id=slave_id)
+            if not self.index.ready:
+                self.reconcile()
                 
-            # 检查设备是否正在使用
-            available_devices = []
-            for device in query.all():
-                usage = DeviceUsage.query.filter_by(
-                    device_id=device.id,
-                    end_time=None
-                ).first()
+            placement = PLACEMENT_POLICIES.get(policy or self.DEFAULT_POLICY)
+            if placement is None:
+                logger.error(f"Unknown placement policy: {policy}")
+                return None
                 
-                if not usage:
-                    available_devices.append(device)
+            for _ in range(self.MAX_ATTEMPTS):
+                device_id = self.index.acquire(
+                    device_type, placement, user_id, slave_id
+                )
+                if device_id is None:
+                    logger.error(f"No available devices of type: {device_type}")
+                    return None
                     
-            if not available_devices:
-                logger.error(f"No available devices of type: {device_type}")
-                return None
+                # 使用设备
+                usage = device_manager.use_device(
+                    device_id=device_id,
+                    user_id=user_id,
+                    description=f"Scheduled usage with priority {priority}"
+                )
                 
-            # 选择设备(这里可以实现更复杂的调度算法)
-            device = available_devices[0]
-            
-            # 使用设备
-            usage = device_manager.use_device(
-                device_id=device.id,
-                user_id=user_id,
-                description=f"Scheduled usage with priority {priority}"
-            )
-            
-            if not usage:
+                if usage:
+                    break
+                    
+                self._settle_failed(device_id)
+            else:
                 return None
                 
             # 如果指定了使用时长,设置自动释放
@@ -73,7 +395,7 @@ class DeviceScheduler:
                 pass
                 
             logger.info(
-                f"Device scheduled: {device.name} -> User {user_id}"
+                f"Device scheduled: {device_id} -> User {user_id}"
             )
             return cast(Dict[str, Any], usage)
             
@@ -81,6 +403,27 @@ class DeviceScheduler:
             logger.error(f"Failed to schedule device: {e}")
             return None
     
+    def _settle_failed(self, device_id: int) -> None:
+        """使用设备失败后按数据库中的实际状态修正索引
+        
+        设备已删除或离线时移出索引；已被占用时保持占用，等待结束事件；
+        其余情况(如提交失败、数据库暂时不可用)视为临时失败，放回空闲集合。
+        """
+        try:
+            device = Device.query.get(device_id)
+            if device is None or device.status != 'online':
+                self.index.remove_device(device_id)
+                return
+            in_use = DeviceUsage.query.filter_by(
+                device_id=device_id,
+                end_time=None
+            ).first()
+        except Exception as e:
+            logger.warning(f"Failed to recheck device {device_id}: {e}")
+            in_use = None
+        if not in_use:
+            self.index.mark_free(device_id)
+    
     def release_scheduled_device(
         self,
         device_id: int,
@@ -154,10 +497,7 @@ class DeviceScheduler:
         """检查设备可用性"""
         try:
             # 查找指定类型的设备
-            query = Device.query.filter_by(
-                device_type=device_type,
-                is_active=True
-            )
+            query = Device.query.filter_by(device_type=device_type)
             
             if slave_id:
                 query = query.filter_by(slave_id=slave_id)
@@ -5,30 +5,296 @@
 - 设备性能统计（CPU、内存、磁盘等）
 - 设备同步统计（成功率、重试次数等）
 - 设备告警统计（告警数量、解决率等）
+
+性能和同步统计以每日统计桶(DeviceStatsDaily)的形式增量维护：状态采样和
+同步记录写入数据库时由映射器事件累加到对应日期的桶中，统计窗口内的
+指标只需把窗口内的桶相加。
 """
 
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Any
-from .models import db, Device, DeviceStatus, DeviceAlert, DeviceSync
+import math
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Any, List, Iterable
+from flask import current_app
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import (
+    db, Device, DeviceStatus, DeviceAlert, DeviceSync, DeviceStatsDaily
+)
 from .utils.logger import get_logger
 from .config_manager import ConfigManager
+from .scheduler_manager import SchedulerManager
 
 logger = get_logger(__name__)
 config = ConfigManager()
 
+# 统计窗口(天)
+STATS_WINDOW_DAYS = 30
+
+# 状态采样中累加的性能指标
+STATUS_METRICS = (
+    'cpu_usage', 'memory_usage', 'disk_usage', 'network_usage', 'temperature'
+)
+
+# 可能缺失(NULL)的指标，单独计数，缺失的采样不计入均值
+OPTIONAL_METRICS = ('temperature',)
+
+# 统计桶中的全部累加列
+COUNTER_COLUMNS = (
+    'status_count', 'online_count',
+    *(f'{metric}{suffix}' for metric in STATUS_METRICS
+      for suffix in ('_sum', '_sq_sum')),
+    *(f'{metric}_count' for metric in OPTIONAL_METRICS),
+    'sync_count', 'sync_completed', 'sync_failed', 'sync_retry_sum'
+)
+
+
+def _bucket_day(timestamp: Optional[datetime]) -> date:
+    return (timestamp or datetime.now()).date()
+
+
+def status_deltas(record: DeviceStatus) -> Dict[str, float]:
+    """一条状态采样对统计桶的增量"""
+    deltas: Dict[str, float] = {
+        'status_count': 1,
+        'online_count': 1 if record.status == 'online' else 0
+    }
+    for metric in STATUS_METRICS:
+        value = getattr(record, metric)
+        if metric in OPTIONAL_METRICS:
+            if value is None:
+                continue
+            deltas[f'{metric}_count'] = 1
+        value = value or 0.0
+        deltas[f'{metric}_sum'] = value
+        deltas[f'{metric}_sq_sum'] = value * value
+    return deltas
+
+
+def sync_deltas(
+    old_status: Optional[str],
+    new_status: Optional[str],
+    retry_delta: int = 0,
+    created: bool = False
+) -> Dict[str, int]:
+    """同步记录新增或状态变化对统计桶的增量"""
+    deltas = {'sync_count': 1 if created else 0, 'sync_retry_sum': retry_delta}
+    for status, column in (('completed', 'sync_completed'),
+                           ('failed', 'sync_failed')):
+        deltas[column] = (
+            (1 if new_status == status else 0) -
+            (1 if old_status == status else 0)
+        )
+    return {name: delta for name, delta in deltas.items() if delta}
+
+
+def _mean_std(total: float, sq_total: float, count: int) -> tuple:
+    """由和与平方和计算均值和总体标准差"""
+    if count <= 0:
+        return 0.0, 0.0
+    mean = total / count
+    variance = max(0.0, sq_total / count - mean * mean)
+    return mean, math.sqrt(variance)
+
+
+def upsert_statement(
+    dialect_name: str,
+    device_id: int,
+    day: date,
+    deltas: Dict[str, float]
+):
+    """插入统计桶，(device_id, day)已存在时累加增量
+
+    一条INSERT ... ON CONFLICT语句完成，并发写入同一个新桶时不会违反唯一约束。
+    """
+    table = DeviceStatsDaily.__table__
+    row = {name: 0 for name in COUNTER_COLUMNS}
+    row.update(deltas)
+    dialect = sqlite if dialect_name == 'sqlite' else postgresql
+    stmt = dialect.insert(table).values(device_id=device_id, day=day, **row)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.device_id, table.c.day],
+        set_={name: table.c[name] + stmt.excluded[name] for name in deltas}
+    )
+
+
+def apply_deltas(
+    connection,
+    device_id: int,
+    day: date,
+    deltas: Dict[str, float]
+) -> None:
+    """把增量累加到(device_id, day)的统计桶，桶不存在时创建"""
+    if not deltas:
+        return
+    connection.execute(
+        upsert_statement(connection.dialect.name, device_id, day, deltas)
+    )
+
+
+@event.listens_for(DeviceStatus, 'after_insert')
+def _on_status_insert(mapper, connection, target) -> None:
+    apply_deltas(
+        connection, target.device_id, _bucket_day(target.created_at),
+        status_deltas(target)
+    )
+
+
+@event.listens_for(DeviceSync, 'after_insert')
+def _on_sync_insert(mapper, connection, target) -> None:
+    apply_deltas(
+        connection, target.device_id, _bucket_day(target.created_at),
+        sync_deltas(None, target.status, target.retry_count or 0, created=True)
+    )
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    return value
+
+
+# 修改前加载旧值，使after_update能从属性历史得到变化前的状态和重试次数
+for _attribute in (DeviceSync.status, DeviceSync.retry_count):
+    event.listen(
+        _attribute, 'set', _keep_previous, retval=True, active_history=True
+    )
+
+
+@event.listens_for(DeviceSync, 'after_update')
+def _on_sync_update(mapper, connection, target) -> None:
+    state = inspect(target)
+    status = state.attrs.status.history
+    retries = state.attrs.retry_count.history
+    if not status.has_changes() and not retries.has_changes():
+        return
+
+    old_status = status.deleted[0] if status.deleted else target.status
+    retry_delta = 0
+    if retries.has_changes():
+        old_retries = retries.deleted[0] if retries.deleted else 0
+        retry_delta = (target.retry_count or 0) - (old_retries or 0)
+    apply_deltas(
+        connection, target.device_id, _bucket_day(target.created_at),
+        sync_deltas(old_status, target.status, retry_delta)
+    )
+
 
 class DeviceStatsManager:
     """设备统计信息管理器，负责收集和更新设备相关的统计数据"""
 
     _instance: Optional['DeviceStatsManager'] = None
+    _app: Any = None
+    # 设备统计刷新间隔(秒)
+    REFRESH_INTERVAL = 300
 
     def __new__(cls) -> 'DeviceStatsManager':
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
+    def start(self) -> None:
+        """统计桶为空时由原始记录重建，并注册定期刷新任务(需在应用上下文中调用)
+
+        统计桶只由映射器事件增量维护，部署前已有的记录需要重建一次。
+        """
+        self._app = current_app._get_current_object()
+        if DeviceStatsDaily.query.first() is None:
+            self.rebuild_daily_stats()
+        SchedulerManager().add_task(
+            self._in_app_context,
+            self.REFRESH_INTERVAL,
+            'device_stats_refresh',
+            args=(self.update_all_device_stats,)
+        )
+
+    def stop(self) -> None:
+        """移除定期刷新任务"""
+        SchedulerManager().remove_task('device_stats_refresh')
+
+    def _in_app_context(self, task: Any) -> Any:
+        with self._app.app_context():
+            return task()
+
+    @staticmethod
+    def _window_start(end_time: datetime) -> date:
+        return (end_time - timedelta(days=STATS_WINDOW_DAYS)).date()
+
+    def _window_totals(
+        self,
+        start_day: date,
+        device_ids: Optional[Iterable[int]] = None
+    ) -> Dict[int, Dict[str, float]]:
+        """按设备汇总窗口内的统计桶"""
+        columns = [
+            func.coalesce(func.sum(getattr(DeviceStatsDaily, name)), 0).label(name)
+            for name in COUNTER_COLUMNS
+        ]
+        query = db.session.query(DeviceStatsDaily.device_id, *columns).filter(
+            DeviceStatsDaily.day >= start_day
+        )
+        if device_ids is not None:
+            query = query.filter(DeviceStatsDaily.device_id.in_(list(device_ids)))
+        rows = query.group_by(DeviceStatsDaily.device_id).all()
+        return {
+            row.device_id: {name: getattr(row, name) for name in COUNTER_COLUMNS}
+            for row in rows
+        }
+
+    @staticmethod
+    def _performance_stats(
+        totals: Dict[str, float],
+        end_time: datetime
+    ) -> Dict[str, Any]:
+        total_records = int(totals.get('status_count', 0))
+        stats: Dict[str, Any] = {}
+        for metric in STATUS_METRICS:
+            count = (
+                int(totals.get(f'{metric}_count', 0))
+                if metric in OPTIONAL_METRICS else total_records
+            )
+            mean, std = _mean_std(
+                totals.get(f'{metric}_sum', 0.0),
+                totals.get(f'{metric}_sq_sum', 0.0),
+                count
+            )
+            stats[f'avg_{metric}'] = round(mean, 2)
+            stats[f'std_{metric}'] = round(std, 2)
+
+        uptime = (
+            totals.get('online_count', 0) / total_records * 100
+            if total_records > 0 else 0
+        )
+        stats.update({
+            'uptime_percentage': round(uptime, 2),
+            'total_records': total_records,
+            'updated_at': end_time.isoformat()
+        })
+        return stats
+
+    @staticmethod
+    def _sync_stats(
+        totals: Dict[str, float],
+        end_time: datetime
+    ) -> Dict[str, Any]:
+        total_syncs = int(totals.get('sync_count', 0))
+        successful_syncs = int(totals.get('sync_completed', 0))
+        avg_retries = (
+            totals.get('sync_retry_sum', 0) / total_syncs
+            if total_syncs > 0 else 0
+        )
+        return {
+            'total_syncs': total_syncs,
+            'successful_syncs': successful_syncs,
+            'failed_syncs': int(totals.get('sync_failed', 0)),
+            'avg_retries': round(avg_retries, 2),
+            'sync_success_rate': round(
+                successful_syncs / total_syncs * 100
+                if total_syncs > 0 else 0,
+                2
+            ),
+            'sync_stats_updated_at': end_time.isoformat()
+        }
+
     def update_device_stats(self, device_id: int) -> bool:
-        """更新设备统计信息"""
+        """更新设备统计信息(汇总最近30天的统计桶)"""
         try:
             # 检查设备是否存在
             device = Device.query.get(device_id)
@@ -36,64 +302,15 @@ class DeviceStatsManager:
                 logger.error("Device not found: %d", device_id)
                 return False
 
-            # 计算统计时间范围
             end_time = datetime.now()
-            start_time = end_time - timedelta(days=30)
-
-            # 获取状态记录
-            status_records = DeviceStatus.query.filter_by(
-                device_id=device_id
-            ).filter(
-                DeviceStatus.created_at >= start_time,
-                DeviceStatus.created_at <= end_time
-            ).all()
-
-            # 计算性能指标
-            total_records = len(status_records)
-            if total_records > 0:
-                cpu_usage = sum(
-                    record.cpu_usage for record in status_records
-                ) / total_records
-                memory_usage = sum(
-                    record.memory_usage for record in status_records
-                ) / total_records
-                disk_usage = sum(
-                    record.disk_usage for record in status_records
-                ) / total_records
-                network_usage = sum(
-                    record.network_usage for record in status_records
-                ) / total_records
-                temperature = sum(
-                    record.temperature for record in status_records
-                ) / total_records
-            else:
-                cpu_usage = 0.0
-                memory_usage = 0.0
-                disk_usage = 0.0
-                network_usage = 0.0
-                temperature = 0.0
-
-            # 计算在线率
-            online_records = sum(
-                1 for record in status_records
-                if record.status == 'online'
-            )
-            uptime = (
-                online_records / total_records * 100
-                if total_records > 0 else 0
-            )
+            totals = self._window_totals(
+                self._window_start(end_time), [device_id]
+            ).get(device_id, {})
 
             # 更新设备统计信息
-            device.stats = {
-                'avg_cpu_usage': round(cpu_usage, 2),
-                'avg_memory_usage': round(memory_usage, 2),
-                'avg_disk_usage': round(disk_usage, 2),
-                'avg_network_usage': round(network_usage, 2),
-                'avg_temperature': round(temperature, 2),
-                'uptime_percentage': round(uptime, 2),
-                'total_records': total_records,
-                'updated_at': end_time.isoformat()
-            }
+            stats = dict(device.stats or {})
+            stats.update(self._performance_stats(totals, end_time))
+            device.stats = stats
 
             db.session.commit()
 
@@ -106,7 +323,7 @@ class DeviceStatsManager:
             return False
 
     def update_sync_stats(self, device_id: int) -> bool:
-        """更新同步统计信息"""
+        """更新同步统计信息(汇总最近30天的统计桶)"""
         try:
             # 检查设备是否存在
             device = Device.query.get(device_id)
@@ -114,54 +331,15 @@ class DeviceStatsManager:
                 logger.error("Device not found: %d", device_id)
                 return False
 
-            # 计算统计时间范围
             end_time = datetime.now()
-            start_time = end_time - timedelta(days=30)
-
-            # 获取同步记录
-            sync_records = DeviceSync.query.filter_by(
-                device_id=device_id
-            ).filter(
-                DeviceSync.created_at >= start_time,
-                DeviceSync.created_at <= end_time
-            ).all()
-
-            # 计算同步统计
-            total_syncs = len(sync_records)
-            if total_syncs > 0:
-                successful_syncs = sum(
-                    1 for record in sync_records
-                    if record.status == 'completed'
-                )
-                failed_syncs = sum(
-                    1 for record in sync_records
-                    if record.status == 'failed'
-                )
-                total_retries = sum(
-                    record.retry_count for record in sync_records
-                )
-                avg_retries = total_retries / total_syncs
-            else:
-                successful_syncs = 0
-                failed_syncs = 0
-                avg_retries = 0
+            totals = self._window_totals(
+                self._window_start(end_time), [device_id]
+            ).get(device_id, {})
 
             # 更新设备同步统计信息
-            if not device.stats:
-                device.stats = {}
-
-            device.stats.update({
-                'total_syncs': total_syncs,
-                'successful_syncs': successful_syncs,
-                'failed_syncs': failed_syncs,
-                'avg_retries': round(avg_retries, 2),
-                'sync_success_rate': round(
-                    successful_syncs / total_syncs * 100
-                    if total_syncs > 0 else 0,
-                    2
-                ),
-                'sync_stats_updated_at': end_time.isoformat()
-            })
+            stats = dict(device.stats or {})
+            stats.update(self._sync_stats(totals, end_time))
+            device.stats = stats
 
             db.session.commit()
 
@@ -173,6 +351,107 @@ class DeviceStatsManager:
             db.session.rollback()
             return False
 
+    def update_all_device_stats(self) -> int:
+        """用一次聚合查询刷新所有设备的性能和同步统计
+
+        Returns:
+            int: 更新的设备数
+        """
+        try:
+            end_time = datetime.now()
+            totals = self._window_totals(self._window_start(end_time))
+
+            devices = Device.query.all()
+            for device in devices:
+                device_totals = totals.get(device.id, {})
+                stats = dict(device.stats or {})
+                stats.update(self._performance_stats(device_totals, end_time))
+                stats.update(self._sync_stats(device_totals, end_time))
+                device.stats = stats
+
+            db.session.commit()
+
+            logger.info("Stats updated for %d devices", len(devices))
+            return len(devices)
+
+        except (ValueError, AttributeError) as e:
+            logger.error("Failed to update all device stats: %s", str(e))
+            db.session.rollback()
+            return 0
+
+    def rebuild_daily_stats(self, days: int = STATS_WINDOW_DAYS) -> bool:
+        """由原始记录重建最近days天的统计桶(用于初始化或修复)
+
+        每类记录只用一次GROUP BY聚合，不加载记录对象。
+        """
+        try:
+            start_day = (datetime.now() - timedelta(days=days)).date()
+            start_time = datetime.combine(start_day, datetime.min.time())
+            buckets: Dict[tuple, Dict[str, float]] = {}
+
+            status_day = func.date(DeviceStatus.created_at)
+            status_columns = [
+                func.count(DeviceStatus.id),
+                func.sum(db.case((DeviceStatus.status == 'online', 1), else_=0))
+            ]
+            for metric in STATUS_METRICS:
+                value = func.coalesce(getattr(DeviceStatus, metric), 0.0)
+                status_columns += [func.sum(value), func.sum(value * value)]
+            status_columns += [
+                func.count(getattr(DeviceStatus, metric))
+                for metric in OPTIONAL_METRICS
+            ]
+            status_rows = db.session.query(
+                DeviceStatus.device_id, status_day, *status_columns
+            ).filter(
+                DeviceStatus.created_at >= start_time
+            ).group_by(DeviceStatus.device_id, status_day).all()
+            status_names = COUNTER_COLUMNS[
+                :2 + 2 * len(STATUS_METRICS) + len(OPTIONAL_METRICS)
+            ]
+            for device_id, day, *values in status_rows:
+                bucket = buckets.setdefault((device_id, day), {})
+                bucket.update(zip(status_names, (v or 0 for v in values)))
+
+            sync_day = func.date(DeviceSync.created_at)
+            sync_rows = db.session.query(
+                DeviceSync.device_id,
+                sync_day,
+                func.count(DeviceSync.id),
+                func.sum(db.case((DeviceSync.status == 'completed', 1), else_=0)),
+                func.sum(db.case((DeviceSync.status == 'failed', 1), else_=0)),
+                func.sum(func.coalesce(DeviceSync.retry_count, 0))
+            ).filter(
+                DeviceSync.created_at >= start_time
+            ).group_by(DeviceSync.device_id, sync_day).all()
+            sync_names = COUNTER_COLUMNS[-4:]
+            for device_id, day, *values in sync_rows:
+                bucket = buckets.setdefault((device_id, day), {})
+                bucket.update(zip(sync_names, (v or 0 for v in values)))
+
+            DeviceStatsDaily.query.filter(
+                DeviceStatsDaily.day >= start_day
+            ).delete(synchronize_session=False)
+            rows: List[Dict[str, Any]] = []
+            for (device_id, day), values in buckets.items():
+                row = {name: 0 for name in COUNTER_COLUMNS}
+                row.update(values)
+                if isinstance(day, str):
+                    day = date.fromisoformat(day)
+                rows.append({'device_id': device_id, 'day': day, **row})
+            if rows:
+                db.session.execute(DeviceStatsDaily.__table__.insert(), rows)
+
+            db.session.commit()
+
+            logger.info("Rebuilt %d daily stats buckets", len(rows))
+            return True
+
+        except (ValueError, AttributeError) as e:
+            logger.error("Failed to rebuild daily stats: %s", str(e))
+            db.session.rollback()
+            return False
+
     def update_alert_stats(self, device_id: int) -> bool:
         """更新告警统计信息"""
         try:
@@ -0,0 +1,142 @@
+"""从服务器长连接接入服务"""
+
+import asyncio
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from ncod.core.channel import (
+    MSG_DEVICE_DELTA,
+    MSG_DEVICE_SNAPSHOT,
+    MSG_HEARTBEAT,
+    MSG_HELLO,
+    MSG_RESYNC_DEVICES,
+    FrameError,
+    encode_frame,
+    read_frame,
+)
+from ncod.core.logger import setup_logger
+from ncod.master.discovery.server import DiscoveryServer
+
+logger = setup_logger("channel_server")
+
+MessageHandler = Callable[[str, Dict], Awaitable[None]]
+
+
+class SlaveChannelServer:
+    """从服务器通道服务器
+
+    每个从服务器保持一条长连接，连接上按帧依次收到心跳、负载和设备增量等消息，
+    按消息类型分发给注册的处理器。主服务器也可以经同一连接向从服务器发送消息
+    (如设备增量版本不连续时请求快照)。
+    """
+
+    def __init__(
+        self,
+        discovery_server: DiscoveryServer,
+        host: str = "0.0.0.0",
+        port: int = 5679,
+    ):
+        self.discovery = discovery_server
+        self.host = host
+        self.port = port
+        self.running = False
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Dict[str, MessageHandler] = {
+            MSG_HEARTBEAT: self._handle_heartbeat
+        }
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._writers: Dict[str, asyncio.StreamWriter] = {}
+        self._device_consumer = None
+
+    def register_handler(self, msg_type: str, handler: MessageHandler):
+        """注册消息处理器，参数为(node_id, data)"""
+        self._handlers[msg_type] = handler
+
+    def attach_device_consumer(self, consumer):
+        """把设备快照和增量交给DeviceDeltaConsumer应用"""
+        self._device_consumer = consumer
+        self.register_handler(MSG_DEVICE_SNAPSHOT, consumer.apply_snapshot)
+        self.register_handler(MSG_DEVICE_DELTA, self._handle_device_delta)
+
+    async def send(self, node_id: str, msg_type: str, data: Dict) -> bool:
+        """向从服务器发送消息，从服务器未连接时返回False"""
+        writer = self._writers.get(node_id)
+        if writer is None:
+            return False
+        writer.write(encode_frame({"type": msg_type, "data": data}))
+        await writer.drain()
+        return True
+
+    async def start(self):
+        """启动服务器"""
+        try:
+            self._server = await asyncio.start_server(
+                self._handle_connection, self.host, self.port
+            )
+            self.running = True
+            logger.info(f"Slave channel server listening on {self.host}:{self.port}")
+        except Exception as e:
+            logger.error(f"Error starting slave channel server: {e}")
+            raise
+
+    async def stop(self):
+        """停止服务器"""
+        self.running = False
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._connections):
+            writer.close()
+        logger.info("Slave channel server stopped")
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """处理单个从服务器连接"""
+        self._connections.add(writer)
+        node_id = None
+        try:
+            while True:
+                message = await read_frame(reader)
+                msg_type = message.get("type")
+                node_id = message.get("node_id") or node_id
+                if msg_type == MSG_HELLO:
+                    self._writers[node_id] = writer
+                    logger.info(f"Slave {node_id} connected")
+                    continue
+                handler = self._handlers.get(msg_type)
+                if handler is None:
+                    logger.debug(f"Unhandled message type {msg_type} from {node_id}")
+                    continue
+                try:
+                    await handler(node_id, message.get("data") or {})
+                except Exception as e:
+                    logger.error(f"Error handling {msg_type} from {node_id}: {e}")
+        except asyncio.IncompleteReadError:
+            logger.info(f"Slave {node_id} disconnected")
+        except FrameError as e:
+            logger.warning(f"Invalid frame from {node_id}: {e}")
+        except Exception as e:
+            logger.error(f"Slave channel error for {node_id}: {e}")
+        finally:
+            self._connections.discard(writer)
+            if node_id is not None and self._writers.get(node_id) is writer:
+                del self._writers[node_id]
+                # 重新连接后从服务器会先发送快照
+                if self._device_consumer is not None:
+                    self._device_consumer.forget(node_id)
+            writer.close()
+
+    async def _handle_heartbeat(self, node_id: str, data: Dict):
+        """处理心跳"""
+        timestamp = data.get("timestamp")
+        await self.discovery.handle_heartbeat(
+            node_id,
+            datetime.fromisoformat(timestamp) if timestamp else datetime.utcnow(),
+        )
+
+    async def _handle_device_delta(self, node_id: str, data: Dict):
+        """应用设备增量，版本不连续时请求完整快照"""
+        if not await self._device_consumer.apply_delta(node_id, data):
+            await self.send(node_id, MSG_RESYNC_DEVICES, {})
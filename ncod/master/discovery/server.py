@@ -4,7 +4,7 @@ import asyncio
 import json
 from typing import Dict, Set
 from datetime import datetime
-from ncod.core.heartbeat import HeartbeatMonitor
+from ncod.core.heartbeat import NODE_DOWN, NODE_UP, HeartbeatMonitor
 from ncod.core.logger import setup_logger
 
 logger = setup_logger("discovery_server")
@@ -53,6 +53,7 @@ class DiscoveryServer:
         try:
             if node_id in self.nodes:
                 del self.nodes[node_id]
+                self.heartbeat.remove_node(node_id)
                 logger.info(f"Node {node_id} unregistered")
             return True
         except Exception as e:
@@ -75,11 +76,19 @@ class DiscoveryServer:
     def get_active_nodes(self) -> Dict[str, Dict]:
         """获取活跃节点"""
         return {
-            node_id: info
-            for node_id, info in self.nodes.items()
-            if self.heartbeat.is_node_alive(node_id)
+            node_id: self.nodes[node_id]
+            for node_id in self.heartbeat.alive_nodes
+            if node_id in self.nodes
         }
 
+    def on_node_down(self, callback):
+        """订阅节点下线事件"""
+        self.heartbeat.add_listener(NODE_DOWN, callback)
+
+    def on_node_up(self, callback):
+        """订阅节点上线事件"""
+        self.heartbeat.add_listener(NODE_UP, callback)
+
     async def handle_heartbeat(self, node_id: str, timestamp: datetime) -> None:
         """处理心跳"""
         try:
@@ -4,6 +4,7 @@ import asyncio
 import logging
 from typing import Dict, Optional, Set
 from datetime import datetime
+from ncod.core.heartbeat import NODE_DOWN
 from ncod.master.discovery.server import DiscoveryServer
 from ncod.master.balancer.load_balancer import LoadBalancer
 
@@ -23,8 +24,9 @@ class FailoverHandler:
         """启动处理器"""
         try:
             self.running = True
+            self.discovery.on_node_down(self._on_node_down)
             logger.info("Failover handler started")
-            asyncio.create_task(self._monitor_nodes())
+            asyncio.create_task(self._check_existing_nodes())
         except Exception as e:
             logger.error(f"Error starting failover handler: {e}")
             self.running = False
@@ -34,6 +36,7 @@ class FailoverHandler:
         """停止处理器"""
         try:
             self.running = False
+            self.discovery.heartbeat.remove_listener(NODE_DOWN, self._on_node_down)
             logger.info("Failover handler stopped")
         except Exception as e:
             logger.error(f"Error stopping failover handler: {e}")
@@ -82,23 +85,23 @@ class FailoverHandler:
         except Exception as e:
             logger.error(f"Error handling node failure: {e}")
 
-    async def _monitor_nodes(self):
-        """监控节点状态"""
-        while self.running:
-            try:
-                active_nodes = self.discovery.get_active_nodes()
-                current_nodes = set(self.node_devices.keys())
+    async def _on_node_down(self, node_id: str):
+        """节点下线事件"""
+        if not self.running or node_id not in self.node_devices:
+            return
+        logger.warning(f"Node {node_id} failed")
+        await self.handle_node_failure(node_id)
 
-                # 检查节点故障
-                for node_id in current_nodes:
-                    if node_id not in active_nodes:
-                        logger.warning(f"Node {node_id} failed")
-                        await self.handle_node_failure(node_id)
-
-            except Exception as e:
-                logger.error(f"Error monitoring nodes: {e}")
-
-            await asyncio.sleep(5)
+    async def _check_existing_nodes(self):
+        """启动时处理已不在线的节点(之后由下线事件驱动)"""
+        try:
+            active_nodes = self.discovery.get_active_nodes()
+            for node_id in list(self.node_devices.keys()):
+                if node_id not in active_nodes:
+                    logger.warning(f"Node {node_id} failed")
+                    await self.handle_node_failure(node_id)
+        except Exception as e:
+            logger.error(f"Error monitoring nodes: {e}")
 
     async def _migrate_device(self, device_id: str, from_node: str, to_node: str):
         """迁移设备"""
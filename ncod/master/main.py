@@ -1,11 +1,19 @@
 import asyncio
+import multiprocessing
+import signal
 import uvicorn
 from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from .config.settings import API_CONFIG
+from ncod.core.channel import MSG_LOAD
+from ncod.utils.cache import near_cache
+from .config.settings import API_CONFIG, CHANNEL_CONFIG
 from .websocket.server import websocket_server
 from .routes import api_router
 from .database import init_models
+from .balancer.load_balancer import LoadBalancer
+from .discovery.channel_server import SlaveChannelServer
+from .discovery.server import DiscoveryServer
+from .services.device_delta import device_delta_consumer
 
 app = FastAPI(
     title="NCOD Master Server",
@@ -25,6 +33,17 @@ app.add_middleware(
 # 注册路由
 app.include_router(api_router)
 
+# 从服务器通道：心跳交给发现服务，负载交给负载均衡，设备增量写入设备表。
+# 通道端口只能由一个进程监听，通道在单独的进程中运行(见serve_channel)，
+# 不随Web工作进程启动
+discovery_server = DiscoveryServer()
+load_balancer = LoadBalancer(discovery_server)
+channel_server = SlaveChannelServer(
+    discovery_server, CHANNEL_CONFIG["host"], CHANNEL_CONFIG["port"]
+)
+channel_server.register_handler(MSG_LOAD, load_balancer.handle_load_report)
+channel_server.attach_device_consumer(device_delta_consumer)
+
 
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
@@ -43,6 +62,9 @@ async def startup_event():
     # 初始化数据库模型
     await init_models()
 
+    # 监听其它工作进程的缓存失效通知
+    await near_cache.start()
+
     # 启动WebSocket服务器
     await websocket_server.start()
 
@@ -58,12 +80,39 @@ async def shutdown_event():
     # 停止WebSocket服务器
     await websocket_server.stop()
 
+    # 停止缓存失效通知监听
+    await near_cache.stop()
+
     # 清理数据库连接
     from .database import cleanup_db
 
     await cleanup_db()
 
 
+async def serve_channel():
+    """运行从服务器发现和通道，直到收到SIGTERM或SIGINT"""
+    await init_models()
+    await near_cache.start()
+    await discovery_server.start()
+    await channel_server.start()
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        await channel_server.stop()
+        await discovery_server.stop()
+        await near_cache.stop()
+
+
+def run_channel_server():
+    """从服务器通道进程入口"""
+    asyncio.run(serve_channel())
+
+
 async def get_user_id_from_token(websocket: WebSocket) -> str:
     """从Token中获取用户ID"""
     try:
@@ -78,4 +127,12 @@ async def get_user_id_from_token(websocket: WebSocket) -> str:
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, workers=4)
+    channel_process = multiprocessing.Process(
+        target=run_channel_server, name="slave-channel"
+    )
+    channel_process.start()
+    try:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, workers=4)
+    finally:
+        channel_process.terminate()
+        channel_process.join()
@@ -1,6 +1,9 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Column, Integer, String, Text, DateTime, Date, Boolean, ForeignKey,
+    Float, JSON, UniqueConstraint
+)
+from sqlalchemy.orm import relationship, synonym
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
@@ -59,6 +62,9 @@ class Device(db.Model):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow)
 
+    # 调度和设备管理按device_type查询，与type为同一列
+    device_type = synonym('type')
+
     # 关联的从服务器
     slave = relationship('Slave', back_populates='devices')
     # 关联的状态记录
@@ -131,4 +137,172 @@ class DeviceSync(db.Model):
     device = relationship('Device', back_populates='sync_records')
 
     def __repr__(self):
-        return f'<DeviceSync {self.device_id} {self.status}>' 
\ No newline at end of file
+        return f'<DeviceSync {self.device_id} {self.status}>' 
+
+
+class DeviceUsage(db.Model):
+    """设备使用记录模型
+
+    end_time为空表示设备仍被占用。
+    """
+    __tablename__ = 'device_usages'
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(
+        Integer, ForeignKey('devices.id'), nullable=False, index=True
+    )
+    user_id = Column(Integer, nullable=False, index=True)
+    description = Column(String(255))
+    start_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    end_time = Column(DateTime, index=True)
+
+    # 关联的设备
+    device = relationship('Device')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'user_id': self.user_id,
+            'description': self.description,
+            'start_time': (
+                self.start_time.isoformat() if self.start_time else None
+            ),
+            'end_time': (
+                self.end_time.isoformat() if self.end_time else None
+            )
+        }
+
+    def __repr__(self):
+        return f'<DeviceUsage {self.device_id} {self.user_id}>'
+
+
+class DeviceNotification(db.Model):
+    """设备通知记录模型
+
+    所有渠道都有发送结果前保持pending，已有结果的渠道记录在
+    delivered_channels中，重启后不再重复发送。
+    """
+    __tablename__ = 'device_notifications'
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(
+        Integer, ForeignKey('devices.id'), nullable=False, index=True
+    )
+    # alert/alert_resolution
+    notification_type = Column(String(50), nullable=False)
+    message = Column(Text, nullable=False)
+    severity = Column(String(20), nullable=False)
+    channels = Column(JSON, nullable=False, default=list)  # 通知渠道列表
+    # 已有发送结果(成功或最终失败)的渠道
+    delivered_channels = Column(JSON, nullable=False, default=list)
+    # pending/sent/failed
+    status = Column(String(20), default='pending', index=True)
+    # metadata是声明式模型的保留属性名，列名保持metadata
+    meta = Column('metadata', JSON)
+    error_message = Column(Text)
+    sent_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    # 关联的设备
+    device = relationship('Device')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'notification_type': self.notification_type,
+            'message': self.message,
+            'severity': self.severity,
+            'channels': self.channels,
+            'delivered_channels': self.delivered_channels,
+            'status': self.status,
+            'metadata': self.meta,
+            'error_message': self.error_message,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'created_at': (
+                self.created_at.isoformat() if self.created_at else None
+            )
+        }
+
+    def __repr__(self):
+        return f'<DeviceNotification {self.device_id} {self.status}>'
+
+
+class DevicePermission(db.Model):
+    """设备权限授予记录模型"""
+    __tablename__ = 'device_permissions'
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    permission_type = Column(String(20), nullable=False)  # view/use/manage
+    is_active = Column(Boolean, default=True, index=True)
+    expires_at = Column(DateTime)  # 过期时间，为空表示永久
+    granted_by = Column(Integer)  # 授权人
+    revoked_by = Column(Integer)  # 撤销人
+    revoked_at = Column(DateTime)  # 撤销时间
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'device_id': self.device_id,
+            'user_id': self.user_id,
+            'permission_type': self.permission_type,
+            'is_active': self.is_active,
+            'expires_at': (
+                self.expires_at.isoformat() if self.expires_at else None
+            ),
+            'granted_by': self.granted_by,
+            'revoked_by': self.revoked_by,
+            'revoked_at': (
+                self.revoked_at.isoformat() if self.revoked_at else None
+            ),
+            'created_at': (
+                self.created_at.isoformat() if self.created_at else None
+            )
+        }
+
+    def __repr__(self):
+        return f'<DevicePermission {self.device_id} {self.user_id}>'
+
+
+class DeviceStatsDaily(db.Model):
+    """设备每日统计桶模型
+
+    状态采样和同步记录写入时累加到所在日期的桶中，
+    统计窗口内的指标由各桶相加得到。
+    """
+    __tablename__ = 'device_stats_daily'
+    __table_args__ = (
+        UniqueConstraint('device_id', 'day', name='uq_device_stats_daily'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
+    day = Column(Date, nullable=False)
+    # 状态采样
+    status_count = Column(Integer, nullable=False, default=0)
+    online_count = Column(Integer, nullable=False, default=0)
+    cpu_usage_sum = Column(Float, nullable=False, default=0.0)
+    cpu_usage_sq_sum = Column(Float, nullable=False, default=0.0)
+    memory_usage_sum = Column(Float, nullable=False, default=0.0)
+    memory_usage_sq_sum = Column(Float, nullable=False, default=0.0)
+    disk_usage_sum = Column(Float, nullable=False, default=0.0)
+    disk_usage_sq_sum = Column(Float, nullable=False, default=0.0)
+    network_usage_sum = Column(Float, nullable=False, default=0.0)
+    network_usage_sq_sum = Column(Float, nullable=False, default=0.0)
+    temperature_sum = Column(Float, nullable=False, default=0.0)
+    temperature_sq_sum = Column(Float, nullable=False, default=0.0)
+    # 温度可能缺失，只统计有温度的采样
+    temperature_count = Column(Integer, nullable=False, default=0)
+    # 同步记录
+    sync_count = Column(Integer, nullable=False, default=0)
+    sync_completed = Column(Integer, nullable=False, default=0)
+    sync_failed = Column(Integer, nullable=False, default=0)
+    sync_retry_sum = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DeviceStatsDaily {self.device_id} {self.day}>'
@@ -1,7 +1,16 @@
 """告警规则模型"""
 
 from typing import Dict, List, Optional
-from sqlalchemy import Column, String, Float, Boolean, JSON, ForeignKey, select
+from sqlalchemy import (
+    Column,
+    String,
+    Float,
+    Integer,
+    Boolean,
+    JSON,
+    ForeignKey,
+    select,
+)
 from sqlalchemy.orm import relationship
 from ncod.core.db.base import BaseModel, TimestampMixin
 from ncod.core.logger import setup_logger
@@ -19,6 +28,8 @@ class AlertRule(BaseModel, TimestampMixin):
     metric_type = Column(String(50), nullable=False)
     condition = Column(String(20), nullable=False)  # gt, lt, eq等
     threshold = Column(Float, nullable=False)
+    for_duration = Column(Integer, default=0)  # 条件持续满足多少秒后才触发
+    hysteresis = Column(Float, default=0.0)  # 恢复时需越过阈值的回差
     level = Column(String(20), nullable=False)  # critical, major, minor, info
     enabled = Column(Boolean, default=True)
     notify_channels = Column(JSON)  # 通知渠道配置
@@ -36,6 +47,8 @@ class AlertRule(BaseModel, TimestampMixin):
             "metric_type": self.metric_type,
             "condition": self.condition,
             "threshold": self.threshold,
+            "for_duration": self.for_duration or 0,
+            "hysteresis": self.hysteresis or 0.0,
             "level": self.level,
             "enabled": self.enabled,
             "notify_channels": self.notify_channels,
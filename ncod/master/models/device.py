@@ -3,7 +3,7 @@
 from datetime import datetime
 from enum import Enum
 from typing import Optional
-from sqlalchemy import Column, String, DateTime, Enum as SQLEnum, select
+from sqlalchemy import Column, String, Integer, DateTime, Enum as SQLEnum, select
 from pydantic import BaseModel
 from ncod.master.core.database import Base
 
@@ -25,6 +25,9 @@ class Device(Base):
     name = Column(String(100), nullable=False)
     type = Column(String(50), nullable=False)
     status = Column(SQLEnum(DeviceStatus), default=DeviceStatus.OFFLINE)
+    # 所属组织，按组织子树统计时与organizations.path联查
+    organization_id = Column(Integer, index=True)
+    slave_id = Column(Integer, index=True)
     last_heartbeat = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -71,6 +74,22 @@ class Device(Base):
             return True
         return False
 
+    def to_dict(self) -> dict:
+        """转换为字典"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "type": self.type,
+            "status": self.status.value if self.status else None,
+            "organization_id": self.organization_id,
+            "slave_id": self.slave_id,
+            "last_heartbeat": (
+                self.last_heartbeat.isoformat() if self.last_heartbeat else None
+            ),
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
 
 class DeviceBase(BaseModel):
     """设备基础模型"""
@@ -2,7 +2,18 @@
 
 from datetime import datetime
 from typing import List, Optional
-from sqlalchemy import Column, String, ForeignKey, Integer, DateTime, Boolean
+from sqlalchemy import (
+    Column,
+    String,
+    ForeignKey,
+    Integer,
+    DateTime,
+    Boolean,
+    func,
+    literal,
+    select,
+    update,
+)
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from ncod.master.core.base import BaseModel, TimestampMixin
 import logging
@@ -11,7 +22,11 @@ logger = logging.getLogger("organization_model")
 
 
 class Organization(BaseModel, TimestampMixin):
-    """组织模型"""
+    """组织模型
+
+    path为物化路径，由根到自身的ID组成，如"/1/5/9/"。子树查询统一为
+    path LIKE '/1/5/%'，可以走path索引，不需要逐层递归查询。
+    """
 
     __tablename__ = "organizations"
 
@@ -23,7 +38,7 @@ class Organization(BaseModel, TimestampMixin):
         Integer, ForeignKey("organizations.id")
     )
     level: Mapped[int] = mapped_column(Integer, default=0)
-    path: Mapped[str] = mapped_column(String(255))
+    path: Mapped[str] = mapped_column(String(255), index=True)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
 
     # 关系
@@ -33,6 +48,80 @@ class Organization(BaseModel, TimestampMixin):
         "User", secondary="user_organizations", back_populates="organizations"
     )
 
+    @staticmethod
+    def child_path(parent: Optional["Organization"], org_id: int) -> str:
+        """子组织的物化路径"""
+        return f"{parent.path if parent else '/'}{org_id}/"
+
+    @staticmethod
+    def path_ids(path: Optional[str]) -> List[int]:
+        """物化路径中由根到自身的组织ID，路径为空时返回空列表"""
+        if not path:
+            return []
+        return [int(part) for part in path.strip("/").split("/") if part]
+
+    @classmethod
+    def subtree_clause(cls, path: str):
+        """子树(包含自身)过滤条件"""
+        return cls.path.like(f"{path}%")
+
+    def attach(self, parent: Optional["Organization"]) -> None:
+        """根据父组织设置路径和层级，ID必须已经分配"""
+        self.parent_id = parent.id if parent else None
+        self.level = parent.level + 1 if parent else 0
+        self.path = self.child_path(parent, self.id)
+
+    def is_ancestor_of(self, other: "Organization") -> bool:
+        """是否为other自身或其祖先"""
+        return other.path.startswith(self.path)
+
+    @classmethod
+    async def move_subtree(
+        cls, session, org: "Organization", parent: Optional["Organization"]
+    ) -> int:
+        """把组织连同子孙移到parent下
+
+        用一条UPDATE改写整棵子树的路径前缀和层级，返回更新的行数。
+        """
+        old_path = org.path
+        new_path = cls.child_path(parent, org.id)
+        level_delta = (parent.level + 1 if parent else 0) - org.level
+        result = await session.execute(
+            update(cls)
+            .where(cls.subtree_clause(old_path))
+            .values(
+                path=literal(new_path) + func.substr(cls.path, len(old_path) + 1),
+                level=cls.level + level_delta,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        org.attach(parent)
+        return result.rowcount
+
+    @classmethod
+    async def get_by_code(cls, session, code: str) -> Optional["Organization"]:
+        """通过代码获取组织"""
+        result = await session.execute(select(cls).where(cls.code == code))
+        return result.scalar_one_or_none()
+
+    @classmethod
+    async def get_children(cls, session, parent_id: int) -> List["Organization"]:
+        """获取直接子组织"""
+        try:
+            stmt = select(cls).where(cls.parent_id == parent_id)
+            result = await session.execute(stmt)
+            return result.scalars().all()
+        except Exception as e:
+            logger.error(f"Error getting child organizations: {e}")
+            return []
+
+    @classmethod
+    async def get_subtree(cls, session, path: str) -> List["Organization"]:
+        """获取子树中的所有组织(包含自身)，按路径排序"""
+        stmt = select(cls).where(cls.subtree_clause(path)).order_by(cls.path)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
     @classmethod
     async def get_root_organizations(cls, session) -> List["Organization"]:
         """获取根组织"""
@@ -44,6 +133,19 @@ class Organization(BaseModel, TimestampMixin):
             logger.error(f"Error getting root organizations: {e}")
             return []
 
+    def to_dict(self) -> dict:
+        """转换为字典"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "code": self.code,
+            "description": self.description,
+            "parent_id": self.parent_id,
+            "level": self.level,
+            "path": self.path,
+            "is_active": self.is_active,
+        }
+
 
 class AuditLog(BaseModel, TimestampMixin):
     """审计日志模型"""
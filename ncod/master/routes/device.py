@@ -117,8 +117,11 @@ async def device_websocket(websocket: WebSocket, device_id: str):
         while True:
             data = await websocket.receive_json()
             # 处理接收到的消息
+            # 同一设备的状态在慢连接的队列中只保留最新一条
             await websocket_manager.broadcast(
-                {"device_id": device_id, "data": data}, "device"
+                {"device_id": device_id, "data": data},
+                "device",
+                conflate_key=f"device:{device_id}",
             )
     except WebSocketDisconnect:
         websocket_manager.disconnect(websocket, "device")
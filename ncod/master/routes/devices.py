@@ -2,29 +2,46 @@ from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
+    Request,
+    Response,
     status,
     WebSocket,
     BackgroundTasks,
 )
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from datetime import datetime, timedelta
-import pandas as pd
 import os
-import asyncio
 import uuid
 
 from ncod.core.db.database import get_db
 from ncod.master.models.device import Device, DeviceStatus
 from ncod.master.models.device_history import DeviceHistory
+from ncod.master.models.organization import Organization
 from ncod.master.schemas.device import DeviceCreate, DeviceResponse, DeviceAssign
 from ncod.master.auth import get_current_user
 from ncod.master.websocket import ConnectionManager
 from ncod.master.auth.permissions import require_permissions
 from ncod.master.models.permission import Permission
+from ncod.master.services.device_delta import device_delta_consumer
 from ncod.master.services.device_stats import DeviceStatsService
 from ncod.master.services.export_manager import ExportManager
+from ncod.master.services.export_writer import media_type
+from ncod.master.services.organization import organization_service
 from ncod.master.services.cache_manager import CacheManager
+from ncod.master.utils.pagination import (
+    etag_matches,
+    keyset_page,
+    make_etag,
+    parse_fields,
+    select_columns,
+)
+from ncod.utils.cache import collection_versions
 from ncod.master.exceptions import (
     DeviceNotFoundError,
     DeviceBusyError,
@@ -37,15 +54,135 @@ ws_manager = ConnectionManager()
 export_manager = ExportManager()
 cache_manager = CacheManager()
 
+# 列表接口可选的字段
+DEVICE_FIELDS = (
+    "id",
+    "name",
+    "type",
+    "status",
+    "organization_id",
+    "slave_id",
+    "last_heartbeat",
+    "created_at",
+    "updated_at",
+)
+HISTORY_FIELDS = ("id", "device_id", "user_id", "start_time", "end_time", "status")
+# 未递增版本号的写入路径(如其它模块直接改库)最多在这段时间后让ETag失效
+LIST_ETAG_MAX_AGE = 60
+
+
+async def _conditional(request: Request, collection: str, current_user):
+    """计算列表的ETag，客户端缓存仍然有效时返回(etag, 304响应)
+
+    版本号在查询之前读取：查询期间发生的变更会递增版本号，下一次轮询
+    一定拿到新的ETag。
+    """
+    version = await collection_versions.get(collection)
+    etag = make_etag(
+        collection,
+        version,
+        request.url.path,
+        request.url.query,
+        current_user.id,
+        max_age=LIST_ETAG_MAX_AGE,
+    )
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return etag, Response(status_code=304, headers={"ETag": etag})
+    return etag, None
+
+
+def _list_response(items, next_cursor: Optional[str], etag: Optional[str]):
+    """列表响应，下一页游标放在X-Next-Cursor头中"""
+    headers = {"Cache-Control": "no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return JSONResponse(content=jsonable_encoder(items), headers=headers)
 
-@router.get("/", response_model=List[DeviceResponse])
+
+@router.get("/")
 @require_permissions(Permission.DEVICE_VIEW)
 async def get_devices(
-    db: Session = Depends(get_db), current_user=Depends(get_current_user)
+    request: Request,
+    device_status: Optional[DeviceStatus] = Query(None, alias="status"),
+    device_type: Optional[str] = Query(None, alias="type"),
+    slave_id: Optional[int] = None,
+    org_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+    current_user=Depends(get_current_user),
+):
+    """获取设备列表
+
+    按设备ID键集分页，org_id包含所有下级组织，fields只查询指定的列。
+    设备集合未变化时对If-None-Match返回304。
+    """
+    etag, not_modified = await _conditional(request, "devices", current_user)
+    if not_modified:
+        return not_modified
+
+    try:
+        names = parse_fields(fields, DEVICE_FIELDS)
+        keys = (Device.id,)
+        stmt = select(*select_columns(Device.__table__, names, keys))
+        if device_status:
+            stmt = stmt.where(Device.status == device_status)
+        if device_type:
+            stmt = stmt.where(Device.type == device_type)
+        if slave_id is not None:
+            stmt = stmt.where(Device.slave_id == slave_id)
+        if org_id is not None:
+            path = await organization_service.get_subtree_path(org_id)
+            if path is None:
+                raise HTTPException(status_code=404, detail="Organization not found")
+            stmt = stmt.join(
+                Organization, Device.organization_id == Organization.id
+            ).where(Organization.subtree_clause(path))
+        items, next_cursor = await keyset_page(db, stmt, keys, names, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return _list_response(items, next_cursor, etag)
+
+
+@router.get("/history")
+@require_permissions(Permission.DEVICE_VIEW)
+async def get_device_history(
+    request: Request,
+    device_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    history_status: Optional[str] = Query(None, alias="status"),
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+    current_user=Depends(get_current_user),
 ):
-    """获取设备列表"""
-    devices = db.query(Device).all()
-    return devices
+    """获取设备使用记录，按开始时间倒序键集分页"""
+    etag, not_modified = await _conditional(request, "device_history", current_user)
+    if not_modified:
+        return not_modified
+
+    try:
+        names = parse_fields(fields, HISTORY_FIELDS)
+        keys = (DeviceHistory.start_time, DeviceHistory.id)
+        stmt = select(*select_columns(DeviceHistory.__table__, names, keys))
+        if device_id is not None:
+            stmt = stmt.where(DeviceHistory.device_id == device_id)
+        if user_id is not None:
+            stmt = stmt.where(DeviceHistory.user_id == user_id)
+        if history_status:
+            stmt = stmt.where(DeviceHistory.status == history_status)
+        items, next_cursor = await keyset_page(
+            db, stmt, keys, names, cursor, limit, descending=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return _list_response(items, next_cursor, etag)
 
 
 @router.post("/{device_id}/assign", response_model=dict)
@@ -76,6 +213,7 @@ async def assign_device(
 
     db.add(history)
     db.commit()
+    await collection_versions.bump("devices", "device_history")
 
     return {"message": "Device assigned successfully"}
 
@@ -107,6 +245,7 @@ async def release_device(
     device.current_user_id = None
 
     db.commit()
+    await collection_versions.bump("devices", "device_history")
 
     return {"message": "Device released successfully"}
 
@@ -142,6 +281,7 @@ async def connect_device(
         device.status = DeviceStatus.IN_USE
         device.current_user_id = current_user.id
         db.commit()
+        await collection_versions.bump("devices")
 
         # 尝试建立连接
         await ws_manager.connect(device_id)
@@ -178,6 +318,7 @@ async def disconnect_device(
         device.status = DeviceStatus.IDLE
         device.current_user_id = None
         db.commit()
+        await collection_versions.bump("devices")
 
         return {"message": "Device disconnected successfully"}
 
@@ -195,15 +336,26 @@ async def disconnect_device(
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket连接端点"""
     await ws_manager.connect(websocket)
+    slave_id = None
     try:
         while True:
             data = await websocket.receive_json()
             # 处理从服务器的状态更新
             if data["type"] == "status_update":
                 await handle_status_update(data)
+            elif data["type"] == "register_slave":
+                slave_id = data["slave_id"]
+                await ws_manager.register_slave(slave_id, websocket)
+            elif data["type"] == "device_snapshot":
+                await device_delta_consumer.apply_snapshot(data["slave_id"], data)
+            elif data["type"] == "device_delta":
+                if not await device_delta_consumer.apply_delta(data["slave_id"], data):
+                    await websocket.send_json({"type": "resync_devices"})
     except Exception as e:
         print(f"WebSocket error: {e}")
     finally:
+        if slave_id is not None:
+            device_delta_consumer.forget(slave_id)
         await ws_manager.disconnect(websocket)
 
 
@@ -219,6 +371,7 @@ async def handle_status_update(data: dict):
                 device.status = status
                 device.last_seen = datetime.utcnow()
                 db.commit()
+                await collection_versions.bump("devices")
 
                 # 广播状态更新给所有客户端
                 await ws_manager.broadcast(
@@ -258,11 +411,12 @@ async def get_device_stats(
 
 @router.get("/organization/{org_id}/stats", response_model=dict)
 @require_permissions([Permission.DEVICE_VIEW, Permission.ORG_VIEW], require_all=True)
-async def get_organization_stats(
-    org_id: int, db: Session = Depends(get_db), current_user=Depends(get_current_user)
-):
-    """获取组织统计"""
-    if current_user.organization_id != org_id and not current_user.is_admin:
+async def get_organization_stats(org_id: int, current_user=Depends(get_current_user)):
+    """获取组织统计(包含所有下级组织)"""
+    # 本部门及下级组织的统计都可以查看
+    if not current_user.is_admin and not await organization_service.is_within(
+        org_id, current_user.organization_id
+    ):
         raise HTTPException(
             status_code=403, detail="Not authorized to view this organization's stats"
         )
@@ -270,10 +424,12 @@ async def get_organization_stats(
     cache_key = f"org_stats_{org_id}"
 
     async def fetch_stats():
-        stats_service = DeviceStatsService(db, cache_manager)
-        return await stats_service.get_organization_stats(org_id)
+        return await organization_service.get_subtree_stats(org_id)
 
-    return await cache_manager.get_or_set("stats", cache_key, fetch_stats, ttl=600)
+    stats = await cache_manager.get_or_set("stats", cache_key, fetch_stats, ttl=600)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Organization not found")
+    return stats
 
 
 @router.post("/{device_id}/stats/export")
@@ -281,18 +437,22 @@ async def get_organization_stats(
 async def create_export_task(
     device_id: int,
     background_tasks: BackgroundTasks,
+    export_format: str = Query("xlsx", alias="format"),
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user),
 ):
-    """创建设备统计导出任务"""
+    """创建设备统计导出任务，format为xlsx/csv/parquet"""
     device = db.query(Device).filter(Device.id == device_id).first()
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
 
     task_id = str(uuid.uuid4())
-    task = await export_manager.create_export_task(task_id)
+    try:
+        task = await export_manager.create_export_task(task_id, export_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    background_tasks.add_task(export_manager.export_device_stats, db, device_id, task)
+    background_tasks.add_task(export_manager.export_device_stats, device_id, task)
 
     return {"task_id": task_id, "status": task.status}
 
@@ -300,17 +460,23 @@ async def create_export_task(
 @router.get("/export/{task_id}/status")
 async def get_export_status(task_id: str):
     """获取导出任务状态"""
-    task = export_manager.get_task_status(task_id)
+    task = await export_manager.get_task_status(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    return {"status": task.status, "progress": task.progress, "error": task.error}
+    return {
+        "status": task.status,
+        "progress": task.progress,
+        "rows_written": task.rows_written,
+        "total_rows": task.total_rows,
+        "error": task.error,
+    }
 
 
 @router.get("/export/{task_id}/download")
 async def download_export(task_id: str):
     """下载导出文件"""
-    task = export_manager.get_task_status(task_id)
+    task = await export_manager.get_task_status(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -323,59 +489,46 @@ async def download_export(task_id: str):
     return FileResponse(
         task.file_path,
         filename=os.path.basename(task.file_path),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        media_type=media_type(task.file_path),
     )
 
 
-@router.get("/organization/{org_id}/stats/export")
+@router.get("/organization/{org_id}/stats/export", status_code=202)
 @require_permissions([Permission.DEVICE_VIEW, Permission.ORG_VIEW], require_all=True)
 async def export_organization_stats(
     org_id: int,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    export_format: str = Query("xlsx", alias="format"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
     current_user=Depends(get_current_user),
 ):
-    """导出组织的设备使用统计"""
-    if current_user.organization_id != org_id and not current_user.is_admin:
+    """导出组织(包含所有下级组织)的设备使用统计
+
+    导出在后台运行，通过 /export/{task_id}/status 查询进度，
+    完成后从 /export/{task_id}/download 下载。
+    """
+    if not current_user.is_admin and not await organization_service.is_within(
+        org_id, current_user.organization_id
+    ):
         raise HTTPException(
             status_code=403, detail="Not authorized to view this organization's stats"
         )
 
-    filename = f"org_stats_{org_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    filepath = f"temp/exports/{filename}"
-
-    os.makedirs("temp/exports", exist_ok=True)
-
-    stats_service = DeviceStatsService(db)
-    stats_data = await stats_service.get_organization_stats_for_export(org_id)
-
-    writer = pd.ExcelWriter(filepath, engine="xlsxwriter")
-
-    # 组织设备统计
-    pd.DataFrame(stats_data["device_stats"]).to_excel(
-        writer, sheet_name="设备统计", index=False
-    )
-
-    # 用户使用统计
-    pd.DataFrame(stats_data["user_stats"]).to_excel(
-        writer, sheet_name="用户统计", index=False
-    )
-
-    writer.close()
+    path = await organization_service.get_subtree_path(org_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Organization not found")
 
-    background_tasks.add_task(cleanup_export_file, filepath)
+    task_id = str(uuid.uuid4())
+    try:
+        task = await export_manager.create_export_task(
+            task_id, export_format, prefix=f"org_stats_{org_id}"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return FileResponse(
-        filepath,
-        filename=filename,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    background_tasks.add_task(
+        export_manager.export_organization_stats, path, task, start, end
     )
 
-
-async def cleanup_export_file(filepath: str):
-    """清理导出文件"""
-    await asyncio.sleep(6 * 3600)  # 6小时后删除
-    try:
-        os.remove(filepath)
-    except Exception as e:
-        logger.error(f"Error cleaning up export file {filepath}: {e}")
+    return {"task_id": task_id, "status": task.status}
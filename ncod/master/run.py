@@ -36,6 +36,14 @@ def run(host: str, port: int, debug: bool):
     app.run(host=host, port=port, debug=debug)
 
 
+@cli.command()
+def channel():
+    """启动从服务器通道(只运行一个进程)"""
+    from ncod.master.main import run_channel_server
+
+    run_channel_server()
+
+
 @cli.command()
 def init_db():
     """初始化数据库"""
@@ -1,10 +1,60 @@
+import asyncio
+import bisect
+import heapq
+import inspect
+import itertools
+import math
+import random
 import threading
-from typing import Dict, Callable, Optional, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Callable, Optional, List, Tuple
 from datetime import datetime, timedelta
 from .utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# 运行耗时直方图的桶上限(秒)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class RunStats:
+    """任务运行统计(耗时直方图、失败/超时/错过次数)"""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.failures = 0
+        self.timeouts = 0
+        self.missed = 0
+
+    def observe(self, duration: float) -> None:
+        self.buckets[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.last = duration
+
+    def to_dict(self) -> Dict:
+        histogram = {
+            f'le_{bound}': count
+            for bound, count in zip(DURATION_BUCKETS, self.buckets)
+        }
+        histogram['le_inf'] = self.buckets[-1]
+        return {
+            'runs': self.count,
+            'avg_duration': round(self.total / self.count, 4) if self.count else 0,
+            'max_duration': round(self.max, 4),
+            'last_duration': round(self.last, 4),
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'missed': self.missed,
+            'histogram': histogram
+        }
+
 
 class Task:
     def __init__(
@@ -13,179 +63,330 @@ class Task:
         interval: int,
         name: str,
         args: tuple = (),
-        kwargs: dict = None
+        kwargs: dict = None,
+        timeout: Optional[float] = None,
+        jitter: float = 0,
+        coalesce: bool = True
     ) -> None:
         self.func = func
         self.interval = interval
         self.name = name
         self.args = args
         self.kwargs = kwargs or {}
+        self.timeout = timeout
+        self.jitter = jitter
+        self.coalesce = coalesce
+        self.is_async = inspect.iscoroutinefunction(func)
         self.last_run: Optional[datetime] = None
         self.next_run: Optional[datetime] = None
         self.is_running = False
-        self.thread: Optional[threading.Thread] = None
-    
+        # 不合并错过的运行时，运行期间到期的一次等本次结束后立即补跑
+        self.pending = False
+        self.stats = RunStats()
+        # 按固定节拍计算的下一次运行时间(monotonic)，不受运行耗时影响
+        self.due = time.monotonic()
+        # 堆中有效条目的令牌，移除或重新调度后旧条目失效
+        self.token = 0
+
     def should_run(self) -> bool:
         """检查是否应该运行任务"""
-        if not self.next_run:
-            return True
-        return datetime.utcnow() >= self.next_run
-    
-    def update_schedule(self) -> None:
-        """更新任务计划时间"""
-        self.last_run = datetime.utcnow()
-        self.next_run = self.last_run + timedelta(seconds=self.interval)
+        return time.monotonic() >= self.due
+
+    def update_schedule(self, now: Optional[float] = None) -> None:
+        """推进到下一个节拍
+
+        错过的节拍: coalesce=True时合并为一次(跳到下一个未来节拍)，
+        否则逐个补跑。
+        """
+        now = time.monotonic() if now is None else now
+        self.due += self.interval
+        if self.coalesce and self.due <= now:
+            skipped = math.floor((now - self.due) / self.interval) + 1
+            self.due += skipped * self.interval
+            self.stats.missed += skipped
+        self.next_run = datetime.utcnow() + timedelta(
+            seconds=max(0.0, self.due - now)
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'last_run': (
+                self.last_run.isoformat()
+                if self.last_run else None
+            ),
+            'next_run': (
+                self.next_run.isoformat()
+                if self.next_run else None
+            ),
+            'is_running': self.is_running,
+            'stats': self.stats.to_dict()
+        }
 
 
 class SchedulerManager:
+    """任务调度器
+
+    所有任务的下一次运行时间放在一个堆中，由单个后台线程上的事件循环睡到最早的
+    运行时间。协程任务直接在事件循环上运行，阻塞任务交给有界线程池；同一任务上
+    一次未结束时不会重复启动，错过的运行按coalesce合并或在结束后补跑，不会堆积。
+    """
+
     _instance: Optional['SchedulerManager'] = None
     _tasks: Dict[str, Task] = {}
     _running = False
     _thread: Optional[threading.Thread] = None
-    
+    # 阻塞任务线程池大小
+    MAX_WORKERS = 4
+    # 同时运行的任务数上限
+    MAX_CONCURRENCY = 8
+
     def __new__(cls) -> 'SchedulerManager':
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance._setup()
         return cls._instance
-    
-    def __init__(self) -> None:
-        if not self._thread:
-            self._thread = threading.Thread(target=self._run, daemon=True)
-    
+
+    def _setup(self) -> None:
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
     def start(self) -> None:
         """启动调度器"""
         if not self._running:
             self._running = True
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.MAX_WORKERS,
+                thread_name_prefix='scheduler'
+            )
+            self._thread = threading.Thread(target=self._run, daemon=True)
             self._thread.start()
             logger.info("Scheduler started")
-    
+
     def stop(self) -> None:
         """停止调度器"""
         self._running = False
+        self._wake()
         if self._thread and self._thread.is_alive():
             self._thread.join()
             logger.info("Scheduler stopped")
-    
+        self._thread = None
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
     def add_task(
         self,
         func: Callable,
         interval: int,
         name: str,
         args: tuple = (),
-        kwargs: dict = None
+        kwargs: dict = None,
+        timeout: Optional[float] = None,
+        jitter: float = 0,
+        coalesce: bool = True
     ) -> bool:
-        """添加任务"""
+        """添加任务
+
+        Args:
+            func: 任务函数，协程函数在事件循环上运行，普通函数在线程池中运行
+            interval: 运行间隔(秒)
+            name: 任务名称
+            timeout: 单次运行超时(秒)
+            jitter: 每次运行随机推迟的最大秒数，避免多个任务同时触发
+            coalesce: 是否把错过的多次运行合并为一次
+        """
         try:
-            if name in self._tasks:
-                logger.warning(f"Task {name} already exists")
-                return False
-                
-            task = Task(func, interval, name, args, kwargs)
-            self._tasks[name] = task
+            with self._lock:
+                if name in self._tasks:
+                    logger.warning(f"Task {name} already exists")
+                    return False
+
+                task = Task(
+                    func, interval, name, args, kwargs,
+                    timeout=timeout, jitter=jitter, coalesce=coalesce
+                )
+                self._tasks[name] = task
+                self._push(task)
+            self._wake()
             logger.info(f"Task {name} added")
             return True
-            
+
         except Exception as e:
             logger.error(f"Failed to add task {name}: {e}")
             return False
-    
+
     def remove_task(self, name: str) -> bool:
         """移除任务"""
         try:
-            if name not in self._tasks:
-                logger.warning(f"Task {name} not found")
-                return False
-                
-            task = self._tasks[name]
-            if task.is_running:
-                logger.warning(f"Task {name} is running")
-                return False
-                
-            del self._tasks[name]
+            with self._lock:
+                if name not in self._tasks:
+                    logger.warning(f"Task {name} not found")
+                    return False
+
+                task = self._tasks[name]
+                if task.is_running:
+                    logger.warning(f"Task {name} is running")
+                    return False
+
+                # 堆中的条目延迟删除
+                task.token = -1
+                del self._tasks[name]
             logger.info(f"Task {name} removed")
             return True
-            
+
         except Exception as e:
             logger.error(f"Failed to remove task {name}: {e}")
             return False
-    
+
     def get_task(self, name: str) -> Optional[Dict]:
         """获取任务信息"""
         try:
             task = self._tasks.get(name)
             if not task:
                 return None
-                
-            return {
-                'name': task.name,
-                'interval': task.interval,
-                'last_run': (
-                    task.last_run.isoformat()
-                    if task.last_run else None
-                ),
-                'next_run': (
-                    task.next_run.isoformat()
-                    if task.next_run else None
-                ),
-                'is_running': task.is_running
-            }
-            
+
+            return task.to_dict()
+
         except Exception as e:
             logger.error(f"Failed to get task {name}: {e}")
             return None
-    
+
     def get_all_tasks(self) -> List[Dict]:
         """获取所有任务信息"""
         try:
-            tasks = []
-            for name, task in self._tasks.items():
-                tasks.append({
-                    'name': task.name,
-                    'interval': task.interval,
-                    'last_run': (
-                        task.last_run.isoformat()
-                        if task.last_run else None
-                    ),
-                    'next_run': (
-                        task.next_run.isoformat()
-                        if task.next_run else None
-                    ),
-                    'is_running': task.is_running
-                })
-            return tasks
-            
+            return [task.to_dict() for task in list(self._tasks.values())]
+
         except Exception as e:
             logger.error(f"Failed to get all tasks: {e}")
             return []
-    
-    def _run(self) -> None:
-        """运行调度器主循环"""
-        while self._running:
+
+    def _push(self, task: Task) -> None:
+        """按下一次运行时间(含抖动)加入堆，调用方持有锁"""
+        task.token = next(self._seq)
+        fire_at = task.due + (random.uniform(0, task.jitter) if task.jitter else 0)
+        heapq.heappush(self._heap, (fire_at, task.token, task.name))
+
+    def _wake(self) -> None:
+        """唤醒调度循环重新计算等待时间(可在任意线程调用)"""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
             try:
-                for name, task in self._tasks.items():
-                    if task.should_run() and not task.is_running:
-                        task.is_running = True
-                        task.thread = threading.Thread(
-                            target=self._execute_task,
-                            args=(task,)
-                        )
-                        task.thread.start()
-                        
-            except Exception as e:
-                logger.error(f"Scheduler error: {e}")
-                
-            # 休眠1秒
-            threading.Event().wait(1)
-    
-    def _execute_task(self, task: Task) -> None:
-        """执行任务"""
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                pass
+
+    def _run(self) -> None:
+        """调度线程入口"""
+        loop = asyncio.new_event_loop()
+        self._loop = loop
         try:
-            task.func(*task.args, **task.kwargs)
-            task.update_schedule()
-            
+            loop.run_until_complete(self._main())
         except Exception as e:
-            logger.error(f"Task {task.name} execution failed: {e}")
-            
+            logger.error(f"Scheduler error: {e}")
         finally:
-            task.is_running = False
-            task.thread = None 
\ No newline at end of file
+            self._loop = None
+            self._wakeup = None
+            loop.close()
+
+    async def _main(self) -> None:
+        """调度主循环: 睡到堆顶任务的运行时间"""
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        running: set = set()
+        while self._running:
+            for task in self._pop_due(time.monotonic()):
+                job = asyncio.ensure_future(self._execute_task(task))
+                running.add(job)
+                job.add_done_callback(running.discard)
+
+            with self._lock:
+                delay = (
+                    max(0.0, self._heap[0][0] - time.monotonic())
+                    if self._heap else None
+                )
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        for job in running:
+            job.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def _pop_due(self, now: float) -> List[Task]:
+        """弹出所有到期的任务并安排下一次运行"""
+        due: List[Task] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, token, name = heapq.heappop(self._heap)
+                task = self._tasks.get(name)
+                if task is None or task.token != token:
+                    continue
+                if task.is_running:
+                    if not task.coalesce:
+                        # 本次结束后再补跑，届时重新入堆
+                        task.pending = True
+                        continue
+                    # 上一次还没结束，本次记为错过
+                    task.stats.missed += 1
+                else:
+                    task.is_running = True
+                    due.append(task)
+                task.update_schedule(now)
+                self._push(task)
+        return due
+
+    async def _execute_task(self, task: Task) -> None:
+        """执行任务"""
+        release = True
+        async with self._slots:
+            task.last_run = datetime.utcnow()
+            started = time.monotonic()
+            try:
+                if task.is_async:
+                    run = task.func(*task.args, **task.kwargs)
+                else:
+                    future = asyncio.get_running_loop().run_in_executor(
+                        self._executor,
+                        lambda: task.func(*task.args, **task.kwargs)
+                    )
+                    # 线程无法被中断，超时后直到线程真正结束才允许下一次运行
+                    run = asyncio.shield(future)
+                await asyncio.wait_for(run, task.timeout)
+
+            except asyncio.TimeoutError:
+                task.stats.timeouts += 1
+                logger.error(f"Task {task.name} timed out after {task.timeout}s")
+                if not task.is_async:
+                    release = False
+                    future.add_done_callback(lambda _: self._finish(task))
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                task.stats.failures += 1
+                logger.error(f"Task {task.name} execution failed: {e}")
+
+            finally:
+                task.stats.observe(time.monotonic() - started)
+                if release:
+                    self._finish(task)
+
+    def _finish(self, task: Task) -> None:
+        """任务结束，补跑运行期间错过的一次"""
+        task.is_running = False
+        if task.pending:
+            task.pending = False
+            with self._lock:
+                if self._tasks.get(task.name) is task:
+                    self._push(task)
+            self._wakeup.set()
@@ -1,87 +1,478 @@
 """告警处理服务"""
 
-from typing import Dict, List
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from datetime import datetime
-from sqlalchemy.sql import select
 
 from ncod.core.logger import LoggerManager
 from ncod.core.db.transaction import TransactionManager
 from ncod.core.db.pool import DatabasePool
+from ncod.core.cache.manager import cache_manager
+from ncod.core.notifier import (
+    Digest,
+    MemoryNotificationQueue,
+    Notification,
+    NotificationDispatcher,
+    RedisNotificationQueue,
+)
 from ncod.master.services.notify import NotifyService
 from ncod.master.services.notify_config import NotifyConfigService
-from ncod.master.models.alert_rule import AlertRule
+from ncod.master.services.alert_rule import alert_rule_service
 
 logger = LoggerManager.get_logger(__name__)
 
+# 告警状态
+PENDING = "pending"
+FIRING = "firing"
+RESOLVED = "resolved"
+
+# 样本: (device_id, metric_type, value) 或 (device_id, metric_type, value, timestamp)
+Sample = Tuple
+
+
+class CompiledRule:
+    """编译后的告警规则"""
+
+    __slots__ = (
+        "id",
+        "device_id",
+        "metric_type",
+        "condition",
+        "threshold",
+        "level",
+        "channels",
+        "for_duration",
+        "hysteresis",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        metric_type: str,
+        condition: str,
+        threshold: float,
+        device_id: Optional[str] = None,
+        level: str = "",
+        channels: Optional[List[str]] = None,
+        for_duration: float = 0,
+        hysteresis: float = 0.0,
+    ):
+        self.id = str(id)
+        self.device_id = device_id
+        self.metric_type = metric_type
+        self.condition = condition
+        self.threshold = float(threshold)
+        self.level = level
+        self.channels = list(channels or [])
+        self.for_duration = float(for_duration or 0)
+        self.hysteresis = float(hysteresis or 0.0)
+
+    @classmethod
+    def from_dict(cls, rule: Dict) -> "CompiledRule":
+        return cls(
+            id=rule["id"],
+            device_id=rule.get("device_id"),
+            metric_type=rule["metric_type"],
+            condition=rule["condition"],
+            threshold=rule["threshold"],
+            level=rule.get("level", ""),
+            channels=rule.get("notify_channels"),
+            for_duration=rule.get("for_duration", 0),
+            hysteresis=rule.get("hysteresis", 0.0),
+        )
+
+    def same_as(self, other: "CompiledRule") -> bool:
+        """规则定义是否相同"""
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def cleared(self, value: float) -> bool:
+        """条件是否已解除(考虑回差)"""
+        if self.condition == "gt":
+            return value <= self.threshold - self.hysteresis
+        if self.condition == "lt":
+            return value >= self.threshold + self.hysteresis
+        return value != self.threshold
+
+
+class RuleGroup:
+    """同一(指标类型, 设备)下的规则
+
+    gt和lt规则按阈值排序保存在数组中，一次二分查找即可得到某个值触发的
+    全部规则，而不必逐条比较。
+    """
+
+    def __init__(self):
+        self.rules: Dict[str, CompiledRule] = {}
+        self._gt_thresholds = array("d")
+        self._gt_rules: List[CompiledRule] = []
+        self._lt_thresholds = array("d")
+        self._lt_rules: List[CompiledRule] = []
+        self._eq_rules: Dict[float, List[CompiledRule]] = {}
+
+    def compile(self) -> None:
+        gt = sorted(
+            (r for r in self.rules.values() if r.condition == "gt"),
+            key=lambda r: r.threshold,
+        )
+        lt = sorted(
+            (r for r in self.rules.values() if r.condition == "lt"),
+            key=lambda r: r.threshold,
+        )
+        self._gt_thresholds = array("d", (r.threshold for r in gt))
+        self._gt_rules = gt
+        self._lt_thresholds = array("d", (r.threshold for r in lt))
+        self._lt_rules = lt
+        self._eq_rules = {}
+        for rule in self.rules.values():
+            if rule.condition == "eq":
+                self._eq_rules.setdefault(rule.threshold, []).append(rule)
+
+    def matches(self, value: float) -> List[CompiledRule]:
+        """value满足条件的规则"""
+        # gt: threshold < value，即阈值数组的前缀
+        matched = self._gt_rules[: bisect_left(self._gt_thresholds, value)]
+        # lt: threshold > value，即阈值数组的后缀
+        matched += self._lt_rules[bisect_right(self._lt_thresholds, value) :]
+        matched += self._eq_rules.get(value, [])
+        return matched
+
+
+class RuleIndex:
+    """按(指标类型, 设备)索引的规则，device_id为None的规则适用于所有设备"""
+
+    def __init__(self):
+        self.rules: Dict[str, CompiledRule] = {}
+        self.groups: Dict[Tuple[str, Optional[str]], RuleGroup] = {}
+
+    def load(self, rules: Iterable[CompiledRule]) -> None:
+        self.rules = {}
+        self.groups = {}
+        for rule in rules:
+            self.rules[rule.id] = rule
+            key = (rule.metric_type, rule.device_id)
+            self.groups.setdefault(key, RuleGroup()).rules[rule.id] = rule
+        for group in self.groups.values():
+            group.compile()
+
+    def upsert(self, rule: CompiledRule) -> None:
+        self.remove(rule.id)
+        self.rules[rule.id] = rule
+        group = self.groups.setdefault((rule.metric_type, rule.device_id), RuleGroup())
+        group.rules[rule.id] = rule
+        group.compile()
+
+    def remove(self, rule_id: str) -> Optional[CompiledRule]:
+        rule = self.rules.pop(str(rule_id), None)
+        if rule is None:
+            return None
+        key = (rule.metric_type, rule.device_id)
+        group = self.groups[key]
+        del group.rules[rule.id]
+        if group.rules:
+            group.compile()
+        else:
+            del self.groups[key]
+        return rule
+
+    def lookup(self, metric_type: str, device_id: str) -> List[RuleGroup]:
+        groups = []
+        for key in ((metric_type, device_id), (metric_type, None)):
+            group = self.groups.get(key)
+            if group is not None:
+                groups.append(group)
+        return groups
+
+
+class AlertState:
+    """单条规则在单个设备上的状态"""
+
+    __slots__ = ("rule", "device_id", "status", "since", "value")
+
+    def __init__(self, rule: CompiledRule, device_id: str, since: float):
+        self.rule = rule
+        self.device_id = device_id
+        self.status = PENDING
+        self.since = since
+        self.value = 0.0
+
+
+class AlertEvaluator:
+    """告警评估引擎
+
+    条件首次满足时进入pending，持续满足for_duration秒后进入firing并产生
+    一次告警；firing期间重复满足不再产生告警，直到值越过回差后恢复。
+    pending期间条件不再满足则直接丢弃。
+    """
+
+    def __init__(self):
+        self.index = RuleIndex()
+        self.states: Dict[Tuple[str, str], AlertState] = {}
+        # (指标类型, 设备) -> 处于pending/firing的规则ID
+        self._active: Dict[Tuple[str, str], Set[str]] = {}
+
+    def load(self, rules: Iterable[Dict]) -> None:
+        """加载全部规则，定义未变的规则保留当前状态，避免重新加载后重复告警"""
+        self.index.load(CompiledRule.from_dict(rule) for rule in rules)
+        for key, state in list(self.states.items()):
+            rule = self.index.rules.get(key[0])
+            if rule is not None and rule.same_as(state.rule):
+                state.rule = rule
+                continue
+            del self.states[key]
+            active = self._active.get((state.rule.metric_type, state.device_id))
+            if active:
+                active.discard(key[0])
+
+    def on_rule_event(self, event: str, rule: Dict) -> None:
+        """规则变更时增量更新索引，并重置该规则的状态"""
+        self._drop_states(str(rule["id"]))
+        if event == "deleted" or not rule.get("enabled", True):
+            self.index.remove(rule["id"])
+        else:
+            self.index.upsert(CompiledRule.from_dict(rule))
+
+    def _drop_states(self, rule_id: str) -> None:
+        for key in [k for k in self.states if k[0] == rule_id]:
+            state = self.states.pop(key)
+            active = self._active.get((state.rule.metric_type, state.device_id))
+            if active:
+                active.discard(rule_id)
+
+    def evaluate(
+        self, samples: Iterable[Sample], now: Optional[float] = None
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """评估一批样本
+
+        Returns:
+            Tuple: (新触发的告警, 恢复的告警)
+        """
+        now = time.time() if now is None else now
+        fired: List[Dict] = []
+        resolved: List[Dict] = []
+        for sample in samples:
+            device_id, metric_type, value = sample[0], sample[1], float(sample[2])
+            timestamp = sample[3] if len(sample) > 3 and sample[3] is not None else now
+            if isinstance(timestamp, datetime):
+                timestamp = timestamp.timestamp()
+
+            key = (metric_type, device_id)
+            matched: Set[str] = set()
+            for group in self.index.lookup(metric_type, device_id):
+                for rule in group.matches(value):
+                    matched.add(rule.id)
+                    alert = self._on_match(rule, device_id, value, timestamp)
+                    if alert:
+                        fired.append(alert)
+
+            active = self._active.get(key)
+            if not active:
+                continue
+            for rule_id in list(active - matched):
+                alert = self._on_miss(rule_id, device_id, value, timestamp)
+                if alert:
+                    resolved.append(alert)
+        return fired, resolved
+
+    def _on_match(
+        self, rule: CompiledRule, device_id: str, value: float, timestamp: float
+    ) -> Optional[Dict]:
+        state = self.states.get((rule.id, device_id))
+        if state is None:
+            state = AlertState(rule, device_id, timestamp)
+            self.states[(rule.id, device_id)] = state
+            self._active.setdefault((rule.metric_type, device_id), set()).add(rule.id)
+        state.value = value
+        if state.status == PENDING and timestamp - state.since >= rule.for_duration:
+            state.status = FIRING
+            return self._alert(state, timestamp)
+        return None
+
+    def _on_miss(
+        self, rule_id: str, device_id: str, value: float, timestamp: float
+    ) -> Optional[Dict]:
+        state = self.states.get((rule_id, device_id))
+        if state is None:
+            return None
+        state.value = value
+        if state.status == FIRING and not state.rule.cleared(value):
+            # 仍在回差范围内，保持firing
+            return None
+
+        del self.states[(rule_id, device_id)]
+        self._active[(state.rule.metric_type, device_id)].discard(rule_id)
+        if state.status == FIRING:
+            state.status = RESOLVED
+            return self._alert(state, timestamp)
+        return None
+
+    @staticmethod
+    def _alert(state: AlertState, timestamp: float) -> Dict:
+        return {
+            "device_id": state.device_id,
+            "rule_id": state.rule.id,
+            "metric_type": state.rule.metric_type,
+            "value": state.value,
+            "level": state.rule.level,
+            "status": state.status,
+            "since": datetime.fromtimestamp(state.since),
+            "timestamp": datetime.fromtimestamp(timestamp),
+        }
+
+    def get_active_alerts(self) -> List[Dict]:
+        """当前处于firing状态的告警"""
+        return [
+            self._alert(state, state.since)
+            for state in self.states.values()
+            if state.status == FIRING
+        ]
+
 
 class AlertHandler:
-    """告警处理器"""
+    """告警处理器
+
+    启用的规则在首次使用时一次性加载并编译为内存索引，之后通过
+    AlertRuleService的变更事件增量更新，评估样本不再访问数据库。其它进程
+    修改的规则不会产生本进程的变更事件，因此每rule_ttl秒重新加载一次全部规则。
+    触发的告警交给通知分发器异步发送，评估不等待通知渠道。
+    """
 
-    def __init__(self, db_pool: DatabasePool):
+    # 每个通知渠道每秒最多发送的摘要数
+    CHANNEL_RATE = 1.0
+
+    def __init__(
+        self,
+        db_pool: DatabasePool,
+        config_ttl: int = 60,
+        notify_window: float = 30.0,
+        rule_ttl: int = 60,
+    ):
         self.notify_service = NotifyService()
         self.notify_config_service = NotifyConfigService()
         self.transaction = TransactionManager(db_pool)
+        self.evaluator = AlertEvaluator()
+        self.rule_service = alert_rule_service
+        self.rule_service.add_listener(self.evaluator.on_rule_event)
+        self._loaded = False
+        self.rule_ttl = rule_ttl
+        self._rules_loaded_at = 0.0
+        # 通知渠道配置缓存
+        self.config_ttl = config_ttl
+        self._channel_configs: Dict[str, Dict] = {}
+        self._configs_loaded_at = 0.0
+        # 通知分发器在首次发送时创建(需要在事件循环中启动)
+        self.notify_window = notify_window
+        self.dispatcher: Optional[NotificationDispatcher] = None
+
+    async def load_rules(self) -> None:
+        """加载并编译所有启用的规则
+
+        查询失败时抛出异常，已加载的规则保持不变。
+        """
+        rules = await self.rule_service.get_enabled_rules()
+        self.evaluator.load(rules)
+        self._loaded = True
+        self._rules_loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(rules)} alert rules")
+
+    async def _ensure_rules(self) -> bool:
+        """首次使用或超过rule_ttl秒时重新加载规则
+
+        Returns:
+            bool: 是否有可用的规则索引
+        """
+        if self._loaded and time.monotonic() - self._rules_loaded_at < self.rule_ttl:
+            return True
+        try:
+            await self.load_rules()
+        except Exception as e:
+            logger.error(f"Error loading alert rules: {e}")
+            if self._loaded:
+                # 沿用已加载的规则，下个周期再重试
+                self._rules_loaded_at = time.monotonic()
+        return self._loaded
 
     async def check_metric(
         self, device_id: str, metric_type: str, value: float
     ) -> List[Dict]:
         """检查指标是否触发告警规则"""
-        alerts = []
-        async with self.transaction.transaction() as session:
-            # 获取活跃的告警规则
-            query = (
-                select(AlertRule)
-                .where(AlertRule.metric_type == metric_type)
-                .where(AlertRule.enabled.is_(True))
+        return await self.check_metrics([(device_id, metric_type, value)])
+
+    async def check_metrics(self, samples: Iterable[Sample]) -> List[Dict]:
+        """批量检查指标，返回新触发的告警"""
+        if not await self._ensure_rules():
+            return []
+
+        fired, resolved = self.evaluator.evaluate(samples)
+        for alert in resolved:
+            logger.info(
+                f"Alert resolved: rule {alert['rule_id']} device {alert['device_id']}"
             )
-            result = await session.execute(query)
-            rules = result.scalars().all()
-
-            for rule in rules:
-                # 从数据库模型中获取实际值
-                condition = str(getattr(rule, "condition", ""))
-                threshold = float(getattr(rule, "threshold", 0.0))
-                channels = getattr(rule, "notify_channels", None)
-                notify_channels = list(channels) if channels is not None else []
-
-                if self._check_condition(value, condition, threshold):
-                    alert = {
-                        "device_id": device_id,
-                        "rule_id": str(getattr(rule, "id", "")),
-                        "metric_type": metric_type,
-                        "value": value,
-                        "timestamp": datetime.now(),
-                    }
-                    alerts.append(alert)
-                    # 发送通知
-                    await self._send_notifications(alert, notify_channels)
-
-        return alerts
-
-    def _check_condition(self, value: float, condition: str, threshold: float) -> bool:
-        """检查条件"""
-        if condition == "gt":
-            return value > threshold
-        elif condition == "lt":
-            return value < threshold
-        elif condition == "eq":
-            return value == threshold
-        else:
-            return False
+        for alert in fired:
+            rule = self.evaluator.index.rules.get(alert["rule_id"])
+            if rule and rule.channels:
+                await self._send_notifications(alert, rule.channels)
+        return fired
 
-    async def _send_notifications(self, alert: Dict, channels: List[str]) -> None:
-        """发送通知"""
-        try:
-            # 获取通知配置
+    async def _get_channel_configs(self) -> Dict[str, Dict]:
+        """获取通知渠道配置(缓存config_ttl秒)"""
+        if time.monotonic() - self._configs_loaded_at >= self.config_ttl:
             configs = await self.notify_config_service.get_channel_configs()
-            channel_configs = {
+            self._channel_configs = {
                 config["channel"]: config["config"] for config in configs
             }
+            self._configs_loaded_at = time.monotonic()
+        return self._channel_configs
+
+    async def _get_dispatcher(self) -> NotificationDispatcher:
+        """获取通知分发器，Redis可用时使用持久化队列"""
+        if self.dispatcher is None:
+            queue = (
+                RedisNotificationQueue(cache_manager.redis, "alert:notify:pending")
+                if cache_manager.redis
+                else MemoryNotificationQueue()
+            )
+            self.dispatcher = NotificationDispatcher(queue, window=self.notify_window)
+            for channel in (await self._get_channel_configs()).keys():
+                self._register_channel(channel)
+            await self.dispatcher.start()
+        return self.dispatcher
+
+    def _register_channel(self, channel: str) -> None:
+        async def send(digest: Digest) -> bool:
+            config = (await self._get_channel_configs()).get(channel)
+            if config is None:
+                return False
+            await self.notify_service.send_notification(channel, config, digest.body)
+            return True
+
+        self.dispatcher.register_channel(channel, send, rate=self.CHANNEL_RATE)
+
+    async def close(self) -> None:
+        """停止通知分发器，未发送的通知保留在队列中"""
+        self.rule_service.remove_listener(self.evaluator.on_rule_event)
+        if self.dispatcher:
+            await self.dispatcher.stop()
+
+    async def _send_notifications(self, alert: Dict, channels: List[str]) -> None:
+        """把告警通知提交给分发器
+
+        同一渠道在合并窗口内的告警合并为一条摘要发送，同一规则和设备的
+        重复告警只保留最新一条。
+        """
+        try:
+            # 获取通知配置
+            channel_configs = await self._get_channel_configs()
+            dispatcher = await self._get_dispatcher()
 
-            # 发送通知
             for channel in channels:
                 if channel not in channel_configs:
                     continue
+                if not dispatcher.has_channel(channel):
+                    self._register_channel(channel)
 
                 # 构造通知消息
                 message = (
@@ -90,8 +481,15 @@ class AlertHandler:
                     f"当前值 {alert['value']}"
                 )
 
-                await self.notify_service.send_notification(
-                    channel, channel_configs[channel], message
+                await dispatcher.submit(
+                    Notification(
+                        channel=channel,
+                        recipient=channel,
+                        title=f"告警: {alert['metric_type']}",
+                        body=message,
+                        severity=alert.get("level") or "info",
+                        key=f"{alert['rule_id']}:{alert['device_id']}",
+                    )
                 )
         except Exception as e:
             logger.error(f"Error sending notifications: {e}")
@@ -1,6 +1,7 @@
 """告警规则服务"""
 
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import select
 from ncod.core.logger import setup_logger
 from ncod.core.db.transaction import transaction_manager
 from ncod.master.models.alert_rule import AlertRule
@@ -16,6 +17,25 @@ class AlertRuleService:
         self.transaction = transaction_manager
         self.cache = cache_manager
         self.cache_ttl = 300  # 5分钟
+        # 规则变更监听器: callback(event, rule_dict)，event为created/updated/deleted
+        self._listeners: List[Callable[[str, Dict], None]] = []
+
+    def add_listener(self, callback: Callable[[str, Dict], None]) -> None:
+        """注册规则变更监听器"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str, Dict], None]) -> None:
+        """移除规则变更监听器"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, event: str, rule: Dict) -> None:
+        for callback in list(self._listeners):
+            try:
+                callback(event, rule)
+            except Exception as e:
+                logger.error(f"Error in alert rule listener: {e}")
 
     async def create_rule(self, device_id: str, data: Dict) -> Optional[Dict]:
         """创建告警规则"""
@@ -27,6 +47,8 @@ class AlertRuleService:
                     metric_type=data["metric_type"],
                     condition=data["condition"],
                     threshold=data["threshold"],
+                    for_duration=data.get("for_duration", 0),
+                    hysteresis=data.get("hysteresis", 0.0),
                     level=data["level"],
                     enabled=data.get("enabled", True),
                     notify_channels=data.get("notify_channels", {}),
@@ -39,7 +61,9 @@ class AlertRuleService:
                 cache_key = f"alert_rules:{device_id}"
                 await self.cache.delete(cache_key)
 
-                return rule.to_dict()
+                result = rule.to_dict()
+                self._notify("created", result)
+                return result
         except Exception as e:
             logger.error(f"Error creating alert rule: {e}")
             return None
@@ -67,6 +91,17 @@ class AlertRuleService:
             logger.error(f"Error getting device rules: {e}")
             return []
 
+    async def get_enabled_rules(self) -> List[Dict]:
+        """获取所有启用的告警规则(用于编译告警规则索引)
+
+        查询失败时抛出异常，调用方不能把失败当作没有规则。
+        """
+        async with self.transaction.transaction() as session:
+            result = await session.execute(
+                select(AlertRule).where(AlertRule.enabled.is_(True))
+            )
+            return [rule.to_dict() for rule in result.scalars().all()]
+
     async def update_rule(self, rule_id: str, data: Dict) -> Optional[Dict]:
         """更新告警规则"""
         try:
@@ -86,7 +121,9 @@ class AlertRuleService:
                 cache_key = f"alert_rules:{rule.device_id}"
                 await self.cache.delete(cache_key)
 
-                return rule.to_dict()
+                result = rule.to_dict()
+                self._notify("updated", result)
+                return result
         except Exception as e:
             logger.error(f"Error updating alert rule: {e}")
             return None
@@ -99,6 +136,7 @@ class AlertRuleService:
                 if not rule:
                     return False
 
+                deleted = rule.to_dict()
                 await session.delete(rule)
                 await session.commit()
 
@@ -106,6 +144,7 @@ class AlertRuleService:
                 cache_key = f"alert_rules:{rule.device_id}"
                 await self.cache.delete(cache_key)
 
+                self._notify("deleted", deleted)
                 return True
         except Exception as e:
             logger.error(f"Error deleting alert rule: {e}")
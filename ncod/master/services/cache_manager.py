@@ -1,69 +1,231 @@
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple
 import asyncio
+import inspect
 import logging
-from cachetools import TTLCache, LRUCache
+import math
+import random
+from cachetools import TLRUCache, LRUCache
 from ncod.master.services.cache_monitor import CacheMonitor
+from ncod.utils.cache import near_cache
 import time
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class CacheEntry:
+    """缓存条目
+
+    fresh_until之前为新鲜数据；之后到stale_until之间仍可返回旧值，
+    同时在后台刷新(stale-while-revalidate)。
+    """
+
+    value: Any
+    fresh_until: float
+    stale_until: float
+    # 上次加载耗时(秒)，用于概率提前刷新
+    delta: float = 0.0
+
+
 class CacheManager:
+    # 各缓存类型的默认新鲜期(秒)
+    DEFAULT_TTLS = {"short": 300, "long": 3600, "stats": 600}
+    # 新鲜期过后允许返回旧值的时长占新鲜期的比例
+    STALE_RATIO = 0.5
+    # 概率提前刷新系数(XFetch中的beta)，越大越早刷新
+    EARLY_REFRESH_BETA = 1.0
+
     def __init__(self):
-        # 短期缓存(5分钟)
-        self.short_term = TTLCache(maxsize=1000, ttl=300)
-        # 长期缓存(1小时)
-        self.long_term = TTLCache(maxsize=500, ttl=3600)
-        # 统计数据缓存(10分钟)
-        self.stats_cache = TTLCache(maxsize=200, ttl=600)
+        # 过期时间随条目保存(CacheEntry.stale_until)，调用方指定的ttl可以长于
+        # 默认值，不会被容器的统一TTL截断
+        # 短期缓存(默认5分钟)
+        self.short_term = TLRUCache(maxsize=1000, ttu=self._entry_expiry)
+        # 长期缓存(默认1小时)
+        self.long_term = TLRUCache(maxsize=500, ttu=self._entry_expiry)
+        # 统计数据缓存(默认10分钟)
+        self.stats_cache = TLRUCache(maxsize=200, ttu=self._entry_expiry)
         # 用户会话缓存
         self.session_cache = LRUCache(maxsize=100)
 
+        # 正在加载中的键 -> 加载任务，同一个键只有一个加载器运行
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
         # 启动清理任务
         asyncio.create_task(self._cleanup_loop())
 
         self.monitor = CacheMonitor()
 
+        # 跨进程共享的两级缓存(本地LRU + Redis)，命中统计计入同一个监控器
+        self.near_cache = near_cache
+        self.near_cache.monitor = self.monitor
+
+    @classmethod
+    def _hard_ttl(cls, ttl: int) -> int:
+        """条目的硬过期时间(新鲜期 + 旧值宽限期)"""
+        return int(ttl * (1 + cls.STALE_RATIO))
+
+    @staticmethod
+    def _entry_expiry(key: str, entry: Any, now: float) -> float:
+        """条目在容器中的过期时间(time.monotonic)"""
+        if isinstance(entry, CacheEntry):
+            return entry.stale_until
+        return math.inf
+
     async def get_or_set(
         self, cache_type: str, key: str, getter_func, ttl: Optional[int] = None
     ) -> Any:
-        """获取或设置缓存"""
+        """获取或设置缓存
+
+        - 并发未命中时只运行一个getter_func，其余调用方等待同一结果(single-flight)
+        - 新鲜期过后、硬过期之前返回旧值并在后台刷新(stale-while-revalidate)
+        - 新鲜期内按上次加载耗时概率性提前刷新，避免大量键同时过期引起的惊群
+        """
+        if cache_type == "shared":
+            return await self._get_or_set_shared(key, getter_func, ttl)
+
         start_time = time.time()
         cache = self._get_cache(cache_type)
 
-        if not cache:
-            return await getter_func()
+        if cache is None:
+            return await self._call(getter_func)
 
         # 尝试获取缓存
+        entry = None
         try:
-            value = cache.get(key)
-            if value is not None:
-                self.monitor.record_hit(cache_type, time.time() - start_time)
-                return value
+            entry = cache.get(key)
         except Exception as e:
             logger.error(f"Cache get error: {e}")
 
+        if isinstance(entry, CacheEntry):
+            now = time.monotonic()
+            if now < entry.stale_until:
+                self.monitor.record_hit(cache_type, time.time() - start_time)
+                if now >= entry.fresh_until or self._should_refresh_early(entry, now):
+                    self._refresh_in_background(cache_type, key, getter_func, ttl)
+                return entry.value
+
         # 缓存未命中
         self.monitor.record_miss(cache_type, time.time() - start_time)
+        return await asyncio.shield(self._load(cache_type, key, getter_func, ttl))
+
+    async def _get_or_set_shared(
+        self, key: str, getter_func, ttl: Optional[int] = None
+    ) -> Any:
+        """通过两级缓存获取或设置，未命中时与其它缓存类型一样只运行一个加载器"""
+        value = await self.near_cache.get(key)
+        if value is not None:
+            return value
+        return await asyncio.shield(self._load("shared", key, getter_func, ttl))
 
-        # 获取新数据
-        value = await getter_func()
+    def _should_refresh_early(self, entry: CacheEntry, now: float) -> bool:
+        """概率提前刷新(XFetch): 越接近过期、加载越慢，越可能提前刷新"""
+        if entry.delta <= 0:
+            return False
+        rand = random.random() or 1e-12
+        jitter = -entry.delta * self.EARLY_REFRESH_BETA * math.log(rand)
+        return now + jitter >= entry.fresh_until
+
+    def _refresh_in_background(
+        self, cache_type: str, key: str, getter_func, ttl: Optional[int]
+    ):
+        """在后台刷新缓存(已有加载任务时不重复发起)"""
+        future = self._load(cache_type, key, getter_func, ttl)
+        # 后台刷新的异常由加载任务记录，这里只需避免未取回异常的警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def _load(
+        self, cache_type: str, key: str, getter_func, ttl: Optional[int]
+    ) -> asyncio.Future:
+        """获取键的加载任务，同一键同时只存在一个"""
+        flight_key = (cache_type, key)
+        future = self._inflight.get(flight_key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._run_loader(cache_type, key, getter_func, ttl)
+            )
+            self._inflight[flight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        return future
+
+    async def _run_loader(
+        self, cache_type: str, key: str, getter_func, ttl: Optional[int]
+    ) -> Any:
+        """运行加载器并写入缓存"""
+        started = time.monotonic()
+        try:
+            value = await self._call(getter_func)
+        except Exception as e:
+            logger.error(f"Cache loader error for {cache_type}:{key}: {e}")
+            raise
+        finished = time.monotonic()
+
+        if cache_type == "shared":
+            if value is not None:
+                await self.near_cache.set(key, value, ttl)
+            return value
 
-        # 设置缓存
         try:
-            if ttl:
-                cache[key] = {
-                    "value": value,
-                    "expires": datetime.utcnow() + timedelta(seconds=ttl),
-                }
-            else:
-                cache[key] = value
+            cache = self._get_cache(cache_type)
+            cache[key] = self._make_entry(
+                cache_type, value, ttl, finished, finished - started
+            )
         except Exception as e:
             logger.error(f"Cache set error: {e}")
 
         return value
 
+    def _make_entry(
+        self,
+        cache_type: str,
+        value: Any,
+        ttl: Optional[int],
+        now: float,
+        delta: float = 0.0,
+    ) -> CacheEntry:
+        """构造缓存条目"""
+        fresh_ttl = ttl or self.DEFAULT_TTLS.get(cache_type)
+        return CacheEntry(
+            value=value,
+            fresh_until=now + fresh_ttl if fresh_ttl else math.inf,
+            stale_until=now + self._hard_ttl(fresh_ttl) if fresh_ttl else math.inf,
+            delta=delta,
+        )
+
+    @staticmethod
+    async def _call(getter_func) -> Any:
+        """调用加载函数，兼容同步和异步函数"""
+        value = getter_func()
+        if inspect.isawaitable(value):
+            value = await value
+        return value
+
+    async def set_many(
+        self, cache_type: str, items: Dict[str, Any], ttl: Optional[int] = None
+    ) -> int:
+        """批量写入缓存(用于预热)，不经过加载器
+
+        Returns:
+            int: 写入的条目数
+        """
+        if not items:
+            return 0
+        if cache_type == "shared":
+            success = await self.near_cache.set_many(items, ttl)
+            return len(items) if success else 0
+
+        cache = self._get_cache(cache_type)
+        if cache is None:
+            return 0
+        now = time.monotonic()
+        for key, value in items.items():
+            cache[key] = self._make_entry(cache_type, value, ttl, now)
+        return len(items)
+
+    async def invalidate_shared(self, key: str):
+        """使共享缓存失效(通知所有工作进程)"""
+        await self.near_cache.delete(key)
+
     def invalidate(self, cache_type: str, key: str):
         """使缓存失效"""
         cache = self._get_cache(cache_type)
@@ -98,16 +260,19 @@ class CacheManager:
     def _cleanup_expired(self):
         """清理过期缓存"""
         start_time = time.time()
-        now = datetime.utcnow()
+        now = time.monotonic()
         eviction_count = 0
 
-        for cache in [self.short_term, self.long_term, self.stats_cache]:
+        for cache in [
+            self.short_term,
+            self.long_term,
+            self.stats_cache,
+            self.session_cache,
+        ]:
             expired_keys = [
                 key
                 for key, value in cache.items()
-                if isinstance(value, dict)
-                and value.get("expires")
-                and value["expires"] < now
+                if isinstance(value, CacheEntry) and value.stale_until < now
             ]
 
             for key in expired_keys:
@@ -1,14 +1,16 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Tuple
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
+from sqlalchemy import extract, func, select
 from sqlalchemy.orm import Session
 
-from ncod.master.models.device import Device
+from ncod.master.models.device import Device, DeviceStatus
+from ncod.master.models.device_history import DeviceHistory
 from ncod.master.models.organization import Organization
 from ncod.master.models.user import User
 from ncod.master.services.cache_manager import CacheManager
-from ncod.master.services.device_stats import DeviceStatsService
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +21,33 @@ class WarmupProgress:
         self.completed = 0
         self.current_type = ""
         self.errors = []
+        # 各类型的 [已完成, 总数]
+        self.type_progress: Dict[str, List[int]] = {}
+        self.started_at = 0.0
+        self.finished_at = 0.0
+
+    def start(self):
+        self.total = 0
+        self.completed = 0
+        self.errors = []
+        self.type_progress = {}
+        self.started_at = time.monotonic()
+        self.finished_at = 0.0
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    def begin(self, current_type: str, total: int):
+        """登记某类数据的总数"""
+        self.type_progress[current_type] = [0, total]
+        self.total += total
+        self.current_type = current_type
+
+    def advance(self, current_type: str, count: int):
+        """某类数据又完成了count条"""
+        self.type_progress[current_type][0] += count
+        self.completed += count
+        self.current_type = current_type
 
     def update(self, completed: int, total: int, current_type: str):
         self.completed = completed
@@ -32,132 +61,257 @@ class WarmupProgress:
     def percentage(self) -> float:
         return round(self.completed / self.total * 100, 2) if self.total > 0 else 0
 
+    @property
+    def elapsed(self) -> float:
+        if not self.started_at:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """每秒写入缓存的条目数"""
+        return round(self.completed / self.elapsed, 2) if self.elapsed > 0 else 0
+
     def to_dict(self) -> Dict:
         return {
             "completed": self.completed,
             "total": self.total,
             "percentage": self.percentage,
             "current_type": self.current_type,
+            "types": {
+                name: {"completed": done, "total": total}
+                for name, (done, total) in self.type_progress.items()
+            },
+            "elapsed": round(self.elapsed, 3),
+            "throughput": self.throughput,
             "errors": self.errors,
         }
 
 
 class CacheWarmupService:
-    def __init__(self, db: Session, cache_manager: CacheManager):
+    """缓存预热
+
+    每类数据只用一次集合查询加载，统计数据由一次GROUP BY聚合得到，
+    再按批写入缓存，同时进行的批次数由concurrency限制。
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        cache_manager: CacheManager,
+        batch_size: int = 500,
+        concurrency: int = 8,
+    ):
         self.db = db
         self.cache = cache_manager
-        self.stats_service = DeviceStatsService(db, cache_manager)
+        self.batch_size = batch_size
         self.progress = WarmupProgress()
+        self._semaphore = asyncio.Semaphore(concurrency)
 
     async def warmup_all(self):
         """预热所有缓存"""
         logger.info("Starting cache warmup...")
-        start_time = datetime.utcnow()
-
-        tasks = [
-            self.warmup_organizations(),
-            self.warmup_devices(),
-            self.warmup_device_stats(),
-            self.warmup_user_stats(),
-        ]
+        self.progress.start()
 
-        await asyncio.gather(*tasks)
+        tasks = {
+            "organizations": self.warmup_organizations(),
+            "devices": self.warmup_devices(),
+            "usage_stats": self.warmup_usage_stats(),
+        }
 
-        duration = (datetime.utcnow() - start_time).total_seconds()
-        logger.info(f"Cache warmup completed in {duration:.2f} seconds")
+        try:
+            # 某类数据失败不影响其它类型的预热
+            results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+            for name, result in zip(tasks, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error warming up {name}: {result}")
+                    self.progress.add_error(f"Error warming up {name}: {result}")
+        finally:
+            self.progress.finish()
+        logger.info(
+            f"Cache warmup completed in {self.progress.elapsed:.2f} seconds "
+            f"({self.progress.completed} entries, "
+            f"{self.progress.throughput} entries/s, "
+            f"{len(self.progress.errors)} errors)"
+        )
 
     async def warmup_organizations(self):
         """预热组织数据"""
-        orgs = self.db.query(Organization).all()
-        total = len(orgs)
-        self.progress.update(0, total, "organizations")
-
-        for i, org in enumerate(orgs, 1):
-            try:
-                key = f"org:{org.id}"
-                await self.cache.get_or_set(
-                    "long", key, lambda: org.to_dict(), ttl=3600
-                )
-                self.progress.update(i, total, "organizations")
-            except Exception as e:
-                self.progress.add_error(f"Error warming up org {org.id}: {str(e)}")
+        rows = self.db.execute(select(Organization.__table__)).mappings().all()
+        await self._fill(
+            "organizations",
+            "long",
+            ((f"org:{row['id']}", dict(row)) for row in rows),
+            len(rows),
+            ttl=3600,
+        )
 
     async def warmup_devices(self):
         """预热设备数据"""
-        devices = self.db.query(Device).filter(Device.is_active == True).all()
-        for device in devices:
-            key = f"device:{device.id}"
-            await self.cache.get_or_set("short", key, lambda: device.to_dict(), ttl=300)
+        rows = (
+            self.db.execute(
+                select(Device.__table__).where(Device.status == DeviceStatus.ONLINE)
+            )
+            .mappings()
+            .all()
+        )
+        await self._fill(
+            "devices",
+            "short",
+            ((f"device:{row['id']}", dict(row)) for row in rows),
+            len(rows),
+            ttl=300,
+        )
 
     async def warmup_device_stats(self):
         """预热设备统计数据"""
-        devices = self.db.query(Device).filter(Device.is_active == True).all()
-        for device in devices:
-            key = f"device_stats:{device.id}"
-            await self.cache.get_or_set(
-                "stats",
-                key,
-                lambda: self.stats_service._fetch_device_stats(device.id),
-                ttl=600,
-            )
+        device_stats, _ = self._aggregate_usage()
+        await self._fill_stats("device_stats", device_stats)
 
     async def warmup_user_stats(self):
         """预热用户统计数据"""
-        active_users = (
-            self.db.query(User)
-            .filter(User.is_active == True)
-            .filter(User.last_login >= datetime.utcnow() - timedelta(days=7))
-            .all()
+        _, user_stats = self._aggregate_usage()
+        await self._fill_stats("user_stats", user_stats)
+
+    async def warmup_usage_stats(self):
+        """预热设备和用户统计数据(共用一次聚合查询)"""
+        device_stats, user_stats = self._aggregate_usage()
+        await asyncio.gather(
+            self._fill_stats("device_stats", device_stats),
+            self._fill_stats("user_stats", user_stats),
         )
 
-        for user in active_users:
-            key = f"user_stats:{user.id}"
-            await self.cache.get_or_set(
-                "stats", key, lambda: self._get_user_stats(user.id), ttl=600
-            )
+    async def _fill_stats(self, name: str, stats: Dict[Any, Dict[str, Any]]):
+        await self._fill(
+            name,
+            "stats",
+            ((f"{name}:{key}", value) for key, value in stats.items()),
+            len(stats),
+            ttl=600,
+        )
 
-    def _get_user_stats(self, user_id: int) -> Dict[str, Any]:
-        """获取用户统计数据"""
-        from ncod.master.models.device_history import DeviceHistory
-
-        # 获取最近30天的使用记录
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        usage_records = (
-            self.db.query(DeviceHistory)
-            .filter(
-                DeviceHistory.user_id == user_id,
-                DeviceHistory.created_at >= thirty_days_ago,
-            )
-            .all()
+    async def _fill(
+        self,
+        name: str,
+        cache_type: str,
+        items: Iterable[Tuple[str, Any]],
+        total: int,
+        ttl: int,
+    ):
+        """分批写入缓存"""
+        self.progress.begin(name, total)
+        batches = []
+        batch: Dict[str, Any] = {}
+        for key, value in items:
+            batch[key] = value
+            if len(batch) >= self.batch_size:
+                batches.append(batch)
+                batch = {}
+        if batch:
+            batches.append(batch)
+
+        await asyncio.gather(
+            *(self._fill_batch(name, cache_type, batch, ttl) for batch in batches)
+        )
+
+    async def _fill_batch(
+        self, name: str, cache_type: str, batch: Dict[str, Any], ttl: int
+    ):
+        async with self._semaphore:
+            try:
+                written = await self.cache.set_many(cache_type, batch, ttl=ttl)
+                self.progress.advance(name, written)
+            except Exception as e:
+                self.progress.add_error(
+                    f"Error warming up {len(batch)} {name} entries: {str(e)}"
+                )
+
+    def _aggregate_usage(
+        self,
+    ) -> Tuple[Dict[Any, Dict[str, Any]], Dict[Any, Dict[str, Any]]]:
+        """按(用户, 设备, 小时)聚合最近30天的使用记录
+
+        一次GROUP BY同时得到设备统计和最近7天登录过的活跃用户的统计。
+
+        Returns:
+            Tuple: (设备统计, 用户统计)
+        """
+        now = datetime.utcnow()
+        thirty_days_ago = now - timedelta(days=30)
+        hour = extract("hour", DeviceHistory.start_time)
+        duration = func.sum(
+            extract("epoch", DeviceHistory.end_time - DeviceHistory.start_time)
         )
+        rows = self.db.execute(
+            select(
+                DeviceHistory.user_id,
+                DeviceHistory.device_id,
+                hour.label("hour"),
+                func.count(DeviceHistory.id).label("usage_count"),
+                duration.label("seconds"),
+            )
+            .where(DeviceHistory.start_time >= thirty_days_ago)
+            .group_by(DeviceHistory.user_id, DeviceHistory.device_id, hour)
+        ).all()
 
-        # 计算总使用时长
-        total_duration = sum(
-            (r.end_time - r.start_time).total_seconds() / 3600
-            for r in usage_records
-            if r.end_time
+        active_users = set(
+            self.db.execute(
+                select(User.id)
+                .where(User.is_active == True)
+                .where(User.last_login >= now - timedelta(days=7))
+            ).scalars()
         )
 
-        # 计算设备使用分布
-        device_usage = {}
-        for record in usage_records:
-            device_id = record.device_id
-            if device_id not in device_usage:
-                device_usage[device_id] = 0
-            if record.end_time:
-                duration = (record.end_time - record.start_time).total_seconds() / 3600
-                device_usage[device_id] += duration
-
-        # 计算使用时段分布
-        hour_distribution = [0] * 24
-        for record in usage_records:
-            hour = record.start_time.hour
-            hour_distribution[hour] += 1
+        device_stats: Dict[Any, Dict[str, Any]] = {}
+        user_stats: Dict[Any, Dict[str, Any]] = {
+            user_id: self._empty_stats("device_usage", now) for user_id in active_users
+        }
+        device_users: Dict[Any, set] = {}
+        for user_id, device_id, row_hour, count, seconds in rows:
+            hours = (seconds or 0) / 3600
+            stats = device_stats.get(device_id)
+            if stats is None:
+                stats = device_stats[device_id] = self._empty_stats("user_usage", now)
+                device_users[device_id] = set()
+            self._accumulate(stats, "user_usage", user_id, row_hour, count, hours)
+            device_users[device_id].add(user_id)
+
+            if user_id in user_stats:
+                self._accumulate(
+                    user_stats[user_id],
+                    "device_usage",
+                    device_id,
+                    row_hour,
+                    count,
+                    hours,
+                )
+
+        for device_id, stats in device_stats.items():
+            stats["user_count"] = len(device_users[device_id])
+        for stats in (*device_stats.values(), *user_stats.values()):
+            stats["total_duration"] = round(stats["total_duration"], 2)
+        return device_stats, user_stats
 
+    @staticmethod
+    def _empty_stats(usage_field: str, now: datetime) -> Dict[str, Any]:
         return {
-            "total_duration": round(total_duration, 2),
-            "usage_count": len(usage_records),
-            "device_usage": device_usage,
-            "hour_distribution": hour_distribution,
-            "last_updated": datetime.utcnow(),
+            "total_duration": 0.0,
+            "usage_count": 0,
+            usage_field: {},
+            "hour_distribution": [0] * 24,
+            "last_updated": now,
         }
+
+    @staticmethod
+    def _accumulate(
+        stats: Dict[str, Any],
+        usage_field: str,
+        key: Any,
+        hour: Any,
+        count: int,
+        hours: float,
+    ):
+        stats["total_duration"] += hours
+        stats["usage_count"] += count
+        stats[usage_field][key] = stats[usage_field].get(key, 0) + hours
+        stats["hour_distribution"][int(hour)] += count
@@ -6,6 +6,7 @@ from ncod.core.db.transaction import transaction_manager
 from ncod.master.models.device import Device
 from ncod.master.models.organization import Organization
 from ncod.master.models.slave import Slave
+from ncod.utils.cache import collection_versions
 
 logger = setup_logger("device_service")
 
@@ -49,6 +50,7 @@ class DeviceService:
 
                 session.add(device)
                 await session.commit()
+                await collection_versions.bump("devices")
                 await session.refresh(device)
 
                 return True, "Device created successfully", device
@@ -99,6 +101,7 @@ class DeviceService:
                     device.slave_id = data["slave_id"]
 
                 await session.commit()
+                await collection_versions.bump("devices")
                 await session.refresh(device)
 
                 return True, "Device updated successfully", device
@@ -116,6 +119,7 @@ class DeviceService:
 
                 await session.delete(device)
                 await session.commit()
+                await collection_versions.bump("devices")
 
                 return True, "Device deleted successfully"
         except Exception as e:
@@ -0,0 +1,115 @@
+"""从服务器设备增量同步
+
+从服务器的DeviceStateTracker只推送变化的设备(新增/移除/状态变化)，主服务器
+按版本号顺序应用。版本不连续(丢失消息、从服务器重启)时由调用方请求完整快照，
+快照中没有的设备标记为离线。
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Union
+from sqlalchemy import select, update
+from ncod.core.logger import setup_logger
+from ncod.core.db.transaction import transaction_manager
+from ncod.master.models.device import Device, DeviceStatus
+from ncod.utils.cache import collection_versions
+
+logger = setup_logger("device_delta")
+
+SlaveId = Union[int, str]
+
+
+class DeviceDeltaConsumer:
+    """设备增量消费者"""
+
+    DEVICE_TYPE = "usb"
+
+    def __init__(self):
+        self.transaction = transaction_manager
+        # 每个从服务器已应用的版本号
+        self._versions: Dict[str, int] = {}
+
+    @staticmethod
+    def device_id(slave_id: SlaveId, device: Dict) -> str:
+        """主服务器上的设备ID(slave_id:hub_id:device_id)"""
+        return f"{slave_id}:{device['hub_id']}:{device['id']}"
+
+    def version(self, slave_id: SlaveId) -> Optional[int]:
+        return self._versions.get(str(slave_id))
+
+    def forget(self, slave_id: SlaveId) -> None:
+        """从服务器断开后丢弃版本号，重新连接时必须先发送快照"""
+        self._versions.pop(str(slave_id), None)
+
+    async def apply_delta(self, slave_id: SlaveId, data: Dict) -> bool:
+        """应用一条增量
+
+        Returns:
+            版本不连续时返回False且不做任何修改，调用方应请求完整快照
+        """
+        last = self.version(slave_id)
+        if last is None or data.get("version") != last + 1:
+            logger.info(
+                f"Device delta version gap for slave {slave_id}: "
+                f"{last} -> {data.get('version')}"
+            )
+            return False
+        await self._persist(
+            slave_id,
+            data.get("added", []) + data.get("changed", []),
+            data.get("removed", []),
+        )
+        self._versions[str(slave_id)] = data["version"]
+        return True
+
+    async def apply_snapshot(self, slave_id: SlaveId, data: Dict) -> None:
+        """用完整快照重建从服务器的设备表"""
+        await self._persist(slave_id, data.get("devices", []), (), snapshot=True)
+        self._versions[str(slave_id)] = data.get("version", 0)
+
+    async def _persist(
+        self,
+        slave_id: SlaveId,
+        online: Iterable[Dict],
+        removed: Iterable[Dict],
+        snapshot: bool = False,
+    ) -> None:
+        now = datetime.utcnow()
+        devices = {self.device_id(slave_id, device): device for device in online}
+        removed_ids: List[str] = [
+            self.device_id(slave_id, device) for device in removed
+        ]
+        slave_column = int(slave_id) if str(slave_id).isdigit() else None
+
+        async with self.transaction.transaction() as session:
+            result = await session.execute(
+                select(Device).where(Device.id.in_(list(devices)))
+            )
+            existing = {device.id: device for device in result.scalars().all()}
+            for device_id, data in devices.items():
+                device = existing.get(device_id)
+                if device is None:
+                    device = Device(
+                        id=device_id, type=self.DEVICE_TYPE, slave_id=slave_column
+                    )
+                    session.add(device)
+                device.name = data["name"]
+                device.status = DeviceStatus.ONLINE
+                device.last_heartbeat = now
+
+            offline = update(Device).values(status=DeviceStatus.OFFLINE)
+            if snapshot:
+                # 快照之外的设备都已从该从服务器移除
+                await session.execute(
+                    offline.where(
+                        Device.id.like(f"{slave_id}:%"),
+                        Device.id.notin_(list(devices)),
+                    )
+                )
+            elif removed_ids:
+                await session.execute(offline.where(Device.id.in_(removed_ids)))
+
+        await collection_versions.bump("devices")
+
+
+# 创建全局设备增量消费者实例
+device_delta_consumer = DeviceDeltaConsumer()
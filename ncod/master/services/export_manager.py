@@ -1,30 +1,125 @@
+"""导出管理
+
+数据按排序键分块从数据库读取，经有界队列交给独立的写入进程增量写入文件。
+API事件循环只执行异步查询，内存占用与导出行数无关，进度按已写入行数计算。
+任务状态保存在Redis中，任一工作进程都能查询进度和下载文件。
+"""
+
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 import asyncio
+import multiprocessing
 import os
-from typing import Dict, Optional
-import pandas as pd
-from sqlalchemy.orm import Session
+import queue as queue_module
+from typing import AsyncIterator, Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import func, select
 import logging
 
+from ncod.core.cache.manager import cache_manager
+from ncod.core.db.database import async_session_maker
+from ncod.master.models.device import Device
+from ncod.master.models.device_stats import DeviceUsageLog, DeviceUsageStats
+from ncod.master.models.organization import Organization
+from ncod.master.models.user import User
+from ncod.master.services.export_writer import (
+    FORMATS,
+    Column,
+    file_suffix,
+    run_writer,
+)
+from ncod.master.utils.pagination import seek
+
 logger = logging.getLogger(__name__)
 
+# Redis中导出任务状态的键
+TASK_KEY = "export:task:{}"
+
+
+@dataclass
+class ExportSheet:
+    """导出的一个工作表
+
+    stmt只选择输出列，keys为分块读取的排序键，直接使用列本身以便利用索引
+    (最后一列必须唯一)。seek用元组比较定位下一块，与NULL比较的结果不为真，
+    第一列可为NULL时设置nullable：先按全部排序键读取第一列不为NULL的行，
+    再按其余排序键读取为NULL的行。
+    """
+
+    name: str
+    columns: Sequence[Column]
+    stmt: Any
+    keys: Sequence[Any]
+    descending: bool = False
+    nullable: bool = False
+
 
 class ExportTask:
-    def __init__(self, task_id: str, file_path: str):
+    def __init__(self, task_id: str, base_path: str, fmt: str = "xlsx"):
         self.task_id = task_id
-        self.file_path = file_path
+        self.base_path = base_path
+        # 扩展名取决于格式和工作表数量，开始导出时确定
+        self.file_path = f"{base_path}.{fmt}"
+        self.format = fmt
         self.status = "pending"
-        self.progress = 0
         self.error = None
+        self.total_rows = 0
         self.created_at = datetime.utcnow()
+        # 与写入进程共享的已写入行数，其他工作进程中为Redis中保存的值
+        self._written = None
+        self._rows_written = 0
+
+    @property
+    def rows_written(self) -> int:
+        if self._written is not None:
+            return self._written.value
+        return self._rows_written
+
+    @property
+    def progress(self) -> int:
+        if self.status == "completed":
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, self.rows_written * 100 // self.total_rows)
+
+    def to_dict(self) -> Dict[str, str]:
+        """保存到Redis哈希中的字段"""
+        return {
+            "task_id": self.task_id,
+            "base_path": self.base_path,
+            "file_path": self.file_path,
+            "format": self.format,
+            "status": self.status,
+            "error": self.error or "",
+            "total_rows": str(self.total_rows),
+            "rows_written": str(self.rows_written),
+            "created_at": self.created_at.isoformat(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, str]) -> "ExportTask":
+        task = cls(data["task_id"], data["base_path"], data["format"])
+        task.file_path = data["file_path"]
+        task.status = data["status"]
+        task.error = data["error"] or None
+        task.total_rows = int(data["total_rows"])
+        task._rows_written = int(data["rows_written"])
+        task.created_at = datetime.fromisoformat(data["created_at"])
+        return task
 
 
 class ExportManager:
     def __init__(self):
+        # 本进程运行的任务
         self.tasks: Dict[str, ExportTask] = {}
         self.chunk_size = 1000  # 每次处理的记录数
+        # 队列中最多缓存的块数，写入跟不上时读取等待
+        self.queue_chunks = 4
         self.export_dir = "temp/exports"
         self.cleanup_interval = 6 * 3600  # 6小时清理一次
+        self.task_ttl = 6 * 3600  # 任务状态在Redis中的保留时间
+        # 写入进程只导入export_writer，用spawn避免复制API进程的状态
+        self._mp = multiprocessing.get_context("spawn")
 
         # 确保导出目录存在
         os.makedirs(self.export_dir, exist_ok=True)
@@ -32,133 +127,309 @@ class ExportManager:
         # 启动清理任务
         asyncio.create_task(self._cleanup_loop())
 
-    async def create_export_task(self, task_id: str) -> ExportTask:
+    async def create_export_task(
+        self, task_id: str, fmt: str = "xlsx", prefix: str = "export"
+    ) -> ExportTask:
         """创建导出任务"""
-        file_path = os.path.join(
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        base_path = os.path.join(
             self.export_dir,
-            f"export_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            f"{prefix}_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
         )
-        task = ExportTask(task_id, file_path)
+        task = ExportTask(task_id, base_path, fmt)
         self.tasks[task_id] = task
+        await self._save(task)
         return task
 
-    def get_task_status(self, task_id: str) -> Optional[ExportTask]:
-        """获取任务状态"""
-        return self.tasks.get(task_id)
+    async def get_task_status(self, task_id: str) -> Optional[ExportTask]:
+        """获取任务状态，任务由其他工作进程运行时从Redis读取"""
+        task = self.tasks.get(task_id)
+        if task is not None or cache_manager.redis is None:
+            return task
+        data = await cache_manager.redis.hgetall(TASK_KEY.format(task_id))
+        return ExportTask.from_dict(data) if data else None
+
+    async def _save(self, task: ExportTask) -> None:
+        """把任务状态写入Redis，失败时只记录日志"""
+        if cache_manager.redis is None:
+            return
+        key = TASK_KEY.format(task.task_id)
+        try:
+            await cache_manager.redis.hset(key, mapping=task.to_dict())
+            await cache_manager.redis.expire(key, self.task_ttl)
+        except Exception as e:
+            logger.error(f"Error saving export task {task.task_id}: {e}")
+
+    async def export_device_stats(self, device_id: int, task: ExportTask):
+        """导出设备统计数据"""
+        await self.run_export(task, self.device_stats_sheets(device_id))
 
-    async def export_device_stats(
+    async def export_organization_stats(
         self,
-        db: Session,
-        device_id: int,
+        org_path: str,
         task: ExportTask,
-        template_path: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
     ):
-        """导出设备统计数据"""
-        try:
-            task.status = "processing"
+        """导出组织(包含所有下级组织)的设备使用统计"""
+        await self.run_export(task, self.organization_sheets(org_path, start, end))
 
-            # 使用模板文件(如果有)
-            writer = pd.ExcelWriter(
-                task.file_path,
-                engine="xlsxwriter",
-                engine_kwargs={"options": {"constant_memory": True}},
-            )
-
-            # 分块处理统计数据
-            usage_stats = []
-            offset = 0
-            while True:
-                stats_chunk = await self._get_stats_chunk(
-                    db, device_id, offset, self.chunk_size
+    def device_stats_sheets(self, device_id: int) -> List[ExportSheet]:
+        """设备统计导出的工作表"""
+        return [
+            ExportSheet(
+                "使用统计",
+                [
+                    ("用户", str),
+                    ("总使用时长(小时)", float),
+                    ("连接次数", int),
+                    ("失败次数", int),
+                    ("最后连接时间", datetime),
+                    ("最后断开时间", datetime),
+                ],
+                select(
+                    User.username,
+                    DeviceUsageStats.total_usage_time,
+                    DeviceUsageStats.connection_count,
+                    DeviceUsageStats.failed_connection_count,
+                    DeviceUsageStats.last_connected,
+                    DeviceUsageStats.last_disconnected,
+                )
+                .outerjoin(User, User.id == DeviceUsageStats.user_id)
+                .where(DeviceUsageStats.device_id == device_id),
+                keys=(DeviceUsageStats.updated_at, DeviceUsageStats.id),
+                descending=True,
+                nullable=True,
+            ),
+            ExportSheet(
+                "连接记录",
+                [
+                    ("用户", str),
+                    ("操作", str),
+                    ("状态", str),
+                    ("错误信息", str),
+                    ("时间", datetime),
+                ],
+                select(
+                    User.username,
+                    DeviceUsageLog.action,
+                    DeviceUsageLog.status,
+                    DeviceUsageLog.error_message,
+                    DeviceUsageLog.created_at,
                 )
-                if not stats_chunk:
-                    break
+                .outerjoin(User, User.id == DeviceUsageLog.user_id)
+                .where(DeviceUsageLog.device_id == device_id),
+                keys=(DeviceUsageLog.created_at, DeviceUsageLog.id),
+                descending=True,
+                nullable=True,
+            ),
+        ]
 
-                usage_stats.extend(stats_chunk)
-                offset += self.chunk_size
-                task.progress = min(90, int(task.progress + 10))
+    def organization_sheets(
+        self,
+        org_path: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[ExportSheet]:
+        """组织统计导出的工作表，范围为org_path下的整棵子树"""
+        in_subtree = Organization.subtree_clause(org_path)
+        totals = (
+            func.sum(DeviceUsageStats.total_usage_time),
+            func.sum(DeviceUsageStats.connection_count),
+            func.sum(DeviceUsageStats.failed_connection_count),
+        )
+        total_columns = [
+            ("总使用时长(小时)", float),
+            ("连接次数", int),
+            ("失败次数", int),
+        ]
 
-            # 写入统计数据
-            pd.DataFrame(usage_stats).to_excel(
-                writer, sheet_name="使用统计", index=False
+        logs = (
+            select(
+                DeviceUsageLog.created_at,
+                DeviceUsageLog.device_id,
+                User.username,
+                DeviceUsageLog.action,
+                DeviceUsageLog.status,
+                DeviceUsageLog.error_message,
             )
+            .join(Organization, DeviceUsageLog.organization_id == Organization.id)
+            .outerjoin(User, User.id == DeviceUsageLog.user_id)
+            .where(in_subtree)
+        )
+        if start:
+            logs = logs.where(DeviceUsageLog.created_at >= start)
+        if end:
+            logs = logs.where(DeviceUsageLog.created_at < end)
 
-            # 分块处理日志数据
-            connection_logs = []
-            offset = 0
-            while True:
-                logs_chunk = await self._get_logs_chunk(
-                    db, device_id, offset, self.chunk_size
-                )
-                if not logs_chunk:
-                    break
+        return [
+            ExportSheet(
+                "设备统计",
+                [("设备ID", int), ("设备名称", str), *total_columns],
+                select(DeviceUsageStats.device_id, Device.name, *totals)
+                .join(Organization, DeviceUsageStats.organization_id == Organization.id)
+                .outerjoin(Device, Device.id == DeviceUsageStats.device_id)
+                .where(in_subtree)
+                .group_by(DeviceUsageStats.device_id, Device.name),
+                # 没有关联设备的统计汇总为一行
+                keys=(DeviceUsageStats.device_id,),
+                nullable=True,
+            ),
+            ExportSheet(
+                "用户统计",
+                [("用户ID", int), ("用户名", str), *total_columns],
+                select(DeviceUsageStats.user_id, User.username, *totals)
+                .join(Organization, DeviceUsageStats.organization_id == Organization.id)
+                .outerjoin(User, User.id == DeviceUsageStats.user_id)
+                .where(in_subtree)
+                .group_by(DeviceUsageStats.user_id, User.username),
+                keys=(DeviceUsageStats.user_id,),
+                nullable=True,
+            ),
+            ExportSheet(
+                "连接记录",
+                [
+                    ("时间", datetime),
+                    ("设备ID", int),
+                    ("用户", str),
+                    ("操作", str),
+                    ("状态", str),
+                    ("错误信息", str),
+                ],
+                logs,
+                keys=(DeviceUsageLog.created_at, DeviceUsageLog.id),
+                nullable=True,
+            ),
+        ]
+
+    async def run_export(self, task: ExportTask, sheets: Sequence[ExportSheet]):
+        """运行导出任务
 
-                connection_logs.extend(logs_chunk)
-                offset += self.chunk_size
-                task.progress = min(99, int(task.progress + 5))
+        先统计总行数，再逐块读取并交给写入进程；写入进程失败或退出时任务失败，
+        残留文件被删除。
+        """
+        loop = asyncio.get_running_loop()
+        chunks = self._mp.Queue(self.queue_chunks)
+        errors = self._mp.Queue()
+        process = None
+        try:
+            task.status = "processing"
+            suffix = file_suffix(task.format, len(sheets))
+            task.file_path = f"{task.base_path}.{suffix}"
+            task.total_rows = await self._count_rows(sheets)
+            task._written = self._mp.Value("q", 0)
+            await self._save(task)
 
-            # 写入日志数据
-            pd.DataFrame(connection_logs).to_excel(
-                writer, sheet_name="连接记录", index=False
+            process = self._mp.Process(
+                target=run_writer,
+                args=(
+                    task.format,
+                    task.file_path,
+                    [(sheet.name, list(sheet.columns)) for sheet in sheets],
+                    chunks,
+                    task._written,
+                    errors,
+                ),
+                daemon=True,
             )
+            process.start()
 
-            writer.close()
+            for index, sheet in enumerate(sheets):
+                async for rows in self._iter_chunks(sheet):
+                    await loop.run_in_executor(
+                        None, self._put, chunks, (index, rows), process
+                    )
+                    await self._save(task)
+            await loop.run_in_executor(None, self._put, chunks, None, process)
+            await loop.run_in_executor(None, process.join)
+
+            if process.exitcode != 0:
+                try:
+                    error = errors.get(timeout=1)
+                except queue_module.Empty:
+                    error = f"writer exited with code {process.exitcode}"
+                raise RuntimeError(error)
             task.status = "completed"
-            task.progress = 100
 
         except Exception as e:
             logger.error(f"Export error: {e}")
             task.status = "failed"
             task.error = str(e)
+        finally:
+            await self._save(task)
+            if task.status != "completed":
+                if process is not None and process.is_alive():
+                    process.terminate()
+                # 写入进程不再读取，丢弃队列中剩余的数据，否则进程退出时会等待
+                chunks.cancel_join_thread()
+                self._remove_file(task.file_path)
+            chunks.close()
+            errors.close()
 
-    async def _get_stats_chunk(
-        self, db: Session, device_id: int, offset: int, limit: int
-    ) -> list:
-        """分块获取统计数据"""
-        stats = (
-            db.query(DeviceUsageStats)
-            .filter_by(device_id=device_id)
-            .order_by(DeviceUsageStats.updated_at.desc())
-            .offset(offset)
-            .limit(limit)
-            .all()
-        )
+    def _put(self, chunks, item, process) -> None:
+        """放入有界队列，写入进程退出时不再等待"""
+        while True:
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue_module.Full:
+                if not process.is_alive():
+                    raise RuntimeError("Export writer exited unexpectedly")
 
-        return [
-            {
-                "用户": stat.user.username,
-                "总使用时长(小时)": round(stat.total_usage_time, 2),
-                "连接次数": stat.connection_count,
-                "失败次数": stat.failed_connection_count,
-                "最后连接时间": stat.last_connected,
-                "最后断开时间": stat.last_disconnected,
-            }
-            for stat in stats
-        ]
+    async def _count_rows(self, sheets: Sequence[ExportSheet]) -> int:
+        """统计各工作表的总行数"""
+        total = 0
+        async with async_session_maker() as session:
+            for sheet in sheets:
+                total += await session.scalar(
+                    select(func.count()).select_from(sheet.stmt.subquery())
+                )
+        return total
 
-    async def _get_logs_chunk(
-        self, db: Session, device_id: int, offset: int, limit: int
-    ) -> list:
-        """分块获取日志数据"""
-        logs = (
-            db.query(DeviceUsageLog)
-            .filter_by(device_id=device_id)
-            .order_by(DeviceUsageLog.created_at.desc())
-            .offset(offset)
-            .limit(limit)
-            .all()
-        )
+    async def _iter_chunks(self, sheet: ExportSheet) -> AsyncIterator[List[Tuple]]:
+        """按排序键分块读取，第一列可为NULL时为NULL的行在最后读取"""
+        passes = [(sheet.stmt, sheet.keys)]
+        if sheet.nullable:
+            head = sheet.keys[0]
+            passes = [
+                (sheet.stmt.where(head.is_not(None)), sheet.keys),
+                (sheet.stmt.where(head.is_(None)), sheet.keys[1:]),
+            ]
+        for stmt, keys in passes:
+            async for rows in self._seek_chunks(sheet, stmt, keys):
+                yield rows
 
-        return [
-            {
-                "用户": log.user.username,
-                "操作": log.action,
-                "状态": log.status,
-                "错误信息": log.error_message,
-                "时间": log.created_at,
-            }
-            for log in logs
-        ]
+    async def _seek_chunks(
+        self, sheet: ExportSheet, stmt, keys: Sequence[Any]
+    ) -> AsyncIterator[List[Tuple]]:
+        """按keys分块读取stmt
+
+        每块是一次独立的短查询，不在整个导出期间占用连接和事务。没有排序键时
+        (按单个可为空的列分组后为NULL的一组)只有一行，一次读取。
+        """
+        width = len(sheet.columns)
+        stmt = stmt.add_columns(*keys)
+        last = None
+        while True:
+            query = seek(stmt, keys, last, sheet.descending)
+            if keys:
+                query = query.limit(self.chunk_size)
+            async with async_session_maker() as session:
+                rows = (await session.execute(query)).all()
+            if not rows:
+                return
+            yield [tuple(row[:width]) for row in rows]
+            if not keys or len(rows) < self.chunk_size:
+                return
+            last = tuple(rows[-1][width:])
+
+    def _remove_file(self, file_path: str):
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception as e:
+            logger.error(f"Error removing file {file_path}: {e}")
 
     async def _cleanup_loop(self):
         """定期清理过期文件"""
@@ -183,11 +454,7 @@ class ExportManager:
 
         for task_id in expired_tasks:
             task = self.tasks.pop(task_id)
-            try:
-                if os.path.exists(task.file_path):
-                    os.remove(task.file_path)
-            except Exception as e:
-                logger.error(f"Error removing file {task.file_path}: {e}")
+            self._remove_file(task.file_path)
 
         # 清理遗留文件
         for filename in os.listdir(self.export_dir):
@@ -0,0 +1,244 @@
+"""导出文件的增量写入
+
+在独立的工作进程中运行，只依赖标准库和所选格式的写入库(xlsxwriter/pyarrow)，
+不导入数据库和Web相关模块。数据按块从队列中读取并立即写入文件，内存占用与
+导出总行数无关。
+"""
+
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+# 列定义: (表头, 类型)，类型为 str/int/float/datetime
+Column = Tuple[str, type]
+# 工作表定义: (名称, 列定义)
+Sheet = Tuple[str, Sequence[Column]]
+
+FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def file_suffix(fmt: str, sheet_count: int) -> str:
+    """导出文件的扩展名，CSV/Parquet有多个工作表时每个表一个文件打包为zip"""
+    if fmt != "xlsx" and sheet_count > 1:
+        return "zip"
+    return fmt
+
+
+def media_type(path: str) -> str:
+    suffix = os.path.splitext(path)[1].lstrip(".")
+    return FORMATS.get(suffix, "application/zip")
+
+
+class ExportWriter:
+    """增量写入器基类，工作表按顺序写入"""
+
+    def __init__(self, path: str, sheets: Sequence[Sheet]):
+        self.path = path
+        self.sheets = list(sheets)
+        self.current: Optional[int] = None
+
+    def write(self, sheet: int, rows: List[Sequence[Any]]) -> int:
+        """写入一块数据，返回实际写入的行数"""
+        if sheet != self.current:
+            if self.current is not None:
+                self.end_sheet()
+            self.current = sheet
+            self.start_sheet(*self.sheets[sheet])
+        return self.write_rows(rows)
+
+    def close(self) -> None:
+        # 没有数据的工作表也输出表头
+        start = 0 if self.current is None else self.current + 1
+        if self.current is not None:
+            self.end_sheet()
+        for index in range(start, len(self.sheets)):
+            self.current = index
+            self.start_sheet(*self.sheets[index])
+            self.end_sheet()
+        self.finish()
+
+    def start_sheet(self, name: str, columns: Sequence[Column]) -> None:
+        raise NotImplementedError
+
+    def write_rows(self, rows: List[Sequence[Any]]) -> int:
+        raise NotImplementedError
+
+    def end_sheet(self) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+class _ArchiveWriter(ExportWriter):
+    """每个工作表一个文件，多个工作表时写入zip"""
+
+    extension = ""
+
+    def __init__(self, path: str, sheets: Sequence[Sheet]):
+        super().__init__(path, sheets)
+        self._archive = (
+            zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+            if len(self.sheets) > 1
+            else None
+        )
+        self._stream = None
+
+    def _open(self, name: str):
+        if self._archive is None:
+            self._stream = open(self.path, "wb")
+        else:
+            self._stream = self._archive.open(f"{name}.{self.extension}", "w")
+        return self._stream
+
+    def end_sheet(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def finish(self) -> None:
+        if self._archive is not None:
+            self._archive.close()
+
+
+class CsvWriter(_ArchiveWriter):
+    """CSV，带BOM以便Excel识别中文"""
+
+    extension = "csv"
+
+    def start_sheet(self, name: str, columns: Sequence[Column]) -> None:
+        self._text = io.TextIOWrapper(
+            self._open(name), encoding="utf-8-sig", newline=""
+        )
+        self._csv = csv.writer(self._text)
+        self._csv.writerow([header for header, _ in columns])
+
+    def write_rows(self, rows: List[Sequence[Any]]) -> int:
+        self._csv.writerows(rows)
+        return len(rows)
+
+    def end_sheet(self) -> None:
+        self._text.flush()
+        self._text.detach()
+        super().end_sheet()
+
+
+class ParquetWriter(_ArchiveWriter):
+    """Parquet，每块数据写为一个行组"""
+
+    extension = "parquet"
+
+    def __init__(self, path: str, sheets: Sequence[Sheet]):
+        import pyarrow as pa
+
+        super().__init__(path, sheets)
+        self._pa = pa
+        self._types = {
+            str: pa.string(),
+            int: pa.int64(),
+            float: pa.float64(),
+            datetime: pa.timestamp("us"),
+        }
+
+    def start_sheet(self, name: str, columns: Sequence[Column]) -> None:
+        import pyarrow.parquet as pq
+
+        self._schema = self._pa.schema(
+            [(header, self._types[kind]) for header, kind in columns]
+        )
+        self._parquet = pq.ParquetWriter(self._open(name), self._schema)
+
+    def write_rows(self, rows: List[Sequence[Any]]) -> int:
+        arrays = [
+            self._pa.array([row[i] for row in rows], type=field.type)
+            for i, field in enumerate(self._schema)
+        ]
+        self._parquet.write_table(
+            self._pa.Table.from_arrays(arrays, schema=self._schema)
+        )
+        return len(rows)
+
+    def end_sheet(self) -> None:
+        self._parquet.close()
+        super().end_sheet()
+
+
+class XlsxWriter(ExportWriter):
+    """xlsx，constant_memory模式下每行写完即刷到临时文件
+
+    工作表写满后在续表("连接记录 (2)")中继续写入，续表同样带表头。
+    """
+
+    # xlsx每个工作表的最大行数(含表头)
+    MAX_ROWS = 1048576
+
+    def __init__(self, path: str, sheets: Sequence[Sheet]):
+        import xlsxwriter
+
+        super().__init__(path, sheets)
+        self._workbook = xlsxwriter.Workbook(
+            path,
+            {
+                "constant_memory": True,
+                "default_date_format": "yyyy-mm-dd hh:mm:ss",
+                "remove_timezone": True,
+            },
+        )
+
+    def start_sheet(self, name: str, columns: Sequence[Column]) -> None:
+        self._name = name
+        self._headers = [header for header, _ in columns]
+        self._part = 1
+        self._add_sheet(name)
+
+    def _add_sheet(self, name: str) -> None:
+        self._sheet = self._workbook.add_worksheet(name)
+        self._sheet.write_row(0, 0, self._headers)
+        self._row = 1
+
+    def write_rows(self, rows: List[Sequence[Any]]) -> int:
+        for row in rows:
+            if self._row >= self.MAX_ROWS:
+                self._part += 1
+                self._add_sheet(f"{self._name} ({self._part})")
+            if self._sheet.write_row(self._row, 0, row) == -1:
+                raise ValueError(
+                    f"Row {self._row} out of range in sheet {self._sheet.name}"
+                )
+            self._row += 1
+        return len(rows)
+
+    def finish(self) -> None:
+        self._workbook.close()
+
+
+WRITERS = {"xlsx": XlsxWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+def run_writer(fmt: str, path: str, sheets: Sequence[Sheet], queue, written, errors):
+    """工作进程入口
+
+    从queue读取 (工作表序号, 行列表)，读到None时关闭文件；每写完一块把实际
+    写入的行数累加到共享计数written，失败时把错误信息放入errors。
+    """
+    try:
+        writer = WRITERS[fmt](path, sheets)
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            sheet, rows = item
+            count = writer.write(sheet, rows)
+            with written.get_lock():
+                written.value += count
+        writer.close()
+    except BaseException as e:
+        errors.put(f"{type(e).__name__}: {e}")
+        raise
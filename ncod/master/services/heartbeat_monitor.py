@@ -1,24 +1,74 @@
 import asyncio
-from datetime import datetime
-from typing import Dict, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import update
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
 
 from ncod.master.models.heartbeat import HeartbeatRecord
 from ncod.master.core.config import settings
+from ncod.master.core.database import async_session
 from ncod.master.core.logger import logger
 
 
+@dataclass
+class HeartbeatState:
+    """内存中的从服务器心跳状态"""
+
+    slave_id: str
+    last_beat_time: datetime
+    ip_address: Optional[str] = None
+    status: str = "online"
+    is_active: bool = True
+    retry_count: int = 0
+    dirty: bool = False
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _aware(value: datetime) -> datetime:
+    """心跳时间统一为带时区的UTC时间，不带时区的按UTC处理"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def upsert_statement(dialect_name: str):
+    """按slave_id插入或更新心跳记录的语句，新注册的从服务器直接插入"""
+    dialect = sqlite if dialect_name == "sqlite" else postgresql
+    stmt = dialect.insert(HeartbeatRecord)
+    return stmt.on_conflict_do_update(
+        index_elements=[HeartbeatRecord.slave_id],
+        set_={
+            "last_beat_time": stmt.excluded.last_beat_time,
+            "status": stmt.excluded.status,
+            "is_active": stmt.excluded.is_active,
+            "retry_count": stmt.excluded.retry_count,
+            "ip_address": func.coalesce(
+                stmt.excluded.ip_address, HeartbeatRecord.ip_address
+            ),
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
 class HeartbeatMonitor:
-    """心跳监控服务"""
+    """心跳监控服务
+
+    心跳只更新内存表，由后台任务每个刷新周期用一条批量upsert写回数据库；
+    失联检测同样基于内存表进行，不再逐条查询和更新心跳记录。时间一律使用
+    带时区的UTC时间，与last_beat_time列(timezone=True)一致。
+    """
 
     def __init__(self):
         self.heartbeat_timeout = settings.HEARTBEAT_TIMEOUT
         self.retry_limit = settings.HEARTBEAT_RETRY_LIMIT
+        self.flush_interval = settings.HEARTBEAT_FLUSH_INTERVAL
         self._running = False
         self._tasks = {}
+        self._states: Dict[str, HeartbeatState] = {}
 
     async def start(self):
         """启动心跳监控"""
@@ -26,7 +76,12 @@ class HeartbeatMonitor:
             return
         self._running = True
         logger.info("Starting heartbeat monitor service")
-        asyncio.create_task(self._monitor_loop())
+        try:
+            await self._load_states()
+        except Exception as e:
+            logger.error(f"Error loading heartbeat records: {e}")
+        self._tasks["monitor"] = asyncio.create_task(self._monitor_loop())
+        self._tasks["flush"] = asyncio.create_task(self._flush_loop())
 
     async def stop(self):
         """停止心跳监控"""
@@ -36,6 +91,23 @@ class HeartbeatMonitor:
         logger.info("Stopping heartbeat monitor service")
         for task in self._tasks.values():
             task.cancel()
+        self._tasks.clear()
+        # 停止前把未落库的心跳写回
+        await self.flush()
+
+    async def _load_states(self):
+        """启动时从数据库加载心跳记录到内存表"""
+        async with async_session() as session:
+            result = await session.execute(select(HeartbeatRecord))
+            for record in result.scalars().all():
+                self._states[record.slave_id] = HeartbeatState(
+                    slave_id=record.slave_id,
+                    last_beat_time=_aware(record.last_beat_time),
+                    ip_address=record.ip_address,
+                    status=record.status,
+                    is_active=record.is_active,
+                    retry_count=record.retry_count or 0,
+                )
 
     async def _monitor_loop(self):
         """心跳监控主循环"""
@@ -46,54 +118,95 @@ class HeartbeatMonitor:
                 logger.error(f"Error in heartbeat monitor loop: {e}")
             await asyncio.sleep(self.heartbeat_timeout)
 
+    async def _flush_loop(self):
+        """定期批量写回心跳"""
+        while self._running:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing heartbeats: {e}")
+
     async def _check_heartbeats(self):
-        """检查所有心跳记录"""
-        async with AsyncSession() as session:
-            stmt = select(HeartbeatRecord).where(
-                HeartbeatRecord.last_heartbeat
-                < datetime.utcnow() - asyncio.timedelta(seconds=self.heartbeat_timeout)
+        """基于内存表检查失联的从服务器"""
+        deadline = _utcnow() - timedelta(seconds=self.heartbeat_timeout)
+        for state in self._states.values():
+            if not state.is_active or state.last_beat_time >= deadline:
+                continue
+            if state.retry_count >= self.retry_limit:
+                self._handle_failed_heartbeat(state)
+            else:
+                state.retry_count += 1
+                state.dirty = True
+
+    def _handle_failed_heartbeat(self, state: HeartbeatState):
+        """处理心跳失败的从服务器"""
+        logger.warning(f"Heartbeat failed for slave {state.slave_id}")
+        state.is_active = False
+        state.status = "offline"
+        state.retry_count = 0
+        state.dirty = True
+
+    async def update_heartbeat(self, slave_id: str, ip_address: Optional[str] = None):
+        """更新心跳时间(只写内存，由刷新任务批量落库)"""
+        state = self._states.get(slave_id)
+        now = _utcnow()
+        if state is None:
+            state = self._states[slave_id] = HeartbeatState(
+                slave_id=slave_id, last_beat_time=now
             )
-            result = await session.execute(stmt)
-            stale_records = result.scalars().all()
-
-            for record in stale_records:
-                if record.retry_count >= self.retry_limit:
-                    await self._handle_failed_heartbeat(session, record)
-                else:
-                    await self._increment_retry_count(session, record)
-
-            await session.commit()
-
-    async def _handle_failed_heartbeat(
-        self, session: AsyncSession, record: HeartbeatRecord
-    ):
-        """处理心跳失败的记录"""
-        logger.warning(f"Heartbeat failed for slave {record.slave_id}")
-        stmt = (
-            update(HeartbeatRecord)
-            .where(HeartbeatRecord.id == record.id)
-            .values(is_alive=False, retry_count=0)
-        )
-        await session.execute(stmt)
-
-    async def _increment_retry_count(
-        self, session: AsyncSession, record: HeartbeatRecord
-    ):
-        """增加重试次数"""
-        stmt = (
-            update(HeartbeatRecord)
-            .where(HeartbeatRecord.id == record.id)
-            .values(retry_count=record.retry_count + 1)
-        )
-        await session.execute(stmt)
-
-    async def update_heartbeat(self, slave_id: int):
-        """更新心跳时间"""
-        async with AsyncSession() as session:
-            stmt = (
-                update(HeartbeatRecord)
-                .where(HeartbeatRecord.slave_id == slave_id)
-                .values(last_heartbeat=datetime.utcnow(), retry_count=0, is_alive=True)
+        state.last_beat_time = now
+        state.status = "online"
+        state.is_active = True
+        state.retry_count = 0
+        if ip_address:
+            state.ip_address = ip_address
+        state.dirty = True
+
+    async def flush(self) -> int:
+        """把有变化的心跳状态用一条批量upsert写回数据库"""
+        dirty = [state for state in self._states.values() if state.dirty]
+        if not dirty:
+            return 0
+
+        now = _utcnow()
+        params: List[Dict] = []
+        for state in dirty:
+            state.dirty = False
+            params.append(
+                {
+                    "slave_id": state.slave_id,
+                    "last_beat_time": state.last_beat_time,
+                    "status": state.status,
+                    "is_active": state.is_active,
+                    "retry_count": state.retry_count,
+                    "ip_address": state.ip_address,
+                    "created_at": now,
+                    "updated_at": now,
+                }
             )
-            await session.execute(stmt)
-            await session.commit()
+
+        try:
+            async with async_session() as session:
+                # 走Core层executemany，而不是ORM逐条合并
+                connection = await session.connection()
+                stmt = upsert_statement(connection.dialect.name)
+                await connection.execute(stmt, params)
+                await session.commit()
+        except Exception:
+            # 写回失败时保留脏标记，下个周期重试
+            for state in dirty:
+                state.dirty = True
+            raise
+        return len(params)
+
+    def is_alive(self, slave_id: str) -> bool:
+        """从服务器是否在线"""
+        state = self._states.get(slave_id)
+        return state is not None and state.is_active
+
+    def get_offline_slaves(self) -> List[str]:
+        """获取已失联的从服务器"""
+        return [
+            state.slave_id for state in self._states.values() if not state.is_active
+        ]
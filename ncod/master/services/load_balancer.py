@@ -68,10 +68,19 @@ class LoadBalancer:
                 result = await session.execute(select(Device))
                 devices = result.scalars().all()
 
-                for device in devices:
-                    # 获取设备负载信息
-                    load = await self._get_device_load(device)
-                    self._device_loads[device.id] = load
+            # 一次MGET读取全部缓存,未命中的设备统一计算后一次写回
+            keys = {device.id: f"device_load:{device.id}" for device in devices}
+            cached = await redis_cache.get_many(keys.values())
+            missing: Dict[str, float] = {}
+            for device in devices:
+                load = cached.get(keys[device.id])
+                if load is None:
+                    load = self._calculate_device_load(device)
+                    missing[keys[device.id]] = load
+                self._device_loads[device.id] = float(load)
+
+            if missing:
+                await redis_cache.set_many(missing, expire=settings.LOAD_CACHE_TTL)
 
         except Exception as e:
             logger.error(f"更新设备负载失败: {e}")
@@ -93,15 +102,7 @@ class LoadBalancer:
             if load is not None:
                 return float(load)
 
-            # 计算设备负载
-            # TODO: 实现具体的负载计算逻辑
-            # 可以考虑:
-            # 1. CPU使用率
-            # 2. 内存使用率
-            # 3. 网络带宽使用率
-            # 4. 当前连接数
-            # 5. 响应时间
-            load = 0.0
+            load = self._calculate_device_load(device)
 
             # 缓存设备负载
             await redis_cache.set(cache_key, load, expire=settings.LOAD_CACHE_TTL)
@@ -112,6 +113,24 @@ class LoadBalancer:
             logger.error(f"获取设备负载失败: {e}")
             return 1.0  # 出错时返回最大负载
 
+    def _calculate_device_load(self, device: Device) -> float:
+        """计算设备负载
+
+        Args:
+            device: 设备实例
+
+        Returns:
+            float: 设备负载(0-1)
+        """
+        # TODO: 实现具体的负载计算逻辑
+        # 可以考虑:
+        # 1. CPU使用率
+        # 2. 内存使用率
+        # 3. 网络带宽使用率
+        # 4. 当前连接数
+        # 5. 响应时间
+        return 0.0
+
     async def _calculate_device_scores(self):
         """计算设备评分"""
         try:
@@ -1,18 +1,148 @@
 """组织服务"""
 
-from typing import Dict, List, Optional, Tuple
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, select
 from ncod.core.logger import setup_logger
 from ncod.core.db.transaction import transaction_manager
+from ncod.master.models.device import Device
 from ncod.master.models.organization import Organization
+from ncod.master.models.user import User, user_organizations
 
 logger = setup_logger("organization_service")
 
 
+class OrganizationTree:
+    """组织树快照
+
+    由一次全表查询构建，子树、祖先判定都在内存中完成。路径尚未回填的组织
+    按parent_id推导路径和层级，父组织不存在的作为根组织，成环的组织被忽略。
+    """
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        self.nodes: Dict[int, Dict[str, Any]] = {}
+        self.children: Dict[Optional[int], List[int]] = {}
+        rows_by_id = {row["id"]: dict(row) for row in rows}
+        for row in rows_by_id.values():
+            if not row.get("path") and self._fill_path(rows_by_id, row) is None:
+                logger.warning(f"Organization {row['id']} has a parent cycle")
+        # 按路径排序保证父节点先于子节点，同级按ID顺序
+        for row in sorted(
+            (row for row in rows_by_id.values() if row.get("path")),
+            key=lambda r: Organization.path_ids(r["path"]),
+        ):
+            # 父组织以路径为准，父组织不存在的组织路径从根开始
+            ids = Organization.path_ids(row["path"])
+            parent_id = ids[-2] if len(ids) > 1 else None
+            self.nodes[row["id"]] = row
+            self.children.setdefault(parent_id, []).append(row["id"])
+
+    @staticmethod
+    def _fill_path(
+        rows: Dict[int, Dict[str, Any]], row: Dict[str, Any]
+    ) -> Optional[str]:
+        """沿parent_id向上找到有路径的祖先或根组织，补齐途经组织的路径"""
+        chain, seen, node = [], set(), row
+        while node is not None and not node.get("path"):
+            if node["id"] in seen:
+                return None
+            seen.add(node["id"])
+            chain.append(node)
+            node = rows.get(node.get("parent_id"))
+        path = node["path"] if node is not None else "/"
+        for item in reversed(chain):
+            path = f"{path}{item['id']}/"
+            item["path"] = path
+            item["level"] = len(Organization.path_ids(path)) - 1
+        return row["path"]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, org_id: int) -> bool:
+        return org_id in self.nodes
+
+    def get(self, org_id: int) -> Optional[Dict[str, Any]]:
+        return self.nodes.get(org_id)
+
+    def path(self, org_id: int) -> Optional[str]:
+        node = self.nodes.get(org_id)
+        return node["path"] if node else None
+
+    def subtree_ids(self, org_id: int) -> List[int]:
+        """子树中的组织ID(包含自身)"""
+        if org_id not in self.nodes:
+            return []
+        ids, stack = [], [org_id]
+        while stack:
+            current = stack.pop()
+            ids.append(current)
+            stack.extend(reversed(self.children.get(current, ())))
+        return ids
+
+    def ancestor_ids(self, org_id: int) -> List[int]:
+        """由根到父组织的ID"""
+        path = self.path(org_id)
+        return Organization.path_ids(path)[:-1] if path else []
+
+    def is_within(self, org_id: int, ancestor_id: int) -> bool:
+        """org_id是否为ancestor_id自身或其子孙"""
+        path, prefix = self.path(org_id), self.path(ancestor_id)
+        return path is not None and prefix is not None and path.startswith(prefix)
+
+    def to_tree(self, org_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """嵌套结构，org_id为空时返回所有根组织"""
+        if org_id is None:
+            roots = self.children.get(None, [])
+        else:
+            roots = [org_id] if org_id in self.nodes else []
+        return [self._node(root) for root in roots]
+
+    def _node(self, org_id: int) -> Dict[str, Any]:
+        node = dict(self.nodes[org_id])
+        children = self.children.get(org_id)
+        if children:
+            node["children"] = [self._node(child) for child in children]
+        return node
+
+
 class OrganizationService:
-    """组织服务"""
+    """组织服务
+
+    组织层级以物化路径存储，子树内的设备、用户和统计都是一次按路径前缀的
+    索引查询。组织树在进程内缓存，本进程变更组织时立即失效，其它进程的
+    变更在TREE_TTL秒内生效。
+    """
+
+    TREE_TTL = 60
 
     def __init__(self):
         self.transaction = transaction_manager
+        self._tree: Optional[OrganizationTree] = None
+        self._tree_loaded_at = 0.0
+
+    def invalidate_tree(self) -> None:
+        self._tree = None
+
+    async def get_tree(self, refresh: bool = False) -> OrganizationTree:
+        """获取缓存的组织树"""
+        if (
+            refresh
+            or self._tree is None
+            or time.monotonic() - self._tree_loaded_at > self.TREE_TTL
+        ):
+            async with self.transaction.transaction() as session:
+                result = await session.execute(select(Organization))
+                tree = OrganizationTree(org.to_dict() for org in result.scalars().all())
+            self._tree, self._tree_loaded_at = tree, time.monotonic()
+        return self._tree
+
+    async def get_subtree_path(self, org_id: int) -> Optional[str]:
+        """子树的路径前缀，缓存中没有时重新加载一次"""
+        tree = await self.get_tree()
+        if org_id not in tree:
+            tree = await self.get_tree(refresh=True)
+        return tree.path(org_id)
 
     async def create_organization(
         self, data: Dict
@@ -25,7 +155,8 @@ class OrganizationService:
                     return False, "Organization code already exists", None
 
                 # 检查父组织
-                if "parent_id" in data:
+                parent = None
+                if data.get("parent_id"):
                     parent = await session.get(Organization, data["parent_id"])
                     if not parent:
                         return False, "Parent organization not found", None
@@ -35,20 +166,24 @@ class OrganizationService:
                     name=data["name"],
                     code=data["code"],
                     description=data.get("description"),
-                    parent_id=data.get("parent_id"),
+                    path="",
                 )
 
                 session.add(org)
+                # 路径中包含自身ID，先插入分配ID再设置路径
+                await session.flush()
+                org.attach(parent)
                 await session.commit()
                 await session.refresh(org)
 
+                self.invalidate_tree()
                 return True, "Organization created successfully", org
         except Exception as e:
             logger.error(f"Error creating organization: {e}")
             return False, str(e), None
 
     async def update_organization(
-        self, org_id: str, data: Dict
+        self, org_id: int, data: Dict
     ) -> Tuple[bool, str, Optional[Organization]]:
         """更新组织"""
         try:
@@ -60,7 +195,7 @@ class OrganizationService:
                 # 检查代码是否重复
                 if "code" in data:
                     existing = await Organization.get_by_code(session, data["code"])
-                    if existing and existing.id != org_id:
+                    if existing and existing.id != org.id:
                         return False, "Organization code already exists", None
                     org.code = data["code"]
 
@@ -69,25 +204,33 @@ class OrganizationService:
                 if "description" in data:
                     org.description = data["description"]
 
-                # 检查父组织
-                if "parent_id" in data:
-                    if data["parent_id"] == org_id:
-                        return False, "Cannot set self as parent", None
+                # 检查父组织，变更时整棵子树一起移动
+                if "parent_id" in data and data["parent_id"] != org.parent_id:
+                    parent = None
                     if data["parent_id"]:
+                        if data["parent_id"] == org.id:
+                            return False, "Cannot set self as parent", None
                         parent = await session.get(Organization, data["parent_id"])
                         if not parent:
                             return False, "Parent organization not found", None
-                    org.parent_id = data["parent_id"]
+                        if org.is_ancestor_of(parent):
+                            return (
+                                False,
+                                "Cannot move organization into its own subtree",
+                                None,
+                            )
+                    await Organization.move_subtree(session, org, parent)
 
                 await session.commit()
                 await session.refresh(org)
 
+                self.invalidate_tree()
                 return True, "Organization updated successfully", org
         except Exception as e:
             logger.error(f"Error updating organization: {e}")
             return False, str(e), None
 
-    async def delete_organization(self, org_id: str) -> Tuple[bool, str]:
+    async def delete_organization(self, org_id: int) -> Tuple[bool, str]:
         """删除组织"""
         try:
             async with self.transaction.transaction() as session:
@@ -96,19 +239,20 @@ class OrganizationService:
                     return False, "Organization not found"
 
                 # 检查是否有子组织
-                children = await Organization.get_children(session, org_id)
+                children = await Organization.get_children(session, org.id)
                 if children:
                     return False, "Cannot delete organization with children"
 
                 await session.delete(org)
                 await session.commit()
 
+                self.invalidate_tree()
                 return True, "Organization deleted successfully"
         except Exception as e:
             logger.error(f"Error deleting organization: {e}")
             return False, str(e)
 
-    async def get_organization(self, org_id: str) -> Optional[Dict]:
+    async def get_organization(self, org_id: int) -> Optional[Dict]:
         """获取组织"""
         try:
             async with self.transaction.transaction() as session:
@@ -118,7 +262,7 @@ class OrganizationService:
             logger.error(f"Error getting organization: {e}")
             return None
 
-    async def list_organizations(self, parent_id: Optional[str] = None) -> List[Dict]:
+    async def list_organizations(self, parent_id: Optional[int] = None) -> List[Dict]:
         """获取组织列表"""
         try:
             async with self.transaction.transaction() as session:
@@ -131,30 +275,129 @@ class OrganizationService:
             logger.error(f"Error listing organizations: {e}")
             return []
 
-    async def get_organization_tree(self, org_id: Optional[str] = None) -> List[Dict]:
+    async def get_organization_tree(self, org_id: Optional[int] = None) -> List[Dict]:
         """获取组织树"""
         try:
+            tree = await self.get_tree()
+            return tree.to_tree(int(org_id) if org_id else None)
+        except Exception as e:
+            logger.error(f"Error getting organization tree: {e}")
+            return []
+
+    async def get_subtree_ids(self, org_id: int) -> List[int]:
+        """获取组织及其所有子孙组织的ID"""
+        tree = await self.get_tree()
+        if org_id not in tree:
+            tree = await self.get_tree(refresh=True)
+        return tree.subtree_ids(org_id)
+
+    async def is_within(self, org_id: int, ancestor_id: Optional[int]) -> bool:
+        """org_id是否在ancestor_id的子树内(本部门及下级)"""
+        if ancestor_id is None:
+            return False
+        tree = await self.get_tree()
+        if org_id not in tree or ancestor_id not in tree:
+            tree = await self.get_tree(refresh=True)
+        return tree.is_within(org_id, ancestor_id)
+
+    async def user_within(self, user_id: str, org_id: int) -> bool:
+        """org_id是否在用户所属任一组织的子树内"""
+        async with self.transaction.transaction() as session:
+            result = await session.execute(
+                select(user_organizations.c.organization_id).where(
+                    user_organizations.c.user_id == user_id
+                )
+            )
+            user_orgs = [int(row[0]) for row in result.all()]
+        for user_org in user_orgs:
+            if await self.is_within(org_id, user_org):
+                return True
+        return False
+
+    async def get_subtree_devices(
+        self, org_id: int, status: Optional[str] = None
+    ) -> List[Dict]:
+        """获取子树内的所有设备"""
+        try:
+            path = await self.get_subtree_path(org_id)
+            if path is None:
+                return []
             async with self.transaction.transaction() as session:
-                if org_id:
-                    orgs = [await session.get(Organization, org_id)]
-                else:
-                    orgs = await Organization.get_root_organizations(session)
+                stmt = (
+                    select(Device)
+                    .join(Organization, Device.organization_id == Organization.id)
+                    .where(Organization.subtree_clause(path))
+                )
+                if status:
+                    stmt = stmt.where(Device.status == status)
+                result = await session.execute(stmt)
+                return [device.to_dict() for device in result.scalars().all()]
+        except Exception as e:
+            logger.error(f"Error getting subtree devices: {e}")
+            return []
 
-                tree = []
-                for org in orgs:
-                    if not org:
-                        continue
-                    node = org.to_dict()
-                    children = await self.get_organization_tree(org.id)
-                    if children:
-                        node["children"] = children
-                    tree.append(node)
-
-                return tree
+    async def get_subtree_users(self, org_id: int) -> List[Dict]:
+        """获取子树内的所有用户，属于多个下级组织的用户只返回一次"""
+        try:
+            path = await self.get_subtree_path(org_id)
+            if path is None:
+                return []
+            async with self.transaction.transaction() as session:
+                members = (
+                    select(user_organizations.c.user_id)
+                    .join(
+                        Organization,
+                        user_organizations.c.organization_id == Organization.id,
+                    )
+                    .where(Organization.subtree_clause(path))
+                )
+                result = await session.execute(select(User).where(User.id.in_(members)))
+                return [user.to_dict() for user in result.scalars().all()]
         except Exception as e:
-            logger.error(f"Error getting organization tree: {e}")
+            logger.error(f"Error getting subtree users: {e}")
             return []
 
+    async def get_subtree_stats(self, org_id: int) -> Optional[Dict]:
+        """获取子树统计：下级组织数、按状态的设备数和用户数"""
+        try:
+            tree = await self.get_tree()
+            if org_id not in tree:
+                tree = await self.get_tree(refresh=True)
+            path = tree.path(org_id)
+            if path is None:
+                return None
+
+            async with self.transaction.transaction() as session:
+                result = await session.execute(
+                    select(Device.status, func.count(Device.id))
+                    .join(Organization, Device.organization_id == Organization.id)
+                    .where(Organization.subtree_clause(path))
+                    .group_by(Device.status)
+                )
+                devices_by_status = {
+                    getattr(status, "value", status): count
+                    for status, count in result.all()
+                }
+                user_count = await session.scalar(
+                    select(func.count(func.distinct(user_organizations.c.user_id)))
+                    .join(
+                        Organization,
+                        user_organizations.c.organization_id == Organization.id,
+                    )
+                    .where(Organization.subtree_clause(path))
+                )
+
+            return {
+                "organization_id": org_id,
+                "organization_count": len(tree.subtree_ids(org_id)),
+                "device_count": sum(devices_by_status.values()),
+                "devices_by_status": devices_by_status,
+                "user_count": user_count or 0,
+            }
+        except Exception as e:
+            logger.error(f"Error getting subtree stats: {e}")
+            return None
+
 
 # 创建全局组织服务实例
 organization_service = OrganizationService()
@@ -1,8 +1,10 @@
 """权限服务"""
 
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 from ncod.core.logger import setup_logger
-from ncod.core.cache.permission import permission_cache
+from ncod.core.cache.permission import PermissionEngine, permission_engine
 from ncod.master.models.user import User
 from ncod.master.models.role import Role
 from ncod.master.models.permission import Permission
@@ -12,28 +14,39 @@ logger = setup_logger("permission_service")
 
 
 class PermissionService:
-    """权限服务"""
+    """权限服务
 
-    def __init__(self):
+    权限判定由进程内的PermissionEngine完成，只有用户或角色尚未编译时才访问数据库。
+    """
+
+    def __init__(self, engine: Optional[PermissionEngine] = None):
         self.transaction = transaction_manager
-        self.cache = permission_cache
+        self.engine = engine or permission_engine
 
     async def check_permission(
-        self, user_id: str, required_permissions: List[str]
+        self,
+        user_id: str,
+        required_permissions: Optional[List[str]] = None,
+        resource_type: Optional[str] = None,
+        action: Optional[str] = None,
     ) -> bool:
-        """检查用户权限"""
+        """检查用户权限
+
+        Args:
+            user_id: 用户ID
+            required_permissions: 所需权限代码列表
+            resource_type: 资源类型，与action组成权限代码"resource_type:action"
+            action: 操作
+        """
         try:
-            # 先从缓存获取
-            user_permissions = await self.cache.get_user_permissions(user_id)
-            if not user_permissions:
-                # 缓存未命中，从数据库获取
-                user_permissions = await self._load_user_permissions(user_id)
-                # 更新缓存
-                await self.cache.set_user_permissions(user_id, user_permissions)
-
-            # 检查权限
-            user_perm_set = set(user_permissions)
-            return all(perm in user_perm_set for perm in required_permissions)
+            codes = list(required_permissions or [])
+            if resource_type and action:
+                codes.append(f"{resource_type}:{action}")
+
+            granted = await self._user_mask(user_id)
+            # 加载用户可能分配新的位，所需位集在加载之后计算
+            required = self.engine.mask(codes)
+            return required is not None and granted & required == required
         except Exception as e:
             logger.error(f"Error checking permission: {e}")
             return False
@@ -41,72 +54,95 @@ class PermissionService:
     async def get_user_permissions(self, user_id: str) -> List[str]:
         """获取用户权限"""
         try:
-            # 先从缓存获取
-            permissions = await self.cache.get_user_permissions(user_id)
-            if not permissions:
-                # 缓存未命中，从数据库获取
-                permissions = await self._load_user_permissions(user_id)
-                # 更新缓存
-                await self.cache.set_user_permissions(user_id, permissions)
-            return permissions
+            return self.engine.codes(await self._user_mask(user_id))
         except Exception as e:
             logger.error(f"Error getting user permissions: {e}")
             return []
 
+    async def _user_mask(self, user_id: str) -> int:
+        """用户权限位集，未编译的用户或角色从数据库加载"""
+        if not self.engine.started:
+            await self.engine.start()
+
+        mask = self.engine.user_mask(user_id)
+        if mask is not None:
+            return mask
+
+        missing = self.engine.missing_roles(user_id)
+        if missing is None:
+            await self._load_user_permissions(user_id)
+        else:
+            # 角色变更后只需重新编译角色，不需要重新加载用户
+            await self._load_roles(missing)
+        return self.engine.user_mask(user_id) or 0
+
     async def _load_user_permissions(self, user_id: str) -> List[str]:
-        """从数据库加载用户权限"""
+        """从数据库加载用户的角色及其权限(一次查询)"""
         try:
             async with self.transaction.transaction() as session:
-                # 获取用户
-                user = await session.get(User, user_id)
+                result = await session.execute(
+                    select(User)
+                    .options(selectinload(User.roles).selectinload(Role.permissions))
+                    .where(User.id == user_id)
+                )
+                user = result.scalar_one_or_none()
                 if not user:
                     return []
 
-                # 获取用户所有角色的权限
-                permissions: Set[str] = set()
                 for role in user.roles:
-                    role_perms = await self.cache.get_role_permissions(role.name)
-                    if not role_perms:
-                        role_perms = [p.code for p in role.permissions]
-                        await self.cache.set_role_permissions(role.name, role_perms)
-                    permissions.update(role_perms)
-
-                return list(permissions)
+                    self.engine.compile_role(
+                        role.name, [p.code for p in role.permissions]
+                    )
+                mask = self.engine.set_user(
+                    user_id, [role.name for role in user.roles]
+                )
+                return self.engine.codes(mask or 0)
         except Exception as e:
             logger.error(f"Error loading user permissions: {e}")
             return []
 
-    async def refresh_user_permissions(self, user_id: str) -> bool:
-        """刷新用户权限缓存"""
+    async def _load_roles(self, role_names: Iterable[str]) -> None:
+        """从数据库编译角色，已删除的角色编译为空权限"""
+        role_names = set(role_names)
+        if not role_names:
+            return
         try:
-            # 删除旧缓存
-            await self.cache.delete_user_permissions(user_id)
-            # 重新加载权限
-            permissions = await self._load_user_permissions(user_id)
-            # 更新缓存
-            return await self.cache.set_user_permissions(user_id, permissions)
+            async with self.transaction.transaction() as session:
+                result = await session.execute(
+                    select(Role)
+                    .options(selectinload(Role.permissions))
+                    .where(Role.name.in_(role_names))
+                )
+                roles = {role.name: role for role in result.scalars().all()}
+            for name in role_names:
+                role = roles.get(name)
+                self.engine.compile_role(
+                    name, [p.code for p in role.permissions] if role else []
+                )
         except Exception as e:
-            logger.error(f"Error refreshing user permissions: {e}")
-            return False
+            logger.error(f"Error loading role permissions: {e}")
 
-    async def refresh_role_permissions(self, role_name: str) -> bool:
-        """刷新角色权限缓存"""
+    async def refresh_user_permissions(self, *user_ids: str) -> bool:
+        """用户角色变更后使其权限失效"""
         try:
-            async with self.transaction.transaction() as session:
-                # 获取角色
-                role = await Role.get_by_name(session, role_name)
-                if not role:
-                    return False
-
-                # 更新角色权限缓存
-                permissions = [p.code for p in role.permissions]
-                await self.cache.set_role_permissions(role_name, permissions)
+            for user_id in user_ids:
+                self.engine.drop_user(user_id)
+            await self.engine.publish(users=user_ids)
+            return True
+        except Exception as e:
+            logger.error(f"Error refreshing user permissions: {e}")
+            return False
 
-                # 获取角色下的所有用户
-                for user in role.users:
-                    await self.refresh_user_permissions(user.id)
+    async def refresh_role_permissions(self, *role_names: str) -> bool:
+        """角色权限变更后重新编译角色
 
-                return True
+        只替换角色位集并广播版本号，使用该角色的用户在下一次判定时重新合成，
+        不逐个重新加载用户。
+        """
+        try:
+            await self._load_roles(role_names)
+            await self.engine.publish(roles=role_names)
+            return True
         except Exception as e:
             logger.error(f"Error refreshing role permissions: {e}")
             return False
@@ -67,10 +67,19 @@ class ResourceScheduler:
                 result = await session.execute(select(Device))
                 devices = result.scalars().all()
 
-                for device in devices:
-                    # 获取设备资源信息
-                    resource_info = await self._get_resource_info(device)
-                    self._resources[device.id] = resource_info
+            # 一次MGET读取全部缓存,未命中的设备统一计算后一次写回
+            keys = {device.id: f"resource_info:{device.id}" for device in devices}
+            cached = await redis_cache.get_many(keys.values())
+            missing: Dict[str, Dict] = {}
+            for device in devices:
+                info = cached.get(keys[device.id])
+                if not info:
+                    info = self._build_resource_info(device)
+                    missing[keys[device.id]] = info
+                self._resources[device.id] = info
+
+            if missing:
+                await redis_cache.set_many(missing, expire=settings.RESOURCE_CACHE_TTL)
 
         except Exception as e:
             logger.error(f"更新资源信息失败: {e}")
@@ -92,23 +101,7 @@ class ResourceScheduler:
             if info:
                 return info
 
-            # 获取资源信息
-            # TODO: 实现具体的资源信息获取逻辑
-            # 可以考虑:
-            # 1. CPU使用率
-            # 2. 内存使用率
-            # 3. 网络带宽
-            # 4. 存储空间
-            # 5. 设备状态
-            info = {
-                "timestamp": datetime.now().isoformat(),
-                "status": device.status.value,
-                "cpu_usage": 0.0,
-                "memory_usage": 0.0,
-                "network_usage": 0.0,
-                "storage_usage": 0.0,
-                "available": True,
-            }
+            info = self._build_resource_info(device)
 
             # 缓存资源信息
             await redis_cache.set(cache_key, info, expire=settings.RESOURCE_CACHE_TTL)
@@ -119,6 +112,32 @@ class ResourceScheduler:
             logger.error(f"获取资源信息失败: {e}")
             return {}
 
+    def _build_resource_info(self, device: Device) -> Dict:
+        """计算资源信息
+
+        Args:
+            device: 设备实例
+
+        Returns:
+            Dict: 资源信息
+        """
+        # TODO: 实现具体的资源信息获取逻辑
+        # 可以考虑:
+        # 1. CPU使用率
+        # 2. 内存使用率
+        # 3. 网络带宽
+        # 4. 存储空间
+        # 5. 设备状态
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "status": device.status.value,
+            "cpu_usage": 0.0,
+            "memory_usage": 0.0,
+            "network_usage": 0.0,
+            "storage_usage": 0.0,
+            "available": True,
+        }
+
     async def _schedule_resources(self):
         """调度资源"""
         try:
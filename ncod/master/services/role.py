@@ -1,19 +1,26 @@
 """角色服务"""
 
 from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select
 from ncod.core.logger import setup_logger
 from ncod.core.db.transaction import transaction_manager
 from ncod.master.models.role import Role
 from ncod.master.models.permission import Permission
+from ncod.master.models.user import user_roles
+from ncod.master.services.permission import PermissionService, permission_service
 
 logger = setup_logger("role_service")
 
 
 class RoleService:
-    """角色服务"""
+    """角色服务
 
-    def __init__(self):
+    角色或其权限变更提交后重新编译角色并通知所有工作进程。
+    """
+
+    def __init__(self, permissions: Optional[PermissionService] = None):
         self.transaction = transaction_manager
+        self.permissions = permissions or permission_service
 
     async def create_role(self, data: Dict) -> Tuple[bool, str, Optional[Role]]:
         """创建角色"""
@@ -43,7 +50,9 @@ class RoleService:
                 await session.commit()
                 await session.refresh(role)
 
-                return True, "Role created successfully", role
+            # 同名角色可能曾被删除后仍有编译结果
+            await self.permissions.refresh_role_permissions(role.name)
+            return True, "Role created successfully", role
         except Exception as e:
             logger.error(f"Error creating role: {e}")
             return False, str(e), None
@@ -57,6 +66,8 @@ class RoleService:
                 role = await session.get(Role, role_id)
                 if not role:
                     return False, "Role not found", None
+                old_name = role.name
+                renamed_users: List[str] = []
 
                 # 检查角色名是否重复
                 if "name" in data:
@@ -64,6 +75,14 @@ class RoleService:
                     if existing and existing.id != role_id:
                         return False, "Role name already exists", None
                     role.name = data["name"]
+                    if role.name != old_name:
+                        # 用户的编译结果按角色名记录，改名后需要重新加载
+                        result = await session.execute(
+                            select(user_roles.c.user_id).where(
+                                user_roles.c.role_id == role_id
+                            )
+                        )
+                        renamed_users = [row[0] for row in result.all()]
 
                 if "description" in data:
                     role.description = data["description"]
@@ -80,7 +99,12 @@ class RoleService:
                 await session.commit()
                 await session.refresh(role)
 
-                return True, "Role updated successfully", role
+            if renamed_users:
+                await self.permissions.refresh_role_permissions(role.name, old_name)
+                await self.permissions.refresh_user_permissions(*renamed_users)
+            else:
+                await self.permissions.refresh_role_permissions(role.name)
+            return True, "Role updated successfully", role
         except Exception as e:
             logger.error(f"Error updating role: {e}")
             return False, str(e), None
@@ -96,10 +120,13 @@ class RoleService:
                 if role.is_system:
                     return False, "Cannot delete system role"
 
+                role_name = role.name
                 await session.delete(role)
                 await session.commit()
 
-                return True, "Role deleted successfully"
+            # 已删除的角色重新编译为空权限，拥有该角色的用户立即失去其权限
+            await self.permissions.refresh_role_permissions(role_name)
+            return True, "Role deleted successfully"
         except Exception as e:
             logger.error(f"Error deleting role: {e}")
             return False, str(e)
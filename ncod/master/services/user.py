@@ -9,15 +9,20 @@ from ncod.core.db.transaction import transaction_manager
 from ncod.master.models.user import User
 from ncod.master.models.role import Role
 from ncod.master.models.organization import Organization
+from ncod.master.services.permission import PermissionService, permission_service
 
 logger = setup_logger("user_service")
 
 
 class UserService:
-    """用户服务"""
+    """用户服务
 
-    def __init__(self):
+    用户角色变更或用户删除提交后使其已编译的权限失效。
+    """
+
+    def __init__(self, permissions: Optional[PermissionService] = None):
         self.transaction = transaction_manager
+        self.permissions = permissions or permission_service
 
     async def create_user(self, data: Dict) -> Tuple[bool, str, Optional[User]]:
         """创建用户"""
@@ -95,7 +100,9 @@ class UserService:
                 await session.commit()
                 await session.refresh(user)
 
-                return True, "User updated successfully", user
+            if "roles" in data:
+                await self.permissions.refresh_user_permissions(user_id)
+            return True, "User updated successfully", user
         except Exception as e:
             logger.error(f"Error updating user: {e}")
             return False, str(e), None
@@ -112,7 +119,8 @@ class UserService:
                 user.soft_delete()
                 await session.commit()
 
-                return True, "User deleted successfully"
+            await self.permissions.refresh_user_permissions(user_id)
+            return True, "User deleted successfully"
         except Exception as e:
             logger.error(f"Error deleting user: {e}")
             return False, str(e)
@@ -1,21 +1,31 @@
 """WebSocket通信服务"""
 
 import asyncio
-from typing import Dict, Set
+from typing import Dict, Optional, Set
 from fastapi import WebSocket, WebSocketDisconnect
+from ncod.master.websocket.hub import FanoutHub, fanout_hub
 from ncod.utils.logger import logger
 
 
 class WebSocketManager:
-    """WebSocket连接管理器"""
+    """WebSocket连接管理器
 
-    def __init__(self):
+    客户端类型即主题，消息经FanoutHub写入各连接自己的发送队列，
+    广播不会被慢连接阻塞。
+    """
+
+    def __init__(self, hub: Optional[FanoutHub] = None):
+        self.hub = hub or fanout_hub
         self.active_connections: Dict[str, Set[WebSocket]] = {
             "device": set(),  # 设备状态订阅
             "monitoring": set(),  # 监控数据订阅
             "alerts": set(),  # 告警信息订阅
         }
 
+    @staticmethod
+    def _client_id(websocket: WebSocket, client_type: str) -> str:
+        return f"{client_type}:{id(websocket)}"
+
     async def connect(self, websocket: WebSocket, client_type: str):
         """建立WebSocket连接
 
@@ -27,6 +37,9 @@ class WebSocketManager:
         if client_type not in self.active_connections:
             self.active_connections[client_type] = set()
         self.active_connections[client_type].add(websocket)
+        self.hub.register(
+            websocket, self._client_id(websocket, client_type), (client_type,)
+        )
         logger.info(f"WebSocket客户端连接: {client_type}")
 
     def disconnect(self, websocket: WebSocket, client_type: str):
@@ -36,30 +49,24 @@ class WebSocketManager:
             websocket: WebSocket连接
             client_type: 客户端类型
         """
-        self.active_connections[client_type].remove(websocket)
+        self.active_connections.get(client_type, set()).discard(websocket)
+        self.hub.unregister(self._client_id(websocket, client_type))
         logger.info(f"WebSocket客户端断开: {client_type}")
 
-    async def broadcast(self, message: dict, client_type: str):
+    async def broadcast(
+        self, message: dict, client_type: str, conflate_key: Optional[str] = None
+    ) -> int:
         """广播消息
 
         Args:
             message: 消息内容
             client_type: 客户端类型
+            conflate_key: 合并键，连接队列中相同键的旧消息只保留最新一条
+
+        Returns:
+            int: 本worker上收到消息的连接数
         """
-        if client_type in self.active_connections:
-            disconnected = set()
-            for connection in self.active_connections[client_type]:
-                try:
-                    await connection.send_json(message)
-                except WebSocketDisconnect:
-                    disconnected.add(connection)
-                except Exception as e:
-                    logger.error(f"发送WebSocket消息失败: {e}")
-                    disconnected.add(connection)
-
-            # 清理断开的连接
-            for connection in disconnected:
-                self.active_connections[client_type].remove(connection)
+        return await self.hub.publish(client_type, message, conflate_key)
 
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """发送个人消息
@@ -0,0 +1,125 @@
+"""
+告警评估引擎测试
+"""
+
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from ..services import alert_handler
+from ..services.alert_handler import FIRING, RESOLVED, AlertEvaluator, AlertHandler
+
+
+def _rule(rule_id, condition, threshold, device_id=None, **extra):
+    return {
+        "id": rule_id,
+        "device_id": device_id,
+        "metric_type": "cpu",
+        "condition": condition,
+        "threshold": threshold,
+        "level": "major",
+        "notify_channels": ["email"],
+        **extra,
+    }
+
+
+def test_threshold_index_matches_rules():
+    """测试按阈值索引匹配gt/lt/eq规则及全局规则"""
+    evaluator = AlertEvaluator()
+    evaluator.load(
+        [
+            _rule("high", "gt", 80),
+            _rule("higher", "gt", 90, device_id="d1"),
+            _rule("low", "lt", 10),
+            _rule("exact", "eq", 50),
+        ]
+    )
+    fired, _ = evaluator.evaluate(
+        [("d1", "cpu", 95), ("d2", "cpu", 95), ("d3", "cpu", 5), ("d4", "cpu", 50)],
+        now=0,
+    )
+    assert sorted((a["rule_id"], a["device_id"]) for a in fired) == [
+        ("exact", "d4"),
+        ("high", "d1"),
+        ("high", "d2"),
+        ("higher", "d1"),
+        ("low", "d3"),
+    ]
+
+
+def test_for_duration_and_dedupe():
+    """测试持续时间满足后才触发，firing期间不重复告警"""
+    evaluator = AlertEvaluator()
+    evaluator.load([_rule("high", "gt", 80, for_duration=30)])
+
+    assert evaluator.evaluate([("d1", "cpu", 90, 0)])[0] == []
+    assert evaluator.evaluate([("d1", "cpu", 91, 20)])[0] == []
+    fired, _ = evaluator.evaluate([("d1", "cpu", 92, 30)])
+    assert [a["status"] for a in fired] == [FIRING]
+    assert evaluator.evaluate([("d1", "cpu", 93, 40)])[0] == []
+
+    # pending期间条件中断则重新计时
+    evaluator.evaluate([("d2", "cpu", 90, 0), ("d2", "cpu", 70, 10)])
+    assert evaluator.evaluate([("d2", "cpu", 90, 35)])[0] == []
+
+
+def test_hysteresis_before_resolve():
+    """测试回差范围内保持firing，越过后恢复"""
+    evaluator = AlertEvaluator()
+    evaluator.load([_rule("high", "gt", 80, hysteresis=5)])
+    evaluator.evaluate([("d1", "cpu", 90, 0)])
+
+    _, resolved = evaluator.evaluate([("d1", "cpu", 78, 1)])
+    assert resolved == []
+    assert len(evaluator.get_active_alerts()) == 1
+
+    _, resolved = evaluator.evaluate([("d1", "cpu", 74, 2)])
+    assert [a["status"] for a in resolved] == [RESOLVED]
+    assert evaluator.get_active_alerts() == []
+
+
+def test_rule_events_update_index():
+    """测试规则变更事件增量更新索引"""
+    evaluator = AlertEvaluator()
+    evaluator.load([])
+    evaluator.on_rule_event("created", _rule("high", "gt", 80))
+    assert len(evaluator.evaluate([("d1", "cpu", 90)], now=0)[0]) == 1
+
+    evaluator.on_rule_event("updated", _rule("high", "gt", 95))
+    assert evaluator.evaluate([("d1", "cpu", 90)], now=1)[0] == []
+
+    evaluator.on_rule_event("deleted", _rule("high", "gt", 95))
+    assert evaluator.index.groups == {}
+
+
+def test_reload_keeps_unchanged_rule_state():
+    """测试重新加载后定义未变的规则不重复告警，变化的规则重新计算"""
+    evaluator = AlertEvaluator()
+    evaluator.load([_rule("high", "gt", 80), _rule("low", "lt", 10)])
+    fired, _ = evaluator.evaluate([("d1", "cpu", 90), ("d2", "cpu", 5)], now=0)
+    assert len(fired) == 2
+
+    evaluator.load([_rule("high", "gt", 80), _rule("low", "lt", 20)])
+    fired, _ = evaluator.evaluate([("d1", "cpu", 90), ("d2", "cpu", 5)], now=1)
+    assert [a["rule_id"] for a in fired] == ["low"]
+
+
+@pytest.mark.asyncio
+async def test_failed_rule_load_is_retried(monkeypatch):
+    """测试规则加载失败时不标记为已加载，下次检查重试"""
+    for name in ("NotifyService", "NotifyConfigService", "TransactionManager"):
+        monkeypatch.setattr(alert_handler, name, MagicMock)
+    rule_service = MagicMock()
+    rule_service.get_enabled_rules = AsyncMock(
+        side_effect=[ConnectionError("db down"), [_rule("high", "gt", 80)]]
+    )
+    monkeypatch.setattr(alert_handler, "alert_rule_service", rule_service)
+    handler = AlertHandler(None)
+    handler._send_notifications = AsyncMock()
+
+    assert await handler.check_metric("d1", "cpu", 90) == []
+    assert not handler._loaded
+
+    fired = await handler.check_metric("d1", "cpu", 90)
+    assert [a["rule_id"] for a in fired] == ["high"]
+    assert rule_service.get_enabled_rules.await_count == 2
@@ -0,0 +1,145 @@
+"""
+缓存管理器测试
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from ..services.cache_manager import CacheEntry, CacheManager
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_run_loader_once():
+    """测试并发未命中只运行一次加载器"""
+    cache_manager = CacheManager()
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"online": 3}
+
+    results = await asyncio.gather(
+        *(cache_manager.get_or_set("stats", "device_stats:1", loader) for _ in range(20))
+    )
+
+    assert calls == 1
+    assert all(result == {"online": 3} for result in results)
+    assert await cache_manager.get_or_set("stats", "device_stats:1", loader) == {
+        "online": 3
+    }
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_sync_getter():
+    """测试同步加载函数"""
+    cache_manager = CacheManager()
+    assert await cache_manager.get_or_set("short", "device:1", lambda: 42) == 42
+    assert cache_manager.short_term["device:1"].value == 42
+
+
+@pytest.mark.asyncio
+async def test_stale_value_served_while_revalidating():
+    """测试过期后先返回旧值并在后台刷新"""
+    cache_manager = CacheManager()
+    now = time.monotonic()
+    cache_manager.stats_cache["k"] = CacheEntry(
+        value="old", fresh_until=now - 1, stale_until=now + 60
+    )
+    refreshed = asyncio.Event()
+
+    async def loader():
+        refreshed.set()
+        return "new"
+
+    assert await cache_manager.get_or_set("stats", "k", loader) == "old"
+    await asyncio.wait_for(refreshed.wait(), 1)
+    await asyncio.sleep(0)
+    assert await cache_manager.get_or_set("stats", "k", loader) == "new"
+
+
+@pytest.mark.asyncio
+async def test_loader_error_not_cached():
+    """测试加载失败时不写入缓存"""
+    cache_manager = CacheManager()
+
+    async def failing():
+        raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        await cache_manager.get_or_set("stats", "k", failing)
+    assert "k" not in cache_manager.stats_cache
+    assert await cache_manager.get_or_set("stats", "k", lambda: 1) == 1
+
+
+@pytest.mark.asyncio
+async def test_set_many_primes_entries():
+    """测试批量写入的条目可直接命中"""
+    cache_manager = CacheManager()
+
+    written = await cache_manager.set_many(
+        "short", {f"device:{i}": {"id": i} for i in range(3)}, ttl=300
+    )
+
+    assert written == 3
+    assert await cache_manager.get_or_set("short", "device:1", lambda: None) == {
+        "id": 1
+    }
+
+
+class FakeNearCache:
+    """模拟两级缓存"""
+
+    def __init__(self):
+        self.data = {}
+        self.monitor = None
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, expire=None):
+        self.data[key] = value
+        return True
+
+
+@pytest.mark.asyncio
+async def test_shared_concurrent_misses_run_loader_once():
+    """测试共享缓存并发未命中同样只运行一次加载器"""
+    cache_manager = CacheManager()
+    cache_manager.near_cache = FakeNearCache()
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return ["admin"]
+
+    results = await asyncio.gather(
+        *(cache_manager.get_or_set("shared", "perm:1", loader) for _ in range(20))
+    )
+
+    assert calls == 1
+    assert all(result == ["admin"] for result in results)
+    assert cache_manager.near_cache.data == {"perm:1": ["admin"]}
+
+
+@pytest.mark.asyncio
+async def test_long_ttl_not_truncated():
+    """测试长于默认值的ttl按条目保存，不被容器截断"""
+    cache_manager = CacheManager()
+    await cache_manager.get_or_set("short", "k", lambda: 1, ttl=7200)
+    entry = cache_manager.short_term["k"]
+
+    assert entry.fresh_until - time.monotonic() > 7000
+    assert cache_manager._entry_expiry("k", entry, 0) == entry.stale_until
+
+    now = time.monotonic()
+    cache_manager.short_term["old"] = CacheEntry(
+        value="old", fresh_until=now - 2, stale_until=now - 1
+    )
+    assert "old" not in cache_manager.short_term
@@ -0,0 +1,72 @@
+"""
+缓存预热测试
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from ..models.device import Device, DeviceStatus
+from ..services.cache_warmup import CacheWarmupService
+
+
+class FakeCacheManager:
+    def __init__(self):
+        self.entries = {}
+
+    async def set_many(self, cache_type, mapping, ttl=None):
+        self.entries.update(mapping)
+        return len(mapping)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Device.__table__.create(engine)
+    with Session(engine) as session:
+        session.add_all(
+            [
+                Device(id="d1", name="A", type="usb", status=DeviceStatus.ONLINE),
+                Device(id="d2", name="B", type="usb", status=DeviceStatus.OFFLINE),
+            ]
+        )
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_warmup_devices_by_status(db):
+    """测试只预热在线设备"""
+    cache = FakeCacheManager()
+    service = CacheWarmupService(db, cache)
+
+    await service.warmup_devices()
+
+    assert list(cache.entries) == ["device:d1"]
+    assert service.progress.to_dict()["types"]["devices"] == {
+        "completed": 1,
+        "total": 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_warmup_all_continues_after_failure(db):
+    """测试某类数据预热失败时记录错误，其它类型照常完成"""
+    cache = FakeCacheManager()
+    service = CacheWarmupService(db, cache)
+
+    async def fail():
+        raise RuntimeError("db down")
+
+    async def no_stats():
+        pass
+
+    service.warmup_organizations = fail
+    service.warmup_usage_stats = no_stats
+
+    await service.warmup_all()
+
+    assert "device:d1" in cache.entries
+    assert service.progress.errors == ["Error warming up organizations: db down"]
+    assert service.progress.finished_at > 0
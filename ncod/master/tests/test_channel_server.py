@@ -0,0 +1,52 @@
+"""
+从服务器通道服务器测试
+"""
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from ncod.core.channel import (
+    MSG_DEVICE_DELTA,
+    MSG_HELLO,
+    MSG_LOAD,
+    MSG_RESYNC_DEVICES,
+    encode_frame,
+    read_frame,
+)
+
+from ..discovery.channel_server import SlaveChannelServer
+
+
+@pytest.mark.asyncio
+async def test_load_dispatch_and_resync_on_version_gap():
+    """测试负载交给注册的处理器，增量版本不连续时回复快照请求"""
+    load_handler = AsyncMock()
+    consumer = AsyncMock()
+    consumer.apply_delta.return_value = False
+    consumer.forget = lambda node_id: None
+
+    server = SlaveChannelServer(AsyncMock(), "127.0.0.1", 0)
+    server.register_handler(MSG_LOAD, load_handler)
+    server.attach_device_consumer(consumer)
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(
+            encode_frame({"type": MSG_HELLO, "node_id": "n1"})
+            + encode_frame({"type": MSG_LOAD, "node_id": "n1", "data": {"cpu": 5}})
+            + encode_frame(
+                {"type": MSG_DEVICE_DELTA, "node_id": "n1", "data": {"version": 9}}
+            )
+        )
+        await writer.drain()
+
+        reply = await asyncio.wait_for(read_frame(reader), 1)
+        assert reply["type"] == MSG_RESYNC_DEVICES
+        load_handler.assert_awaited_once_with("n1", {"cpu": 5})
+        consumer.apply_delta.assert_awaited_once_with("n1", {"version": 9})
+    finally:
+        writer.close()
+        await server.stop()
@@ -0,0 +1,148 @@
+"""
+设备访问控制索引测试
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from ..device_permission import DeviceACLIndex, DevicePermissionManager
+from ..models import Device, DevicePermission, Slave, db
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def _index():
+    index = DeviceACLIndex()
+    index.rebuild(
+        [
+            (1, 7, 10, "use", None),
+            (2, 7, 11, "view", NOW + timedelta(minutes=5)),
+            (3, 7, 12, "use", NOW - timedelta(minutes=1)),
+            (4, 8, 10, "view", None),
+        ]
+    )
+    return index
+
+
+def test_check_respects_expiry():
+    """测试判定按过期时间即时生效"""
+    index = _index()
+    assert index.check(7, 10, "use", now=NOW)
+    assert not index.check(7, 10, "view", now=NOW)
+    assert index.check(7, 11, "view", now=NOW)
+    assert not index.check(7, 11, "view", now=NOW + timedelta(minutes=5))
+    assert not index.check(7, 12, "use", now=NOW)
+
+
+def test_user_devices_filtered_by_type():
+    """测试按权限类型列出用户可访问的设备"""
+    index = _index()
+    assert index.devices(7, now=NOW) == {10, 11}
+    assert index.devices(7, "use", now=NOW) == {10}
+    assert index.devices(8, now=NOW) == {10}
+    assert index.permissions(7, 10, now=NOW) == {"use"}
+
+
+def test_grant_and_revoke_events():
+    """测试授予/撤销事件更新索引"""
+    index = _index()
+    index.grant(5, 9, 10, "use")
+    assert index.check(9, 10, "use", now=NOW)
+    index.revoke(5)
+    assert not index.check(9, 10, "use", now=NOW)
+    assert index.devices(9, now=NOW) == set()
+
+
+def test_expiry_heap_pops_due_grants():
+    """测试过期堆只弹出到期且仍有效的授权"""
+    index = _index()
+    # 重新授权后旧的过期条目失效
+    index.grant(6, 7, 11, "view", NOW + timedelta(hours=1))
+    assert index.pop_expired(NOW) == [3]
+    assert index.pop_expired(NOW + timedelta(minutes=10)) == []
+    assert index.next_expiry() == NOW + timedelta(hours=1)
+    assert index.pop_expired(NOW + timedelta(hours=1)) == [6]
+    assert len(index) == 2
+
+
+def test_events_during_rebuild_are_replayed():
+    """测试重建期间的事件不会被旧快照覆盖"""
+    index = _index()
+    index.begin_rebuild()
+    index.revoke(1)
+    index.grant(5, 9, 10, "use")
+    # 快照在事件之前读取
+    index.rebuild([(1, 7, 10, "use", None)])
+    assert not index.check(7, 10, "use", now=NOW)
+    assert index.check(9, 10, "use", now=NOW)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, data):
+        self.published.append((channel, data))
+
+
+def test_grant_events_applied_on_other_workers(monkeypatch):
+    """测试授予/撤销事件广播后其他进程立即更新索引，忽略自己发出的事件"""
+    workers = []
+    for _ in range(2):
+        monkeypatch.setattr(DevicePermissionManager, "_instance", None)
+        manager = DevicePermissionManager()
+        manager._redis = FakeRedis()
+        workers.append(manager)
+    first, second = workers
+    expires_at = datetime.now() + timedelta(hours=1)
+
+    first._publish("grant", (5, 9, 10, "use", expires_at))
+    first._publish("revoke", 1)
+    for _, data in first._redis.published:
+        first._on_event({"data": data})
+        second._on_event({"data": data})
+
+    assert second.index.check(9, 10, "use")
+    assert second.index.next_expiry() == expires_at
+    assert not first.index.check(9, 10, "use")
+
+    second.index.grant(1, 7, 10, "use")
+    second._on_event({"data": first._redis.published[1][1]})
+    assert not second.index.check(7, 10, "use")
+
+
+def test_regrant_after_expiry_publishes_revoke(monkeypatch):
+    """测试重新授予已过期的权限时广播旧授权的撤销事件"""
+    monkeypatch.setattr(DevicePermissionManager, "_instance", None)
+    manager = DevicePermissionManager()
+    manager._redis = FakeRedis()
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        slave = Slave(hostname="s1", ip_address="10.0.0.1", mac_address="m")
+        db.session.add(slave)
+        db.session.flush()
+        device = Device(name="d1", type="dongle", slave_id=slave.id)
+        db.session.add(device)
+        db.session.flush()
+        expired = DevicePermission(
+            device_id=device.id,
+            user_id=7,
+            permission_type="use",
+            expires_at=datetime.now() - timedelta(minutes=1),
+            is_active=True,
+        )
+        db.session.add(expired)
+        db.session.commit()
+        expired_id = expired.id
+
+        assert manager.grant_permission(device.id, 7, "use") is not None
+
+    events = [json.loads(data) for _, data in manager._redis.published]
+    assert [event["event"] for event in events] == ["revoke", "grant"]
+    assert events[0]["data"] == expired_id
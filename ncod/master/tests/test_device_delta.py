@@ -0,0 +1,54 @@
+"""
+设备增量同步测试
+"""
+
+from unittest.mock import AsyncMock
+
+import pytest
+
+from ..services.device_delta import DeviceDeltaConsumer
+
+DONGLE = {"id": 1, "hub_id": 2, "name": "Dongle A", "status": "Available"}
+
+
+def _consumer():
+    consumer = DeviceDeltaConsumer()
+    consumer._persist = AsyncMock()
+    return consumer
+
+
+@pytest.mark.asyncio
+async def test_delta_requires_snapshot_first():
+    """测试未收到快照前的增量被拒绝，调用方应请求快照"""
+    consumer = _consumer()
+    assert not await consumer.apply_delta(7, {"version": 1, "added": [DONGLE]})
+    consumer._persist.assert_not_called()
+
+    await consumer.apply_snapshot(7, {"version": 3, "devices": [DONGLE]})
+    consumer._persist.assert_awaited_with(7, [DONGLE], (), snapshot=True)
+    assert consumer.version(7) == 3
+
+
+@pytest.mark.asyncio
+async def test_delta_applied_in_order():
+    """测试增量按版本顺序应用，版本不连续时不做修改"""
+    consumer = _consumer()
+    await consumer.apply_snapshot(7, {"version": 3, "devices": []})
+
+    assert await consumer.apply_delta(
+        7, {"version": 4, "added": [DONGLE], "changed": [], "removed": []}
+    )
+    consumer._persist.assert_awaited_with(7, [DONGLE], [])
+    assert consumer.version(7) == 4
+
+    assert not await consumer.apply_delta(7, {"version": 6, "removed": [DONGLE]})
+    assert consumer.version(7) == 4
+
+    consumer.forget(7)
+    assert not await consumer.apply_delta(7, {"version": 5, "removed": [DONGLE]})
+
+
+def test_device_id_includes_slave():
+    """测试不同从服务器上相同Hub/设备号的设备互不冲突"""
+    assert DeviceDeltaConsumer.device_id(7, DONGLE) == "7:2:1"
+    assert DeviceDeltaConsumer.device_id("slave-b", DONGLE) == "slave-b:2:1"
@@ -0,0 +1,172 @@
+"""
+设备列表分页与条件请求测试
+"""
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select
+
+from ...utils.cache import CollectionVersions
+from ..utils.pagination import (
+    decode_cursor,
+    etag_matches,
+    keyset_page,
+    make_etag,
+    parse_fields,
+    select_columns,
+)
+
+metadata = MetaData()
+history = Table(
+    "history",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("device", String(20)),
+    Column("start_time", DateTime),
+)
+T0 = datetime(2024, 1, 1)
+
+
+@asynccontextmanager
+async def _session():
+    """与get_db相同的AsyncSession"""
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        # 每两条记录开始时间相同，验证排序键的第二列打破平局
+        await conn.execute(
+            history.insert(),
+            [
+                {"id": i, "device": f"d{i % 3}", "start_time": T0 + timedelta(i // 2)}
+                for i in range(1, 8)
+            ],
+        )
+    try:
+        async with AsyncSession(engine) as session:
+            yield session
+    finally:
+        await engine.dispose()
+
+
+async def _pages(stmt, keys, fields, limit, descending=False):
+    pages, cursor = [], None
+    async with _session() as session:
+        while True:
+            items, cursor = await keyset_page(
+                session, stmt, keys, fields, cursor, limit, descending=descending
+            )
+            pages.append(items)
+            if cursor is None:
+                return pages
+
+
+@pytest.mark.asyncio
+async def test_keyset_pages_cover_all_rows():
+    """测试按主键翻页不重不漏"""
+    keys = (history.c.id,)
+    stmt = select(*select_columns(history, ["device"], keys))
+    pages = await _pages(stmt, keys, ["device"], limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    # 只返回请求的字段，排序列只用于游标
+    assert pages[0][0] == {"device": "d1"}
+
+
+@pytest.mark.asyncio
+async def test_descending_composite_key():
+    """测试时间倒序加ID的复合排序键"""
+    keys = (history.c.start_time, history.c.id)
+    stmt = select(*select_columns(history, ["id"], keys))
+    pages = await _pages(stmt, keys, ["id"], limit=2, descending=True)
+    assert [row["id"] for page in pages for row in page] == [7, 6, 5, 4, 3, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_filters_apply_before_paging():
+    """测试过滤条件与游标同时生效"""
+    keys = (history.c.id,)
+    stmt = select(*select_columns(history, ["id"], keys)).where(
+        history.c.device == "d1"
+    )
+    pages = await _pages(stmt, keys, ["id"], limit=1)
+    assert [row["id"] for page in pages for row in page] == [1, 4, 7]
+
+
+def test_invalid_input_is_rejected():
+    """测试非法游标和未知字段"""
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor", (history.c.id,))
+    with pytest.raises(ValueError):
+        parse_fields("id,password", ("id", "name"))
+    assert parse_fields(None, ("id", "name")) == ["id", "name"]
+    assert parse_fields("name, id,name", ("id", "name")) == ["name", "id"]
+
+
+def test_etag_follows_version_and_query():
+    """测试ETag随版本号和查询参数变化"""
+    etag = make_etag("devices", 3, "/api/v1/devices/", "status=online", 1)
+    assert etag == make_etag("devices", 3, "/api/v1/devices/", "status=online", 1)
+    assert etag != make_etag("devices", 4, "/api/v1/devices/", "status=online", 1)
+    assert etag != make_etag("devices", 3, "/api/v1/devices/", "status=error", 1)
+    assert make_etag("devices", None, "/api/v1/devices/") is None
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag[2:]}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+class FakeRemote:
+    """模拟Redis计数器"""
+
+    def __init__(self):
+        self.values = {}
+        self.reads = 0
+
+    async def incr(self, key, amount=1):
+        self.reads += amount == 0
+        self.values[key] = self.values.get(key, 0) + amount
+        return self.values[key]
+
+
+class FakeNearCache:
+    """把失效通知转发给共享同一Redis的其它进程"""
+
+    def __init__(self, remote, peers):
+        self.remote = remote
+        self.peers = peers
+        self.listeners = []
+        peers.append(self)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    async def publish_invalidation(self, keys):
+        for peer in self.peers:
+            if peer is not self:
+                for listener in peer.listeners:
+                    listener(list(keys))
+
+
+@pytest.mark.asyncio
+async def test_collection_version_shared_between_workers():
+    """测试版本号在本地缓存，其它进程递增后失效"""
+    remote, peers = FakeRemote(), []
+    first = CollectionVersions(FakeNearCache(remote, peers), ttl=60)
+    second = CollectionVersions(FakeNearCache(remote, peers), ttl=60)
+
+    assert await first.get("devices") == 1
+    assert await second.get("devices") == 1
+    reads = remote.reads
+    # 版本未变化时不访问Redis
+    assert await second.get("devices") == 1
+    assert remote.reads == reads
+
+    await first.bump("devices")
+    assert await first.get("devices") == 2
+    assert await second.get("devices") == 2
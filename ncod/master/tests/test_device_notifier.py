@@ -0,0 +1,97 @@
+"""
+设备通知测试
+"""
+
+import asyncio
+import time
+
+from flask import Flask
+
+from ncod.core.notifier import MemoryNotificationQueue, Notification
+
+from ..device_notifier import DeviceNotifier
+from ..models import Device, DeviceNotification, Slave, db
+
+
+def test_recover_pending_resubmits_undelivered_channels(monkeypatch):
+    """测试重启后只重新提交尚未有结果且不在队列中的渠道"""
+    monkeypatch.setattr(DeviceNotifier, "_instance", None)
+    sent = []
+    for name in ("email", "sms"):
+        monkeypatch.setattr(
+            DeviceNotifier,
+            f"_send_{name}_notification",
+            lambda self, digest: sent.extend(
+                (digest.channel, item.meta["notification_id"]) for item in digest.items
+            ),
+        )
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        slave = Slave(hostname="s1", ip_address="10.0.0.1", mac_address="m")
+        db.session.add(slave)
+        db.session.flush()
+        device = Device(name="d1", type="dongle", slave_id=slave.id)
+        db.session.add(device)
+        db.session.flush()
+        for channels, delivered in (
+            # 邮件在重启前已发送
+            (["email", "sms"], ["email"]),
+            # 邮件仍在队列中
+            (["email"], []),
+            (["fax"], []),
+            (["email"], []),
+        ):
+            db.session.add(
+                DeviceNotification(
+                    device_id=device.id,
+                    notification_type="alert",
+                    message="alert",
+                    severity="major",
+                    channels=channels,
+                    delivered_channels=delivered,
+                    status="pending",
+                )
+            )
+        db.session.commit()
+
+    notifier = DeviceNotifier()
+    notifier.dispatcher.window = 0
+    # 重启前已持久化、尚未发送的通知
+    queue = notifier.dispatcher.queue = MemoryNotificationQueue()
+    asyncio.run(
+        queue.put(
+            Notification(
+                id="2:email",
+                channel="email",
+                recipient="email",
+                title="[major] alert",
+                body="alert",
+                meta={"notification_id": 2},
+            )
+        )
+    )
+
+    try:
+        with app.app_context():
+            assert notifier.recover_pending() == 4
+
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            with app.app_context():
+                if not DeviceNotification.query.filter_by(status="pending").count():
+                    break
+            time.sleep(0.01)
+
+        assert sorted(sent) == [("email", 2), ("email", 4), ("sms", 1)]
+        with app.app_context():
+            rows = DeviceNotification.query.order_by(DeviceNotification.id).all()
+            assert [row.status for row in rows] == ["sent", "sent", "failed", "sent"]
+            assert rows[0].delivered_channels == ["email", "sms"]
+    finally:
+        loop = notifier.dispatcher._loop
+        asyncio.run_coroutine_threadsafe(notifier.dispatcher.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,135 @@
+"""
+空闲设备索引测试
+"""
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from flask import Flask
+
+from .. import device_scheduler
+from ..device_scheduler import (
+    PLACEMENT_POLICIES,
+    AvailabilityIndex,
+    DeviceScheduler,
+    LeastLoadedPolicy,
+)
+from ..models import Device, DeviceUsage, Slave, db
+
+
+def _index():
+    index = AvailabilityIndex()
+    index.rebuild(
+        [(1, "dongle", 10), (2, "dongle", 10), (3, "dongle", 20), (4, "key", 20)],
+        [(1, 7)],
+    )
+    return index
+
+
+def test_acquire_least_loaded():
+    """测试优先选择负载最低的从服务器"""
+    index = _index()
+    assert index.acquire("dongle", LeastLoadedPolicy()) == 3
+    assert index.free_count("dongle") == 1
+    assert index.acquire("dongle", LeastLoadedPolicy()) == 2
+    assert index.acquire("dongle", LeastLoadedPolicy()) is None
+
+
+def test_usage_events_update_index():
+    """测试使用事件更新空闲集合"""
+    index = _index()
+    index.mark_free(1)
+    assert index.free_count("dongle", 10) == 2
+    index.mark_busy(3, user_id=8)
+    assert index.free_count("dongle", 20) == 0
+    assert index.slave_load(20) == 1
+    index.remove_device(2)
+    assert index.free_count("dongle") == 1
+
+
+def test_locality_prefers_last_slave():
+    """测试就近策略优先用户上次使用的从服务器"""
+    index = _index()
+    # 用户7正在使用从服务器10上的设备1
+    assert index.acquire("dongle", PLACEMENT_POLICIES["locality"], user_id=7) == 2
+    assert index.acquire("dongle", PLACEMENT_POLICIES["locality"], user_id=9) == 3
+
+
+def test_round_robin_cycles_slaves():
+    """测试轮询策略"""
+    index = AvailabilityIndex()
+    index.rebuild([(i, "dongle", i % 3) for i in range(9)], [])
+    policy = PLACEMENT_POLICIES["round_robin"]
+    slaves = [index._devices[index.acquire("dongle", policy)][1] for _ in range(6)]
+    assert slaves == [0, 1, 2, 0, 1, 2]
+
+
+def test_events_during_rebuild_are_replayed():
+    """测试重建期间的事件不会被旧快照覆盖"""
+    index = _index()
+    index.begin_rebuild()
+    index.mark_busy(2, user_id=9)
+    # 快照在事件之前读取，不包含设备2的占用
+    index.rebuild([(1, "dongle", 10), (2, "dongle", 10)], [])
+    assert index.free_count("dongle", 10) == 1
+
+
+def _scheduler(monkeypatch, use_device, device, in_use=None):
+    scheduler = DeviceScheduler()
+    scheduler.index = AvailabilityIndex()
+    scheduler.index.rebuild([(1, "dongle", 10)], [])
+    monkeypatch.setattr(device_scheduler.device_manager, "use_device", use_device)
+    monkeypatch.setattr(
+        device_scheduler, "Device", MagicMock(**{"query.get.return_value": device})
+    )
+    usage = MagicMock(**{"query.filter_by.return_value.first.return_value": in_use})
+    monkeypatch.setattr(device_scheduler, "DeviceUsage", usage)
+    return scheduler
+
+
+def test_transient_failure_keeps_device(monkeypatch):
+    """测试使用设备临时失败时设备放回空闲集合，重试成功"""
+    online = SimpleNamespace(status="online")
+    use_device = MagicMock(side_effect=[None, {"device_id": 1}])
+    scheduler = _scheduler(monkeypatch, use_device, online)
+
+    assert scheduler.schedule_device("dongle", 7) == {"device_id": 1}
+    assert use_device.call_count == 2
+    assert 1 in scheduler.index._devices
+
+
+def test_offline_device_removed(monkeypatch):
+    """测试设备已离线时移出索引"""
+    offline = SimpleNamespace(status="offline")
+    scheduler = _scheduler(monkeypatch, MagicMock(return_value=None), offline)
+
+    assert scheduler.schedule_device("dongle", 7) is None
+    assert scheduler.index._devices == {}
+
+
+def test_reconcile_reads_devices_and_usages():
+    """测试对账从设备表和使用记录表重建索引"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        slave = Slave(hostname="s1", ip_address="10.0.0.1", mac_address="m")
+        db.session.add(slave)
+        db.session.flush()
+        devices = [
+            Device(name=name, type="dongle", status=status, slave_id=slave.id)
+            for name, status in (("d1", "online"), ("d2", "online"), ("d3", "offline"))
+        ]
+        db.session.add_all(devices)
+        db.session.flush()
+        db.session.add(DeviceUsage(device_id=devices[0].id, user_id=7))
+        db.session.commit()
+        slave_id = slave.id
+
+        scheduler = DeviceScheduler()
+        scheduler.index = AvailabilityIndex()
+        scheduler.reconcile()
+
+    assert scheduler.index.free_count("dongle") == 1
+    assert scheduler.index.slave_load(slave_id) == 1
@@ -0,0 +1,150 @@
+"""
+设备每日统计桶测试
+"""
+
+from datetime import date, datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects import postgresql
+
+from .. import device_stats
+from ..device_stats import (
+    DeviceStatsManager,
+    _mean_std,
+    apply_deltas,
+    status_deltas,
+    sync_deltas,
+    upsert_statement,
+)
+from ..models import Device, DeviceStatsDaily, DeviceStatus, Slave, db
+
+
+def test_status_deltas():
+    """测试状态采样的累加增量"""
+    record = SimpleNamespace(
+        status="online",
+        cpu_usage=30.0,
+        memory_usage=50.0,
+        disk_usage=10.0,
+        network_usage=0.0,
+        temperature=None,
+    )
+    deltas = status_deltas(record)
+    assert deltas["status_count"] == 1
+    assert deltas["online_count"] == 1
+    assert deltas["cpu_usage_sq_sum"] == 900.0
+    # 缺失的温度不计入和与采样数
+    assert "temperature_sum" not in deltas
+    assert "temperature_count" not in deltas
+
+    record.temperature = 40.0
+    assert status_deltas(record)["temperature_count"] == 1
+
+
+def test_sync_deltas_track_status_transitions():
+    """测试同步状态变化时移出旧状态计数"""
+    assert sync_deltas(None, "pending", 3, created=True) == {
+        "sync_count": 1,
+        "sync_retry_sum": 3,
+    }
+    assert sync_deltas("pending", "completed") == {"sync_completed": 1}
+    assert sync_deltas("completed", "failed", -1) == {
+        "sync_retry_sum": -1,
+        "sync_completed": -1,
+        "sync_failed": 1,
+    }
+
+
+def test_mean_std_from_running_sums():
+    """测试由和与平方和计算均值和标准差"""
+    values = [10.0, 20.0, 30.0]
+    mean, std = _mean_std(sum(values), sum(v * v for v in values), len(values))
+    assert mean == 20.0
+    assert std == pytest.approx(8.165, abs=1e-3)
+    assert _mean_std(0.0, 0.0, 0) == (0.0, 0.0)
+
+
+def test_upsert_statement_postgresql():
+    """测试统计桶用一条INSERT ... ON CONFLICT累加"""
+    stmt = upsert_statement("postgresql", 1, date(2024, 1, 1), {"status_count": 1})
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (device_id, day) DO UPDATE" in sql
+    assert "status_count = (device_stats_daily.status_count + excluded" in sql
+
+
+def test_apply_deltas_accumulates():
+    """测试新桶插入，已有桶累加增量"""
+    engine = create_engine("sqlite://")
+    table = DeviceStatsDaily.__table__
+    table.create(engine)
+    day = date(2024, 1, 1)
+    with engine.begin() as connection:
+        apply_deltas(connection, 1, day, {"status_count": 1, "cpu_usage_sum": 30.0})
+        apply_deltas(connection, 1, day, {"status_count": 1, "cpu_usage_sum": 10.0})
+        row = connection.execute(select(table)).one()
+    assert (row.status_count, row.cpu_usage_sum, row.online_count) == (2, 40.0, 0)
+
+
+def test_temperature_mean_skips_missing_samples():
+    """测试温度均值只按有温度的采样计算"""
+    totals = {
+        "status_count": 4,
+        "temperature_sum": 80.0,
+        "temperature_sq_sum": 3200.0,
+        "temperature_count": 2,
+    }
+    stats = DeviceStatsManager._performance_stats(totals, datetime(2024, 1, 2))
+    assert stats["avg_temperature"] == 40.0
+    assert stats["std_temperature"] == 0.0
+
+
+def test_start_rebuilds_empty_buckets(monkeypatch):
+    """测试启动时统计桶为空则由已有记录重建，并注册定期刷新任务"""
+    scheduler = MagicMock()
+    monkeypatch.setattr(device_stats, "SchedulerManager", lambda: scheduler)
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        slave = Slave(hostname="s1", ip_address="10.0.0.1", mac_address="m")
+        db.session.add(slave)
+        db.session.flush()
+        device = Device(name="d1", type="dongle", slave_id=slave.id)
+        db.session.add(device)
+        db.session.flush()
+        # 部署统计桶之前写入的记录，不经过映射器事件
+        db.session.execute(
+            DeviceStatus.__table__.insert(),
+            [
+                {
+                    "device_id": device.id,
+                    "status": status,
+                    "cpu_usage": 20.0,
+                    "created_at": datetime.now(),
+                }
+                for status in ("online", "offline")
+            ],
+        )
+        db.session.commit()
+
+        manager = DeviceStatsManager()
+        manager.start()
+        bucket = DeviceStatsDaily.query.one()
+        assert (bucket.status_count, bucket.online_count) == (2, 1)
+        assert bucket.cpu_usage_sum == 40.0
+
+        # 已有统计桶时不再重建
+        manager.rebuild_daily_stats = MagicMock()
+        manager.start()
+        manager.rebuild_daily_stats.assert_not_called()
+        del manager.rebuild_daily_stats
+
+    assert scheduler.add_task.call_args.args[2] == "device_stats_refresh"
+    assert scheduler.add_task.call_args.kwargs["args"] == (
+        manager.update_all_device_stats,
+    )
@@ -0,0 +1,110 @@
+"""
+导出分块读取测试
+"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from ..models.device_stats import DeviceUsageStats
+from ..services import export_manager
+from ..services.export_manager import ExportManager, ExportSheet, ExportTask
+
+T0 = datetime(2024, 1, 1, 8, 30)
+
+
+@pytest.mark.asyncio
+async def test_chunks_include_null_sort_keys(monkeypatch):
+    """测试排序键为NULL的行在分块读取时不被跳过"""
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(DeviceUsageStats.__table__.create)
+        await conn.execute(
+            insert(DeviceUsageStats.__table__),
+            [
+                {"id": 1, "device_id": 1, "connection_count": 1, "updated_at": T0},
+                {"id": 2, "device_id": None, "connection_count": 2, "updated_at": None},
+                {"id": 3, "device_id": 2, "connection_count": 3, "updated_at": None},
+                {"id": 4, "device_id": None, "connection_count": 4, "updated_at": T0},
+                {"id": 5, "device_id": 3, "connection_count": 5, "updated_at": T0},
+            ],
+        )
+    monkeypatch.setattr(
+        export_manager, "async_session_maker", async_sessionmaker(engine)
+    )
+    manager = ExportManager.__new__(ExportManager)
+    manager.chunk_size = 2
+
+    async def read(sheet):
+        return [row async for rows in manager._iter_chunks(sheet) for row in rows]
+
+    try:
+        grouped = ExportSheet(
+            "设备统计",
+            [("设备ID", int), ("连接次数", int)],
+            select(
+                DeviceUsageStats.device_id, func.sum(DeviceUsageStats.connection_count)
+            ).group_by(DeviceUsageStats.device_id),
+            keys=(DeviceUsageStats.device_id,),
+            nullable=True,
+        )
+        assert await read(grouped) == [(1, 1), (2, 3), (3, 5), (None, 6)]
+
+        latest = ExportSheet(
+            "使用统计",
+            [("ID", int)],
+            select(DeviceUsageStats.id),
+            keys=(DeviceUsageStats.updated_at, DeviceUsageStats.id),
+            descending=True,
+            nullable=True,
+        )
+        assert await read(latest) == [(5,), (4,), (1,), (3,), (2,)]
+    finally:
+        await engine.dispose()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+
+    async def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def expire(self, key, seconds):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_task_status_visible_from_other_workers(monkeypatch):
+    """测试任务状态保存在Redis中，其他工作进程能查询进度"""
+    monkeypatch.setattr(export_manager.cache_manager, "redis", FakeRedis())
+    workers = []
+    for _ in range(2):
+        manager = ExportManager.__new__(ExportManager)
+        manager.tasks = {}
+        manager.export_dir = "exports"
+        manager.task_ttl = 60
+        workers.append(manager)
+
+    task = await workers[0].create_export_task("t1", "csv")
+    task.status = "processing"
+    task.total_rows = 10
+    task._rows_written = 4
+    await workers[0]._save(task)
+
+    loaded = await workers[1].get_task_status("t1")
+    assert isinstance(loaded, ExportTask)
+    assert (loaded.status, loaded.progress, loaded.file_path) == (
+        "processing",
+        40,
+        task.file_path,
+    )
+    assert loaded.error is None
+    assert await workers[1].get_task_status("missing") is None
@@ -0,0 +1,110 @@
+"""
+导出写入测试
+"""
+
+import csv
+import io
+import multiprocessing
+import queue
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from ..services.export_writer import XlsxWriter, file_suffix, media_type, run_writer
+
+SHEETS = [
+    ("统计", [("用户", str), ("时长", float)]),
+    ("记录", [("时间", datetime), ("操作", str)]),
+]
+T0 = datetime(2024, 1, 1, 8, 30)
+
+
+def _run(fmt, path, sheets, chunks):
+    items, errors = queue.Queue(), queue.Queue()
+    for chunk in chunks:
+        items.put(chunk)
+    items.put(None)
+    written = multiprocessing.Value("q", 0)
+    run_writer(fmt, str(path), sheets, items, written, errors)
+    return written.value
+
+
+def test_single_sheet_csv(tmp_path):
+    """测试单个工作表直接写为CSV，逐块追加"""
+    path = tmp_path / "out.csv"
+    written = _run(
+        "csv", path, SHEETS[:1], [(0, [("张三", 1.5)]), (0, [("李四", 2.0)])]
+    )
+    assert written == 2
+    rows = list(csv.reader(io.StringIO(path.read_text(encoding="utf-8-sig"))))
+    assert rows == [["用户", "时长"], ["张三", "1.5"], ["李四", "2.0"]]
+
+
+def test_multiple_sheets_csv_zip(tmp_path):
+    """测试多个工作表打包为zip，没有数据的工作表只有表头"""
+    path = tmp_path / "out.zip"
+    assert file_suffix("csv", len(SHEETS)) == "zip"
+    _run("csv", path, SHEETS, [(0, [("张三", 1.5)])])
+    with zipfile.ZipFile(path) as archive:
+        assert archive.namelist() == ["统计.csv", "记录.csv"]
+        assert archive.read("记录.csv").decode("utf-8-sig").strip() == "时间,操作"
+    assert media_type(str(path)) == "application/zip"
+
+
+def test_xlsx_constant_memory(tmp_path):
+    """测试xlsx按行写入多个工作表"""
+    pytest.importorskip("xlsxwriter")
+    openpyxl = pytest.importorskip("openpyxl")
+    path = tmp_path / "out.xlsx"
+    _run("xlsx", path, SHEETS, [(0, [("张三", 1.5)]), (1, [(T0, "connect")])])
+    workbook = openpyxl.load_workbook(path)
+    assert workbook.sheetnames == ["统计", "记录"]
+    assert list(workbook["记录"].values) == [("时间", "操作"), (T0, "connect")]
+
+
+def test_xlsx_full_sheet_continues(tmp_path, monkeypatch):
+    """测试xlsx工作表写满后在续表中继续写入，计数为实际写入的行数"""
+    pytest.importorskip("xlsxwriter")
+    openpyxl = pytest.importorskip("openpyxl")
+    monkeypatch.setattr(XlsxWriter, "MAX_ROWS", 3)
+    path = tmp_path / "out.xlsx"
+    rows = [(T0, f"op{i}") for i in range(5)]
+    assert _run("xlsx", path, SHEETS[1:], [(0, rows[:3]), (0, rows[3:])]) == 5
+    workbook = openpyxl.load_workbook(path)
+    assert workbook.sheetnames == ["记录", "记录 (2)", "记录 (3)"]
+    assert [list(workbook[name].values)[1:] for name in workbook.sheetnames] == [
+        rows[:2],
+        rows[2:4],
+        rows[4:],
+    ]
+    assert list(workbook["记录 (3)"].values)[0] == ("时间", "操作")
+
+
+def test_parquet_row_groups(tmp_path):
+    """测试每块数据写为Parquet行组，空值保留"""
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "out.parquet"
+    _run("parquet", path, SHEETS[1:], [(0, [(T0, None)]), (0, [(T0, "connect")])])
+    parquet = pq.ParquetFile(path)
+    assert parquet.num_row_groups == 2
+    assert parquet.read().to_pylist() == [
+        {"时间": T0, "操作": None},
+        {"时间": T0, "操作": "connect"},
+    ]
+
+
+def test_writer_error_is_reported(tmp_path):
+    """测试写入失败时错误信息交回主进程"""
+    items, errors = queue.Queue(), queue.Queue()
+    items.put((5, [("x",)]))
+    with pytest.raises(IndexError):
+        run_writer(
+            "csv",
+            str(tmp_path / "out.csv"),
+            SHEETS[:1],
+            items,
+            multiprocessing.Value("q", 0),
+            errors,
+        )
+    assert errors.get_nowait().startswith("IndexError")
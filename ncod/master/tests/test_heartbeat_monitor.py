@@ -0,0 +1,88 @@
+"""
+心跳监控测试
+"""
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from ..models.heartbeat import HeartbeatRecord
+from ..services import heartbeat_monitor
+from ..services.heartbeat_monitor import (
+    HeartbeatMonitor,
+    HeartbeatState,
+    upsert_statement,
+)
+
+
+def _monitor():
+    monitor = HeartbeatMonitor()
+    monitor.heartbeat_timeout = 30
+    monitor.retry_limit = 1
+    return monitor
+
+
+@pytest.mark.asyncio
+async def test_check_heartbeats_with_aware_and_naive_times():
+    """测试数据库加载的带时区时间与新心跳可以直接比较"""
+    monitor = _monitor()
+    stale = datetime.now(timezone.utc) - timedelta(minutes=5)
+    monitor._states["a"] = HeartbeatState("a", stale)
+    monitor._states["b"] = HeartbeatState("b", heartbeat_monitor._aware(stale))
+    await monitor.update_heartbeat("c")
+
+    await monitor._check_heartbeats()
+    await monitor._check_heartbeats()
+
+    assert set(monitor.get_offline_slaves()) == {"a", "b"}
+    assert monitor.is_alive("c")
+    assert monitor._states["c"].last_beat_time.tzinfo is not None
+
+
+def test_upsert_statement_postgresql():
+    """测试写回语句按slave_id冲突时更新"""
+    sql = str(upsert_statement("postgresql").compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (slave_id) DO UPDATE" in sql
+
+
+@pytest.mark.asyncio
+async def test_flush_inserts_new_slaves(monkeypatch):
+    """测试新注册的从服务器由flush插入，已有记录被更新"""
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(HeartbeatRecord.__table__.create)
+    sessions = async_sessionmaker(engine)
+
+    @asynccontextmanager
+    async def session_factory():
+        async with sessions() as session:
+            yield session
+
+    monkeypatch.setattr(heartbeat_monitor, "async_session", session_factory)
+    try:
+        monitor = _monitor()
+        await monitor.update_heartbeat("a", "10.0.0.1")
+        await monitor.update_heartbeat("b")
+        assert await monitor.flush() == 2
+
+        monitor._handle_failed_heartbeat(monitor._states["a"])
+        assert await monitor.flush() == 1
+
+        async with sessions() as session:
+            result = await session.execute(
+                select(HeartbeatRecord).order_by(HeartbeatRecord.slave_id)
+            )
+            records = result.scalars().all()
+        assert [(r.slave_id, r.status) for r in records] == [
+            ("a", "offline"),
+            ("b", "online"),
+        ]
+        assert records[0].ip_address == "10.0.0.1"
+    finally:
+        await engine.dispose()
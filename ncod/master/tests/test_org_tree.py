@@ -0,0 +1,146 @@
+"""
+组织树测试
+"""
+
+from contextlib import asynccontextmanager
+
+import pytest
+
+from ..models.organization import Organization
+from ..services.organization import OrganizationService, OrganizationTree
+
+
+def _row(org_id, path, name=None):
+    ids = Organization.path_ids(path)
+    return {
+        "id": org_id,
+        "name": name or f"org{org_id}",
+        "parent_id": ids[-2] if len(ids) > 1 else None,
+        "level": len(ids) - 1,
+        "path": path,
+    }
+
+
+def _tree():
+    # 乱序输入，子节点先于父节点出现
+    return OrganizationTree(
+        [
+            _row(12, "/1/10/12/"),
+            _row(1, "/1/"),
+            _row(10, "/1/10/"),
+            _row(2, "/1/2/"),
+            _row(11, "/1/10/11/"),
+            _row(3, "/3/"),
+        ]
+    )
+
+
+def test_path_helpers():
+    """测试物化路径的生成与解析"""
+    parent = Organization(id=10, level=1, path="/1/10/")
+    child = Organization(id=12)
+    child.attach(parent)
+    assert child.path == "/1/10/12/"
+    assert child.level == 2
+    assert child.parent_id == 10
+    assert Organization.path_ids(child.path) == [1, 10, 12]
+    assert parent.is_ancestor_of(child)
+    assert not child.is_ancestor_of(parent)
+    assert Organization.child_path(None, 3) == "/3/"
+
+
+def test_subtree_and_ancestors():
+    """测试子树与祖先在内存中计算"""
+    tree = _tree()
+    assert tree.subtree_ids(1) == [1, 2, 10, 11, 12]
+    assert tree.subtree_ids(10) == [10, 11, 12]
+    assert tree.subtree_ids(99) == []
+    assert tree.ancestor_ids(12) == [1, 10]
+    assert tree.ancestor_ids(3) == []
+
+
+def test_is_within_does_not_match_sibling_prefix():
+    """测试路径前缀以分隔符结尾，/1/不会匹配/10/"""
+    tree = OrganizationTree([_row(1, "/1/"), _row(10, "/10/"), _row(5, "/1/5/")])
+    assert tree.is_within(5, 1)
+    assert tree.is_within(1, 1)
+    assert not tree.is_within(10, 1)
+    assert not tree.is_within(1, 5)
+    assert not tree.is_within(1, 99)
+
+
+def test_nested_tree():
+    """测试嵌套结构一次构建"""
+    tree = _tree()
+    roots = tree.to_tree()
+    assert [node["id"] for node in roots] == [1, 3]
+    assert [node["id"] for node in roots[0]["children"]] == [2, 10]
+    assert [node["id"] for node in roots[0]["children"][1]["children"]] == [11, 12]
+    assert "children" not in roots[1]
+
+    subtree = tree.to_tree(10)
+    assert [node["id"] for node in subtree] == [10]
+    assert tree.to_tree(99) == []
+
+
+def test_missing_paths_derived_from_parent():
+    """测试路径尚未回填的组织按parent_id推导，成环的组织被忽略"""
+    rows = [
+        {"id": 12, "name": "c", "parent_id": 10, "level": 0, "path": None},
+        {"id": 10, "name": "b", "parent_id": 1, "level": 0, "path": None},
+        _row(1, "/1/"),
+        # 父组织已删除
+        {"id": 7, "name": "d", "parent_id": 99, "level": 3, "path": None},
+        {"id": 20, "name": "x", "parent_id": 21, "level": 0, "path": None},
+        {"id": 21, "name": "y", "parent_id": 20, "level": 0, "path": None},
+    ]
+    tree = OrganizationTree(rows)
+
+    assert tree.path(12) == "/1/10/12/"
+    assert tree.get(12)["level"] == 2
+    assert tree.subtree_ids(1) == [1, 10, 12]
+    assert [node["id"] for node in tree.to_tree()] == [1, 7]
+    assert tree.path(7) == "/7/"
+    assert 20 not in tree and 21 not in tree
+    assert rows[0]["path"] is None
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeTransaction:
+    """查询用户所属组织时返回固定的组织ID"""
+
+    def __init__(self, org_ids):
+        self.org_ids = org_ids
+
+    @asynccontextmanager
+    async def transaction(self):
+        rows = [(org_id,) for org_id in self.org_ids]
+
+        class Session:
+            async def execute(self, stmt):
+                return FakeResult(rows)
+
+        yield Session()
+
+
+@pytest.mark.asyncio
+async def test_user_within_member_subtrees():
+    """测试用户只能访问所属组织及其下级组织"""
+    service = OrganizationService()
+    service.transaction = FakeTransaction(["10", "3"])
+
+    async def get_tree(refresh=False):
+        return _tree()
+
+    service.get_tree = get_tree
+    assert await service.user_within("u1", 12)
+    assert await service.user_within("u1", 3)
+    assert not await service.user_within("u1", 1)
+    assert not await service.user_within("u1", 2)
@@ -0,0 +1,140 @@
+"""
+角色变更后的权限失效测试
+"""
+
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from ncod.core.cache.permission import PermissionEngine
+
+from ..services import role as role_module
+from ..services.permission import PermissionService
+from ..services.role import RoleService
+
+
+class FakeRemote:
+    def __init__(self):
+        self.values = {}
+
+    async def incr(self, key, amount=1):
+        self.values[key] = self.values.get(key, 0) + amount
+        return self.values[key]
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+class FakeNearCache:
+    """把失效通知转发给共享同一Redis的其它进程"""
+
+    def __init__(self, remote, peers):
+        self.remote = remote
+        self.peers = peers
+        self.listeners = []
+        peers.append(self)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    async def start(self):
+        pass
+
+    async def publish_invalidation(self, keys):
+        for peer in self.peers:
+            if peer is not self:
+                for listener in peer.listeners:
+                    listener(list(keys))
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """按ID保存角色，查询总是返回全部角色"""
+
+    def __init__(self, roles):
+        self.roles = roles
+
+    async def get(self, model, role_id):
+        return self.roles.get(role_id)
+
+    async def execute(self, stmt):
+        return FakeResult(list(self.roles.values()))
+
+    async def delete(self, role):
+        del self.roles[role.id]
+
+    async def commit(self):
+        pass
+
+    async def refresh(self, obj):
+        pass
+
+
+class FakeTransaction:
+    def __init__(self, roles):
+        self.session = FakeSession(roles)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield self.session
+
+
+def _permission(code):
+    return SimpleNamespace(code=code)
+
+
+@pytest.mark.asyncio
+async def test_role_revoke_takes_effect_on_all_workers(monkeypatch):
+    """测试角色撤销权限或被删除后，所有工作进程的下一次判定立即生效"""
+    role = SimpleNamespace(
+        id="r1",
+        name="operator",
+        is_system=False,
+        permissions=[_permission("device:read"), _permission("device:write")],
+    )
+    transaction = FakeTransaction({"r1": role})
+    remote, peers = FakeRemote(), []
+    workers = []
+    for _ in range(2):
+        service = PermissionService(PermissionEngine(FakeNearCache(remote, peers)))
+        service.transaction = transaction
+        service.engine.compile_role("operator", ["device:read", "device:write"])
+        service.engine.set_user("u1", ["operator"])
+        workers.append(service)
+
+    async def get_by_code(session, code):
+        return _permission(code)
+
+    monkeypatch.setattr(role_module.Permission, "get_by_code", get_by_code)
+    roles = RoleService(permissions=workers[0])
+    roles.transaction = transaction
+    try:
+        for worker in workers:
+            assert await worker.check_permission("u1", ["device:write"])
+
+        ok, _, _ = await roles.update_role("r1", {"permissions": ["device:read"]})
+        assert ok
+        for worker in workers:
+            assert not await worker.check_permission("u1", ["device:write"])
+            assert await worker.check_permission("u1", ["device:read"])
+
+        assert (await roles.delete_role("r1"))[0]
+        for worker in workers:
+            assert not await worker.check_permission("u1", ["device:read"])
+    finally:
+        for worker in workers:
+            await worker.engine.stop()
@@ -0,0 +1,90 @@
+"""
+任务调度器测试
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ..scheduler_manager import SchedulerManager, Task
+
+
+@pytest.fixture
+def scheduler():
+    manager = SchedulerManager()
+    manager.start()
+    yield manager
+    for task in manager.get_all_tasks():
+        manager._tasks.pop(task["name"], None)
+    manager.stop()
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_runs_sync_and_async_jobs(scheduler):
+    """测试阻塞任务在线程池、协程任务在事件循环上运行"""
+    threads = set()
+    async_runs = []
+
+    def blocking():
+        threads.add(threading.current_thread().name)
+
+    async def coroutine():
+        async_runs.append(asyncio.get_running_loop())
+
+    scheduler.add_task(blocking, 0.05, "blocking")
+    scheduler.add_task(coroutine, 0.05, "coroutine")
+
+    assert _wait_for(lambda: len(async_runs) >= 3)
+    assert all(name.startswith("scheduler") for name in threads)
+    stats = scheduler.get_task("coroutine")["stats"]
+    assert stats["runs"] >= 3
+    assert sum(stats["histogram"].values()) == stats["runs"]
+
+
+def test_slow_job_does_not_pile_up(scheduler):
+    """测试上一次未结束时不会重复启动"""
+    active = []
+    overlaps = []
+
+    def slow():
+        overlaps.append(len(active))
+        active.append(1)
+        time.sleep(0.2)
+        active.pop()
+
+    scheduler.add_task(slow, 0.05, "slow")
+    assert _wait_for(lambda: scheduler.get_task("slow")["stats"]["missed"] >= 2)
+    assert max(overlaps) == 0
+
+
+def test_timeout_counted(scheduler):
+    """测试单次运行超时"""
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    scheduler.add_task(hang, 60, "hang", timeout=0.05)
+    assert _wait_for(lambda: scheduler.get_task("hang")["stats"]["timeouts"] == 1)
+    assert not scheduler.get_task("hang")["is_running"]
+
+
+def test_coalesce_skips_missed_slots():
+    """测试错过的节拍合并为一次，且不随运行耗时漂移"""
+    task = Task(lambda: None, 10, "t")
+    start = task.due
+    task.update_schedule(start + 35)
+    assert task.due == start + 40
+    assert task.stats.missed == 3
+
+    catch_up = Task(lambda: None, 10, "c", coalesce=False)
+    start = catch_up.due
+    catch_up.update_schedule(start + 35)
+    assert catch_up.due == start + 10
@@ -0,0 +1,210 @@
+"""
+WebSocket扇出测试
+"""
+
+import asyncio
+import json
+from unittest.mock import AsyncMock
+
+import pytest
+
+from ..websocket.auth import TopicAuthorizer
+from ..websocket.hub import FanoutHub, device_topic
+from ..websocket.server import WebSocketServer
+
+
+class FakeWebSocket:
+    """模拟WebSocket连接"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed = False
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(text))
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeRedis:
+    """多个hub共用的内存pub/sub"""
+
+    def __init__(self):
+        self.hubs = []
+
+    async def publish(self, channel, data):
+        message = json.loads(data)
+        for hub in self.hubs:
+            if hub.node_id != message["origin"]:
+                hub._fanout(message["topics"], message["text"], message["key"])
+
+
+@pytest.mark.asyncio
+async def test_publish_by_topic_once_per_connection():
+    """测试按主题分发，订阅多个主题的连接只收到一次"""
+    hub = FanoutHub()
+    a, b = FakeWebSocket(), FakeWebSocket()
+    hub.register(a, "a", [device_topic(1), "slave:1"])
+    hub.register(b, "b", [device_topic(2)])
+
+    assert await hub.publish([device_topic(1), "slave:1"], {"v": 1}) == 1
+    await asyncio.sleep(0.01)
+    assert a.sent == [{"v": 1}]
+    assert b.sent == []
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_slow_connection_does_not_block_others():
+    """测试慢连接只丢弃自己的旧消息"""
+    hub = FanoutHub(queue_size=2)
+    slow, fast = FakeWebSocket(), FakeWebSocket()
+    slow.gate.clear()
+    hub.register(slow, "slow", ["all"])
+    hub.register(fast, "fast", ["all"])
+
+    for i in range(5):
+        await hub.publish("all", {"seq": i})
+        await asyncio.sleep(0.01)
+    assert [m["seq"] for m in fast.sent] == [0, 1, 2, 3, 4]
+
+    slow.gate.set()
+    await asyncio.sleep(0.01)
+    # 第一条已在发送中，队列只保留最新的两条
+    assert [m["seq"] for m in slow.sent] == [0, 3, 4]
+    assert hub.get("slow").dropped == 2
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_conflation_keeps_latest_status():
+    """测试相同合并键的状态在队列中被替换"""
+    hub = FanoutHub()
+    ws = FakeWebSocket()
+    ws.gate.clear()
+    hub.register(ws, "c", [device_topic(1)])
+
+    await hub.publish(device_topic(1), {"status": "busy"}, conflate_key="d1")
+    await asyncio.sleep(0.01)
+    for status in ("idle", "offline", "online"):
+        await hub.publish(device_topic(1), {"status": status}, conflate_key="d1")
+    await hub.publish(device_topic(1), {"event": "log"})
+
+    ws.gate.set()
+    await asyncio.sleep(0.01)
+    assert ws.sent == [{"status": "busy"}, {"status": "online"}, {"event": "log"}]
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_send_timeout_unregisters_connection():
+    """测试发送超时的连接被关闭并注销"""
+    hub = FanoutHub(send_timeout=0.01)
+    ws = FakeWebSocket()
+    ws.gate.clear()
+    hub.register(ws, "stuck", ["all"])
+
+    await hub.publish("all", {"v": 1})
+    await asyncio.sleep(0.05)
+    assert ws.closed
+    assert hub.get("stuck") is None
+    assert hub.connection_count == 0
+
+
+@pytest.mark.asyncio
+async def test_cross_worker_delivery():
+    """测试消息经Redis转发给其他worker的连接"""
+    redis = FakeRedis()
+    first, second = FanoutHub(redis=redis), FanoutHub(redis=redis)
+    redis.hubs = [first, second]
+    local, remote = FakeWebSocket(), FakeWebSocket()
+    first.register(local, "local", ["alerts:critical"])
+    second.register(remote, "remote", ["alerts:critical"])
+
+    await first.publish("alerts:critical", {"alert": 1})
+    await asyncio.sleep(0.01)
+    assert local.sent == remote.sent == [{"alert": 1}]
+    await first.stop()
+    await second.stop()
+
+
+@pytest.mark.asyncio
+async def test_unauthorized_subscription_rejected():
+    """测试未授权的主题不被订阅，客户端收到拒绝消息"""
+
+    async def authorize(user_id, topic):
+        return user_id == "u1" and topic == device_topic(1)
+
+    hub = FanoutHub()
+    server = WebSocketServer(hub, authorize=authorize)
+    ws = FakeWebSocket()
+    await server.connect(ws, "c")
+    server.connection_users["c"] = "u1"
+
+    await server.handle_message(
+        "c", json.dumps({"type": "subscribe", "topics": ["device:1", "device:2"]})
+    )
+    await hub.publish(device_topic(2), {"v": 2})
+    await hub.publish(device_topic(1), {"v": 1})
+    await asyncio.sleep(0.01)
+
+    assert ws.sent == [
+        {"type": "subscribe_rejected", "topics": ["device:2"]},
+        {"v": 1},
+    ]
+    assert hub.get("c").topics == {"all", "device:1"}
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_subscribe_device_goes_through_authorizer():
+    """测试按设备订阅同样经过主题授权"""
+    checked = []
+
+    async def authorize(user_id, topic):
+        checked.append((user_id, topic))
+        return topic == device_topic(1)
+
+    hub = FanoutHub()
+    server = WebSocketServer(hub, authorize=authorize)
+    await server.connect(FakeWebSocket(), "c")
+    server.connection_users["c"] = "u1"
+
+    assert await server.subscribe_device("c", 1)
+    assert not await server.subscribe_device("c", 2)
+    assert checked == [("u1", "device:1"), ("u1", "device:2")]
+    assert hub.get("c").topics == {"all", "device:1"}
+    await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_topic_authorizer_checks_permission_and_org():
+    """测试主题按权限和设备所属组织授权"""
+    permissions = AsyncMock()
+    permissions.check_permission.side_effect = (
+        lambda user_id, codes: user_id == "u1" and codes != ["system:view"]
+    )
+    authorizer = TopicAuthorizer(permissions, AsyncMock())
+    authorizer._device_visible = AsyncMock(side_effect=lambda u, d: d == "1")
+
+    assert await authorizer.authorize(None, "all")
+    assert await authorizer.authorize("u1", "alerts:critical")
+    assert await authorizer.authorize("u1", device_topic(1))
+    # 设备不在用户组织子树内
+    assert not await authorizer.authorize("u1", device_topic(2))
+    # 没有权限
+    assert not await authorizer.authorize("u2", device_topic(1))
+    assert not await authorizer.authorize("u1", "slave:3")
+    # 未登录或未知前缀
+    assert not await authorizer.authorize(None, "alerts:critical")
+    assert not await authorizer.authorize("u1", "metrics:1")
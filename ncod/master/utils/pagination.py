@@ -0,0 +1,121 @@
+"""列表接口的键集分页、字段投影与条件请求"""
+
+import base64
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import DateTime, tuple_
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """把上一页最后一行的排序键编码为游标"""
+    data = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, keys: Sequence[Any]) -> List[Any]:
+    """解析游标，按排序列的类型还原取值，格式不对时抛出ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Invalid cursor")
+    return [_load(key, value) for key, value in zip(keys, values)]
+
+
+def _load(key, value: Any) -> Any:
+    if value is not None and isinstance(key.type, DateTime):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """解析稀疏字段参数(逗号分隔)，为空时返回全部允许的字段"""
+    if not fields:
+        return list(allowed)
+    names = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def select_columns(table, names: Iterable[str], keys: Sequence[Any]) -> List[Any]:
+    """需要查询的列：请求的字段加上分页所需的排序列"""
+    return [table.c[name] for name in dict.fromkeys([*names, *(k.key for k in keys)])]
+
+
+def seek(stmt, keys: Sequence[Any], values: Optional[Sequence[Any]], descending=False):
+    """按排序键排序，并从values之后(不含)开始"""
+    if values is not None:
+        key, bound = tuple_(*keys), tuple_(*values)
+        stmt = stmt.where(key < bound if descending else key > bound)
+    return stmt.order_by(*[k.desc() if descending else k.asc() for k in keys])
+
+
+async def keyset_page(
+    session,
+    stmt,
+    keys: Sequence[Any],
+    fields: Sequence[str],
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    descending: bool = False,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """按排序键分页执行查询
+
+    以 (k1, k2) > (v1, v2) 定位下一页，翻页代价与页码无关；排序键的最后一列
+    必须唯一(通常为主键)。多查询一行判断是否还有下一页。session为AsyncSession。
+
+    Returns:
+        (只含请求字段的行, 下一页游标)，没有下一页时游标为None
+    """
+    values = decode_cursor(cursor, keys) if cursor else None
+    stmt = seek(stmt, keys, values, descending)
+    rows = (await session.execute(stmt.limit(limit + 1))).mappings().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][k.key] for k in keys])
+    return [{name: row[name] for name in fields} for row in rows], next_cursor
+
+
+def make_etag(
+    collection: str, version: Optional[int], *parts: Any, max_age: int = 0
+) -> Optional[str]:
+    """由集合版本号和请求参数生成弱ETag，版本号不可用时返回None
+
+    max_age大于0时ETag每max_age秒轮换一次，未递增版本号的写入路径最多在这段
+    时间后可见。
+    """
+    if version is None:
+        return None
+    if max_age > 0:
+        parts = (*parts, int(time.time() // max_age))
+    text = "\n".join(str(part) for part in parts)
+    digest = hashlib.sha1(text.encode()).hexdigest()[:16]
+    return f'W/"{collection}-{version}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-Match是否命中(弱比较)"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
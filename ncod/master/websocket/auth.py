@@ -0,0 +1,80 @@
+"""WebSocket主题订阅授权"""
+
+from typing import List, Optional
+from sqlalchemy import select
+from ncod.core.logger import setup_logger
+from ncod.core.db.transaction import transaction_manager
+from ncod.master.models.device import Device
+from ncod.master.models.user import user_organizations
+from ncod.master.services.organization import OrganizationService
+from ncod.master.services.permission import PermissionService
+from ncod.master.websocket.hub import BROADCAST_TOPIC
+
+logger = setup_logger("websocket_auth")
+
+# 主题前缀 -> 订阅所需的权限代码
+TOPIC_PERMISSIONS = {
+    "device": "device:view",
+    "slave": "system:view",
+    "alerts": "alert:view",
+}
+
+
+class TopicAuthorizer:
+    """WebSocket主题订阅授权
+
+    广播主题对所有连接开放，其余主题按前缀要求相应权限；设备主题还要求
+    设备属于用户所在组织(含下级组织)。未知前缀的主题一律拒绝。
+    """
+
+    def __init__(
+        self,
+        permission_service: Optional[PermissionService] = None,
+        organization_service: Optional[OrganizationService] = None,
+    ):
+        self.transaction = transaction_manager
+        self.permission_service = permission_service or PermissionService()
+        self.organization_service = organization_service or OrganizationService()
+
+    async def authorize(self, user_id: Optional[str], topic: str) -> bool:
+        """判断用户能否订阅主题"""
+        if topic == BROADCAST_TOPIC:
+            return True
+        if user_id is None or not isinstance(topic, str):
+            return False
+
+        kind, _, key = topic.partition(":")
+        permission = TOPIC_PERMISSIONS.get(kind)
+        if permission is None or not key:
+            return False
+        try:
+            if not await self.permission_service.check_permission(
+                user_id, [permission]
+            ):
+                return False
+            if kind == "device":
+                return await self._device_visible(user_id, key)
+            return True
+        except Exception as e:
+            logger.error(f"Error authorizing topic {topic} for {user_id}: {e}")
+            return False
+
+    async def _device_visible(self, user_id: str, device_id: str) -> bool:
+        """设备是否属于用户所在组织的子树"""
+        async with self.transaction.transaction() as session:
+            org_id = await session.scalar(
+                select(Device.organization_id).where(Device.id == device_id)
+            )
+            if org_id is None:
+                return False
+            result = await session.execute(
+                select(user_organizations.c.organization_id).where(
+                    user_organizations.c.user_id == user_id
+                )
+            )
+            user_orgs: List[int] = [int(row[0]) for row in result.all()]
+
+        for user_org in user_orgs:
+            if await self.organization_service.is_within(org_id, user_org):
+                return True
+        return False
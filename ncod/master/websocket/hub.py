@@ -0,0 +1,306 @@
+"""WebSocket消息扇出
+
+消息按主题(设备、从服务器、告警级别等)分发，每条消息只序列化一次。
+每个连接有独立的有界发送队列和发送协程，慢连接只会丢弃自己队列中最旧的
+消息，不会阻塞其他订阅者；带合并键的消息(如设备状态)在队列中只保留最新
+一条。配置Redis后，消息通过pub/sub转发给其他worker上的连接。
+"""
+
+import asyncio
+import json
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Union
+from fastapi import WebSocket
+from ncod.core.logger import setup_logger
+
+logger = setup_logger("websocket_hub")
+
+# 所有连接默认订阅的主题
+BROADCAST_TOPIC = "all"
+
+
+def device_topic(device_id: Any) -> str:
+    return f"device:{device_id}"
+
+
+def slave_topic(slave_id: Any) -> str:
+    return f"slave:{slave_id}"
+
+
+def alert_topic(level: str) -> str:
+    return f"alerts:{level}"
+
+
+class Subscriber:
+    """单个WebSocket连接的发送队列"""
+
+    def __init__(
+        self,
+        hub: "FanoutHub",
+        websocket: WebSocket,
+        client_id: str,
+        queue_size: int = 256,
+        send_timeout: float = 5.0,
+    ):
+        self.hub = hub
+        self.websocket = websocket
+        self.client_id = client_id
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.topics: Set[str] = set()
+        self.closed = False
+        self.dropped = 0
+        self.conflated = 0
+        # 队列条目为 [合并键, 文本]，合并时原地替换文本，保持队列位置
+        self._queue: Deque[List[Optional[str]]] = deque()
+        self._pending: Dict[str, List[Optional[str]]] = {}
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        self.closed = True
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def offer(self, text: str, key: Optional[str] = None) -> bool:
+        """放入发送队列，不等待发送"""
+        if self.closed:
+            return False
+        if key is not None:
+            entry = self._pending.get(key)
+            if entry is not None:
+                entry[1] = text
+                self.conflated += 1
+                return True
+        if len(self._queue) >= self.queue_size:
+            oldest = self._queue.popleft()
+            if oldest[0] is not None:
+                self._pending.pop(oldest[0], None)
+            self.dropped += 1
+        entry = [key, text]
+        self._queue.append(entry)
+        if key is not None:
+            self._pending[key] = entry
+        self._ready.set()
+        return True
+
+    async def _run(self) -> None:
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    key, text = self._queue.popleft()
+                    if key is not None:
+                        self._pending.pop(key, None)
+                    await self._send(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 发送超时或连接已断开，关闭连接让客户端重连
+            logger.warning(f"Dropping websocket client {self.client_id}: {e}")
+            self.hub.unregister(self.client_id, self)
+            try:
+                await self.websocket.close()
+            except Exception:
+                pass
+
+    async def _send(self, text: str) -> None:
+        # 不用wait_for: 发送恰好完成时它会吞掉外层的取消，发送协程无法退出
+        send = asyncio.ensure_future(self.websocket.send_text(text))
+        try:
+            done, _ = await asyncio.wait((send,), timeout=self.send_timeout)
+        finally:
+            if not send.done():
+                send.cancel()
+        if not done:
+            raise asyncio.TimeoutError(f"send timed out after {self.send_timeout}s")
+        send.result()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "client_id": self.client_id,
+            "topics": sorted(self.topics),
+            "queued": len(self._queue),
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+        }
+
+
+class FanoutHub:
+    """按主题扇出WebSocket消息"""
+
+    def __init__(
+        self,
+        redis=None,
+        channel: str = "ws:fanout",
+        queue_size: int = 256,
+        send_timeout: float = 5.0,
+    ):
+        self.redis = redis
+        self.channel = channel
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        # 区分本worker发出的Redis消息
+        self.node_id = uuid.uuid4().hex
+        self._subscribers: Dict[str, Subscriber] = {}
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._subscribers)
+
+    def register(
+        self, websocket: WebSocket, client_id: str, topics: Iterable[str] = ()
+    ) -> Subscriber:
+        """登记已接受的连接并启动其发送协程"""
+        self.unregister(client_id)
+        subscriber = Subscriber(
+            self, websocket, client_id, self.queue_size, self.send_timeout
+        )
+        self._subscribers[client_id] = subscriber
+        self.subscribe(client_id, *topics)
+        subscriber.start()
+        return subscriber
+
+    def unregister(
+        self, client_id: str, subscriber: Optional[Subscriber] = None
+    ) -> Optional[Subscriber]:
+        """注销连接，subscriber不为空时只在仍是同一连接时注销"""
+        current = self._subscribers.get(client_id)
+        if current is None or (subscriber is not None and current is not subscriber):
+            return None
+        del self._subscribers[client_id]
+        self.unsubscribe(client_id, *current.topics)
+        current.stop()
+        return current
+
+    def get(self, client_id: str) -> Optional[Subscriber]:
+        return self._subscribers.get(client_id)
+
+    def subscribe(self, client_id: str, *topics: str) -> None:
+        subscriber = self._subscribers.get(client_id)
+        if subscriber is None:
+            return
+        for topic in topics:
+            subscriber.topics.add(topic)
+            self._topics.setdefault(topic, set()).add(subscriber)
+
+    def unsubscribe(self, client_id: str, *topics: str) -> None:
+        subscriber = self._subscribers.get(client_id)
+        if subscriber is None:
+            return
+        for topic in list(topics):
+            subscriber.topics.discard(topic)
+            members = self._topics.get(topic)
+            if members is not None:
+                members.discard(subscriber)
+                if not members:
+                    del self._topics[topic]
+
+    async def publish(
+        self,
+        topics: Union[str, Iterable[str]],
+        message: Union[str, Dict[str, Any]],
+        conflate_key: Optional[str] = None,
+    ) -> int:
+        """发布消息，返回本worker上收到消息的连接数
+
+        Args:
+            topics: 主题或主题列表，同时订阅多个主题的连接只收到一次
+            message: 消息，字典只序列化一次
+            conflate_key: 合并键，队列中相同键的旧消息被替换
+        """
+        topics = [topics] if isinstance(topics, str) else list(topics)
+        text = message if isinstance(message, str) else json.dumps(message, default=str)
+        delivered = self._fanout(topics, text, conflate_key)
+        if self.redis is not None:
+            try:
+                await self.redis.publish(
+                    self.channel,
+                    json.dumps(
+                        {
+                            "origin": self.node_id,
+                            "topics": topics,
+                            "key": conflate_key,
+                            "text": text,
+                        }
+                    ),
+                )
+            except Exception as e:
+                logger.error(f"Error publishing websocket message to redis: {e}")
+        return delivered
+
+    def _fanout(self, topics: List[str], text: str, key: Optional[str]) -> int:
+        if len(topics) == 1:
+            targets: Iterable[Subscriber] = self._topics.get(topics[0], ())
+        else:
+            targets = set()
+            for topic in topics:
+                targets.update(self._topics.get(topic, ()))
+        delivered = 0
+        for subscriber in list(targets):
+            if subscriber.offer(text, key):
+                delivered += 1
+        return delivered
+
+    async def start(self) -> None:
+        """启动Redis订阅，未配置Redis时只在本worker内分发"""
+        if self.redis is None:
+            from ncod.core.cache.manager import cache_manager
+
+            self.redis = cache_manager.redis
+        if self.redis is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        for client_id in list(self._subscribers):
+            self.unregister(client_id)
+
+    async def _listen(self) -> None:
+        """接收其他worker发布的消息"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message is None:
+                        continue
+                    data = json.loads(message["data"])
+                    if data.get("origin") == self.node_id:
+                        continue
+                    self._fanout(data["topics"], data["text"], data.get("key"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in websocket redis listener: {e}")
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.unsubscribe(self.channel)
+                except Exception:
+                    pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self._subscribers),
+            "topics": {topic: len(members) for topic, members in self._topics.items()},
+            "dropped": sum(s.dropped for s in self._subscribers.values()),
+            "conflated": sum(s.conflated for s in self._subscribers.values()),
+        }
+
+
+# 全局扇出实例，WebSocketServer和WebSocketManager共用
+fanout_hub = FanoutHub()
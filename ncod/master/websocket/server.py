@@ -2,26 +2,59 @@
 
 import asyncio
 import json
-from typing import Dict, Set
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
 from fastapi import WebSocket, WebSocketDisconnect
 from ncod.core.logger import setup_logger
 from ncod.master.sync.handler import SyncHandler
+from ncod.master.websocket.auth import TopicAuthorizer
+from ncod.master.websocket.hub import (
+    BROADCAST_TOPIC,
+    FanoutHub,
+    alert_topic,
+    device_topic,
+    fanout_hub,
+    slave_topic,
+)
 
 logger = setup_logger("websocket_server")
 
 
 class WebSocketServer:
-    """WebSocket服务器"""
+    """WebSocket服务器
 
-    def __init__(self):
+    消息通过FanoutHub按主题发送，每个连接有自己的发送队列，广播不等待
+    任何一个连接发送完成。客户端订阅的主题先经过授权，未授权的主题被拒绝
+    并回复subscribe_rejected。
+    """
+
+    def __init__(
+        self,
+        hub: Optional[FanoutHub] = None,
+        authorize: Optional[Callable[[Optional[str], str], Awaitable[bool]]] = None,
+    ):
+        self.hub = hub or fanout_hub
         self.active_connections: Dict[str, WebSocket] = {}
+        # 连接ID -> 用户ID
+        self.connection_users: Dict[str, Optional[str]] = {}
         self.sync_handler = SyncHandler()
+        self.authorize = authorize or TopicAuthorizer().authorize
+
+    async def start(self):
+        """启动跨worker的消息转发"""
+        await self.hub.start()
+
+    async def stop(self):
+        """关闭所有连接"""
+        for client_id in list(self.active_connections):
+            await self.disconnect(client_id)
+        await self.hub.stop()
 
     async def connect(self, websocket: WebSocket, client_id: str):
         """处理连接"""
         try:
             await websocket.accept()
             self.active_connections[client_id] = websocket
+            self.hub.register(websocket, client_id, (BROADCAST_TOPIC,))
             logger.info(f"Client {client_id} connected")
         except Exception as e:
             logger.error(f"Error accepting connection from {client_id}: {e}")
@@ -30,13 +63,32 @@ class WebSocketServer:
     async def disconnect(self, client_id: str):
         """处理断开连接"""
         try:
+            self.hub.unregister(client_id)
+            self.connection_users.pop(client_id, None)
             if client_id in self.active_connections:
-                await self.active_connections[client_id].close()
-                del self.active_connections[client_id]
+                websocket = self.active_connections.pop(client_id)
+                await websocket.close()
                 logger.info(f"Client {client_id} disconnected")
         except Exception as e:
             logger.error(f"Error disconnecting client {client_id}: {e}")
 
+    async def handle_connection(
+        self, websocket: WebSocket, client_id: str, user_id: Optional[str] = None
+    ):
+        """处理一个连接的完整生命周期"""
+        await self.connect(websocket, client_id)
+        self.connection_users[client_id] = user_id
+        try:
+            while True:
+                message = await websocket.receive_text()
+                await self.handle_message(client_id, message)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"Error in websocket connection {client_id}: {e}")
+        finally:
+            await self.disconnect(client_id)
+
     async def handle_message(self, client_id: str, message: str):
         """处理消息"""
         try:
@@ -49,6 +101,10 @@ class WebSocketServer:
                 await self.sync_handler.handle_device_status(
                     client_id, data.get("data", {})
                 )
+            elif message_type == "subscribe":
+                await self.subscribe(client_id, data.get("topics", []))
+            elif message_type == "unsubscribe":
+                self.hub.unsubscribe(client_id, *data.get("topics", []))
             else:
                 logger.warning(f"Unknown message type: {message_type}")
 
@@ -57,16 +113,62 @@ class WebSocketServer:
         except Exception as e:
             logger.error(f"Error handling message from {client_id}: {e}")
 
-    async def broadcast(self, message: str):
+    async def subscribe(self, client_id: str, topics: Iterable[str]) -> List[str]:
+        """订阅已授权的主题，返回被拒绝的主题"""
+        user_id = self.connection_users.get(client_id)
+        allowed, rejected = [], []
+        for topic in topics:
+            if await self.authorize(user_id, topic):
+                allowed.append(topic)
+            else:
+                rejected.append(topic)
+
+        self.hub.subscribe(client_id, *allowed)
+        if rejected:
+            logger.warning(f"Client {client_id} denied topics: {rejected}")
+            subscriber = self.hub.get(client_id)
+            if subscriber is not None:
+                subscriber.offer(
+                    json.dumps({"type": "subscribe_rejected", "topics": rejected})
+                )
+        return rejected
+
+    async def subscribe_device(self, client_id: str, device_id: Any) -> bool:
+        """订阅设备消息(经主题授权)，返回是否订阅成功"""
+        return not await self.subscribe(client_id, [device_topic(device_id)])
+
+    async def unsubscribe_device(self, client_id: str, device_id: Any):
+        """取消订阅设备消息"""
+        self.hub.unsubscribe(client_id, device_topic(device_id))
+
+    async def broadcast(
+        self,
+        message: Union[str, Dict[str, Any]],
+        topics: Union[str, Iterable[str]] = BROADCAST_TOPIC,
+    ) -> int:
         """广播消息"""
-        disconnected = set()
-        for client_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting to {client_id}: {e}")
-                disconnected.add(client_id)
-
-        # 清理断开的连接
-        for client_id in disconnected:
-            await self.disconnect(client_id)
+        return await self.hub.publish(topics, message)
+
+    async def broadcast_device_status(
+        self, device_id: Any, status: Any, slave_id: Optional[Any] = None
+    ) -> int:
+        """广播设备状态，慢连接只收到最新的状态"""
+        topics = [device_topic(device_id)]
+        if slave_id is not None:
+            topics.append(slave_topic(slave_id))
+        return await self.hub.publish(
+            topics,
+            {"type": "device_status", "device_id": device_id, "status": status},
+            conflate_key=f"{device_topic(device_id)}:status",
+        )
+
+    async def broadcast_alert(self, alert: Dict[str, Any]) -> int:
+        """按告警级别广播告警"""
+        topics = [alert_topic(alert.get("level", "info"))]
+        if alert.get("device_id") is not None:
+            topics.append(device_topic(alert["device_id"]))
+        return await self.hub.publish(topics, {"type": "alert", "data": alert})
+
+
+# 全局WebSocket服务器实例
+websocket_server = WebSocketServer()
@@ -1,7 +1,7 @@
 """队列相关模型"""
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from ncod.core.db.base import Base
@@ -13,8 +13,10 @@ class PortQueue(Base):
     __tablename__ = "port_queues"
 
     id = Column(Integer, primary_key=True, index=True)
-    port_id = Column(Integer, ForeignKey("usb_ports.id"), nullable=False)
+    port_id = Column(Integer, ForeignKey("usb_ports.id"))
+    device_id = Column(String(64), index=True)  # 从服务器上的设备序列号
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    priority = Column(Integer, default=0)
     status = Column(String(20), default="waiting")  # waiting/using/completed/cancelled
     request_time = Column(DateTime, nullable=False)
     start_time = Column(DateTime)
@@ -25,3 +27,5 @@ class PortQueue(Base):
 
     port = relationship("USBPort", back_populates="queue")
     user = relationship("User", back_populates="port_queues")
+
+    __table_args__ = (Index("ix_port_queues_status_device", "status", "device_id"),)
@@ -63,5 +63,18 @@ class Settings(BaseSettings):
     # 数据管理配置
     DATA_RETENTION_DAYS: int = 30
 
+    # VirtualHere配置
+    VIRTUALHERE_HOST: str = "localhost"
+    VIRTUALHERE_PORT: int = 7575
+    VIRTUALHERE_POOL_SIZE: int = 4  # 控制连接数
+    VIRTUALHERE_MAX_IN_FLIGHT: int = 8  # 单连接最大在途命令数
+    VIRTUALHERE_TIMEOUT: float = 5.0  # 连接/命令超时(秒)
+    VIRTUALHERE_TRACK_INTERVAL: float = 0.5  # 设备状态跟踪间隔(秒)
+    VIRTUALHERE_FULL_SYNC_INTERVAL: int = 300  # 完整同步兜底间隔(秒)
+
+    # 主服务器配置
+    SLAVE_ID: int = 0
+    MASTER_WS_URL: Optional[str] = None  # 为空时不向主服务器推送设备增量
+
 
 settings = Settings()
@@ -0,0 +1,11 @@
+"""
+从服务器应用异常
+"""
+
+
+class VirtualHereError(Exception):
+    """VirtualHere操作错误"""
+
+
+class VirtualHereConnectionError(VirtualHereError):
+    """VirtualHere连接错误(命令未发出，可安全重试)"""
@@ -15,6 +15,9 @@ from .api.v1.api import api_router
 from .core.config import settings
 from .db.session import async_session
 from .services.monitor import MonitorService
+from .services.virtualhere import VirtualHereService
+from ..monitor.notification import notification_service
+from ..websocket_client import WebSocketClient
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +45,9 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 
 # 监控服务实例
 monitor_service = None
+virtualhere_service = None
+master_client = None
+master_task = None
 
 
 @app.on_event("startup")
@@ -54,12 +60,26 @@ async def startup_event():
         )
         FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
 
+        # 通知保存在Redis队列中，重启后重新发送未确认的通知
+        await notification_service.start(redis)
+
         # 初始化监控服务
         global monitor_service
         db = async_session()
         monitor_service = MonitorService(db)
         await monitor_service.start()
 
+        # 启动设备状态跟踪，设备增量推送给主服务器
+        global virtualhere_service, master_client, master_task
+        virtualhere_service = VirtualHereService()
+        await virtualhere_service.start()
+        if settings.MASTER_WS_URL:
+            master_client = WebSocketClient(
+                settings.MASTER_WS_URL, virtualhere_service, settings.SLAVE_ID
+            )
+            master_client.track_devices(virtualhere_service.tracker)
+            master_task = asyncio.create_task(master_client.connect())
+
         logger.info("服务启动成功")
 
     except Exception as e:
@@ -75,6 +95,15 @@ async def shutdown_event():
         if monitor_service:
             await monitor_service.stop()
 
+        # 停止设备状态跟踪
+        if master_task:
+            master_task.cancel()
+        if virtualhere_service:
+            await virtualhere_service.stop()
+
+        # 停止通知分发，未发送的通知保留在队列中
+        await notification_service.close()
+
         # 关闭缓存
         await FastAPICache.clear()
 
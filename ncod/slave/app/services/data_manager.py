@@ -5,21 +5,75 @@
 
 import asyncio
 import logging
+import re
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from sqlalchemy import delete, func, select
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import text
 
 from ..core.config import settings
-from ..models.monitor import MonitorAlert, MonitorMetric
 
 logger = logging.getLogger(__name__)
 
+# 首次汇总时的起始时间
+EPOCH = datetime(1970, 1, 1)
+
+# 水位表
+WATERMARK_TABLE = "monitor_rollup_watermarks"
+
+
+@dataclass(frozen=True)
+class RollupTier:
+    """汇总层级
+
+    Attributes:
+        name: 层级名称，同时是date_trunc的精度
+        source: 数据来源层级，None表示原始指标表
+        retention_days: 该层级的保留天数
+    """
+
+    name: str
+    source: Optional[str]
+    retention_days: int
+
+    @property
+    def table(self) -> str:
+        return f"monitor_metric_rollup_{self.name}"
+
+
+# 按顺序汇总: 分钟由原始数据汇总，小时由分钟汇总，天由小时汇总
+ROLLUP_TIERS = (
+    RollupTier("minute", None, 7),
+    RollupTier("hour", "minute", 90),
+    RollupTier("day", "hour", 730),
+)
+
+# 分区上界，如 FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-01-02 00:00:00')
+_PARTITION_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def partition_upper_bound(expr: str) -> Optional[datetime]:
+    """解析范围分区的上界，MAXVALUE或无法解析时返回None"""
+    match = _PARTITION_BOUND.search(expr or "")
+    if not match:
+        return None
+    try:
+        return datetime.fromisoformat(match.group(1)).replace(tzinfo=None)
+    except ValueError:
+        return None
+
 
 class DataManager:
-    """数据管理服务"""
+    """数据管理服务
+
+    原始指标按分钟、小时、天三级增量汇总。每个层级按指标类型记录水位，
+    每次只用一条INSERT ... SELECT汇总水位之后、已经结束的时间桶，
+    并在同一条语句中推进水位。过期数据按整个分区删除，
+    未分区的表退化为按批删除。
+    """
 
     def __init__(
         self,
@@ -28,6 +82,8 @@ class DataManager:
         cleanup_interval: int = 86400,  # 清理间隔（秒）
         archive_interval: int = 7,  # 归档间隔（天）
         batch_size: int = 1000,  # 批处理大小
+        rollup_lag: int = 60,  # 汇总延迟（秒），等待迟到的数据
+        partition_days_ahead: int = 3,  # 预先创建的分区天数
     ):
         """初始化数据管理服务
 
@@ -37,14 +93,19 @@ class DataManager:
             cleanup_interval: 清理间隔（秒）
             archive_interval: 归档间隔（天）
             batch_size: 批处理大小
+            rollup_lag: 汇总延迟（秒），晚于水位到达的数据不再汇总
+            partition_days_ahead: 预先创建的分区天数
         """
         self.db = db
         self.retention_days = retention_days
         self.cleanup_interval = cleanup_interval
         self.archive_interval = archive_interval
         self.batch_size = batch_size
+        self.rollup_lag = rollup_lag
+        self.partition_days_ahead = partition_days_ahead
         self._running = False
         self._task = None
+        self._schema_ready = False
 
     async def start(self):
         """启动数据管理服务"""
@@ -73,12 +134,15 @@ class DataManager:
         """数据管理循环"""
         while self._running:
             try:
-                # 执行数据清理
-                await self.cleanup_old_data()
+                # 预先创建分区
+                await self.ensure_partitions()
 
-                # 执行数据归档
+                # 执行数据归档(先汇总再清理，避免未汇总的数据被删除)
                 await self.archive_data()
 
+                # 执行数据清理
+                await self.cleanup_old_data()
+
                 # 执行数据优化
                 await self.optimize_tables()
 
@@ -87,107 +151,333 @@ class DataManager:
 
             await asyncio.sleep(self.cleanup_interval)
 
-    async def cleanup_old_data(self):
-        """清理过期数据"""
-        try:
-            cutoff_date = datetime.utcnow() - timedelta(days=self.retention_days)
-
-            # 分批删除指标数据
-            while True:
-                delete_stmt = (
-                    delete(MonitorMetric)
-                    .where(MonitorMetric.timestamp < cutoff_date)
-                    .limit(self.batch_size)
+    async def ensure_schema(self):
+        """创建汇总表和水位表"""
+        if self._schema_ready:
+            return
+
+        for tier in ROLLUP_TIERS:
+            await self.db.execute(
+                text(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {tier.table} (
+                        metric_type VARCHAR NOT NULL,
+                        bucket TIMESTAMP NOT NULL,
+                        min_value DOUBLE PRECISION,
+                        max_value DOUBLE PRECISION,
+                        sum_value DOUBLE PRECISION,
+                        sample_count BIGINT NOT NULL,
+                        PRIMARY KEY (metric_type, bucket)
+                    )
+                    """
+                )
+            )
+            await self.db.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{tier.table}_bucket "
+                    f"ON {tier.table} (bucket)"
+                )
+            )
+        await self.db.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+                    tier VARCHAR NOT NULL,
+                    metric_type VARCHAR NOT NULL,
+                    watermark TIMESTAMP NOT NULL,
+                    PRIMARY KEY (tier, metric_type)
                 )
+                """
+            )
+        )
+        await self.db.commit()
+        self._schema_ready = True
 
-                result = await self.db.execute(delete_stmt)
-                deleted_count = result.rowcount
-                await self.db.commit()
+    async def cleanup_old_data(self):
+        """清理过期数据
+
+        原始数据和告警按保留天数、各汇总层级按各自的保留天数清理。
+        """
+        try:
+            await self.ensure_schema()
+            now = datetime.utcnow()
+            cutoff_date = now - timedelta(days=self.retention_days)
+
+            targets = [
+                ("monitor_metrics", "timestamp", cutoff_date),
+                ("monitor_alerts", "timestamp", cutoff_date),
+            ] + [
+                (tier.table, "bucket", now - timedelta(days=tier.retention_days))
+                for tier in ROLLUP_TIERS
+            ]
+            for table, column, cutoff in targets:
+                deleted_count = await self._enforce_retention(table, column, cutoff)
+                logger.info(f"已清理 {table} 中 {deleted_count} 条过期数据")
+
+            self._last_cleanup = now
 
-                logger.info(f"已删除 {deleted_count} 条过期指标数据")
+        except Exception as e:
+            logger.error(f"清理过期数据失败: {str(e)}")
+            await self.db.rollback()
 
-                if deleted_count < self.batch_size:
-                    break
+    async def _enforce_retention(
+        self, table: str, column: str, cutoff: datetime
+    ) -> int:
+        """删除早于cutoff的数据
 
-            # 分批删除告警数据
-            while True:
-                delete_stmt = (
-                    delete(MonitorAlert)
-                    .where(MonitorAlert.timestamp < cutoff_date)
-                    .limit(self.batch_size)
-                )
+        分区表直接删除上界不晚于cutoff的分区，未分区的表按批删除。
 
-                result = await self.db.execute(delete_stmt)
-                deleted_count = result.rowcount
-                await self.db.commit()
+        Returns:
+            int: 删除的记录数(删除分区时为分区数)
+        """
+        if await self._is_partitioned(table):
+            dropped = 0
+            for name, upper in await self._partitions(table):
+                if upper is not None and upper <= cutoff:
+                    await self.db.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+                    dropped += 1
+            await self.db.commit()
+            return dropped
 
-                logger.info(f"已删除 {deleted_count} 条过期告警数据")
+        # PostgreSQL的DELETE不支持LIMIT，通过ctid子查询分批
+        delete_stmt = text(
+            f"""
+            DELETE FROM {table} WHERE ctid IN (
+                SELECT ctid FROM {table} WHERE {column} < :cutoff LIMIT :limit
+            )
+            """
+        )
+        total = 0
+        while True:
+            result = await self.db.execute(
+                delete_stmt, {"cutoff": cutoff, "limit": self.batch_size}
+            )
+            await self.db.commit()
+            total += result.rowcount
+            if result.rowcount < self.batch_size:
+                return total
 
-                if deleted_count < self.batch_size:
-                    break
+    async def _is_partitioned(self, table: str) -> bool:
+        result = await self.db.execute(
+            text(
+                """
+                SELECT 1 FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                WHERE c.relname = :table
+                """
+            ),
+            {"table": table},
+        )
+        return result.scalar() is not None
+
+    async def _partitions(self, table: str) -> List[Tuple[str, Optional[datetime]]]:
+        """分区表的全部分区及其上界"""
+        result = await self.db.execute(
+            text(
+                """
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = :table
+                """
+            ),
+            {"table": table},
+        )
+        return [(name, partition_upper_bound(bound)) for name, bound in result.all()]
+
+    async def ensure_partitions(self, tables: Tuple[str, ...] = None):
+        """为按天分区的表预先创建今天起若干天的分区，未分区的表跳过"""
+        tables = tables or ("monitor_metrics", "monitor_alerts")
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        try:
+            for table in tables:
+                if not await self._is_partitioned(table):
+                    continue
+                for offset in range(self.partition_days_ahead + 1):
+                    day = today + timedelta(days=offset)
+                    await self.db.execute(
+                        text(
+                            f"""
+                            CREATE TABLE IF NOT EXISTS {table}_p{day:%Y%m%d}
+                            PARTITION OF {table}
+                            FOR VALUES FROM ('{day.isoformat()}')
+                            TO ('{(day + timedelta(days=1)).isoformat()}')
+                            """
+                        )
+                    )
+            await self.db.commit()
 
         except Exception as e:
-            logger.error(f"清理过期数据失败: {str(e)}")
+            logger.error(f"创建分区失败: {str(e)}")
             await self.db.rollback()
 
     async def archive_data(self):
-        """归档历史数据"""
+        """增量汇总历史数据
+
+        按层级顺序汇总到同一个截止时间，任一层级失败时放弃本轮，
+        下一轮从各自的水位继续。
+        """
         try:
-            archive_date = datetime.utcnow() - timedelta(days=self.archive_interval)
-
-            # 聚合并归档指标数据
-            metrics_query = (
-                select(
-                    MonitorMetric.metric_type,
-                    func.date_trunc("hour", MonitorMetric.timestamp).label("hour"),
-                    func.avg(MonitorMetric.value).label("avg_value"),
-                    func.min(MonitorMetric.value).label("min_value"),
-                    func.max(MonitorMetric.value).label("max_value"),
-                    func.count().label("count"),
-                )
-                .where(MonitorMetric.timestamp < archive_date)
-                .group_by(MonitorMetric.metric_type, text("hour"))
+            await self.ensure_schema()
+            now = datetime.utcnow() - timedelta(seconds=self.rollup_lag)
+
+            total = 0
+            for tier in ROLLUP_TIERS:
+                count = await self._rollup(tier, now)
+                await self.db.commit()
+                logger.debug(f"{tier.name}级汇总生成 {count} 条记录")
+                total += count
+
+            self._last_archive = datetime.utcnow()
+            logger.info(f"已归档 {total} 条汇总数据")
+
+        except Exception as e:
+            logger.error(f"归档历史数据失败: {str(e)}")
+            await self.db.rollback()
+
+    async def _rollup(self, tier: RollupTier, now: datetime) -> int:
+        """汇总一个层级中水位之后、now之前已结束的时间桶
+
+        汇总范围的下界取该层级最低的水位，使查询可以走时间索引或分区裁剪；
+        新出现的指标类型从该下界开始汇总。插入和推进水位在同一条语句中完成，
+        本轮没有数据的指标类型水位同样推进。
+
+        Returns:
+            int: 生成的汇总记录数
+        """
+        result = await self.db.execute(
+            text(f"SELECT min(watermark) FROM {WATERMARK_TABLE} WHERE tier = :tier"),
+            {"tier": tier.name},
+        )
+        low = result.scalar() or EPOCH
+
+        if tier.source is None:
+            source = "monitor_metrics"
+            time_column = "timestamp"
+            aggregates = "min(s.value), max(s.value), sum(s.value), count(*)"
+        else:
+            source = f"monitor_metric_rollup_{tier.source}"
+            time_column = "bucket"
+            aggregates = (
+                "min(s.min_value), max(s.max_value), "
+                "sum(s.sum_value), sum(s.sample_count)"
             )
 
-            # 将聚合数据插入归档表
-            archive_stmt = text(
+        result = await self.db.execute(
+            text(
+                f"""
+                WITH cutoff AS (
+                    SELECT date_trunc(:tier, CAST(:now AS TIMESTAMP)) AS bound
+                ),
+                rolled AS (
+                    INSERT INTO {tier.table}
+                    (metric_type, bucket, min_value, max_value, sum_value, sample_count)
+                    SELECT s.metric_type, date_trunc(:tier, s.{time_column}),
+                           {aggregates}
+                    FROM {source} s
+                    LEFT JOIN {WATERMARK_TABLE} w
+                        ON w.tier = :tier AND w.metric_type = s.metric_type
+                    WHERE s.{time_column} >= :low
+                      AND s.{time_column} >= COALESCE(w.watermark, :low)
+                      AND s.{time_column} < (SELECT bound FROM cutoff)
+                    GROUP BY 1, 2
+                    ON CONFLICT (metric_type, bucket) DO NOTHING
+                    RETURNING metric_type
+                ),
+                advanced AS (
+                    INSERT INTO {WATERMARK_TABLE} (tier, metric_type, watermark)
+                    SELECT :tier, metric_type, (SELECT bound FROM cutoff)
+                    FROM (
+                        SELECT metric_type FROM rolled
+                        UNION
+                        SELECT metric_type FROM {WATERMARK_TABLE} WHERE tier = :tier
+                    ) types
+                    ON CONFLICT (tier, metric_type) DO UPDATE
+                    SET watermark = GREATEST(
+                        {WATERMARK_TABLE}.watermark, EXCLUDED.watermark
+                    )
+                )
+                SELECT count(*) FROM rolled
                 """
-                INSERT INTO monitor_metric_archives 
-                (metric_type, timestamp, avg_value, min_value, max_value, sample_count)
-                VALUES (:metric_type, :hour, :avg_value, :min_value, :max_value, :count)
-            """
-            )
+            ),
+            {"tier": tier.name, "now": now, "low": low},
+        )
+        return result.scalar() or 0
 
-            result = await self.db.execute(metrics_query)
-            archives = result.all()
+    async def reset_watermark(self, metric_type: str, since: datetime):
+        """从since开始重新汇总某个指标类型(例如补录历史数据后)
 
-            for archive in archives:
+        删除各层级since之后的汇总记录，并把水位回退到since所在的时间桶。
+        """
+        try:
+            await self.ensure_schema()
+            for tier in ROLLUP_TIERS:
+                params = {"tier": tier.name, "metric_type": metric_type, "since": since}
                 await self.db.execute(
-                    archive_stmt,
-                    {
-                        "metric_type": archive.metric_type,
-                        "hour": archive.hour,
-                        "avg_value": archive.avg_value,
-                        "min_value": archive.min_value,
-                        "max_value": archive.max_value,
-                        "count": archive.count,
-                    },
+                    text(
+                        f"""
+                        DELETE FROM {tier.table}
+                        WHERE metric_type = :metric_type
+                          AND bucket >= date_trunc(:tier, CAST(:since AS TIMESTAMP))
+                        """
+                    ),
+                    params,
+                )
+                await self.db.execute(
+                    text(
+                        f"""
+                        UPDATE {WATERMARK_TABLE}
+                        SET watermark = date_trunc(:tier, CAST(:since AS TIMESTAMP))
+                        WHERE tier = :tier AND metric_type = :metric_type
+                          AND watermark > date_trunc(:tier, CAST(:since AS TIMESTAMP))
+                        """
+                    ),
+                    params,
                 )
-
             await self.db.commit()
-            logger.info(f"已归档 {len(archives)} 条历史数据")
 
         except Exception as e:
-            logger.error(f"归档历史数据失败: {str(e)}")
+            logger.error(f"重置汇总水位失败: {str(e)}")
             await self.db.rollback()
 
+    async def get_rollups(
+        self,
+        metric_type: str,
+        tier: str,
+        start_time: datetime,
+        end_time: Optional[datetime] = None,
+    ) -> List[Dict[str, Any]]:
+        """查询某个层级的汇总数据"""
+        table = next(t.table for t in ROLLUP_TIERS if t.name == tier)
+        result = await self.db.execute(
+            text(
+                f"""
+                SELECT bucket, min_value, max_value,
+                       sum_value / NULLIF(sample_count, 0) AS avg_value,
+                       sample_count
+                FROM {table}
+                WHERE metric_type = :metric_type
+                  AND bucket >= :start_time AND bucket < :end_time
+                ORDER BY bucket
+                """
+            ),
+            {
+                "metric_type": metric_type,
+                "start_time": start_time,
+                "end_time": end_time or datetime.utcnow(),
+            },
+        )
+        return [dict(row) for row in result.mappings().all()]
+
     async def optimize_tables(self):
         """优化数据表"""
         try:
             # 执行表优化
             await self.db.execute(text("VACUUM ANALYZE monitor_metrics"))
             await self.db.execute(text("VACUUM ANALYZE monitor_alerts"))
-            await self.db.execute(text("VACUUM ANALYZE monitor_metric_archives"))
+            for tier in ROLLUP_TIERS:
+                await self.db.execute(text(f"VACUUM ANALYZE {tier.table}"))
 
             logger.info("数据表优化完成")
 
@@ -203,7 +493,7 @@ class DataManager:
             for table in [
                 "monitor_metrics",
                 "monitor_alerts",
-                "monitor_metric_archives",
+                *(tier.table for tier in ROLLUP_TIERS),
             ]:
                 count_query = select(func.count()).select_from(text(table))
                 size_query = text(f"SELECT pg_total_relation_size('{table}')")
@@ -216,10 +506,19 @@ class DataManager:
                     "size_bytes": size_result.scalar(),
                 }
 
+            watermarks = await self.db.execute(
+                text(
+                    f"SELECT tier, min(watermark) FROM {WATERMARK_TABLE} GROUP BY tier"
+                )
+            )
+
             return {
                 "tables": stats,
                 "retention_days": self.retention_days,
                 "archive_interval": self.archive_interval,
+                "watermarks": {
+                    tier: watermark.isoformat() for tier, watermark in watermarks.all()
+                },
                 "last_cleanup": (
                     self._last_cleanup.isoformat()
                     if hasattr(self, "_last_cleanup")
@@ -0,0 +1,215 @@
+"""
+VirtualHere设备状态跟踪
+
+保存上一次解析得到的Hub/设备树，新的list输出按Hub分块比较，只重新解析
+内容发生变化的Hub，并计算最小差异(新增/移除/状态变化)推送给订阅者。
+"""
+
+import asyncio
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+HUB_PATTERN = re.compile(r"Hub #(\d+) \((.*?)\)")
+DEVICE_PATTERN = re.compile(r"Device #(\d+) \((.*?)\) \[(.*?)\]")
+
+
+def split_hub_blocks(response: str) -> Dict[int, Tuple[str, List[str]]]:
+    """把list输出按Hub切分为 {hub_id: (hub_name, 设备行列表)}"""
+    blocks: Dict[int, Tuple[str, List[str]]] = {}
+    current: Optional[List[str]] = None
+    for line in response.split("\n"):
+        line = line.strip()
+        if line.startswith("Hub #"):
+            hub_match = HUB_PATTERN.match(line)
+            if hub_match:
+                current = []
+                blocks[int(hub_match.group(1))] = (hub_match.group(2), current)
+                continue
+        if current is not None and line.startswith("Device #"):
+            current.append(line)
+    return blocks
+
+
+def parse_hub_devices(hub_id: int, hub_name: str, lines: List[str]) -> List[Dict]:
+    """解析单个Hub下的设备行"""
+    devices = []
+    for line in lines:
+        device_match = DEVICE_PATTERN.match(line)
+        if device_match:
+            devices.append(
+                {
+                    "id": int(device_match.group(1)),
+                    "name": device_match.group(2),
+                    "status": device_match.group(3),
+                    "hub_id": hub_id,
+                    "hub_name": hub_name,
+                }
+            )
+    return devices
+
+
+def parse_device_list(response: str) -> List[Dict]:
+    """解析完整的list输出"""
+    devices = []
+    for hub_id, (hub_name, lines) in split_hub_blocks(response).items():
+        devices.extend(parse_hub_devices(hub_id, hub_name, lines))
+    return devices
+
+
+def device_key(device: Dict) -> str:
+    """设备唯一键(hub_id:device_id)"""
+    return f"{device['hub_id']}:{device['id']}"
+
+
+@dataclass
+class DeviceDelta:
+    """设备状态增量"""
+
+    version: int
+    added: List[Dict] = field(default_factory=list)
+    removed: List[Dict] = field(default_factory=list)
+    changed: List[Dict] = field(default_factory=list)
+    timestamp: datetime = field(default_factory=datetime.utcnow)
+
+    @property
+    def empty(self) -> bool:
+        """是否没有任何变化"""
+        return not (self.added or self.removed or self.changed)
+
+    def to_dict(self) -> Dict:
+        """转换为可发送的字典"""
+        data = asdict(self)
+        data["timestamp"] = self.timestamp.isoformat()
+        return data
+
+
+DeltaListener = Callable[[DeviceDelta], Awaitable[None]]
+
+
+class DeviceStateTracker:
+    """设备状态跟踪器"""
+
+    def __init__(self, client=None, interval: float = 0.5):
+        self.client = client
+        self.interval = interval
+        self.version = 0
+        self.running = False
+        self._hub_lines: Dict[int, Tuple[str, List[str]]] = {}
+        self._hub_devices: Dict[int, Dict[str, Dict]] = {}
+        self._last_response: Optional[str] = None
+        self._listeners: List[DeltaListener] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def devices(self) -> Dict[str, Dict]:
+        """当前设备表 {hub_id:device_id: 设备}"""
+        result: Dict[str, Dict] = {}
+        for devices in self._hub_devices.values():
+            result.update(devices)
+        return result
+
+    def snapshot(self) -> Dict:
+        """当前完整状态，用于订阅方首次同步或版本断档后的重新同步"""
+        return {"version": self.version, "devices": list(self.devices.values())}
+
+    def subscribe(self, listener: DeltaListener):
+        """订阅设备增量"""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: DeltaListener):
+        """取消订阅"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def apply(self, response: str) -> DeviceDelta:
+        """用新的list输出更新状态并返回增量"""
+        if response == self._last_response:
+            return DeviceDelta(version=self.version)
+        self._last_response = response
+
+        added: List[Dict] = []
+        removed: List[Dict] = []
+        changed: List[Dict] = []
+        blocks = split_hub_blocks(response)
+
+        for hub_id in set(self._hub_devices) - set(blocks):
+            removed.extend(self._hub_devices.pop(hub_id).values())
+            self._hub_lines.pop(hub_id, None)
+
+        for hub_id, block in blocks.items():
+            if self._hub_lines.get(hub_id) == block:
+                continue
+            self._hub_lines[hub_id] = block
+            old = self._hub_devices.get(hub_id, {})
+            new = {
+                device_key(device): device
+                for device in parse_hub_devices(hub_id, *block)
+            }
+            for key, device in new.items():
+                previous = old.get(key)
+                if previous is None:
+                    added.append(device)
+                elif previous != device:
+                    changed.append(device)
+            removed.extend(device for key, device in old.items() if key not in new)
+            self._hub_devices[hub_id] = new
+
+        delta = DeviceDelta(
+            version=self.version, added=added, removed=removed, changed=changed
+        )
+        if not delta.empty:
+            self.version += 1
+            delta.version = self.version
+        return delta
+
+    async def refresh(self) -> DeviceDelta:
+        """拉取一次设备列表并推送增量"""
+        response = await self.client.execute("list")
+        delta = self.apply(response)
+        if not delta.empty:
+            await self._publish(delta)
+        return delta
+
+    async def _publish(self, delta: DeviceDelta):
+        """推送增量给所有订阅者"""
+        for listener in list(self._listeners):
+            try:
+                await listener(delta)
+            except Exception as e:
+                logger.error(f"推送设备增量失败: {str(e)}")
+
+    async def start(self):
+        """启动跟踪"""
+        if self.running:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._track())
+        logger.info("设备状态跟踪已启动")
+
+    async def stop(self):
+        """停止跟踪"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info("设备状态跟踪已停止")
+
+    async def _track(self):
+        """跟踪循环"""
+        while self.running:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"刷新设备状态失败: {str(e)}")
+            await asyncio.sleep(self.interval)
@@ -6,15 +6,20 @@ import asyncio
 import logging
 import platform
 import re
-import socket
 import subprocess
-import telnetlib
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
 from ..core.config import settings
 from ..exceptions import VirtualHereError
 from ..models.device import DeviceConnection, UsbDevice
+from .device_tracker import (
+    DeviceDelta,
+    DeviceStateTracker,
+    device_key,
+    parse_device_list,
+)
+from .virtualhere_pool import VirtualHereConnectionPool
 
 logger = logging.getLogger(__name__)
 
@@ -82,64 +87,76 @@ class HardwareInfo:
 
 
 class VirtualHereClient:
-    """VirtualHere客户端"""
+    """VirtualHere客户端
 
-    def __init__(self, host: str = "localhost", port: int = 7575):
+    所有命令经由持久化连接池发送，多条命令可以同时在途，不再为每次操作
+    新建telnet连接，也不再用全局锁串行化attach/detach。
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 7575,
+        pool_size: int = 4,
+        max_in_flight: int = 8,
+        timeout: float = 5.0,
+    ):
         self.host = host
         self.port = port
-        self._lock = asyncio.Lock()
+        self._pool = VirtualHereConnectionPool(
+            host,
+            port,
+            size=pool_size,
+            max_in_flight=max_in_flight,
+            connect_timeout=timeout,
+            command_timeout=timeout,
+        )
         self._connection_cache: Dict[str, Dict] = {}
 
-    async def connect(self) -> telnetlib.Telnet:
-        """连接到VirtualHere服务器"""
-        try:
-            tn = telnetlib.Telnet(self.host, self.port, timeout=5)
-            return tn
-        except Exception as e:
-            raise VirtualHereError(f"连接VirtualHere服务器失败: {str(e)}")
+    async def execute(self, command: str) -> str:
+        """发送命令并返回响应"""
+        return await self._pool.execute(command)
+
+    async def close(self):
+        """关闭连接池"""
+        await self._pool.close()
 
     async def force_detach_device(
         self, device_id: int, admin_id: str, reason: str = "Administrative action"
     ) -> bool:
         """管理员强制断开设备"""
-        async with self._lock:
-            try:
-                tn = await self.connect()
-
-                # 先获取设备当前状态
-                device_info = await self.get_device_info(device_id)
-                if not device_info:
-                    return False
-
-                # 如果设备正在使用中，记录强制断开事件
-                if device_info.get("status") == "In Use":
-                    connection_key = f"{device_id}:{device_info.get('client_id', '')}"
-                    if connection_key in self._connection_cache:
-                        conn_info = self._connection_cache[connection_key]
-                        await self._log_force_detach(
-                            device_id=device_id,
-                            user_id=conn_info.get("user_id"),
-                            admin_id=admin_id,
-                            reason=reason,
-                        )
-
-                # 发送强制断开命令
-                tn.write(f"force_detach {device_id}\n".encode())
-                response = tn.read_until(b"END", timeout=5).decode()
-
-                success = "SUCCESS" in response
-                if success:
-                    # 清除连接缓存
-                    self._connection_cache.pop(connection_key, None)
-
-                return success
-
-            except Exception as e:
-                logger.error(f"强制断开设备失败: {str(e)}")
+        connection_key = None
+        try:
+            # 先获取设备当前状态
+            device_info = await self.get_device_info(device_id)
+            if not device_info:
                 return False
-            finally:
-                if "tn" in locals():
-                    tn.close()
+
+            # 如果设备正在使用中，记录强制断开事件
+            if device_info.get("status") == "In Use":
+                connection_key = f"{device_id}:{device_info.get('client_id', '')}"
+                if connection_key in self._connection_cache:
+                    conn_info = self._connection_cache[connection_key]
+                    await self._log_force_detach(
+                        device_id=device_id,
+                        user_id=conn_info.get("user_id"),
+                        admin_id=admin_id,
+                        reason=reason,
+                    )
+
+            # 发送强制断开命令
+            response = await self.execute(f"force_detach {device_id}")
+
+            success = "SUCCESS" in response
+            if success and connection_key:
+                # 清除连接缓存
+                self._connection_cache.pop(connection_key, None)
+
+            return success
+
+        except Exception as e:
+            logger.error(f"强制断开设备失败: {str(e)}")
+            return False
 
     async def _log_force_detach(
         self, device_id: int, user_id: str, admin_id: str, reason: str
@@ -168,36 +185,29 @@ class VirtualHereClient:
         hardware_info: Dict[str, str],
     ) -> bool:
         """将设备分配给客户端，包含硬件验证"""
-        async with self._lock:
-            try:
-                # 验证硬件信息
-                if not self._verify_hardware_info(hardware_info):
-                    logger.warning(f"硬件信息验证失败: {client_id}")
-                    return False
-
-                tn = await self.connect()
+        try:
+            # 验证硬件信息
+            if not self._verify_hardware_info(hardware_info):
+                logger.warning(f"硬件信息验证失败: {client_id}")
+                return False
 
-                # 发送attach命令
-                tn.write(f"attach {device_id} {client_id}\n".encode())
-                response = tn.read_until(b"END", timeout=5).decode()
+            # 发送attach命令
+            response = await self.execute(f"attach {device_id} {client_id}")
 
-                success = "SUCCESS" in response
-                if success:
-                    # 缓存连接信息
-                    self._connection_cache[f"{device_id}:{client_id}"] = {
-                        "user_id": user_id,
-                        "hardware_info": hardware_info,
-                        "connected_at": datetime.utcnow(),
-                    }
+            success = "SUCCESS" in response
+            if success:
+                # 缓存连接信息
+                self._connection_cache[f"{device_id}:{client_id}"] = {
+                    "user_id": user_id,
+                    "hardware_info": hardware_info,
+                    "connected_at": datetime.utcnow(),
+                }
 
-                return success
+            return success
 
-            except Exception as e:
-                logger.error(f"分配设备失败: {str(e)}")
-                return False
-            finally:
-                if "tn" in locals():
-                    tn.close()
+        except Exception as e:
+            logger.error(f"分配设备失败: {str(e)}")
+            return False
 
     def _verify_hardware_info(self, hardware_info: Dict[str, str]) -> bool:
         """验证硬件信息"""
@@ -206,169 +216,163 @@ class VirtualHereClient:
 
     async def list_devices(self) -> List[Dict]:
         """获取设备列表"""
-        async with self._lock:
-            try:
-                tn = await self.connect()
-
-                # 发送list命令
-                tn.write(b"list\n")
-                response = tn.read_until(b"END", timeout=5).decode()
-
-                devices = []
-                current_hub = None
-
-                for line in response.split("\n"):
-                    line = line.strip()
-
-                    # 解析Hub信息
-                    hub_match = re.match(r"Hub #(\d+) \((.*?)\)", line)
-                    if hub_match:
-                        current_hub = {
-                            "id": int(hub_match.group(1)),
-                            "name": hub_match.group(2),
-                        }
-                        continue
-
-                    # 解析设备信息
-                    device_match = re.match(r"Device #(\d+) \((.*?)\) \[(.*?)\]", line)
-                    if device_match and current_hub:
-                        device = {
-                            "id": int(device_match.group(1)),
-                            "name": device_match.group(2),
-                            "status": device_match.group(3),
-                            "hub_id": current_hub["id"],
-                            "hub_name": current_hub["name"],
-                        }
-                        devices.append(device)
-
-                return devices
+        try:
+            # 发送list命令
+            response = await self.execute("list")
+            return parse_device_list(response)
 
-            except Exception as e:
-                raise VirtualHereError(f"获取设备列表失败: {str(e)}")
-            finally:
-                if "tn" in locals():
-                    tn.close()
+        except Exception as e:
+            raise VirtualHereError(f"获取设备列表失败: {str(e)}")
 
     async def get_device_info(self, device_id: int) -> Optional[Dict]:
         """获取设备详细信息"""
-        async with self._lock:
-            try:
-                tn = await self.connect()
-
-                # 发送info命令
-                tn.write(f"info {device_id}\n".encode())
-                response = tn.read_until(b"END", timeout=5).decode()
+        try:
+            # 发送info命令
+            response = await self.execute(f"info {device_id}")
 
-                info = {}
-                for line in response.split("\n"):
-                    line = line.strip()
-                    if ":" in line:
-                        key, value = line.split(":", 1)
-                        info[key.strip()] = value.strip()
+            info = {}
+            for line in response.split("\n"):
+                line = line.strip()
+                if ":" in line:
+                    key, value = line.split(":", 1)
+                    info[key.strip()] = value.strip()
 
-                return info if info else None
+            return info if info else None
 
-            except Exception as e:
-                raise VirtualHereError(f"获取设备信息失败: {str(e)}")
-            finally:
-                if "tn" in locals():
-                    tn.close()
+        except Exception as e:
+            raise VirtualHereError(f"获取设备信息失败: {str(e)}")
 
     async def detach_device(self, device_id: int) -> bool:
         """释放设备"""
-        async with self._lock:
-            try:
-                tn = await self.connect()
-
-                # 发送detach命令
-                tn.write(f"detach {device_id}\n".encode())
-                response = tn.read_until(b"END", timeout=5).decode()
+        try:
+            # 发送detach命令
+            response = await self.execute(f"detach {device_id}")
 
-                return "SUCCESS" in response
+            return "SUCCESS" in response
 
-            except Exception as e:
-                raise VirtualHereError(f"释放设备失败: {str(e)}")
-            finally:
-                if "tn" in locals():
-                    tn.close()
+        except Exception as e:
+            raise VirtualHereError(f"释放设备失败: {str(e)}")
 
     async def get_client_list(self) -> List[Dict]:
         """获取客户端列表"""
-        async with self._lock:
-            try:
-                tn = await self.connect()
-
-                # 发送clients命令
-                tn.write(b"clients\n")
-                response = tn.read_until(b"END", timeout=5).decode()
-
-                clients = []
-                for line in response.split("\n"):
-                    line = line.strip()
-                    if line and not line.startswith("Clients"):
-                        client_match = re.match(r"(\d+)\. (.*?) \((.*?)\)", line)
-                        if client_match:
-                            client = {
-                                "id": int(client_match.group(1)),
-                                "name": client_match.group(2),
-                                "ip": client_match.group(3),
-                            }
-                            clients.append(client)
-
-                return clients
+        try:
+            # 发送clients命令
+            response = await self.execute("clients")
+
+            clients = []
+            for line in response.split("\n"):
+                line = line.strip()
+                if line and not line.startswith("Clients"):
+                    client_match = re.match(r"(\d+)\. (.*?) \((.*?)\)", line)
+                    if client_match:
+                        client = {
+                            "id": int(client_match.group(1)),
+                            "name": client_match.group(2),
+                            "ip": client_match.group(3),
+                        }
+                        clients.append(client)
 
-            except Exception as e:
-                raise VirtualHereError(f"获取客户端列表失败: {str(e)}")
-            finally:
-                if "tn" in locals():
-                    tn.close()
+            return clients
+
+        except Exception as e:
+            raise VirtualHereError(f"获取客户端列表失败: {str(e)}")
 
 
 class VirtualHereService:
-    """VirtualHere服务"""
+    """VirtualHere服务
+
+    设备缓存由DeviceStateTracker推送的增量维护，完整的list重建只作为定期
+    兜底，纠正可能遗漏的增量。
+    """
 
     def __init__(self):
         self.client = VirtualHereClient(
-            settings.VIRTUALHERE_HOST, settings.VIRTUALHERE_PORT
+            settings.VIRTUALHERE_HOST,
+            settings.VIRTUALHERE_PORT,
+            pool_size=settings.VIRTUALHERE_POOL_SIZE,
+            max_in_flight=settings.VIRTUALHERE_MAX_IN_FLIGHT,
+            timeout=settings.VIRTUALHERE_TIMEOUT,
+        )
+        self.tracker = DeviceStateTracker(
+            self.client, interval=settings.VIRTUALHERE_TRACK_INTERVAL
         )
+        self.full_sync_interval = settings.VIRTUALHERE_FULL_SYNC_INTERVAL
         self._device_cache = {}
         self._last_update = datetime.min
-
-    async def sync_devices(self) -> List[UsbDevice]:
-        """同步设备状态"""
+        self._full_sync_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动设备跟踪和定期完整同步"""
+        if self.tracker.running:
+            return
+        self.tracker.subscribe(self._on_delta)
+        await self.tracker.start()
+        self._full_sync_task = asyncio.create_task(self._full_sync_loop())
+        logger.info("VirtualHere服务已启动")
+
+    async def stop(self):
+        """停止设备跟踪并关闭连接池"""
+        if self._full_sync_task:
+            self._full_sync_task.cancel()
+            try:
+                await self._full_sync_task
+            except asyncio.CancelledError:
+                pass
+            self._full_sync_task = None
+        await self.tracker.stop()
+        self.tracker.unsubscribe(self._on_delta)
+        await self.client.close()
+        logger.info("VirtualHere服务已停止")
+
+    async def _on_delta(self, delta: DeviceDelta):
+        """按增量更新设备缓存"""
+        current_time = datetime.utcnow()
+        for device in delta.removed:
+            self._device_cache.pop(device_key(device), None)
+        for device in delta.added + delta.changed:
+            self._cache_device(device, current_time)
+        self._last_update = current_time
+
+    def _cache_device(self, device: Dict, current_time: datetime):
+        key = device_key(device)
+        if key in self._device_cache:
+            # 更新现有设备状态
+            self._device_cache[key].update(
+                {
+                    "name": device["name"],
+                    "status": device["status"],
+                    "last_seen": current_time,
+                }
+            )
+        else:
+            # 添加新设备
+            self._device_cache[key] = {
+                "hub_id": device["hub_id"],
+                "device_id": device["id"],
+                "name": device["name"],
+                "status": device["status"],
+                "first_seen": current_time,
+                "last_seen": current_time,
+            }
+
+    async def _full_sync_loop(self):
+        """定期完整同步"""
+        while True:
+            await asyncio.sleep(self.full_sync_interval)
+            await self.full_sync()
+
+    async def full_sync(self) -> List[Dict]:
+        """用完整的设备列表重建缓存，列表中没有的设备视为已离线"""
         try:
-            # 获取设备列表
             devices = await self.client.list_devices()
 
-            # 更新设备缓存
             current_time = datetime.utcnow()
+            present = set()
             for device in devices:
-                device_id = f"{device['hub_id']}:{device['id']}"
-                if device_id in self._device_cache:
-                    # 更新现有设备状态
-                    self._device_cache[device_id].update(
-                        {"status": device["status"], "last_seen": current_time}
-                    )
-                else:
-                    # 添加新设备
-                    self._device_cache[device_id] = {
-                        "hub_id": device["hub_id"],
-                        "device_id": device["id"],
-                        "name": device["name"],
-                        "status": device["status"],
-                        "first_seen": current_time,
-                        "last_seen": current_time,
-                    }
-
-            # 清理离线设备
-            offline_threshold = current_time - settings.DEVICE_OFFLINE_THRESHOLD
-            offline_devices = [
-                device_id
-                for device_id, device in self._device_cache.items()
-                if device["last_seen"] < offline_threshold
-            ]
-            for device_id in offline_devices:
-                del self._device_cache[device_id]
+                present.add(device_key(device))
+                self._cache_device(device, current_time)
+            for key in set(self._device_cache) - present:
+                del self._device_cache[key]
 
             self._last_update = current_time
             return list(self._device_cache.values())
@@ -377,6 +381,12 @@ class VirtualHereService:
             logger.error(f"同步设备状态失败: {str(e)}")
             return []
 
+    async def sync_devices(self) -> List[UsbDevice]:
+        """同步设备状态，跟踪运行时直接返回增量维护的缓存"""
+        if self.tracker.running:
+            return list(self._device_cache.values())
+        return await self.full_sync()
+
     async def get_device_status(self, hub_id: int, device_id: int) -> Optional[Dict]:
         """获取设备状态"""
         device_key = f"{hub_id}:{device_id}"
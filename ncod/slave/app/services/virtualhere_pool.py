@@ -0,0 +1,219 @@
+"""
+VirtualHere控制通道连接池
+
+VirtualHere服务器的控制协议按行收发，每个响应以"END"结束，且同一连接上的
+响应顺序与命令顺序一致。因此每个连接维护一个待响应队列(FIFO)，允许多条命令
+同时在途(流水线)，由后台读取任务按顺序把响应交给对应的命令。
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, List, Optional
+
+from ..exceptions import VirtualHereConnectionError, VirtualHereError
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_TERMINATOR = "END"
+
+
+class VirtualHereConnection:
+    """单个持久化的VirtualHere控制连接"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        connect_timeout: float = 5.0,
+        max_in_flight: int = 8,
+    ):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.max_in_flight = max_in_flight
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Deque[asyncio.Future] = deque()
+        self._write_lock = asyncio.Lock()
+        self._connect_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._active = 0
+
+    @property
+    def connected(self) -> bool:
+        """连接是否可用"""
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def in_flight(self) -> int:
+        """已派发到该连接(含等待发送)的命令数量"""
+        return self._active
+
+    async def connect(self) -> None:
+        """建立连接(已连接时直接返回)"""
+        async with self._connect_lock:
+            if self.connected:
+                return
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    timeout=self.connect_timeout,
+                )
+            except Exception as e:
+                raise VirtualHereConnectionError(
+                    f"连接VirtualHere服务器失败: {str(e)}"
+                )
+            self._reader_task = asyncio.create_task(self._read_responses())
+            logger.debug(f"已连接VirtualHere服务器 {self.host}:{self.port}")
+
+    async def close(self) -> None:
+        """关闭连接"""
+        if self._reader_task:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+        self._teardown(VirtualHereError("连接已关闭"))
+
+    async def execute(self, command: str, timeout: float = 5.0) -> str:
+        """发送命令并等待对应的响应"""
+        # 同步计数，使并发派发时连接池能立即看到该连接的负载
+        self._active += 1
+        try:
+            return await self._execute(command, timeout)
+        finally:
+            self._active -= 1
+
+    async def _execute(self, command: str, timeout: float) -> str:
+        """在连接上发送命令，响应由读取任务按FIFO顺序交回"""
+        async with self._slots:
+            if not self.connected:
+                await self.connect()
+
+            future = asyncio.get_running_loop().create_future()
+            async with self._write_lock:
+                # 入队与写入必须在同一临界区内，保证队列顺序与发送顺序一致
+                self._pending.append(future)
+                try:
+                    self._writer.write(f"{command}\n".encode())
+                    await self._writer.drain()
+                except Exception as e:
+                    error = VirtualHereConnectionError(f"发送命令失败: {str(e)}")
+                    self._teardown(error)
+                    raise error
+
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                # 响应流已无法与命令对齐，只能断开重建
+                error = VirtualHereError(f"命令超时: {command}")
+                self._teardown(error)
+                if future.done():
+                    future.exception()
+                raise error
+
+    async def _read_responses(self) -> None:
+        """按顺序读取响应并交给队首命令"""
+        lines: List[str] = []
+        try:
+            while True:
+                raw = await self._reader.readline()
+                if not raw:
+                    raise ConnectionError("服务器关闭了连接")
+                line = raw.decode(errors="replace").rstrip("\r\n")
+                lines.append(line)
+                if line.strip() != RESPONSE_TERMINATOR:
+                    continue
+
+                response = "\n".join(lines)
+                lines = []
+                if not self._pending:
+                    logger.warning("收到无对应命令的VirtualHere响应，已丢弃")
+                    continue
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"VirtualHere连接中断: {str(e)}")
+            self._teardown(VirtualHereError(f"连接中断: {str(e)}"))
+
+    def _teardown(self, error: Exception) -> None:
+        """断开连接并让所有在途命令失败"""
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+        task, self._reader_task = self._reader_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+
+class VirtualHereConnectionPool:
+    """VirtualHere控制连接池
+
+    连接按需建立、断线后在下一次使用时自动重连；命令总是派发到在途命令最少的
+    连接上，多个attach/detach可以并发进行，不再互相排队。
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 7575,
+        size: int = 4,
+        max_in_flight: int = 8,
+        connect_timeout: float = 5.0,
+        command_timeout: float = 5.0,
+        retries: int = 1,
+    ):
+        self.host = host
+        self.port = port
+        self.command_timeout = command_timeout
+        self.retries = retries
+        self._connections = [
+            VirtualHereConnection(
+                host,
+                port,
+                connect_timeout=connect_timeout,
+                max_in_flight=max_in_flight,
+            )
+            for _ in range(max(1, size))
+        ]
+
+    def _pick(self) -> VirtualHereConnection:
+        """选择负载最轻的连接，优先使用已建立的连接"""
+        return min(
+            self._connections,
+            key=lambda conn: (conn.in_flight, not conn.connected),
+        )
+
+    async def execute(self, command: str, timeout: Optional[float] = None) -> str:
+        """执行命令
+
+        仅在命令未发出(连接/发送失败)时换连接重试；已发出但超时或中断的命令
+        不会重发，避免attach等非幂等操作被执行两次。
+        """
+        timeout = timeout or self.command_timeout
+        last_error: Optional[Exception] = None
+        for _ in range(self.retries + 1):
+            try:
+                return await self._pick().execute(command, timeout=timeout)
+            except VirtualHereConnectionError as e:
+                last_error = e
+                logger.debug(f"VirtualHere命令失败，准备重试: {command}: {str(e)}")
+        raise last_error
+
+    async def close(self) -> None:
+        """关闭所有连接"""
+        await asyncio.gather(
+            *(conn.close() for conn in self._connections), return_exceptions=True
+        )
@@ -1,11 +1,12 @@
 """负载报告客户端"""
 
 import asyncio
-import json
 import psutil
 import logging
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Optional
+
+from ncod.slave.core.channel import MasterChannel
 
 logger = logging.getLogger("load_reporter")
 
@@ -13,16 +14,27 @@ logger = logging.getLogger("load_reporter")
 class LoadReporter:
     """负载报告器"""
 
-    def __init__(self, node_id: str, master_host: str, master_port: int = 5679):
+    def __init__(
+        self,
+        node_id: str,
+        master_host: str,
+        master_port: int = 5679,
+        channel: Optional[MasterChannel] = None,
+    ):
         self.node_id = node_id
         self.master_host = master_host
         self.master_port = master_port
+        # 与心跳共用同一条主服务器连接；未传入时自建通道
+        self._owns_channel = channel is None
+        self.channel = channel or MasterChannel(node_id, master_host, master_port)
         self.running = False
 
     async def start(self):
         """启动报告器"""
         try:
             self.running = True
+            if self._owns_channel:
+                await self.channel.start()
             logger.info("Load reporter started")
             asyncio.create_task(self._report_load())
         except Exception as e:
@@ -34,6 +46,8 @@ class LoadReporter:
         """停止报告器"""
         try:
             self.running = False
+            if self._owns_channel:
+                await self.channel.stop()
             logger.info("Load reporter stopped")
         except Exception as e:
             logger.error(f"Error stopping load reporter: {e}")
@@ -58,20 +72,9 @@ class LoadReporter:
             try:
                 # 获取系统负载
                 load_info = self._get_system_load()
-                if not load_info:
-                    continue
-
-                # 发送负载信息
-                reader, writer = await asyncio.open_connection(
-                    self.master_host, self.master_port
-                )
-
-                message = {"node_id": self.node_id, "load": load_info}
-
-                writer.write(json.dumps(message).encode())
-                await writer.drain()
-                writer.close()
-                await writer.wait_closed()
+                if load_info:
+                    # 通过长连接发送负载信息
+                    self.channel.send_load(load_info)
 
             except Exception as e:
                 logger.error(f"Error reporting load: {e}")
@@ -0,0 +1,206 @@
+"""从服务器到主服务器的长连接通道"""
+
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from ncod.core.channel import (
+    MSG_DEVICE_DELTA,
+    MSG_DEVICE_SNAPSHOT,
+    MSG_HEARTBEAT,
+    MSG_HELLO,
+    MSG_LOAD,
+    MSG_RESYNC_DEVICES,
+    FrameError,
+    encode_frame,
+    read_frame,
+)
+
+logger = logging.getLogger("master_channel")
+
+MessageHandler = Callable[[Dict], Awaitable[None]]
+
+
+class MasterChannel:
+    """主服务器通道
+
+    每个从服务器只保持一条到主服务器的长连接，心跳、负载和设备增量共用该连接，
+    以长度前缀帧发送。断线后按指数退避自动重连；离线期间的消息暂存在有界队列中，
+    队列满时丢弃最旧的消息(心跳/负载只关心最新值)。丢失的设备增量由主服务器
+    发现版本不连续后请求快照补齐。
+    """
+
+    def __init__(
+        self,
+        node_id: str,
+        master_host: str,
+        master_port: int = 5679,
+        max_queue: int = 1000,
+        max_backoff: float = 30.0,
+    ):
+        self.node_id = node_id
+        self.master_host = master_host
+        self.master_port = master_port
+        self.max_backoff = max_backoff
+        self.running = False
+        self.connected = False
+        self._queue: Deque[bytes] = deque(maxlen=max_queue)
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._handlers: Dict[str, MessageHandler] = {}
+        self._tracker = None
+
+    async def start(self):
+        """启动通道"""
+        if self.running:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info("Master channel started")
+
+    async def stop(self):
+        """停止通道"""
+        self.running = False
+        self._ready.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close()
+        logger.info("Master channel stopped")
+
+    def send(self, msg_type: str, data: Dict):
+        """发送消息(非阻塞，消息进入发送队列)"""
+        self._queue.append(
+            encode_frame({"type": msg_type, "node_id": self.node_id, "data": data})
+        )
+        self._ready.set()
+
+    def send_heartbeat(self, timestamp: Optional[datetime] = None):
+        """发送心跳"""
+        self.send(
+            MSG_HEARTBEAT, {"timestamp": (timestamp or datetime.utcnow()).isoformat()}
+        )
+
+    def send_load(self, load: Dict):
+        """发送负载信息"""
+        self.send(MSG_LOAD, load)
+
+    async def send_device_delta(self, delta):
+        """发送设备增量(可直接作为DeviceStateTracker的订阅者)"""
+        self.send(MSG_DEVICE_DELTA, delta.to_dict())
+
+    def send_device_snapshot(self):
+        """发送完整设备状态"""
+        if self._tracker is not None:
+            self.send(MSG_DEVICE_SNAPSHOT, self._tracker.snapshot())
+
+    def register_handler(self, msg_type: str, handler: MessageHandler):
+        """注册主服务器消息处理器，参数为data"""
+        self._handlers[msg_type] = handler
+
+    def track_devices(self, tracker):
+        """订阅DeviceStateTracker，连接建立和主服务器请求时发送完整快照"""
+        self._tracker = tracker
+        tracker.subscribe(self.send_device_delta)
+
+        async def resync(data: Dict):
+            self.send_device_snapshot()
+
+        self.register_handler(MSG_RESYNC_DEVICES, resync)
+
+    async def _run(self):
+        """连接并持续发送，断线重连"""
+        backoff = 1.0
+        while self.running:
+            try:
+                reader, self._writer = await asyncio.open_connection(
+                    self.master_host, self.master_port
+                )
+                self.connected = True
+                backoff = 1.0
+                logger.info(
+                    f"Connected to master {self.master_host}:{self.master_port}"
+                )
+                self._writer.write(
+                    encode_frame({"type": MSG_HELLO, "node_id": self.node_id})
+                )
+                # 断线期间主服务器已丢弃本节点的设备版本，先补发快照
+                self.send_device_snapshot()
+                await self._serve(reader)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Master channel error: {e}")
+            finally:
+                await self._close()
+
+            if self.running:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _serve(self, reader: asyncio.StreamReader):
+        """发送队列直到连接断开"""
+        sender = asyncio.create_task(self._drain_queue())
+        # 读到EOF即说明连接已断开，不必等到下次写失败
+        watcher = asyncio.create_task(self._receive(reader))
+        try:
+            done, _ = await asyncio.wait(
+                {sender, watcher}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            sender.cancel()
+            watcher.cancel()
+        if sender in done:
+            sender.result()
+        else:
+            logger.warning("Master closed the channel")
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        """接收主服务器消息直到连接关闭"""
+        try:
+            while True:
+                message = await read_frame(reader)
+                handler = self._handlers.get(message.get("type"))
+                if handler is None:
+                    continue
+                try:
+                    await handler(message.get("data") or {})
+                except Exception as e:
+                    logger.error(f"Error handling {message.get('type')}: {e}")
+        except (asyncio.IncompleteReadError, FrameError):
+            return
+
+    async def _drain_queue(self):
+        """把队列中的帧合并写出"""
+        while self.running:
+            await self._ready.wait()
+            self._ready.clear()
+            if not self._queue:
+                continue
+            frames = list(self._queue)
+            self._queue.clear()
+            try:
+                self._writer.write(b"".join(frames))
+                await self._writer.drain()
+            except BaseException:
+                # 写出失败或被取消的消息放回队首，重连后重发
+                self._queue.extendleft(reversed(frames))
+                raise
+
+    async def _close(self):
+        """关闭当前连接"""
+        self.connected = False
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
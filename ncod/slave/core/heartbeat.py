@@ -1,11 +1,12 @@
 """从服务器心跳客户端"""
 
 import asyncio
-import json
 import logging
 from datetime import datetime
 from typing import Optional
 
+from ncod.slave.core.channel import MasterChannel
+
 # 创建日志记录器
 logger = logging.getLogger("heartbeat_client")
 logger.setLevel(logging.INFO)
@@ -14,8 +15,9 @@ logger.setLevel(logging.INFO)
 class HeartbeatClient:
     """心跳客户端"""
 
-    def __init__(self, node_id: str, interval: int = 5):
+    def __init__(self, node_id: str, channel: MasterChannel, interval: int = 5):
         self.node_id = node_id
+        self.channel = channel
         self.interval = interval
         self.running = False
         self.last_sent: Optional[datetime] = None
@@ -44,8 +46,8 @@ class HeartbeatClient:
         """发送心跳"""
         while self.running:
             try:
-                # 这里添加实际的心跳发送逻辑
                 self.last_sent = datetime.utcnow()
+                self.channel.send_heartbeat(self.last_sent)
                 logger.debug(f"Sent heartbeat at {self.last_sent}")
                 await asyncio.sleep(self.interval)
             except Exception as e:
@@ -1,37 +1,164 @@
-"""设备调度器"""
+"""设备调度器
+
+每个设备一个等待堆，按老化后的有效优先级出队:
+    有效优先级 = priority + aging_rate * 已等待秒数
+所有条目老化速度相同，任意两个条目的先后顺序不随时间改变，因此排序键在入队时
+一次算好即可(key = aging_rate * 入队时间 - priority，越小越先)，入队/出队均为
+O(log n)，低优先级用户等得足够久后自然排到前面。
+
+最长使用时间和最长排队时间统一放在一个截止时间堆中，由定时任务睡到最早的截止
+时间再处理，不再轮询所有设备。队列状态通过PortQueue持久化，重启后恢复。
+"""
 
 import asyncio
-from typing import Dict, List, Optional, Tuple, NamedTuple
-from datetime import datetime, timedelta
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update
 from ncod.core.logger import setup_logger
 from ncod.core.config import config
+from ncod.core.db.database import async_session_maker
+from ncod.models.queue import PortQueue
 from ncod.slave.device.manager import device_manager
 
 logger = setup_logger("device_scheduler")
 
+# PortQueue.status
+WAITING = "waiting"
+USING = "using"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+
+# 截止时间类型
+DEADLINE_USE = "use"
+DEADLINE_WAIT = "wait"
+
+
+def _to_timestamp(value: datetime) -> float:
+    """把数据库中的UTC时间(无时区)转换为时间戳"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _to_datetime(timestamp: float) -> datetime:
+    """把时间戳转换为数据库使用的UTC时间(无时区)"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
 
-class QueueEntry(NamedTuple):
+@dataclass(eq=False)
+class QueueEntry:
     """队列条目"""
 
     user_id: str
     priority: int
+    device_id: str = ""
+    enqueued_at: float = field(default_factory=time.time)
+    key: float = 0.0
+    seq: int = 0
+    record_id: Optional[int] = None
+    # 取消或出队后置为False，堆中的条目延迟删除
+    active: bool = True
+
+    def __lt__(self, other: "QueueEntry") -> bool:
+        return (self.key, self.seq) < (other.key, other.seq)
+
+
+@dataclass
+class Holder:
+    """当前占用设备的会话"""
+
+    user_id: str
+    record_id: Optional[int] = None
+    token: int = 0
+
+
+class PortQueueStore:
+    """基于PortQueue表的队列持久化"""
+
+    def __init__(self, session_factory=async_session_maker):
+        self.session_factory = session_factory
+
+    async def load(self) -> List[PortQueue]:
+        """加载未结束的排队和使用记录"""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(PortQueue)
+                .where(PortQueue.status.in_((WAITING, USING)))
+                .where(PortQueue.device_id.is_not(None))
+                .order_by(PortQueue.request_time)
+            )
+            return list(result.scalars().all())
+
+    async def add(
+        self,
+        device_id: str,
+        user_id: str,
+        priority: int,
+        status: str,
+        request_time: datetime,
+        start_time: Optional[datetime] = None,
+    ) -> int:
+        """新增记录并返回ID"""
+        async with self.session_factory() as session:
+            record = PortQueue(
+                device_id=device_id,
+                user_id=user_id,
+                priority=priority,
+                status=status,
+                request_time=request_time,
+                start_time=start_time,
+            )
+            session.add(record)
+            await session.commit()
+            return record.id
+
+    async def update(self, record_id: int, **values):
+        """更新记录"""
+        async with self.session_factory() as session:
+            await session.execute(
+                update(PortQueue).where(PortQueue.id == record_id).values(**values)
+            )
+            await session.commit()
 
 
 class DeviceScheduler:
     """设备调度器"""
 
-    def __init__(self):
-        self.manager = device_manager
+    def __init__(self, manager=None, store: Optional[PortQueueStore] = None):
+        self.manager = manager or device_manager
+        self.store = store or PortQueueStore()
         self.running = False
         self.device_queue: Dict[str, List[QueueEntry]] = {}
-        self.max_wait_time = config.max_device_wait_time
-        self.max_use_time = config.max_device_use_time
+        self.max_wait_time = config.MAX_DEVICE_WAIT_TIME
+        self.max_use_time = config.MAX_DEVICE_USE_TIME
+        self.aging_rate = config.QUEUE_AGING_RATE
+        self.max_queued_per_user = config.MAX_QUEUED_PER_USER
+        self.max_devices_per_user = config.MAX_DEVICES_PER_USER
+        # (device_id, user_id) -> 排队中的条目
+        self._entries: Dict[Tuple[str, str], QueueEntry] = {}
+        self._queued_count: Dict[str, int] = defaultdict(int)
+        # device_id -> 排队中的人数
+        self._waiting_count: Dict[str, int] = defaultdict(int)
+        self._holders: Dict[str, Holder] = {}
+        self._held_count: Dict[str, int] = defaultdict(int)
+        # (截止时间, 令牌, 类型, device_id, user_id)
+        self._deadlines: List[Tuple[float, int, str, str, str]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
 
     async def start(self):
         """启动调度器"""
         try:
+            await self._restore()
             self.running = True
-            asyncio.create_task(self._scheduling_loop())
+            self._tasks = [
+                asyncio.create_task(self._scheduling_loop()),
+                asyncio.create_task(self._deadline_loop()),
+            ]
             logger.info("Device scheduler started")
         except Exception as e:
             logger.error(f"Error starting device scheduler: {e}")
@@ -41,6 +168,10 @@ class DeviceScheduler:
         """停止调度器"""
         try:
             self.running = False
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
             logger.info("Device scheduler stopped")
         except Exception as e:
             logger.error(f"Error stopping device scheduler: {e}")
@@ -54,33 +185,53 @@ class DeviceScheduler:
             if not device_info:
                 return False, "Device not found"
 
-            if device_info["status"] == "available":
-                success = await self.manager.request_device(device_id, user_id)
-                if success:
+            holder = self._holders.get(device_id)
+            if holder and holder.user_id == user_id:
+                return True, "Device already assigned"
+            if (device_id, user_id) in self._entries:
+                return True, "Already in queue"
+            if self._held_count[user_id] >= self.max_devices_per_user:
+                return False, "User device limit reached"
+
+            if device_info["status"] == "available" and not self.queue_length(
+                device_id
+            ):
+                if await self._assign(device_id, user_id, priority):
                     return True, "Device assigned"
                 return False, "Failed to assign device"
 
-            if device_id not in self.device_queue:
-                self.device_queue[device_id] = []
+            if self._queued_count[user_id] >= self.max_queued_per_user:
+                return False, "User queue limit reached"
 
-            queue = self.device_queue[device_id]
-            insert_pos = len(queue)
-            for i, entry in enumerate(queue):
-                if priority > entry.priority:
-                    insert_pos = i
-                    break
-
-            queue.insert(insert_pos, QueueEntry(user_id, priority))
+            entry = QueueEntry(user_id, priority, device_id=device_id)
+            self._enqueue(entry)
+            await self._persist_new(entry, WAITING)
+            # 设备空闲但已有人排队时，按队列顺序分配
+            await self._process_device_queue(device_id)
+            if (device_id, user_id) not in self._entries:
+                return True, "Device assigned"
             return True, "Added to queue"
         except Exception as e:
             logger.error(f"Error requesting device: {e}")
             return False, str(e)
 
+    async def cancel_request(self, device_id: str, user_id: str) -> bool:
+        """取消排队"""
+        entry = self._entries.get((device_id, user_id))
+        if not entry:
+            return False
+        self._dequeue(entry)
+        await self._persist_update(
+            entry.record_id, status=CANCELLED, end_time=datetime.utcnow()
+        )
+        return True
+
     async def release_device(self, device_id: str, user_id: str) -> Tuple[bool, str]:
         """释放设备"""
         try:
             success = await self.manager.release_device(device_id, user_id)
             if success:
+                await self._clear_holder(device_id, COMPLETED)
                 # 检查等待队列
                 await self._process_device_queue(device_id)
             return success, "Device released"
@@ -88,61 +239,218 @@ class DeviceScheduler:
             logger.error(f"Error releasing device: {e}")
             return False, str(e)
 
+    async def notify_available(self, device_id: str):
+        """设备变为可用时(例如在调度器之外被释放)分配给排队用户"""
+        await self._process_device_queue(device_id)
+
+    def _enqueue(self, entry: QueueEntry):
+        """加入设备等待堆"""
+        entry.seq = next(self._seq)
+        entry.key = self.aging_rate * entry.enqueued_at - entry.priority
+        heapq.heappush(self.device_queue.setdefault(entry.device_id, []), entry)
+        self._entries[(entry.device_id, entry.user_id)] = entry
+        self._queued_count[entry.user_id] += 1
+        self._waiting_count[entry.device_id] += 1
+        if self.max_wait_time:
+            self._push_deadline(
+                entry.enqueued_at + self.max_wait_time,
+                entry.seq,
+                DEADLINE_WAIT,
+                entry.device_id,
+                entry.user_id,
+            )
+
+    def _dequeue(self, entry: QueueEntry):
+        """标记条目离开队列(堆中延迟删除)"""
+        if not entry.active:
+            return
+        entry.active = False
+        self._entries.pop((entry.device_id, entry.user_id), None)
+        self._queued_count[entry.user_id] -= 1
+        if self._queued_count[entry.user_id] <= 0:
+            del self._queued_count[entry.user_id]
+        self._waiting_count[entry.device_id] -= 1
+        if self._waiting_count[entry.device_id] <= 0:
+            del self._waiting_count[entry.device_id]
+        self._prune(entry.device_id)
+
+    def _prune(self, device_id: str):
+        """弹出堆顶已失效的条目，队列为空时移除"""
+        heap = self.device_queue.get(device_id)
+        while heap and not heap[0].active:
+            heapq.heappop(heap)
+        if not heap:
+            self.device_queue.pop(device_id, None)
+
+    def _push_deadline(
+        self, deadline: float, token: int, kind: str, device_id: str, user_id: str
+    ):
+        """加入截止时间堆，成为最早的截止时间时唤醒定时任务"""
+        item = (deadline, token, kind, device_id, user_id)
+        heapq.heappush(self._deadlines, item)
+        if self._deadlines[0] is item:
+            self._wakeup.set()
+
+    async def _assign(
+        self,
+        device_id: str,
+        user_id: str,
+        priority: int = 0,
+        entry: Optional[QueueEntry] = None,
+    ) -> bool:
+        """把设备分配给用户"""
+        success = await self.manager.request_device(device_id, user_id)
+        if not success:
+            return False
+
+        now = time.time()
+        token = next(self._seq)
+        holder = Holder(user_id, token=token)
+        if entry and entry.record_id is not None:
+            holder.record_id = entry.record_id
+            await self._persist_update(
+                entry.record_id, status=USING, start_time=_to_datetime(now)
+            )
+        else:
+            holder.record_id = await self._persist_add(
+                device_id, user_id, priority, USING, now, now
+            )
+        self._set_holder(device_id, holder, now)
+        return True
+
+    def _set_holder(self, device_id: str, holder: Holder, start_time: float):
+        """登记设备占用并安排最长使用时间"""
+        self._holders[device_id] = holder
+        self._held_count[holder.user_id] += 1
+        if self.max_use_time:
+            self._push_deadline(
+                start_time + self.max_use_time,
+                holder.token,
+                DEADLINE_USE,
+                device_id,
+                holder.user_id,
+            )
+
+    async def _clear_holder(self, device_id: str, status: str):
+        """结束设备占用"""
+        holder = self._holders.pop(device_id, None)
+        if not holder:
+            return
+        self._held_count[holder.user_id] -= 1
+        if self._held_count[holder.user_id] <= 0:
+            del self._held_count[holder.user_id]
+        await self._persist_update(
+            holder.record_id, status=status, end_time=datetime.utcnow()
+        )
+
     async def _scheduling_loop(self):
-        """调度循环"""
+        """兜底调度循环，只检查有人排队的设备"""
         while self.running:
             try:
-                await self._check_timeouts()
                 await self._process_all_queues()
-                await asyncio.sleep(config.scheduling_interval)
+                await asyncio.sleep(config.SCHEDULING_INTERVAL)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Error in scheduling loop: {e}")
                 await asyncio.sleep(5)
 
-    async def _check_timeouts(self):
-        """检查超时"""
+    async def _deadline_loop(self):
+        """截止时间循环，睡到最早的截止时间"""
+        while self.running:
+            try:
+                await self._check_timeouts()
+                timeout = (
+                    max(0.0, self._deadlines[0][0] - time.time())
+                    if self._deadlines
+                    else None
+                )
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in deadline loop: {e}")
+                await asyncio.sleep(1)
+
+    async def _check_timeouts(self, now: Optional[float] = None):
+        """处理所有已到期的截止时间"""
         try:
-            current_time = datetime.utcnow()
-            for device_id, device in self.manager.controller.devices.items():
-                if device["status"] != "in_use":
-                    continue
-
-                usage = self.manager.device_usage.get(device_id, {})
-                current_session = usage.get("current_session")
-                if not current_session:
-                    continue
-
-                # 检查使用时间是否超过限制
-                start_time = current_session["start_time"]
-                if (current_time - start_time) > timedelta(seconds=self.max_use_time):
-                    user_id = current_session["user_id"]
-                    await self.release_device(device_id, user_id)
-                    logger.info(f"Released device {device_id} due to timeout")
+            now = time.time() if now is None else now
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, token, kind, device_id, user_id = heapq.heappop(self._deadlines)
+                if kind == DEADLINE_USE:
+                    await self._expire_use(token, device_id, user_id)
+                else:
+                    await self._expire_wait(token, device_id, user_id)
         except Exception as e:
             logger.error(f"Error checking timeouts: {e}")
 
+    async def _expire_use(self, token: int, device_id: str, user_id: str):
+        """使用时间到期，强制释放"""
+        holder = self._holders.get(device_id)
+        if not holder or holder.token != token:
+            return
+        success, _ = await self.release_device(device_id, user_id)
+        if success:
+            logger.info(f"Released device {device_id} due to timeout")
+        else:
+            # 管理器中已没有该会话(例如重启后)，只结束记录
+            await self._clear_holder(device_id, COMPLETED)
+            await self._process_device_queue(device_id)
+
+    async def _expire_wait(self, token: int, device_id: str, user_id: str):
+        """排队时间到期，移出队列"""
+        entry = self._entries.get((device_id, user_id))
+        if not entry or entry.seq != token:
+            return
+        self._dequeue(entry)
+        await self._persist_update(
+            entry.record_id, status=CANCELLED, end_time=datetime.utcnow()
+        )
+        logger.info(f"Removed user {user_id} from queue of {device_id} due to timeout")
+
     async def _process_device_queue(self, device_id: str):
         """处理设备队列"""
         try:
-            if device_id not in self.device_queue:
-                return
-
-            queue = self.device_queue[device_id]
-            if not queue:
+            self._prune(device_id)
+            heap = self.device_queue.get(device_id)
+            if not heap:
                 return
 
             device_info = self.manager.controller.get_device_info(device_id)
             if not device_info or device_info["status"] != "available":
                 return
 
-            entry = queue.pop(0)
-            success = await self.manager.request_device(device_id, entry.user_id)
-            if success:
-                logger.info(
-                    f"Assigned device {device_id} to queued user {entry.user_id}"
-                )
-            else:
-                queue.append(QueueEntry(entry.user_id, 0))
+            # 已达到占用上限的用户保留原位，让给后面的用户
+            skipped: List[QueueEntry] = []
+            try:
+                while heap:
+                    entry = heapq.heappop(heap)
+                    if not entry.active:
+                        continue
+                    if self._held_count[entry.user_id] >= self.max_devices_per_user:
+                        skipped.append(entry)
+                        continue
+                    if await self._assign(device_id, entry.user_id, entry=entry):
+                        self._dequeue(entry)
+                        logger.info(
+                            f"Assigned device {device_id} to queued user "
+                            f"{entry.user_id}"
+                        )
+                    else:
+                        skipped.append(entry)
+                    break
+            finally:
+                if skipped:
+                    # 出队过程中队列可能已被清空移除，需要重新登记
+                    heap = self.device_queue.setdefault(device_id, heap)
+                    for entry in skipped:
+                        heapq.heappush(heap, entry)
+                self._prune(device_id)
         except Exception as e:
             logger.error(f"Error processing device queue: {e}")
 
@@ -154,14 +462,86 @@ class DeviceScheduler:
         except Exception as e:
             logger.error(f"Error processing all queues: {e}")
 
+    async def _restore(self):
+        """从PortQueue恢复排队和占用状态"""
+        try:
+            records = await self.store.load()
+        except Exception as e:
+            logger.error(f"Error restoring device queues: {e}")
+            return
+
+        for record in records:
+            if record.status == USING and record.device_id not in self._holders:
+                start_time = _to_timestamp(record.start_time or record.request_time)
+                holder = Holder(
+                    str(record.user_id), record_id=record.id, token=next(self._seq)
+                )
+                self._set_holder(record.device_id, holder, start_time)
+            elif record.status == WAITING:
+                self._enqueue(
+                    QueueEntry(
+                        str(record.user_id),
+                        record.priority or 0,
+                        device_id=record.device_id,
+                        enqueued_at=_to_timestamp(record.request_time),
+                        record_id=record.id,
+                    )
+                )
+        if records:
+            logger.info(f"Restored {len(records)} device queue records")
+
+    async def _persist_new(self, entry: QueueEntry, status: str):
+        entry.record_id = await self._persist_add(
+            entry.device_id, entry.user_id, entry.priority, status, entry.enqueued_at
+        )
+
+    async def _persist_add(
+        self,
+        device_id: str,
+        user_id: str,
+        priority: int,
+        status: str,
+        request_time: float,
+        start_time: Optional[float] = None,
+    ) -> Optional[int]:
+        """写入新记录，失败时只记录日志(内存状态为准)"""
+        try:
+            return await self.store.add(
+                device_id,
+                user_id,
+                priority,
+                status,
+                _to_datetime(request_time),
+                _to_datetime(start_time) if start_time else None,
+            )
+        except Exception as e:
+            logger.error(f"Error persisting device queue record: {e}")
+            return None
+
+    async def _persist_update(self, record_id: Optional[int], **values):
+        """更新记录，失败时只记录日志(内存状态为准)"""
+        if record_id is None:
+            return
+        try:
+            await self.store.update(record_id, **values)
+        except Exception as e:
+            logger.error(f"Error updating device queue record {record_id}: {e}")
+
+    def queue_length(self, device_id: str) -> int:
+        """设备等待人数"""
+        return self._waiting_count.get(device_id, 0)
+
     def get_queue_position(self, device_id: str, user_id: str) -> Optional[int]:
         """获取用户在队列中的位置"""
         try:
-            queue = self.device_queue.get(device_id, [])
-            for i, (queued_user, _) in enumerate(queue):
-                if queued_user == user_id:
-                    return i
-            return None
+            entry = self._entries.get((device_id, user_id))
+            if not entry:
+                return None
+            return sum(
+                1
+                for other in self.device_queue.get(device_id, [])
+                if other.active and other < entry
+            )
         except Exception as e:
             logger.error(f"Error getting queue position: {e}")
             return None
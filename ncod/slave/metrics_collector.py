@@ -5,15 +5,21 @@
 import asyncio
 import json
 import logging
-from dataclasses import asdict, dataclass
+import math
+import time
+from array import array
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 import aioredis
 import psutil
 
 logger = logging.getLogger(__name__)
 
+# 每个指标在内存和Redis中保留的数据点数
+DEFAULT_CAPACITY = 1000
+
 
 @dataclass
 class MetricValue:
@@ -24,6 +30,121 @@ class MetricValue:
     labels: Dict = None
 
 
+class MetricSeries:
+    """定长环形缓冲区
+
+    时间戳和值分别保存在float64数组中，按写入顺序(时间递增)排列，
+    写满后覆盖最旧的数据点。时间范围查询用二分查找定位，
+    只有带标签的数据点才会占用标签槽位。
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._timestamps = array("d", bytes(8 * capacity))
+        self._values = array("d", bytes(8 * capacity))
+        self._labels: List[Optional[Dict]] = [None] * capacity
+        self._head = 0  # 最旧数据点的位置
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, timestamp: float, value: float, labels: Dict = None):
+        """追加数据点，时间戳早于最新数据点时按最新时间戳记录以保持有序"""
+        if self._size and timestamp < self._timestamps[self._slot(self._size - 1)]:
+            timestamp = self._timestamps[self._slot(self._size - 1)]
+        if self._size < self.capacity:
+            slot = self._slot(self._size)
+            self._size += 1
+        else:
+            slot = self._head
+            self._head = (self._head + 1) % self.capacity
+        self._timestamps[slot] = timestamp
+        self._values[slot] = value
+        self._labels[slot] = labels
+
+    def extend(self, values: Iterable[MetricValue]):
+        """按时间顺序追加多个指标值"""
+        points = []
+        for v in values:
+            timestamp = v.timestamp
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            points.append((timestamp.timestamp(), float(v.value), v.labels))
+        points.sort(key=lambda point: point[0])
+        for point in points:
+            self.append(*point)
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+        self._labels = [None] * self.capacity
+
+    def _slot(self, index: int) -> int:
+        return (self._head + index) % self.capacity
+
+    def _bisect(self, timestamp: float, right: bool) -> int:
+        """第一个时间戳 >= timestamp(right为True时 > timestamp)的位置"""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = self._timestamps[self._slot(mid)]
+            if current < timestamp or (right and current == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Tuple[int, int]:
+        """时间范围[start, end]对应的逻辑下标区间[lo, hi)"""
+        lo = self._bisect(start, False) if start is not None else 0
+        hi = self._bisect(end, True) if end is not None else self._size
+        return lo, max(lo, hi)
+
+    def _slice(self, data: array, lo: int, hi: int) -> array:
+        """按逻辑下标取连续的数据，最多拼接两段"""
+        if lo >= hi:
+            return array("d")
+        begin = self._slot(lo)
+        end = begin + (hi - lo)
+        if end <= self.capacity:
+            return data[begin:end]
+        return data[begin:] + data[: end - self.capacity]
+
+    def timestamps(self, lo: int = 0, hi: Optional[int] = None) -> array:
+        return self._slice(self._timestamps, lo, self._size if hi is None else hi)
+
+    def values(self, lo: int = 0, hi: Optional[int] = None) -> array:
+        return self._slice(self._values, lo, self._size if hi is None else hi)
+
+    def to_values(self, lo: int = 0, hi: Optional[int] = None) -> List[MetricValue]:
+        """转换为MetricValue列表"""
+        hi = self._size if hi is None else hi
+        return [
+            MetricValue(
+                value=self._values[slot],
+                timestamp=datetime.fromtimestamp(self._timestamps[slot]),
+                labels=self._labels[slot],
+            )
+            for slot in (self._slot(i) for i in range(lo, hi))
+        ]
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """已排序数据的百分位数(线性插值)"""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = rank - lower
+    return sorted_values[lower] + (
+        sorted_values[upper] - sorted_values[lower]
+    ) * fraction
+
+
 @dataclass
 class Metric:
     """指标定义"""
@@ -32,16 +153,47 @@ class Metric:
     type: str  # gauge, counter, histogram
     description: str
     unit: str = ""
-    values: List[MetricValue] = None
+    capacity: int = DEFAULT_CAPACITY
+    series: MetricSeries = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.series = MetricSeries(self.capacity)
+
+    @property
+    def values(self) -> List[MetricValue]:
+        """全部数据点(按时间顺序)"""
+        return self.series.to_values()
+
+    @values.setter
+    def values(self, values: Iterable[MetricValue]):
+        self.series.clear()
+        self.series.extend(values or [])
 
 
 class MetricsCollector:
-    """指标采集器"""
+    """指标采集器
 
-    def __init__(self, redis_url: Optional[str] = None):
+    采样只写入各指标的环形缓冲区，Redis持久化在缓冲的数据点达到
+    flush_size或每隔flush_interval秒时批量写入。
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        capacity: int = DEFAULT_CAPACITY,
+        flush_size: int = 100,
+        flush_interval: float = 5.0,
+    ):
         self.metrics: Dict[str, Metric] = {}
         self.redis_url = redis_url
         self.redis: Optional[aioredis.Redis] = None
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # 待写入Redis的数据点: 指标名 -> [(时间戳, 值, 标签)]
+        self._pending: Dict[str, List[Tuple[float, float, Optional[Dict]]]] = {}
+        self._pending_count = 0
+        self._tasks: List[asyncio.Task] = []
         self._setup_default_metrics()
 
     def _setup_default_metrics(self):
@@ -86,18 +238,27 @@ class MetricsCollector:
     def add_metric(self, name: str, type: str, description: str, unit: str = ""):
         """添加指标"""
         self.metrics[name] = Metric(
-            name=name, type=type, description=description, unit=unit, values=[]
+            name=name,
+            type=type,
+            description=description,
+            unit=unit,
+            capacity=self.capacity,
         )
 
     async def start(self):
         """启动指标采集"""
         if self.redis_url:
             self.redis = await aioredis.from_url(self.redis_url)
-        asyncio.create_task(self._collect_system_metrics())
+            self._tasks.append(asyncio.create_task(self._flush_loop()))
+        self._tasks.append(asyncio.create_task(self._collect_system_metrics()))
 
     async def stop(self):
         """停止指标采集"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
         if self.redis:
+            await self.flush()
             await self.redis.close()
 
     async def _collect_system_metrics(self):
@@ -135,31 +296,56 @@ class MetricsCollector:
             logger.warning(f"Metric {name} not defined")
             return
 
-        metric = self.metrics[name]
-        metric_value = MetricValue(value=value, timestamp=datetime.now(), labels=labels)
-        metric.values.append(metric_value)
+        timestamp = time.time()
+        self.metrics[name].series.append(timestamp, value, labels)
 
-        # 保留最近1000个数据点
-        if len(metric.values) > 1000:
-            metric.values = metric.values[-1000:]
-
-        # 如果配置了Redis，同时保存到Redis
+        # 如果配置了Redis，缓冲后批量保存
         if self.redis:
+            self._pending.setdefault(name, []).append((timestamp, value, labels))
+            self._pending_count += 1
+            if self._pending_count >= self.flush_size:
+                await self.flush()
+
+    async def flush(self):
+        """把缓冲的数据点批量写入Redis，每个指标一次lpush和ltrim"""
+        if not self.redis or not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        self._pending_count = 0
+        for name, points in pending.items():
             try:
-                await self._save_to_redis(name, metric_value)
+                await self._save_to_redis(name, points)
             except Exception as e:
                 logger.error(f"Error saving metric to Redis: {e}")
+                # 保留未写入的数据点等待下次写入，超出容量的最旧数据丢弃
+                retry = (points + self._pending.get(name, []))[-self.capacity :]
+                self._pending[name] = retry
+                self._pending_count += len(retry)
+
+    async def _flush_loop(self):
+        """定时写入Redis"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
 
-    async def _save_to_redis(self, name: str, value: MetricValue):
-        """保存指标到Redis"""
+    async def _save_to_redis(
+        self, name: str, points: List[Tuple[float, float, Optional[Dict]]]
+    ):
+        """保存指标到Redis(最新的数据点在列表头部)"""
         key = f"metrics:{name}"
-        data = {
-            "value": value.value,
-            "timestamp": value.timestamp.isoformat(),
-            "labels": value.labels,
-        }
-        await self.redis.lpush(key, json.dumps(data))
-        await self.redis.ltrim(key, 0, 999)  # 保留最近1000个数据点
+        data = [
+            json.dumps(
+                {
+                    "value": value,
+                    "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+                    "labels": labels,
+                }
+            )
+            for timestamp, value, labels in points[-self.capacity :]
+        ]
+        await self.redis.lpush(key, *data)
+        await self.redis.ltrim(key, 0, self.capacity - 1)
 
     def get_metric(self, name: str) -> Optional[Metric]:
         """获取指标"""
@@ -169,6 +355,17 @@ class MetricsCollector:
         """获取所有指标"""
         return self.metrics
 
+    def _window(
+        self,
+        metric: Metric,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+    ) -> Tuple[int, int]:
+        return metric.series.window(
+            start_time.timestamp() if start_time else None,
+            end_time.timestamp() if end_time else None,
+        )
+
     async def get_metric_values(
         self,
         name: str,
@@ -180,12 +377,7 @@ class MetricsCollector:
         if not metric:
             return []
 
-        values = metric.values
-        if start_time:
-            values = [v for v in values if v.timestamp >= start_time]
-        if end_time:
-            values = [v for v in values if v.timestamp <= end_time]
-        return values
+        return metric.series.to_values(*self._window(metric, start_time, end_time))
 
     async def export_metrics(self) -> Dict:
         """导出所有指标"""
@@ -216,22 +408,38 @@ class MetricsCollector:
         """清除指标数据"""
         if name:
             if name in self.metrics:
-                self.metrics[name].values = []
+                self.metrics[name].series.clear()
         else:
             for metric in self.metrics.values():
-                metric.values = []
+                metric.series.clear()
+
+    async def calculate_statistics(
+        self,
+        name: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        percentiles: Sequence[float] = (50, 90, 99),
+    ) -> Dict:
+        """计算指标统计信息
+
+        直接在值数组上计算，不构造MetricValue对象。
+        """
+        metric = self.metrics.get(name)
+        if not metric:
+            return {}
 
-    async def calculate_statistics(self, name: str) -> Dict:
-        """计算指标统计信息"""
-        values = await self.get_metric_values(name)
+        values = metric.series.values(*self._window(metric, start_time, end_time))
         if not values:
             return {}
 
-        raw_values = [v.value for v in values]
-        return {
-            "count": len(raw_values),
-            "min": min(raw_values),
-            "max": max(raw_values),
-            "avg": sum(raw_values) / len(raw_values),
-            "last": raw_values[-1],
+        ordered = sorted(values)
+        stats = {
+            "count": len(values),
+            "min": ordered[0],
+            "max": ordered[-1],
+            "avg": math.fsum(values) / len(values),
+            "last": values[-1],
         }
+        for q in percentiles:
+            stats[f"p{q:g}"] = percentile(ordered, q)
+        return stats
@@ -11,6 +11,12 @@ from dataclasses import dataclass
 from jinja2 import Environment, FileSystemLoader
 from ncod.core.logger import setup_logger
 from ncod.core.config import config
+from ncod.core.notifier import (
+    Digest,
+    Notification,
+    NotificationDispatcher,
+    RedisNotificationQueue,
+)
 
 logger = setup_logger("notification")
 
@@ -41,14 +47,59 @@ class NotificationRule:
 
 
 class NotificationService:
-    """通知服务"""
+    """通知服务
+
+    通知按规则格式化后交给分发器，同一渠道在合并窗口内的通知合并为一条
+    摘要，按渠道限速发送，失败时指数退避重试。启动时传入Redis连接则通知
+    保存在Redis队列中，重启后重新发送未确认的通知。
+    """
+
+    # 合并窗口(秒)
+    DIGEST_WINDOW = 30
+    # 各渠道每秒最多发送的摘要数
+    CHANNEL_RATES = {"email": 1.0, "webhook": 5.0, "dingtalk": 0.3}
+    # Redis中待发送通知的键
+    QUEUE_KEY = "slave:notify:pending"
 
     def __init__(self):
         self.channels: Dict[str, NotificationChannel] = {}
         self.rules: Dict[str, NotificationRule] = {}
         self.notification_history: List[Dict] = []
         self.max_history_size = config.notification_history_size
+        self.dispatcher = NotificationDispatcher(window=self.DIGEST_WINDOW)
         self._load_config()
+        for channel in self.channels.values():
+            self._register_channel(channel)
+
+    def _register_channel(self, channel: NotificationChannel):
+        """在分发器上注册渠道"""
+
+        async def send(digest: Digest) -> bool:
+            return await self._send_to_channel(channel, digest.title, digest.body)
+
+        self.dispatcher.register_channel(
+            channel.name,
+            send,
+            rate=self.CHANNEL_RATES.get(channel.type, 1.0),
+            on_result=self._on_delivered,
+        )
+
+    def _on_delivered(self, digest: Digest, ok: bool, error: Optional[str]):
+        """摘要发送成功或最终失败后记录通知历史"""
+        for item in digest.items:
+            self._add_to_history(
+                {
+                    "type": item.meta.get("type"),
+                    "severity": item.severity,
+                    "title": item.title,
+                    "content": item.meta.get("content"),
+                    "channel": digest.channel,
+                    "count": item.count,
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "success": ok,
+                    "error": error,
+                }
+            )
 
     def _load_config(self):
         """加载配置"""
@@ -121,9 +172,12 @@ class NotificationService:
         title: str,
         content: Dict,
         template: Optional[str] = None,
-        retry_count: int = 3,
     ) -> bool:
-        """发送通知"""
+        """发送通知
+
+        通知写入分发队列后立即返回，至少有一个渠道接收时返回True；
+        发送结果记录在通知历史中。
+        """
         try:
             # 查找匹配的规则
             matched_rules = [
@@ -139,52 +193,53 @@ class NotificationService:
             if not matched_rules:
                 return False
 
-            success = False
+            queued = False
             for rule in matched_rules:
+                # 使用指定模板或规则默认模板
+                template_name = template or rule.template
+                formatted_content = await self._format_content(
+                    template_name, title, content
+                )
+
                 # 发送到所有配置的渠道
                 for channel_name in rule.channels:
                     channel = self.channels.get(channel_name)
                     if not channel or not channel.enabled:
                         continue
 
-                    # 使用指定模板或规则默认模板
-                    template_name = template or rule.template
-                    formatted_content = await self._format_content(
-                        template_name, title, content
-                    )
-
-                    # 重试机制
-                    for attempt in range(retry_count):
-                        try:
-                            if await self._send_to_channel(
-                                channel, title, formatted_content
-                            ):
-                                success = True
-                                break
-                            await asyncio.sleep(2**attempt)  # 指数退避
-                        except Exception as e:
-                            logger.error(
-                                f"Attempt {attempt + 1} failed for "
-                                f"channel {channel.name}: {e}"
-                            )
-
-            # 记录通知历史
-            self._add_to_history(
-                {
-                    "type": notification_type,
-                    "severity": severity,
-                    "title": title,
-                    "content": content,
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "success": success,
-                }
-            )
-
-            return success
+                    if await self.dispatcher.submit(
+                        Notification(
+                            channel=channel.name,
+                            recipient=channel.name,
+                            title=title,
+                            body=formatted_content,
+                            severity=severity,
+                            # 同一规则下重复的通知在窗口内只保留最新一条
+                            key=f"{rule.name}:{title}",
+                            meta={"type": notification_type, "content": content},
+                        )
+                    ):
+                        queued = True
+
+            return queued
         except Exception as e:
             logger.error(f"Error sending notification: {e}")
             return False
 
+    async def start(self, redis=None):
+        """启动分发器并重新加载未发送的通知
+
+        Args:
+            redis: Redis连接，为None时使用进程内队列
+        """
+        if redis is not None and not self.dispatcher.running:
+            self.dispatcher.queue = RedisNotificationQueue(redis, self.QUEUE_KEY)
+        await self.dispatcher.start()
+
+    async def close(self):
+        """停止分发器"""
+        await self.dispatcher.stop()
+
     def _add_to_history(self, entry: Dict):
         """添加到历史记录"""
         self.notification_history.append(entry)
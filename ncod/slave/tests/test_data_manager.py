@@ -0,0 +1,56 @@
+"""
+数据管理服务测试模块
+"""
+
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from ..app.services.data_manager import DataManager, partition_upper_bound
+
+
+def test_partition_upper_bound():
+    """测试解析范围分区上界"""
+    expr = "FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-01-02 00:00:00')"
+    assert partition_upper_bound(expr) == datetime(2024, 1, 2)
+    assert partition_upper_bound("FOR VALUES FROM (MINVALUE) TO (MAXVALUE)") is None
+    assert partition_upper_bound("DEFAULT") is None
+
+
+@pytest.mark.asyncio
+async def test_retention_drops_expired_partitions():
+    """测试分区表按整个分区删除过期数据"""
+    db = AsyncMock()
+    executed = []
+
+    async def execute(statement, params=None):
+        sql = str(statement)
+        executed.append(sql)
+        if "pg_partitioned_table" in sql:
+            return SimpleNamespace(scalar=lambda: 1)
+        if "pg_inherits" in sql:
+            return SimpleNamespace(
+                all=lambda: [
+                    (
+                        "monitor_metrics_p20240101",
+                        "FOR VALUES FROM ('2024-01-01') TO ('2024-01-02')",
+                    ),
+                    (
+                        "monitor_metrics_p20240102",
+                        "FOR VALUES FROM ('2024-01-02') TO ('2024-01-03')",
+                    ),
+                ]
+            )
+        return SimpleNamespace(rowcount=0)
+
+    db.execute.side_effect = execute
+    manager = DataManager(db)
+
+    dropped = await manager._enforce_retention(
+        "monitor_metrics", "timestamp", datetime(2024, 1, 2, 12)
+    )
+    assert dropped == 1
+    assert any("DROP TABLE" in sql and "p20240101" in sql for sql in executed)
+    assert not any("DELETE" in sql or "p20240102" in sql for sql in executed)
@@ -0,0 +1,201 @@
+"""
+设备调度器测试模块
+"""
+
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from ..device.scheduler import (
+    CANCELLED,
+    COMPLETED,
+    USING,
+    WAITING,
+    DeviceScheduler,
+)
+
+
+class FakeController:
+    """模拟设备控制器"""
+
+    def __init__(self, device_ids):
+        self.devices = {device_id: {"status": "available"} for device_id in device_ids}
+
+    def get_device_info(self, device_id):
+        return self.devices.get(device_id)
+
+
+class FakeManager:
+    """模拟设备管理器"""
+
+    def __init__(self, device_ids):
+        self.controller = FakeController(device_ids)
+        self.users = {}
+
+    async def request_device(self, device_id, user_id):
+        if self.controller.devices[device_id]["status"] != "available":
+            return False
+        self.controller.devices[device_id]["status"] = "in_use"
+        self.users[device_id] = user_id
+        return True
+
+    async def release_device(self, device_id, user_id):
+        if self.users.get(device_id) != user_id:
+            return False
+        self.controller.devices[device_id]["status"] = "available"
+        del self.users[device_id]
+        return True
+
+
+class MemoryStore:
+    """内存中的PortQueue存储"""
+
+    def __init__(self, records=None):
+        self.records = {record.id: record for record in records or []}
+        self._next_id = len(self.records) + 1
+
+    async def load(self):
+        return [r for r in self.records.values() if r.status in (WAITING, USING)]
+
+    async def add(self, device_id, user_id, priority, status, request_time, start_time):
+        record = SimpleNamespace(
+            id=self._next_id,
+            device_id=device_id,
+            user_id=user_id,
+            priority=priority,
+            status=status,
+            request_time=request_time,
+            start_time=start_time,
+        )
+        self.records[record.id] = record
+        self._next_id += 1
+        return record.id
+
+    async def update(self, record_id, **values):
+        for name, value in values.items():
+            setattr(self.records[record_id], name, value)
+
+
+def _scheduler(device_ids=("dongle",), records=None, **limits):
+    scheduler = DeviceScheduler(FakeManager(device_ids), MemoryStore(records))
+    scheduler.max_wait_time = limits.get("max_wait_time", 0)
+    scheduler.max_use_time = limits.get("max_use_time", 0)
+    scheduler.max_devices_per_user = limits.get("max_devices_per_user", 3)
+    scheduler.max_queued_per_user = limits.get("max_queued_per_user", 5)
+    return scheduler
+
+
+@pytest.mark.asyncio
+async def test_priority_order_and_release_handoff():
+    """测试按优先级排队，释放后交给队首用户"""
+    scheduler = _scheduler()
+    assert await scheduler.request_device("dongle", "owner") == (
+        True,
+        "Device assigned",
+    )
+    await scheduler.request_device("dongle", "low", priority=0)
+    await scheduler.request_device("dongle", "high", priority=5)
+
+    assert scheduler.get_queue_position("dongle", "high") == 0
+    assert scheduler.get_queue_position("dongle", "low") == 1
+    assert scheduler.queue_length("dongle") == 2
+
+    await scheduler.release_device("dongle", "owner")
+    assert scheduler.manager.users["dongle"] == "high"
+    assert scheduler.queue_length("dongle") == 1
+
+    assert await scheduler.cancel_request("dongle", "low")
+    assert scheduler.queue_length("dongle") == 0
+
+
+@pytest.mark.asyncio
+async def test_aging_prevents_starvation():
+    """测试等待足够久的低优先级用户排到前面"""
+    scheduler = _scheduler()
+    scheduler.aging_rate = 1.0
+    await scheduler.request_device("dongle", "owner")
+    await scheduler.request_device("dongle", "patient", priority=0)
+    # 高优先级用户晚到10秒，老化后有效优先级低于先到的用户
+    scheduler._entries[("dongle", "patient")].key -= 10
+    await scheduler.request_device("dongle", "vip", priority=5)
+
+    assert scheduler.get_queue_position("dongle", "patient") == 0
+
+
+@pytest.mark.asyncio
+async def test_fairness_cap_skips_busy_user():
+    """测试已达占用上限的用户让给后面的用户"""
+    scheduler = _scheduler(("a", "b"), max_devices_per_user=1)
+    await scheduler.request_device("a", "owner")
+    await scheduler.request_device("a", "greedy", priority=9)
+    await scheduler.request_device("a", "other")
+    await scheduler.request_device("b", "greedy")
+
+    await scheduler.release_device("a", "owner")
+    assert scheduler.manager.users["a"] == "other"
+    assert scheduler.get_queue_position("a", "greedy") == 0
+
+
+@pytest.mark.asyncio
+async def test_deadlines_expire_use_and_wait():
+    """测试使用和排队截止时间到期"""
+    scheduler = _scheduler(max_use_time=60, max_wait_time=30)
+    await scheduler.request_device("dongle", "owner")
+    await scheduler.request_device("dongle", "waiter")
+    await scheduler.request_device("dongle", "late")
+
+    now = time.time()
+    await scheduler._check_timeouts(now + 31)
+    # 排队超时的用户被移出队列
+    assert scheduler.queue_length("dongle") == 0
+    records = scheduler.store.records
+    assert {r.status for r in records.values() if r.user_id != "owner"} == {
+        CANCELLED
+    }
+
+    scheduler.max_wait_time = 0
+    await scheduler.request_device("dongle", "next")
+    # 只验证owner的使用期限，接手的用户不再设置期限
+    scheduler.max_use_time = 0
+    await scheduler._check_timeouts(now + 61)
+    assert scheduler.manager.users["dongle"] == "next"
+    assert records[1].status == COMPLETED
+
+
+@pytest.mark.asyncio
+async def test_restore_from_store():
+    """测试从PortQueue记录恢复队列"""
+    request_time = datetime.utcnow()
+    records = [
+        SimpleNamespace(
+            id=1,
+            device_id="dongle",
+            user_id="owner",
+            priority=0,
+            status=USING,
+            request_time=request_time,
+            start_time=request_time,
+        ),
+        SimpleNamespace(
+            id=2,
+            device_id="dongle",
+            user_id="waiter",
+            priority=1,
+            status=WAITING,
+            request_time=request_time,
+            start_time=None,
+        ),
+    ]
+    scheduler = _scheduler(records=records)
+    scheduler.manager.controller.devices["dongle"]["status"] = "in_use"
+    scheduler.manager.users["dongle"] = "owner"
+
+    await scheduler._restore()
+    assert scheduler.get_queue_position("dongle", "waiter") == 0
+
+    await scheduler.release_device("dongle", "owner")
+    assert scheduler.manager.users["dongle"] == "waiter"
+    assert records[0].status == COMPLETED
+    assert records[1].status == USING
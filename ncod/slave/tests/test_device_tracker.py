@@ -0,0 +1,89 @@
+"""
+设备状态跟踪测试模块
+"""
+
+from unittest.mock import AsyncMock
+
+import pytest
+
+from ..app.services.device_tracker import DeviceStateTracker, parse_device_list
+
+LISTING = """Hub #1 (hub-a)
+Device #1 (Dongle A) [Available]
+Device #2 (Dongle B) [In Use]
+Hub #2 (hub-b)
+Device #1 (Dongle C) [Available]
+END"""
+
+
+def test_parse_device_list():
+    """测试解析设备列表"""
+    devices = parse_device_list(LISTING)
+    assert len(devices) == 3
+    assert devices[1] == {
+        "id": 2,
+        "name": "Dongle B",
+        "status": "In Use",
+        "hub_id": 1,
+        "hub_name": "hub-a",
+    }
+
+
+def test_initial_apply_adds_all():
+    """测试首次同步全部为新增"""
+    tracker = DeviceStateTracker()
+    delta = tracker.apply(LISTING)
+    assert len(delta.added) == 3
+    assert delta.version == 1
+    assert set(tracker.devices) == {"1:1", "1:2", "2:1"}
+
+
+def test_unchanged_listing_is_empty():
+    """测试输出未变化时没有增量"""
+    tracker = DeviceStateTracker()
+    tracker.apply(LISTING)
+    delta = tracker.apply(LISTING)
+    assert delta.empty
+    assert tracker.version == 1
+
+
+def test_minimal_diff():
+    """测试只报告实际变化"""
+    tracker = DeviceStateTracker()
+    tracker.apply(LISTING)
+    listing = LISTING.replace("Dongle A) [Available]", "Dongle A) [In Use]")
+    listing = listing.replace("Device #1 (Dongle C) [Available]\n", "")
+    listing = listing.replace("END", "Hub #3 (hub-c)\nDevice #7 (Dongle D) [Available]\nEND")
+    delta = tracker.apply(listing)
+    assert [d["name"] for d in delta.changed] == ["Dongle A"]
+    assert [d["name"] for d in delta.removed] == ["Dongle C"]
+    assert [d["name"] for d in delta.added] == ["Dongle D"]
+    assert delta.version == 2
+
+
+def test_removed_hub():
+    """测试Hub消失时其下设备全部移除"""
+    tracker = DeviceStateTracker()
+    tracker.apply(LISTING)
+    delta = tracker.apply(LISTING.split("Hub #2")[0] + "END")
+    assert sorted(d["name"] for d in delta.removed) == ["Dongle C"]
+    assert not delta.added and not delta.changed
+
+
+@pytest.mark.asyncio
+async def test_refresh_publishes_delta():
+    """测试刷新后推送增量"""
+    client = AsyncMock()
+    client.execute.return_value = LISTING
+    tracker = DeviceStateTracker(client)
+    received = []
+
+    async def listener(delta):
+        received.append(delta)
+
+    tracker.subscribe(listener)
+    await tracker.refresh()
+    await tracker.refresh()
+    client.execute.assert_called_with("list")
+    assert len(received) == 1
+    assert received[0].to_dict()["version"] == 1
@@ -0,0 +1,118 @@
+"""
+主服务器通道测试模块
+"""
+
+import asyncio
+
+import pytest
+
+from ncod.core.channel import (
+    MSG_DEVICE_DELTA,
+    MSG_DEVICE_SNAPSHOT,
+    MSG_HEARTBEAT,
+    MSG_HELLO,
+    MSG_LOAD,
+    MSG_RESYNC_DEVICES,
+    encode_frame,
+    read_frame,
+)
+
+from ..app.services.device_tracker import DeviceStateTracker
+from ..core.channel import MasterChannel
+
+
+async def _start_fake_master():
+    """启动模拟主服务器，收集收到的帧"""
+    received = asyncio.Queue()
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                await received.put(await read_frame(reader))
+        except asyncio.IncompleteReadError:
+            pass
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], received, connections
+
+
+@pytest.mark.asyncio
+async def test_frame_roundtrip():
+    """测试帧编解码"""
+    reader = asyncio.StreamReader()
+    message = {"type": MSG_LOAD, "node_id": "n1", "data": {"cpu": 12.5}}
+    reader.feed_data(encode_frame(message) + encode_frame(message))
+    assert await read_frame(reader) == message
+    assert await read_frame(reader) == message
+
+
+@pytest.mark.asyncio
+async def test_messages_share_one_connection():
+    """测试心跳、负载和设备增量共用一条连接"""
+    server, port, received, connections = await _start_fake_master()
+    channel = MasterChannel("n1", "127.0.0.1", port)
+    try:
+        channel.send_heartbeat()
+        channel.send_load({"cpu": 10})
+        await channel.start()
+        assert (await asyncio.wait_for(received.get(), 1))["type"] == MSG_HELLO
+        assert (await asyncio.wait_for(received.get(), 1))["type"] == MSG_HEARTBEAT
+        load = await asyncio.wait_for(received.get(), 1)
+        assert load == {"type": MSG_LOAD, "node_id": "n1", "data": {"cpu": 10}}
+
+        channel.send(MSG_DEVICE_DELTA, {"version": 1})
+        delta = await asyncio.wait_for(received.get(), 1)
+        assert delta["data"] == {"version": 1}
+        assert len(connections) == 1
+    finally:
+        await channel.stop()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_after_drop():
+    """测试断线后重连并继续发送"""
+    server, port, received, connections = await _start_fake_master()
+    channel = MasterChannel("n1", "127.0.0.1", port)
+    try:
+        await channel.start()
+        assert (await asyncio.wait_for(received.get(), 1))["type"] == MSG_HELLO
+        connections[0].close()
+        await asyncio.sleep(0.05)
+        channel.send_heartbeat()
+        messages = []
+        while not any(m["type"] == MSG_HEARTBEAT for m in messages):
+            messages.append(await asyncio.wait_for(received.get(), 3))
+        assert len(connections) == 2
+    finally:
+        await channel.stop()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_snapshot_on_connect_and_resync():
+    """测试连接后先发送设备快照，主服务器请求时重新发送"""
+    server, port, received, connections = await _start_fake_master()
+    tracker = DeviceStateTracker()
+    tracker.apply("Hub #1 (hub-a)\nDevice #1 (Dongle A) [Available]\n")
+    channel = MasterChannel("n1", "127.0.0.1", port)
+    channel.track_devices(tracker)
+    try:
+        await channel.start()
+        assert (await asyncio.wait_for(received.get(), 1))["type"] == MSG_HELLO
+        snapshot = await asyncio.wait_for(received.get(), 1)
+        assert snapshot["type"] == MSG_DEVICE_SNAPSHOT
+        assert snapshot["data"]["version"] == 1
+
+        connections[0].write(encode_frame({"type": MSG_RESYNC_DEVICES, "data": {}}))
+        resent = await asyncio.wait_for(received.get(), 1)
+        assert resent["type"] == MSG_DEVICE_SNAPSHOT
+        assert resent["data"]["devices"] == snapshot["data"]["devices"]
+    finally:
+        await channel.stop()
+        server.close()
+        await server.wait_closed()
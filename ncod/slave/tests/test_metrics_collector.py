@@ -9,7 +9,13 @@ from unittest.mock import AsyncMock, Mock, patch
 import aioredis
 import pytest
 
-from ..metrics_collector import Metric, MetricsCollector, MetricValue
+from ..metrics_collector import (
+    Metric,
+    MetricsCollector,
+    MetricSeries,
+    MetricValue,
+    percentile,
+)
 
 
 @pytest.fixture
@@ -60,6 +66,7 @@ async def test_add_metric(metrics_collector):
 @pytest.mark.asyncio
 async def test_record_metric(metrics_collector, mock_redis):
     """测试记录指标值"""
+    metrics_collector.redis = mock_redis
     # 添加测试指标
     metrics_collector.add_metric(
         name="test_metric", type="gauge", description="Test metric", unit="count"
@@ -76,16 +83,34 @@ async def test_record_metric(metrics_collector, mock_redis):
     assert metric.values[0].value == 42.0
     assert metric.values[0].labels == {"host": "test"}
 
-    # 验证Redis存储
+    # Redis写入被缓冲，flush时批量保存
+    mock_redis.lpush.assert_not_called()
+    await metrics_collector.flush()
     mock_redis.lpush.assert_called_once()
     mock_redis.ltrim.assert_called_once()
 
     # 测试记录不存在的指标
     await metrics_collector.record_metric(name="nonexistent", value=42.0)
+    await metrics_collector.flush()
     # 应该只有一次lpush调用
     assert mock_redis.lpush.call_count == 1
 
 
+@pytest.mark.asyncio
+async def test_flush_batches_samples(metrics_collector, mock_redis):
+    """测试达到批量大小时一次写入多个数据点"""
+    metrics_collector.redis = mock_redis
+    metrics_collector.flush_size = 3
+    for value in range(3):
+        await metrics_collector.record_metric("device_status", float(value))
+
+    mock_redis.lpush.assert_called_once()
+    key, *data = mock_redis.lpush.call_args.args
+    assert key == "metrics:device_status"
+    # 最新的数据点在列表头部
+    assert [json.loads(item)["value"] for item in data] == [0.0, 1.0, 2.0]
+
+
 @pytest.mark.asyncio
 async def test_get_metric_values(metrics_collector):
     """测试获取指标值"""
@@ -250,6 +275,7 @@ async def test_calculate_statistics(metrics_collector):
     assert stats["max"] == 5.0
     assert stats["avg"] == 3.0
     assert stats["last"] == 5.0
+    assert stats["p50"] == 3.0
 
     # 测试空指标
     stats = await metrics_collector.calculate_statistics("nonexistent")
@@ -259,6 +285,7 @@ async def test_calculate_statistics(metrics_collector):
 @pytest.mark.asyncio
 async def test_redis_integration(metrics_collector, mock_redis):
     """测试Redis集成"""
+    metrics_collector.redis = mock_redis
     # 添加测试指标
     metrics_collector.add_metric(
         name="test_metric", type="gauge", description="Test metric"
@@ -268,6 +295,7 @@ async def test_redis_integration(metrics_collector, mock_redis):
     await metrics_collector.record_metric(
         name="test_metric", value=42.0, labels={"host": "test"}
     )
+    await metrics_collector.flush()
 
     # 验证Redis操作
     assert mock_redis.lpush.called
@@ -276,4 +304,31 @@ async def test_redis_integration(metrics_collector, mock_redis):
     # 模拟Redis错误
     mock_redis.lpush.side_effect = aioredis.RedisError
     await metrics_collector.record_metric(name="test_metric", value=43.0)
-    # 应该继续工作，但会记录错误
+    await metrics_collector.flush()
+    # 应该继续工作，但会记录错误，未写入的数据点留待下次写入
+    assert len(metrics_collector._pending["test_metric"]) == 1
+
+    mock_redis.lpush.side_effect = None
+    await metrics_collector.flush()
+    assert metrics_collector._pending == {}
+
+
+def test_series_ring_buffer():
+    """测试环形缓冲区覆盖最旧数据并按时间范围二分查找"""
+    series = MetricSeries(capacity=4)
+    for i in range(6):
+        series.append(float(i), i * 10.0)
+
+    assert len(series) == 4
+    assert list(series.timestamps()) == [2.0, 3.0, 4.0, 5.0]
+    lo, hi = series.window(2.5, 4.0)
+    assert list(series.values(lo, hi)) == [30.0, 40.0]
+    assert series.window(6.0) == (4, 4)
+
+
+def test_percentile():
+    """测试百分位数线性插值"""
+    ordered = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert percentile(ordered, 50) == 3.0
+    assert percentile(ordered, 90) == pytest.approx(4.6)
+    assert percentile([], 50) == 0.0
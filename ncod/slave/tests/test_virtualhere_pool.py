@@ -0,0 +1,108 @@
+"""
+VirtualHere连接池测试模块
+"""
+
+import asyncio
+
+import pytest
+
+from ..app.exceptions import VirtualHereConnectionError, VirtualHereError
+from ..app.services.virtualhere_pool import VirtualHereConnectionPool
+
+
+async def _start_fake_server(delays=None):
+    """启动模拟VirtualHere服务器，按命令名延迟响应"""
+    delays = delays or {}
+    connections = []
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode().strip()
+            # 同一连接上顺序处理，保证响应顺序与命令一致
+            await asyncio.sleep(delays.get(command.split()[0], 0))
+            writer.write(f"OK {command}\nSUCCESS\nEND\n".encode())
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, port, connections
+
+
+@pytest.mark.asyncio
+async def test_pipelined_responses_match_commands():
+    """测试流水线命令的响应与命令一一对应"""
+    server, port, connections = await _start_fake_server({"attach": 0.05})
+    pool = VirtualHereConnectionPool("127.0.0.1", port, size=1)
+    try:
+        commands = [f"attach {i} client" for i in range(5)] + ["list"]
+        responses = await asyncio.gather(*(pool.execute(c) for c in commands))
+        for command, response in zip(commands, responses):
+            assert response.startswith(f"OK {command}")
+            assert response.endswith("END")
+        # 所有命令复用同一条持久连接
+        assert len(connections) == 1
+    finally:
+        await pool.close()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_commands_spread_over_connections():
+    """测试并发命令分散到多个连接"""
+    server, port, connections = await _start_fake_server({"attach": 0.05})
+    pool = VirtualHereConnectionPool("127.0.0.1", port, size=3)
+    try:
+        await asyncio.gather(*(pool.execute(f"attach {i} c") for i in range(6)))
+        assert len(connections) == 3
+    finally:
+        await pool.close()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_after_server_drop():
+    """测试连接断开后自动重连"""
+    server, port, connections = await _start_fake_server()
+    pool = VirtualHereConnectionPool("127.0.0.1", port, size=1)
+    try:
+        assert "SUCCESS" in await pool.execute("list")
+        connections[0].close()
+        await asyncio.sleep(0.05)
+        assert "SUCCESS" in await pool.execute("list")
+        assert len(connections) == 2
+    finally:
+        await pool.close()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_timeout_fails_command():
+    """测试命令超时"""
+    server, port, _ = await _start_fake_server({"info": 1})
+    pool = VirtualHereConnectionPool("127.0.0.1", port, size=1, command_timeout=0.1)
+    try:
+        with pytest.raises(VirtualHereError):
+            await pool.execute("info 1")
+    finally:
+        await pool.close()
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_connect_failure():
+    """测试无法连接时抛出连接错误"""
+    server, port, _ = await _start_fake_server()
+    server.close()
+    await server.wait_closed()
+    pool = VirtualHereConnectionPool("127.0.0.1", port, size=1, retries=1)
+    with pytest.raises(VirtualHereConnectionError):
+        await pool.execute("list")
@@ -16,6 +16,7 @@ class WebSocketClient:
         self.ws: Optional[websockets.WebSocketClientProtocol] = None
         self.reconnect_interval = 5
         self.is_connected = False
+        self.tracker = None
 
     async def connect(self):
         """连接到主服务器"""
@@ -40,6 +41,8 @@ class WebSocketClient:
     async def register_slave(self):
         """注册从服务器"""
         await self.send_message({"type": "register_slave", "slave_id": self.slave_id})
+        # 断线期间的增量已丢失，重新连接后先发送完整快照
+        await self.send_device_snapshot()
 
     async def send_message(self, message: dict):
         """发送消息到主服务器"""
@@ -81,6 +84,10 @@ class WebSocketClient:
                     device_id, "online" if success else "error"
                 )
 
+            elif message_type == "resync_devices":
+                # 主服务器发现增量版本不连续
+                await self.send_device_snapshot()
+
         except Exception as e:
             logger.error(f"Error handling message: {e}")
 
@@ -95,6 +102,29 @@ class WebSocketClient:
             }
         )
 
+    def track_devices(self, tracker):
+        """订阅DeviceStateTracker，把设备增量推送给主服务器"""
+        self.tracker = tracker
+        tracker.subscribe(self.send_device_delta)
+
+    async def send_device_delta(self, delta):
+        """发送设备状态增量(可直接作为DeviceStateTracker的订阅者)"""
+        await self.send_message(
+            {"type": "device_delta", "slave_id": self.slave_id, **delta.to_dict()}
+        )
+
+    async def send_device_snapshot(self):
+        """发送完整设备状态，主服务器据此重建该从服务器的设备表"""
+        if self.tracker is None:
+            return
+        await self.send_message(
+            {
+                "type": "device_snapshot",
+                "slave_id": self.slave_id,
+                **self.tracker.snapshot(),
+            }
+        )
+
     async def start_status_reporting(self):
         """开始定期报告设备状态"""
         while True:
@@ -0,0 +1,70 @@
+"""心跳检测测试"""
+
+import asyncio
+import time
+
+import pytest
+from ...core.heartbeat import NODE_DOWN, NODE_UP, HeartbeatMonitor
+
+
+def test_alive_after_heartbeat():
+    """测试心跳后节点存活"""
+    monitor = HeartbeatMonitor(interval=5)
+    assert not monitor.is_node_alive("node-1")
+    monitor.update_heartbeat("node-1")
+    assert monitor.is_node_alive("node-1")
+    assert monitor.alive_nodes == {"node-1"}
+
+
+def test_expire_only_due_nodes():
+    """测试只有到期节点被标记下线"""
+    monitor = HeartbeatMonitor(interval=5)
+    monitor.update_heartbeat("node-1")
+    monitor.update_heartbeat("node-2")
+    monitor._deadlines["node-1"] = 0
+    monitor._heap = [(0, "node-1"), (monitor._deadlines["node-2"], "node-2")]
+
+    assert monitor.expire() == ["node-1"]
+    assert not monitor.is_node_alive("node-1")
+    assert monitor.alive_nodes == {"node-2"}
+
+
+def test_refreshed_node_not_expired():
+    """测试再次心跳后旧的截止时间失效"""
+    monitor = HeartbeatMonitor(interval=5)
+    monitor.update_heartbeat("node-1")
+    monitor.update_heartbeat("node-1")
+    assert monitor.expire(now=time.monotonic() + 1) == []
+    assert monitor.expire(now=time.monotonic() + monitor.timeout + 1) == ["node-1"]
+
+
+def test_up_down_events():
+    """测试上线/下线事件"""
+    monitor = HeartbeatMonitor(interval=5)
+    events = []
+    monitor.add_listener(NODE_UP, lambda node_id: events.append(("up", node_id)))
+    monitor.add_listener(NODE_DOWN, lambda node_id: events.append(("down", node_id)))
+
+    monitor.update_heartbeat("node-1")
+    monitor.update_heartbeat("node-1")
+    monitor.expire(now=time.monotonic() + monitor.timeout + 1)
+    monitor.update_heartbeat("node-1")
+
+    assert events == [("up", "node-1"), ("down", "node-1"), ("up", "node-1")]
+
+
+@pytest.mark.asyncio
+async def test_checker_fires_on_deadline():
+    """测试检测任务在截止时间到达时触发下线"""
+    monitor = HeartbeatMonitor(interval=5)
+    monitor.timeout = 0.05
+    down = asyncio.Event()
+    monitor.add_listener(NODE_DOWN, lambda node_id: down.set())
+
+    await monitor.start()
+    try:
+        monitor.update_heartbeat("node-1")
+        await asyncio.wait_for(down.wait(), timeout=1)
+        assert not monitor.is_node_alive("node-1")
+    finally:
+        await monitor.stop()
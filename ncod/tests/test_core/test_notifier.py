@@ -0,0 +1,185 @@
+"""通知分发测试"""
+
+import asyncio
+
+import pytest
+from ...core.notifier import (
+    MemoryNotificationQueue,
+    Notification,
+    NotificationDispatcher,
+    RedisNotificationQueue,
+    TokenBucket,
+)
+
+
+class FakeRedis:
+    """多个队列共享的Redis，租约键不会自动过期"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.values = {}
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    async def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    async def pexpire(self, key, ms):
+        return key in self.values
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+def _notification(key=None, title="cpu high", recipient="ops"):
+    return Notification(
+        channel="email", recipient=recipient, title=title, body=title, key=key
+    )
+
+
+def test_token_bucket():
+    """测试令牌桶限速"""
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.try_acquire(now=bucket.updated) == 0
+    assert bucket.try_acquire(now=bucket.updated) == 0
+    assert bucket.try_acquire(now=bucket.updated) == pytest.approx(0.5)
+    assert bucket.try_acquire(now=bucket.updated + 0.5) == 0
+
+
+@pytest.mark.asyncio
+async def test_window_groups_and_coalesces():
+    """测试窗口内的通知按接收方合并为摘要，相同合并键只保留最新一条"""
+    sent = []
+
+    async def sender(digest):
+        sent.append(digest)
+
+    queue = MemoryNotificationQueue()
+    dispatcher = NotificationDispatcher(queue, window=0.05)
+    dispatcher.register_channel("email", sender, rate=100)
+    await dispatcher.submit(_notification("a", "cpu 91"))
+    await dispatcher.submit(_notification("a", "cpu 95"))
+    await dispatcher.submit(_notification("b", "disk full"))
+    await dispatcher.submit(_notification(recipient="dev"))
+
+    await asyncio.sleep(0.2)
+    await dispatcher.stop()
+
+    digests = {digest.recipient: digest for digest in sent}
+    assert len(sent) == 2
+    assert [item.title for item in digests["ops"].items] == ["cpu 95", "disk full"]
+    assert digests["ops"].items[0].count == 2
+    assert dispatcher.stats["coalesced"] == 1
+    # 发送成功后队列中的通知(包括被合并的)全部确认
+    assert await queue.load() == []
+
+
+@pytest.mark.asyncio
+async def test_retry_with_backoff_then_drop():
+    """测试失败后退避重试，超过次数后放弃并回调"""
+    calls = []
+    results = []
+
+    def sender(digest):
+        calls.append(digest.attempts)
+        raise ConnectionError("smtp down")
+
+    async def on_result(digest, ok, error):
+        results.append((ok, error))
+
+    queue = MemoryNotificationQueue()
+    dispatcher = NotificationDispatcher(
+        queue, window=0, max_attempts=3, backoff=0.01
+    )
+    dispatcher.register_channel("email", sender, rate=100, on_result=on_result)
+    await dispatcher.submit(_notification())
+
+    await asyncio.sleep(0.3)
+    await dispatcher.stop()
+
+    assert calls == [0, 1, 2]
+    assert results == [(False, "smtp down")]
+    assert dispatcher.stats["dropped"] == 1
+    assert await queue.load() == []
+
+
+@pytest.mark.asyncio
+async def test_reload_pending_on_start():
+    """测试重启后重新发送队列中未确认的通知"""
+    queue = MemoryNotificationQueue()
+    await queue.put(_notification())
+    sent = []
+
+    async def sender(digest):
+        sent.append(digest.title)
+
+    dispatcher = NotificationDispatcher(queue, window=0)
+    dispatcher.register_channel("email", sender, rate=100)
+    await dispatcher.start()
+    await asyncio.sleep(0.05)
+    await dispatcher.stop()
+
+    assert sent == ["cpu high"]
+
+
+@pytest.mark.asyncio
+async def test_shared_redis_queue_sends_once():
+    """测试多个进程共享Redis队列时每条通知只由一个进程发送"""
+    redis = FakeRedis()
+    # 已退出的进程留下的通知，租约已过期
+    orphan = _notification()
+    await RedisNotificationQueue(redis, "pending").put(orphan)
+    sent = []
+
+    async def sender(digest):
+        sent.extend(item.id for item in digest.items)
+
+    dispatchers = []
+    for _ in range(2):
+        dispatcher = NotificationDispatcher(
+            RedisNotificationQueue(redis, "pending"), window=0
+        )
+        dispatcher.register_channel("email", sender, rate=100)
+        await dispatcher.start()
+        dispatchers.append(dispatcher)
+    # 重新提交同一ID的通知不会重复发送
+    duplicate = _notification()
+    duplicate.id = "dup"
+    assert await dispatchers[0].submit(duplicate)
+    assert not await dispatchers[1].submit(duplicate)
+
+    await asyncio.sleep(0.05)
+    for dispatcher in dispatchers:
+        await dispatcher.stop()
+
+    assert sorted(sent) == sorted([orphan.id, "dup"])
+    assert redis.hashes["pending"] == {}
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_taken_over():
+    """测试持有通知的进程退出、租约过期后由其他进程接手"""
+    redis = FakeRedis()
+    crashed = RedisNotificationQueue(redis, "pending")
+    notification = _notification()
+    assert await crashed.claim(notification.id)
+    await crashed.put(notification)
+
+    queue = RedisNotificationQueue(redis, "pending")
+    assert await queue.load() == []
+    # 租约过期
+    await redis.delete(crashed._lease_key(notification.id))
+    assert [item.id for item in await queue.renew()] == [notification.id]
+    assert await queue.renew() == []
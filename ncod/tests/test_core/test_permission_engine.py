@@ -0,0 +1,147 @@
+"""权限判定引擎测试"""
+
+import pytest
+from ...core.cache.permission import PermissionEngine
+
+
+class FakeRemote:
+    """模拟Redis版本号"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def incr(self, key, amount=1):
+        self.values[key] = self.values.get(key, 0) + amount
+        return self.values[key]
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+class FakeNearCache:
+    """把失效通知转发给共享同一Redis的其它进程"""
+
+    def __init__(self, remote, peers):
+        self.remote = remote
+        self.peers = peers
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    async def start(self):
+        pass
+
+    async def publish_invalidation(self, keys):
+        for peer in self.peers:
+            if peer is not self:
+                for listener in peer.listeners:
+                    listener(list(keys))
+
+
+def _engines(count=2):
+    remote, peers = FakeRemote(), []
+    engines = []
+    for _ in range(count):
+        cache = FakeNearCache(remote, peers)
+        peers.append(cache)
+        engines.append(PermissionEngine(cache=cache))
+    return engines
+
+
+def test_check_is_bitwise():
+    """测试用户位集由角色合成，判定为按位与"""
+    engine = PermissionEngine(cache=None)
+    engine.compile_role("viewer", ["device:read"])
+    engine.compile_role("operator", ["device:read", "device:write"])
+    engine.set_user("u1", ["viewer"])
+    engine.set_user("u2", ["viewer", "operator"])
+
+    write = engine.mask(["device:write"])
+    assert engine.check("u1", write) is False
+    assert engine.check("u2", write) is True
+    assert engine.check("u3", write) is None
+    # 未被任何角色授予过的权限
+    assert engine.mask(["system:admin"]) is None
+    assert sorted(engine.codes(engine.user_mask("u2"))) == [
+        "device:read",
+        "device:write",
+    ]
+
+
+def test_role_change_recomposes_users():
+    """测试角色变更只替换角色位集，用户下次判定时重新合成"""
+    engine = PermissionEngine(cache=None)
+    engine.compile_role("viewer", ["device:read"])
+    engine.set_user("u1", ["viewer"])
+    write = engine.bit("device:write")
+    assert engine.check("u1", write) is False
+
+    engine.compile_role("viewer", ["device:read", "device:write"])
+    assert engine.check("u1", write) is True
+
+    engine.drop_role("viewer")
+    assert engine.user_mask("u1") is None
+    assert engine.missing_roles("u1") == ["viewer"]
+
+
+def test_user_limit_evicts_oldest():
+    """测试用户数超过上限时淘汰最早登记的用户"""
+    engine = PermissionEngine(cache=None, max_users=2)
+    engine.compile_role("viewer", ["device:read"])
+    for user_id in ("u1", "u2", "u3"):
+        engine.set_user(user_id, ["viewer"])
+    assert engine.user_mask("u1") is None
+    assert engine.user_mask("u3") is not None
+
+
+@pytest.mark.asyncio
+async def test_publish_invalidates_other_workers():
+    """测试变更通过版本号广播给其它进程"""
+    first, second = _engines()
+    for engine in (first, second):
+        engine.cache.add_listener(engine.on_invalidate)
+        engine.compile_role("viewer", ["device:read"])
+        engine.set_user("u1", ["viewer"])
+
+    await first.publish(roles=["viewer"])
+    assert first.version == second.version == 1
+    assert second.missing_roles("u1") == ["viewer"]
+    assert first.user_mask("u1") is not None
+
+    await first.publish(users=["u1"])
+    assert second.user_mask("u1") is None
+
+
+@pytest.mark.asyncio
+async def test_missed_notification_clears_cache():
+    """测试错过通知时按全局版本号清空编译结果"""
+    first, second = _engines()
+    second.compile_role("viewer", ["device:read"])
+    second.set_user("u1", ["viewer"])
+
+    # second未注册监听，收不到通知
+    await first.publish(roles=["viewer"])
+    assert second.user_mask("u1") is not None
+
+    await second.sync()
+    assert second.version == 1
+    assert second.user_mask("u1") is None
+
+
+@pytest.mark.asyncio
+async def test_sync_expires_compiled_results():
+    """测试编译结果超过ttl后即使没有收到变更也被清空"""
+    engine = _engines(1)[0]
+    engine.compile_role("viewer", ["device:read"])
+    engine.set_user("u1", ["viewer"])
+
+    await engine.sync()
+    assert engine.user_mask("u1") is not None
+
+    engine.ttl = 0
+    await engine.sync()
+    assert engine.user_mask("u1") is None
@@ -0,0 +1,238 @@
+"""
+两级缓存测试
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from ncod.utils.cache import NearCache, RedisCache, get_serializer
+
+SERIALIZERS = ["json", "orjson", "msgpack"]
+
+
+class FakePipeline:
+    """模拟Redis流水线，execute时计一次往返"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return command
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        results = [
+            await getattr(self.redis, name)(*args, **kwargs, count=False)
+            for name, args, kwargs in self.commands
+        ]
+        self.commands = []
+        return results
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.messages = asyncio.Queue()
+        self.closed = False
+
+    async def subscribe(self, channel):
+        self.redis.subscribers.setdefault(channel, []).append(self)
+
+    async def unsubscribe(self, channel):
+        if self in self.redis.subscribers.get(channel, []):
+            self.redis.subscribers[channel].remove(self)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=1.0):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeRedis:
+    """模拟Redis客户端，记录往返次数"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.round_trips = 0
+        self.published = []
+        self.subscribers = {}
+        self.pubsubs = []
+
+    def _count(self, count):
+        if count:
+            self.round_trips += 1
+
+    async def get(self, key, count=True):
+        self._count(count)
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, count=True):
+        self._count(count)
+        self.data[key] = value
+        self.ttls[key] = ex or -1
+        return True
+
+    async def setex(self, key, ex, value, count=True):
+        return await self.set(key, value, ex=ex, count=count)
+
+    async def mget(self, keys, count=True):
+        self._count(count)
+        return [self.data.get(key) for key in keys]
+
+    async def incrby(self, key, amount=1, count=True):
+        self._count(count)
+        # 与Redis相同，计数器保存为十进制文本
+        value = int(self.data.get(key, b"0")) + amount
+        self.data[key] = str(value).encode()
+        return value
+
+    async def ttl(self, key, count=True):
+        self._count(count)
+        return self.ttls.get(key, -1) if key in self.data else -2
+
+    async def delete(self, *keys, count=True):
+        self._count(count)
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    async def publish(self, channel, message):
+        self.round_trips += 1
+        self.published.append((channel, message))
+        for pubsub in self.subscribers.get(channel, []):
+            pubsub.messages.put_nowait({"data": message})
+        return len(self.subscribers.get(channel, []))
+
+    def pubsub(self):
+        pubsub = FakePubSub(self)
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+def _near_cache():
+    remote = RedisCache(serializer=get_serializer("json"))
+    remote._redis = FakeRedis()
+    return NearCache(remote, maxsize=100, ttl=60, channel="invalidate")
+
+
+@pytest.mark.asyncio
+async def test_remote_hit_single_round_trip():
+    """测试本地未命中时值和TTL一次往返取回，之后命中本地"""
+    cache = _near_cache()
+    redis = cache.remote._redis
+    await redis.set("k", json.dumps({"a": 1}), ex=30, count=False)
+
+    assert await cache.get("k") == {"a": 1}
+    assert redis.round_trips == 1
+    assert await cache.get("k") == {"a": 1}
+    assert redis.round_trips == 1
+    assert await cache.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_delete_many_batches():
+    """测试批量删除只发送一次DEL和一条失效通知"""
+    cache = _near_cache()
+    redis = cache.remote._redis
+    await cache.set_many({f"k{i}": i for i in range(5)})
+    redis.round_trips, redis.published = 0, []
+
+    assert await cache.delete_many([f"k{i}" for i in range(5)])
+    assert redis.data == {}
+    assert redis.round_trips == 2
+    assert len(redis.published) == 1
+    assert json.loads(redis.published[0][1])["keys"] == [f"k{i}" for i in range(5)]
+    assert cache.local.get("k0") == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_each_subscriber_has_own_pubsub():
+    """测试同一频道的多个订阅者各自收到全部消息"""
+    remote = RedisCache(serializer=get_serializer("json"))
+    redis = remote._redis = FakeRedis()
+    received = {"a": [], "b": []}
+
+    def collector(name):
+        async def callback(channel, message):
+            received[name].append(message)
+
+        return callback
+
+    tasks = [
+        asyncio.create_task(remote.subscribe("events", collector(name)))
+        for name in received
+    ]
+    await asyncio.sleep(0.01)
+    assert len(redis.pubsubs) == 2
+
+    await remote.publish("events", {"n": 1})
+    await asyncio.sleep(0.01)
+    assert received == {"a": [{"n": 1}], "b": [{"n": 1}]}
+
+    tasks[0].cancel()
+    await asyncio.gather(tasks[0], return_exceptions=True)
+    assert redis.pubsubs[0].closed and not redis.pubsubs[1].closed
+
+    await remote.unsubscribe("events")
+    await asyncio.wait_for(tasks[1], 2)
+    assert redis.pubsubs[1].closed
+
+
+def _redis_cache(name):
+    serializer = get_serializer(name)
+    if serializer.name != name:
+        pytest.skip(f"{name}未安装")
+    remote = RedisCache(serializer=serializer)
+    remote._redis = FakeRedis()
+    return remote
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", SERIALIZERS)
+async def test_counters_read_as_integers(name):
+    """测试INCR写入的计数器按整数读取，不经过序列化器解码"""
+    cache = _redis_cache(name)
+    await cache.incr("hits", 5)
+    await cache.incr("total", 123)
+
+    assert await cache.get("hits") == 5
+    assert await cache.get("total") == 123
+    assert await cache.get_many(["hits", "total", "missing"]) == {
+        "hits": 5,
+        "total": 123,
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", SERIALIZERS)
+async def test_serialized_values_round_trip(name):
+    """测试序列化的值(包括与计数器文本相同的小整数)原样读回"""
+    cache = _redis_cache(name)
+    values = {"n": 53, "neg": -7, "s": "5", "d": {"a": [1, 2]}}
+    assert await cache.set_many(values, expire=30)
+    await cache.set("single", 48)
+
+    assert await cache.get_many(values) == values
+    assert await cache.get("single") == 48
+    async with cache.pipeline() as pipe:
+        pipe.get("n").incr("count")
+    assert pipe.results == [53, 1]
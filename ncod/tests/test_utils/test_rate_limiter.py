@@ -0,0 +1,111 @@
+"""
+速率限制引擎测试
+"""
+
+import math
+
+import pytest
+
+from ncod.utils import rate_limiter
+from ncod.utils.rate_limiter import (
+    POLICY_TOKEN_BUCKET,
+    SLIDING_WINDOW_SCRIPT,
+    RateLimitEngine,
+)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeScriptCache:
+    """按Lua脚本的语义在内存中执行，记录往返次数"""
+
+    def __init__(self):
+        self.counters = {}
+        self.buckets = {}
+        self.calls = 0
+
+    async def run_script(self, script, keys, args):
+        self.calls += 1
+        if script == SLIDING_WINDOW_SCRIPT:
+            return self._sliding_window(keys, *args)
+        return self._token_bucket(keys, *args)
+
+    def _sliding_window(self, keys, limit, period, elapsed, requested, refund):
+        if refund > 0 and self.counters.get(keys[2], 0) > 0:
+            self.counters[keys[2]] -= min(refund, self.counters[keys[2]])
+        current = self.counters.get(keys[0], 0)
+        previous = self.counters.get(keys[1], 0)
+        used = math.floor(previous * (1 - elapsed)) + current
+        granted = min(requested, limit - used)
+        if granted <= 0:
+            return [0, 0]
+        self.counters[keys[0]] = current + granted
+        return [granted, limit - used - granted]
+
+    def _token_bucket(self, keys, capacity, rate, now, requested, refund):
+        tokens, ts = self.buckets.get(keys[0], (capacity, now))
+        tokens = min(capacity, tokens + refund + max(0, now - ts) * rate)
+        granted = min(requested, math.floor(tokens))
+        self.buckets[keys[0]] = (tokens - granted, now)
+        return [granted, math.floor(tokens - granted)]
+
+
+@pytest.fixture
+def env(monkeypatch):
+    clock = FakeClock(6000.0)
+    cache = FakeScriptCache()
+    monkeypatch.setattr(rate_limiter.time, "time", clock.time)
+    monkeypatch.setattr(rate_limiter, "redis_cache", cache)
+    return clock, cache
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy", ["sliding_window", POLICY_TOKEN_BUCKET])
+async def test_low_rate_client_not_overcharged(env, policy):
+    """测试低于限额的低频客户端的请求全部放行，预取不多占额度"""
+    clock, cache = env
+    engine = RateLimitEngine(policy=policy, lease_size=5, lease_ttl=1.0)
+
+    results = []
+    for _ in range(50):
+        allowed, _ = await engine.acquire("ip:low", 100, 60)
+        results.append(allowed)
+        clock.now += 1.2
+
+    assert all(results)
+    assert max(lease.size for lease in engine._leases.values()) == 1
+
+
+@pytest.mark.asyncio
+async def test_burst_client_limited_with_fewer_round_trips(env):
+    """测试突发请求按限额放行，预取数量增长后减少Redis往返"""
+    clock, cache = env
+    engine = RateLimitEngine(lease_size=5, lease_ttl=1.0)
+
+    allowed = [(await engine.acquire("ip:burst", 100, 60))[0] for _ in range(150)]
+
+    assert allowed.count(True) == 100
+    assert engine._leases["ip:burst"].size == 5
+    assert cache.calls < 40
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_returns_unused_tokens(env):
+    """测试过期预取中未使用的令牌在下次预取时归还"""
+    clock, cache = env
+    engine = RateLimitEngine(lease_size=5, lease_ttl=1.0)
+    for _ in range(4):
+        await engine.acquire("ip:a", 100, 60)
+    lease = engine._leases["ip:a"]
+    assert lease.size == 4 and lease.tokens == 3
+    assert cache.counters[lease.key] == 7
+
+    clock.now += 2
+    await engine.acquire("ip:a", 100, 60)
+    assert cache.counters[lease.key] == 6
@@ -1,20 +1,183 @@
 """缓存模块"""
 
+import asyncio
 import json
-from typing import Any, Dict, Optional, Union, cast, Callable, Awaitable
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Union,
+    cast,
+    Callable,
+    Awaitable,
+)
 import aioredis
-from aioredis.client import Redis, PubSub
+from aioredis.client import Redis, PubSub, Pipeline
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson为可选依赖
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack为可选依赖
+    msgpack = None
 
 from ncod.utils.config import settings
 from ncod.utils.logger import logger
 
 
+class JsonSerializer:
+    """标准库json序列化"""
+
+    name = "json"
+
+    def dumps(self, value: Any) -> Union[str, bytes]:
+        return json.dumps(value)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JsonSerializer):
+    """orjson序列化，输出与json兼容"""
+
+    name = "orjson"
+
+    def dumps(self, value: Any) -> Union[str, bytes]:
+        return orjson.dumps(value)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackSerializer(JsonSerializer):
+    """msgpack二进制序列化，与json格式不兼容
+
+    INCR等命令写入的计数器是十进制文本(如b'5')，按msgpack解码会得到错误的值，
+    因此序列化的值带有前缀标记，不带标记的十进制文本按整数读取。
+    """
+
+    name = "msgpack"
+
+    # msgpack未使用的类型字节，不会出现在合法的msgpack数据和十进制文本开头
+    TAG = b"\xc1"
+
+    def dumps(self, value: Any) -> Union[str, bytes]:
+        return self.TAG + msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            data = data.encode()
+        if data.startswith(self.TAG):
+            return msgpack.unpackb(data[1:], raw=False)
+        if data.lstrip(b"-").isdigit():
+            return int(data)
+        # 兼容加入标记前写入的值
+        return msgpack.unpackb(data, raw=False)
+
+
+def get_serializer(name: str) -> JsonSerializer:
+    """按名称获取序列化器，依赖未安装时退回json"""
+    if name == "orjson" and orjson is not None:
+        return OrjsonSerializer()
+    if name == "msgpack" and msgpack is not None:
+        return MsgpackSerializer()
+    if name not in ("json", "orjson", "msgpack"):
+        raise ValueError(f"不支持的序列化格式: {name}")
+    if name != "json":
+        logger.warning(f"{name}未安装，缓存序列化退回json")
+    return JsonSerializer()
+
+
+class CachePipeline:
+    """缓存流水线
+
+    命令先在本地缓冲，execute时一次往返发送；结果按命令顺序返回，get的结果
+    已反序列化。
+    """
+
+    def __init__(self, pipe: Pipeline, serializer: JsonSerializer):
+        self._pipe = pipe
+        self._serializer = serializer
+        self._decoders: List[Optional[Callable[[Any], Any]]] = []
+        self.results: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._decoders)
+
+    def get(self, key: str) -> "CachePipeline":
+        """读取缓存值"""
+        self._pipe.get(key)
+        self._decoders.append(self._decode)
+        return self
+
+    def set(
+        self, key: str, value: Any, expire: Optional[int] = None
+    ) -> "CachePipeline":
+        """设置缓存值"""
+        self._pipe.set(key, self._serializer.dumps(value), ex=expire or None)
+        self._decoders.append(bool)
+        return self
+
+    def delete(self, *keys: str) -> "CachePipeline":
+        """删除缓存"""
+        self._pipe.delete(*keys)
+        self._decoders.append(None)
+        return self
+
+    def expire(self, key: str, seconds: int) -> "CachePipeline":
+        """设置过期时间"""
+        self._pipe.expire(key, seconds)
+        self._decoders.append(bool)
+        return self
+
+    def incr(self, key: str, amount: int = 1) -> "CachePipeline":
+        """递增缓存值"""
+        self._pipe.incrby(key, amount)
+        self._decoders.append(None)
+        return self
+
+    def ttl(self, key: str) -> "CachePipeline":
+        """获取剩余过期时间"""
+        self._pipe.ttl(key)
+        self._decoders.append(None)
+        return self
+
+    async def execute(self) -> List[Any]:
+        """发送缓冲的命令并返回结果"""
+        if not self._decoders:
+            return []
+        raw = await self._pipe.execute()
+        decoders, self._decoders = self._decoders, []
+        self.results = [
+            decoder(value) if decoder else value
+            for decoder, value in zip(decoders, raw)
+        ]
+        return self.results
+
+    def _decode(self, value: Any) -> Any:
+        return self._serializer.loads(value) if value else None
+
+
 class RedisCache:
     """Redis缓存管理器"""
 
-    def __init__(self):
+    def __init__(self, serializer: Optional[JsonSerializer] = None):
         self._redis: Optional[Redis] = None
-        self._pubsub: Optional[PubSub] = None
+        # 每个订阅者独占一个发布/订阅连接，按频道记录以便取消订阅
+        self._pubsubs: Dict[str, List[PubSub]] = {}
+        self._scripts: Dict[str, Any] = {}
+        self.serializer = serializer or get_serializer(settings.CACHE_SERIALIZER)
 
     async def init(self):
         """初始化Redis连接"""
@@ -49,7 +212,7 @@ class RedisCache:
             redis = cast(Redis, self._redis)
             value = await redis.get(key)
             if value:
-                return json.loads(value)
+                return self.serializer.loads(value)
             return None
 
         except Exception as e:
@@ -72,7 +235,7 @@ class RedisCache:
                 await self.init()
 
             redis = cast(Redis, self._redis)
-            value_str = json.dumps(value)
+            value_str = self.serializer.dumps(value)
             if expire:
                 await redis.setex(key, expire, value_str)
             else:
@@ -104,6 +267,121 @@ class RedisCache:
             logger.error(f"删除缓存失败: {e}")
             return False
 
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """批量获取缓存值(一次MGET)
+
+        Args:
+            keys: 缓存键列表
+
+        Returns:
+            Dict[str, Any]: 命中的键值,未命中的键不出现在结果中
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            if not self._redis:
+                await self.init()
+
+            redis = cast(Redis, self._redis)
+            values = await redis.mget(keys)
+            return {
+                key: self.serializer.loads(value)
+                for key, value in zip(keys, values)
+                if value
+            }
+
+        except Exception as e:
+            logger.error(f"批量获取缓存失败: {e}")
+            return {}
+
+    async def set_many(
+        self,
+        mapping: Mapping[str, Any],
+        expire: Optional[int] = None,
+        expires: Optional[Mapping[str, int]] = None,
+    ) -> bool:
+        """批量设置缓存值(一次流水线往返)
+
+        Args:
+            mapping: 键值映射
+            expire: 默认过期时间(秒)
+            expires: 单独指定的过期时间 {键: 秒},优先于expire
+
+        Returns:
+            bool: 是否全部设置成功
+        """
+        if not mapping:
+            return True
+        try:
+            async with self.pipeline() as pipe:
+                for key, value in mapping.items():
+                    ttl = expires.get(key, expire) if expires else expire
+                    pipe.set(key, value, ttl)
+            return all(pipe.results)
+
+        except Exception as e:
+            logger.error(f"批量设置缓存失败: {e}")
+            return False
+
+    async def get_with_ttl(self, key: str) -> tuple[Optional[Any], int]:
+        """一次往返获取缓存值和剩余过期时间
+
+        Returns:
+            tuple[Optional[Any], int]: (缓存值, 剩余过期时间)，不存在时为(None, -2)
+        """
+        try:
+            async with self.pipeline() as pipe:
+                pipe.get(key).ttl(key)
+            value, ttl = pipe.results
+            return value, ttl
+
+        except Exception as e:
+            logger.error(f"获取缓存失败: {e}")
+            return None, -2
+
+    async def delete_many(self, keys: Iterable[str]) -> int:
+        """批量删除缓存
+
+        Args:
+            keys: 缓存键列表
+
+        Returns:
+            int: 实际删除的键数量
+        """
+        keys = list(keys)
+        if not keys:
+            return 0
+        try:
+            if not self._redis:
+                await self.init()
+
+            redis = cast(Redis, self._redis)
+            return await redis.delete(*keys)
+
+        except Exception as e:
+            logger.error(f"批量删除缓存失败: {e}")
+            return 0
+
+    @asynccontextmanager
+    async def pipeline(self, transaction: bool = False) -> AsyncIterator[CachePipeline]:
+        """流水线上下文
+
+        块内缓冲的命令在退出时一次发送,结果保存在pipe.results中;块内抛出异常时
+        丢弃缓冲的命令。与run_script相同,执行失败时直接抛出异常。
+
+        Args:
+            transaction: 是否以MULTI/EXEC事务执行
+        """
+        if not self._redis:
+            await self.init()
+
+        redis = cast(Redis, self._redis)
+        async with redis.pipeline(transaction=transaction) as raw:
+            pipe = CachePipeline(raw, self.serializer)
+            yield pipe
+            await pipe.execute()
+
     async def exists(self, key: str) -> bool:
         """检查缓存是否存在
 
@@ -246,6 +524,29 @@ class RedisCache:
             logger.error(f"获取Redis信息失败: {e}")
             return {}
 
+    async def run_script(self, script: str, keys: list, args: list) -> Any:
+        """执行Lua脚本
+
+        脚本在首次使用时注册，之后通过EVALSHA执行，服务端未缓存时自动回退为EVAL。
+        与其它方法不同，执行失败时直接抛出异常，由调用方决定降级策略。
+
+        Args:
+            script: Lua脚本
+            keys: 脚本使用的键
+            args: 脚本参数
+
+        Returns:
+            Any: 脚本返回值
+        """
+        if not self._redis:
+            await self.init()
+
+        redis = cast(Redis, self._redis)
+        registered = self._scripts.get(script)
+        if registered is None:
+            registered = self._scripts[script] = redis.register_script(script)
+        return await registered(keys=keys, args=args)
+
     async def publish(self, channel: str, message: Any) -> int:
         """发布消息
 
@@ -277,22 +578,24 @@ class RedisCache:
     ):
         """订阅频道
 
+        每次调用使用独立的发布/订阅连接，多个订阅者之间互不抢读消息。调用会一直
+        阻塞到任务被取消或频道被取消订阅。
+
         Args:
             channel: 频道名称
             callback: 回调函数,接收频道名称和消息内容作为参数
         """
+        pubsub: Optional[PubSub] = None
         try:
             if not self._redis:
                 await self.init()
 
             redis = cast(Redis, self._redis)
-            if not self._pubsub:
-                self._pubsub = redis.pubsub()
-
-            pubsub = cast(PubSub, self._pubsub)
+            pubsub = redis.pubsub()
+            self._pubsubs.setdefault(channel, []).append(pubsub)
             await pubsub.subscribe(channel)
 
-            while True:
+            while pubsub in self._pubsubs.get(channel, ()):
                 try:
                     message = await pubsub.get_message(
                         ignore_subscribe_messages=True, timeout=1.0
@@ -316,32 +619,305 @@ class RedisCache:
 
         except Exception as e:
             logger.error(f"订阅频道失败: {e}")
+        finally:
+            # 被unsubscribe移除的连接已经关闭
+            subscribers = self._pubsubs.get(channel, [])
+            if pubsub is not None and pubsub in subscribers:
+                subscribers.remove(pubsub)
+                if not subscribers:
+                    del self._pubsubs[channel]
+                await self._close_pubsub(pubsub, channel)
 
     async def unsubscribe(self, channel: str):
-        """取消订阅频道
+        """取消该频道的所有订阅
 
         Args:
             channel: 频道名称
         """
-        try:
-            if self._pubsub:
-                pubsub = cast(PubSub, self._pubsub)
-                await pubsub.unsubscribe(channel)
-
-        except Exception as e:
-            logger.error(f"取消订阅频道失败: {e}")
+        for pubsub in self._pubsubs.pop(channel, []):
+            await self._close_pubsub(pubsub, channel)
 
     async def close_pubsub(self):
-        """关闭发布/订阅连接"""
+        """关闭所有发布/订阅连接"""
+        for channel in list(self._pubsubs):
+            await self.unsubscribe(channel)
+
+    async def _close_pubsub(self, pubsub: PubSub, channel: str):
         try:
-            if self._pubsub:
-                pubsub = cast(PubSub, self._pubsub)
-                await pubsub.close()
-                self._pubsub = None
+            await pubsub.unsubscribe(channel)
+            await pubsub.close()
 
         except Exception as e:
             logger.error(f"关闭发布/订阅连接失败: {e}")
 
 
+class LocalLRUCache:
+    """带过期时间的进程内LRU缓存"""
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """获取缓存值
+
+        Returns:
+            tuple[bool, Any]: (是否命中, 缓存值)
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expire_at, value = entry
+        if expire_at <= time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value: Any, expire: Optional[int] = None) -> int:
+        """设置缓存值
+
+        Returns:
+            int: 因容量不足被淘汰的条目数
+        """
+        ttl = min(expire, self.ttl) if expire else self.ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        evicted = 0
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def pop(self, key: str) -> bool:
+        """删除缓存值"""
+        return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+
+
+class NearCache:
+    """两级缓存: 进程内LRU + Redis
+
+    读操作优先命中本地LRU，未命中时读Redis并回填本地；写/删除操作同时更新两级缓存，
+    并通过Redis发布/订阅通知其它工作进程丢弃本地副本。本地条目的存活时间不超过
+    NEAR_CACHE_TTL，即使错过失效通知也只会短暂读到旧值。
+
+    注意: 本地命中返回的是同一个对象，调用方不应原地修改缓存值。
+    """
+
+    def __init__(
+        self,
+        remote: RedisCache,
+        maxsize: int = settings.NEAR_CACHE_MAX_SIZE,
+        ttl: int = settings.NEAR_CACHE_TTL,
+        channel: str = settings.NEAR_CACHE_CHANNEL,
+        monitor: Optional[Any] = None,
+    ):
+        self.remote = remote
+        self.local = LocalLRUCache(maxsize=maxsize, ttl=ttl)
+        self.channel = channel
+        # 命中统计，接口与CacheMonitor一致(record_hit/record_miss/record_eviction)
+        self.monitor = monitor
+        self.instance_id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+        # 收到其它进程失效通知后的回调，参数为失效的键列表
+        self._listeners: List[Callable[[List[str]], None]] = []
+
+    async def start(self):
+        """开始监听失效通知"""
+        if self._listener is None:
+            self._listener = asyncio.create_task(
+                self.remote.subscribe(self.channel, self._on_invalidate)
+            )
+
+    async def stop(self):
+        """停止监听失效通知，只关闭本实例的订阅连接"""
+        if self._listener is not None:
+            listener, self._listener = self._listener, None
+            listener.cancel()
+            try:
+                await listener
+            except asyncio.CancelledError:
+                pass
+        self.local.clear()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """获取缓存值"""
+        start_time = time.perf_counter()
+        hit, value = self.local.get(key)
+        if hit:
+            self._record("hit", "local", start_time)
+            return value
+
+        value, ttl = await self.remote.get_with_ttl(key)
+        if value is None:
+            self._record("miss", "near", start_time)
+            return None
+
+        self._fill_local(key, value, ttl if ttl > 0 else None)
+        self._record("hit", "redis", start_time)
+        return value
+
+    async def set(self, key: str, value: Any, expire: Optional[int] = None) -> bool:
+        """设置缓存值"""
+        success = await self.remote.set(key, value, expire)
+        if success:
+            self._fill_local(key, value, expire)
+            await self._broadcast([key])
+        return success
+
+    async def set_many(
+        self, mapping: Dict[str, Any], expire: Optional[int] = None
+    ) -> bool:
+        """批量设置缓存值，只发送一次失效通知"""
+        success = await self.remote.set_many(mapping, expire)
+        if success:
+            for key, value in mapping.items():
+                self._fill_local(key, value, expire)
+            await self._broadcast(list(mapping))
+        return success
+
+    async def delete(self, key: str) -> bool:
+        """删除缓存值"""
+        return await self.delete_many([key])
+
+    async def delete_many(self, keys: Iterable[str]) -> bool:
+        """批量删除缓存值，一次DEL并只发送一次失效通知"""
+        keys = list(keys)
+        if not keys:
+            return True
+        self.invalidate_local(keys)
+        try:
+            async with self.remote.pipeline() as pipe:
+                pipe.delete(*keys)
+            success = True
+        except Exception as e:
+            logger.error(f"批量删除缓存失败: {e}")
+            success = False
+        await self._broadcast(keys)
+        return success
+
+    def invalidate_local(self, keys: Iterable[str]):
+        """只丢弃本地副本"""
+        for key in keys:
+            self.local.pop(key)
+
+    def add_listener(self, listener: Callable[[List[str]], None]):
+        """注册失效通知回调(用于维护自己进程内索引的模块)"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[List[str]], None]):
+        """移除失效通知回调"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    async def publish_invalidation(self, keys: Iterable[str]):
+        """只广播失效通知，不修改缓存"""
+        await self._broadcast(list(keys))
+
+    def _fill_local(self, key: str, value: Any, expire: Optional[int]):
+        """回填本地缓存"""
+        evicted = self.local.set(key, value, expire)
+        if evicted and self.monitor:
+            for _ in range(evicted):
+                self.monitor.record_eviction()
+
+    def _record(self, outcome: str, cache_type: str, start_time: float):
+        """记录命中统计"""
+        if not self.monitor:
+            return
+        elapsed = time.perf_counter() - start_time
+        if outcome == "hit":
+            self.monitor.record_hit(cache_type, elapsed)
+        else:
+            self.monitor.record_miss(cache_type, elapsed)
+
+    async def _broadcast(self, keys: list[str]):
+        """通知其它进程丢弃本地副本"""
+        if keys:
+            await self.remote.publish(
+                self.channel, {"origin": self.instance_id, "keys": keys}
+            )
+
+    async def _on_invalidate(self, channel: str, message: Any):
+        """处理失效通知"""
+        if not isinstance(message, dict):
+            return
+        if message.get("origin") == self.instance_id:
+            return
+        keys = message.get("keys") or []
+        self.invalidate_local(keys)
+        for listener in list(self._listeners):
+            try:
+                listener(keys)
+            except Exception as e:
+                logger.error(f"处理失效通知回调失败: {e}")
+
+
+class CollectionVersions:
+    """集合变更版本号
+
+    每个集合(如设备列表)一个保存在Redis中的递增版本号，用作列表接口的ETag。
+    本进程缓存当前值，其它进程递增后通过NearCache失效通知丢弃本地值；本地值
+    最多信任ttl秒，错过通知时也只会短暂使用旧版本号。
+    """
+
+    PREFIX = "version:"
+
+    def __init__(self, cache: NearCache, ttl: int = settings.NEAR_CACHE_TTL):
+        self.cache = cache
+        self.ttl = ttl
+        self._local: Dict[str, tuple[int, float]] = {}
+        cache.add_listener(self._on_invalidate)
+
+    def _key(self, collection: str) -> str:
+        return f"{self.PREFIX}{collection}"
+
+    async def get(self, collection: str) -> Optional[int]:
+        """当前版本号，Redis不可用时返回None"""
+        entry = self._local.get(collection)
+        now = time.monotonic()
+        if entry is not None and now - entry[1] < self.ttl:
+            return entry[0]
+
+        # INCRBY 0 读取整数值，不经过序列化器；键不存在时初始化为1
+        key = self._key(collection)
+        version = await self.cache.remote.incr(key, 0)
+        if not version:
+            version = await self.cache.remote.incr(key)
+        if not version:
+            self._local.pop(collection, None)
+            return None
+        self._local[collection] = (version, now)
+        return version
+
+    async def bump(self, *collections: str) -> None:
+        """集合内容变更后递增版本号并通知其它进程"""
+        for collection in collections:
+            version = await self.cache.remote.incr(self._key(collection))
+            if version:
+                self._local[collection] = (version, time.monotonic())
+            else:
+                self._local.pop(collection, None)
+        await self.cache.publish_invalidation(
+            [self._key(collection) for collection in collections]
+        )
+
+    def _on_invalidate(self, keys: List[str]):
+        for key in keys:
+            if key.startswith(self.PREFIX):
+                self._local.pop(key[len(self.PREFIX) :], None)
+
+
 # 创建全局缓存实例
 redis_cache = RedisCache()
+near_cache = NearCache(redis_cache)
+collection_versions = CollectionVersions(near_cache)
@@ -42,6 +42,15 @@ class Settings(BaseSettings):
     # 数据库配置
     DB_URL: str = "sqlite+aiosqlite:///ncod.db"
 
+    # Redis配置
+    REDIS_URL: str = "redis://localhost:6379/0"
+    CACHE_SERIALIZER: str = "json"  # 缓存值序列化格式: json/orjson/msgpack
+
+    # 进程内近端缓存配置
+    NEAR_CACHE_MAX_SIZE: int = 10000  # 本地最大条目数
+    NEAR_CACHE_TTL: int = 60  # 本地条目最长存活时间(秒)
+    NEAR_CACHE_CHANNEL: str = "ncod:cache:invalidate"  # 失效通知频道
+
     # 日志配置
     LOG_LEVEL: str = "INFO"
     LOG_PATH: Path = Path("logs/ncod.log")  # 改名以避免重复
@@ -51,6 +60,14 @@ class Settings(BaseSettings):
     # API配置
     API_RATE_LIMIT: int = 100  # 每分钟请求数限制
 
+    # 速率限制配置
+    RATE_LIMIT_POLICY: str = "sliding_window"  # sliding_window 或 token_bucket
+    RATE_LIMIT_REQUESTS: int = 100  # 每个周期允许的请求数
+    RATE_LIMIT_PERIOD: int = 60  # 周期(秒)
+    RATE_LIMIT_CONFIG_TTL: int = 300  # 客户端配置缓存时间(秒)
+    RATE_LIMIT_LEASE_SIZE: int = 5  # 每次向Redis预取的令牌数
+    RATE_LIMIT_LEASE_TTL: float = 1.0  # 本地预取令牌的有效期(秒)
+
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", case_sensitive=True
     )
@@ -1,16 +1,231 @@
 """API速率限制模块"""
 
 import time
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Optional, Tuple, cast
+from typing import Dict, List, Optional, Tuple, cast
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.responses import Response
 
 from ncod.utils.logger import logger
-from ncod.utils.cache import redis_cache
+from ncod.utils.cache import near_cache, redis_cache
 from ncod.utils.config import settings
 
+POLICY_SLIDING_WINDOW = "sliding_window"
+POLICY_TOKEN_BUCKET = "token_bucket"
+
+# 滑动窗口计数: 按上一窗口剩余重叠比例加权，检查与递增在服务端一次完成
+# KEYS[1]=当前窗口计数 KEYS[2]=上一窗口计数 KEYS[3]=归还令牌的窗口计数
+# ARGV[1]=限额 ARGV[2]=周期(秒) ARGV[3]=当前窗口已过比例(0-1) ARGV[4]=申请数量
+# ARGV[5]=归还数量(上一批预取中未使用的令牌，先从其所在窗口扣回)
+# 返回 {实际授予数量, 授予后剩余额度}
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local elapsed = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local refund = tonumber(ARGV[5])
+if refund > 0 then
+    local charged = tonumber(redis.call('GET', KEYS[3]) or '0')
+    if charged > 0 then
+        redis.call('DECRBY', KEYS[3], math.min(refund, charged))
+    end
+end
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local used = math.floor(previous * (1 - elapsed)) + current
+local granted = math.min(requested, limit - used)
+if granted <= 0 then
+    return {0, 0}
+end
+redis.call('INCRBY', KEYS[1], granted)
+redis.call('EXPIRE', KEYS[1], period * 2)
+return {granted, limit - used - granted}
+"""
+
+# 令牌桶: 按时间补充令牌并收回归还的令牌后扣减
+# KEYS[1]=桶 ARGV[1]=容量 ARGV[2]=每秒补充数 ARGV[3]=当前时间(秒) ARGV[4]=申请数量
+# ARGV[5]=归还数量
+# 返回 {实际授予数量, 授予后剩余令牌}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local refund = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + refund + math.max(0, now - ts) * rate)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {granted, math.floor(tokens)}
+"""
+
+
+@dataclass
+class TokenLease:
+    """本地预取的令牌"""
+
+    tokens: int
+    remaining: int
+    reset: int
+    expires_at: float
+    size: int = 1
+    key: str = ""
+
+    @property
+    def denied(self) -> bool:
+        """Redis未授予任何令牌(在有效期内本地直接拒绝)"""
+        return self.tokens <= 0 and self.remaining <= 0
+
+
+class RateLimitEngine:
+    """速率限制引擎
+
+    每个工作进程从Redis预取令牌(由Lua脚本原子地检查并扣减)，之后的请求在本地消耗
+    预取的令牌，无需访问Redis；预取令牌在短时间后失效，以限制进程间分配不均造成的误差。
+
+    预取数量按客户端自适应: 新客户端每次只预取1个令牌，在有效期内用完时翻倍(最多
+    lease_size个)，过期时减半。过期未用的令牌在下次预取时由同一个脚本归还，
+    因此低频客户端不会因预取而提前占用全局额度。
+    """
+
+    def __init__(
+        self,
+        policy: str = settings.RATE_LIMIT_POLICY,
+        lease_size: int = settings.RATE_LIMIT_LEASE_SIZE,
+        lease_ttl: float = settings.RATE_LIMIT_LEASE_TTL,
+        max_leases: int = 10000,
+    ):
+        self.policy = policy
+        self.lease_size = max(1, lease_size)
+        self.lease_ttl = lease_ttl
+        self.max_leases = max_leases
+        self._leases: Dict[str, TokenLease] = {}
+
+    def window_keys(self, client_id: str, period: int, now: float) -> List[str]:
+        """滑动窗口使用的计数键(当前窗口, 上一窗口)"""
+        window = int(now // period) * period
+        return [
+            f"rate_limit:{client_id}:{window}",
+            f"rate_limit:{client_id}:{window - period}",
+        ]
+
+    @staticmethod
+    def bucket_key(client_id: str) -> str:
+        """令牌桶键"""
+        return f"rate_limit:bucket:{client_id}"
+
+    async def acquire(
+        self, client_id: str, limit: int, period: int
+    ) -> Tuple[bool, Dict[str, str]]:
+        """申请一个请求配额
+
+        Returns:
+            Tuple[bool, Dict[str, str]]: (是否允许请求, 响应头)
+        """
+        now = time.time()
+        lease = self._leases.get(client_id)
+        if lease is None:
+            lease = await self._lease(client_id, limit, period, now, 1)
+        elif lease.expires_at <= now:
+            # 过期: 归还未用的令牌，下次少取一些
+            lease = await self._lease(
+                client_id, limit, period, now, max(1, lease.size // 2), lease
+            )
+        elif lease.tokens <= 0 and not lease.denied:
+            # 有效期内已用完: 下次多取一些
+            lease = await self._lease(
+                client_id, limit, period, now, min(self.lease_size, lease.size * 2)
+            )
+
+        allowed = lease.tokens > 0
+        if allowed:
+            lease.tokens -= 1
+
+        headers = {
+            "X-RateLimit-Limit": str(limit),
+            "X-RateLimit-Remaining": str(lease.remaining + lease.tokens),
+            "X-RateLimit-Reset": str(lease.reset),
+        }
+        if not allowed:
+            headers["Retry-After"] = str(max(1, lease.reset - int(now)))
+        return allowed, headers
+
+    async def _lease(
+        self,
+        client_id: str,
+        limit: int,
+        period: int,
+        now: float,
+        size: int,
+        expired: Optional[TokenLease] = None,
+    ) -> TokenLease:
+        """向Redis预取一批令牌，同时归还过期预取中未使用的令牌"""
+        requested = min(size, limit)
+        refund = max(0, expired.tokens) if expired else 0
+        if self.policy == POLICY_TOKEN_BUCKET:
+            rate = limit / period
+            key = self.bucket_key(client_id)
+            granted, remaining = await redis_cache.run_script(
+                TOKEN_BUCKET_SCRIPT,
+                [key],
+                [limit, rate, now, requested, refund],
+            )
+            # 令牌桶在补充出一个令牌后即可重试
+            reset = int(now + (1 / rate if granted == 0 else 0)) + 1
+        else:
+            window = int(now // period) * period
+            keys = self.window_keys(client_id, period, now)
+            key = keys[0]
+            granted, remaining = await redis_cache.run_script(
+                SLIDING_WINDOW_SCRIPT,
+                keys + [expired.key if refund else key],
+                [limit, period, (now - window) / period, requested, refund],
+            )
+            reset = window + period
+
+        lease = TokenLease(
+            tokens=int(granted),
+            remaining=int(remaining),
+            reset=reset,
+            expires_at=now + self.lease_ttl,
+            size=requested,
+            key=key,
+        )
+        if len(self._leases) >= self.max_leases:
+            self._evict_expired(now)
+        self._leases[client_id] = lease
+        return lease
+
+    def _evict_expired(self, now: float):
+        """清理过期的本地令牌"""
+        for client_id in [
+            client_id
+            for client_id, lease in self._leases.items()
+            if lease.expires_at <= now
+        ]:
+            del self._leases[client_id]
+        if len(self._leases) >= self.max_leases:
+            self._leases.clear()
+
+    def drop_lease(self, client_id: str):
+        """丢弃本地预取的令牌"""
+        self._leases.pop(client_id, None)
+
+    async def reset(self, client_id: str, period: int):
+        """重置客户端的计数"""
+        self.drop_lease(client_id)
+        if self.policy == POLICY_TOKEN_BUCKET:
+            await redis_cache.delete(self.bucket_key(client_id))
+        else:
+            for key in self.window_keys(client_id, period, time.time()):
+                await redis_cache.delete(key)
+
 
 class RateLimiter(BaseHTTPMiddleware):
     """API速率限制中间件"""
@@ -100,42 +315,9 @@ class RateLimiter(BaseHTTPMiddleware):
             # 获取客户端配置
             config = await self._get_client_config(client_id)
 
-            # 获取当前时间窗口
-            window = int(time.time() / config["period"]) * config["period"]
-
-            # 构造缓存键
-            cache_key = f"rate_limit:{client_id}:{window}"
-
-            # 获取当前请求计数
-            count = await redis_cache.get(cache_key)
-            if count is None:
-                count = 0
-
-            # 检查是否超过限制
-            allowed = count < config["limit"]
-
-            # 更新请求计数
-            if allowed:
-                await redis_cache.set(cache_key, count + 1, expire=config["period"])
-
-            # 计算剩余配额
-            remaining = max(0, config["limit"] - (count + 1))
-
-            # 计算重置时间
-            reset = window + config["period"]
-
-            # 构造响应头
-            headers = {
-                "X-RateLimit-Limit": str(config["limit"]),
-                "X-RateLimit-Remaining": str(remaining),
-                "X-RateLimit-Reset": str(reset),
-            }
-
-            if not allowed:
-                retry_after = reset - int(time.time())
-                headers["Retry-After"] = str(retry_after)
-
-            return allowed, headers
+            return await rate_limit_engine.acquire(
+                client_id, config["limit"], config["period"]
+            )
 
         except Exception as e:
             logger.error(f"检查速率限制失败: {e}")
@@ -151,9 +333,9 @@ class RateLimiter(BaseHTTPMiddleware):
             Dict: 客户端配置
         """
         try:
-            # 从缓存获取配置
+            # 从缓存获取配置(两级缓存，热点客户端不访问Redis)
             cache_key = f"rate_limit_config:{client_id}"
-            config = await redis_cache.get(cache_key)
+            config = await near_cache.get(cache_key)
 
             if config:
                 return config
@@ -175,7 +357,7 @@ class RateLimiter(BaseHTTPMiddleware):
                 config["limit"] = int(config["limit"] * 1.5)  # 较高的限制
 
             # 缓存配置
-            await redis_cache.set(
+            await near_cache.set(
                 cache_key, config, expire=settings.RATE_LIMIT_CONFIG_TTL
             )
 
@@ -201,11 +383,14 @@ class RateLimiter(BaseHTTPMiddleware):
             # 获取客户端配置
             config = await self._get_client_config(client_id)
 
-            # 获取当前时间窗口
-            window = int(time.time() / config["period"]) * config["period"]
-
-            # 获取当前请求计数
-            cache_key = f"rate_limit:{client_id}:{window}"
+            # 获取当前窗口的请求计数
+            if rate_limit_engine.policy == POLICY_TOKEN_BUCKET:
+                return None
+            now = time.time()
+            window = int(now // config["period"]) * config["period"]
+            cache_key = rate_limit_engine.window_keys(
+                client_id, config["period"], now
+            )[0]
             count = await redis_cache.get(cache_key)
 
             if count is None:
@@ -238,12 +423,8 @@ class RateLimiter(BaseHTTPMiddleware):
             # 获取客户端配置
             config = await self._get_client_config(client_id)
 
-            # 获取当前时间窗口
-            window = int(time.time() / config["period"]) * config["period"]
-
             # 删除请求计数
-            cache_key = f"rate_limit:{client_id}:{window}"
-            await redis_cache.delete(cache_key)
+            await rate_limit_engine.reset(client_id, config["period"])
 
             return True
 
@@ -265,8 +446,8 @@ class RateLimiter(BaseHTTPMiddleware):
             bool: 是否更新成功
         """
         try:
-            # 获取当前配置
-            config = await self._get_client_config(client_id)
+            # 获取当前配置(复制一份，避免修改本地缓存中的对象)
+            config = dict(await self._get_client_config(client_id))
 
             # 更新配置
             if limit is not None:
@@ -274,11 +455,12 @@ class RateLimiter(BaseHTTPMiddleware):
             if period is not None:
                 config["period"] = period
 
-            # 缓存配置
+            # 缓存配置(同时通知其它工作进程)
             cache_key = f"rate_limit_config:{client_id}"
-            await redis_cache.set(
+            await near_cache.set(
                 cache_key, config, expire=settings.RATE_LIMIT_CONFIG_TTL
             )
+            rate_limit_engine.drop_lease(client_id)
 
             return True
 
@@ -287,5 +469,6 @@ class RateLimiter(BaseHTTPMiddleware):
             return False
 
 
-# 创建全局速率限制器实例
+# 创建全局速率限制引擎和速率限制器实例
+rate_limit_engine = RateLimitEngine()
 rate_limiter = RateLimiter